@@ -1,12 +1,19 @@
 import os
-from flask import Flask
+import click
+from flask import Flask, Response
 from flask_cors import CORS
-from flask_migrate import Migrate
+from werkzeug.middleware.proxy_fix import ProxyFix
 from .models import db
+from .services.prediction_cache import prediction_cache
+from .services.chat_service import chat_history_store
+from .services.metrics_service import metrics, collect_queue_depths
+from .services.profiling_service import request_profiler
+from .services.file_cleaner import file_cleaner
+from .services.search_indexer import search_indexer
+from .services.evaluation_runner import evaluation_runner
+from .services.admission_control import admission
 from config.config import config
 
-migrate = Migrate()
-
 def create_app(config_name='default'):
     """Create and configure the Flask application"""
     app = Flask(__name__)
@@ -14,26 +21,56 @@ def create_app(config_name='default'):
     # Load configuration
     app.config.from_object(config[config_name])
     config[config_name].init_app(app)
+    if app.config.get('TRUSTED_PROXIES'):
+        # Behind nginx remote_addr is the proxy's; clients are told apart by it, see admission_control
+        proxies = app.config['TRUSTED_PROXIES']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies)
     
     # Initialize extensions
     db.init_app(app)
-    migrate.init_app(app, db)
+    if click.get_current_context(silent=True) is not None:
+        # Only the flask CLI needs the `flask db` commands; alembic is slow to import
+        from flask_migrate import Migrate
+        Migrate(app, db)
     CORS(app)
+    prediction_cache.init_app(app)
+    chat_history_store.init_app(app)
+    metrics.init_app(app)
+    metrics.add_collector(collect_queue_depths)
+    request_profiler.init_app(app)
+    admission.init_app(app)  # After metrics, so rejected requests are counted
+    file_cleaner.init_app(app)
+    search_indexer.init_app(app)
+    evaluation_runner.init_app(app)
     
     # Register blueprints
     from .api.models import model_bp
     from .api.datasets import dataset_bp
     from .api.training import training_bp
     from .api.chat import chat_bp
+    from .api.evaluations import evaluation_bp
+    from .api.sweeps import sweep_bp
+    from .api.debug import debug_bp
+    from .api.storage import storage_bp
+    from .api.exports import export_bp
+    from .api.localization import localization_bp
     
     app.register_blueprint(model_bp)
     app.register_blueprint(dataset_bp)
     app.register_blueprint(training_bp)
     app.register_blueprint(chat_bp)
+    app.register_blueprint(evaluation_bp)
+    app.register_blueprint(sweep_bp)
+    app.register_blueprint(debug_bp)
+    app.register_blueprint(storage_bp)
+    app.register_blueprint(export_bp)
+    app.register_blueprint(localization_bp)
     
     # Create database tables
     with app.app_context():
-        db.create_all()
+        if app.config['AUTO_CREATE_SCHEMA']:
+            db.create_all()
+        metrics.track_engine(db.engine)
     
     @app.route('/')
     def index():
@@ -43,4 +80,24 @@ def create_app(config_name='default'):
     def health():
         return {'status': 'healthy'}
     
+    @app.route('/metrics')
+    def prometheus_metrics():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+    
+    @app.cli.command('init-db')
+    def init_db():
+        """Create missing database tables once, e.g. before starting workers"""
+        db.create_all()
+        click.echo('Database tables created')
+    
     return app
+
+def after_fork(app):
+    """
+    Reset state inherited from the parent in a forked worker process, e.g.
+    under gunicorn --preload: pooled database connections and the prediction
+    cache's SQLite handle must not be shared between processes
+    """
+    with app.app_context():
+        db.engine.dispose(close=False)
+    prediction_cache.after_fork()
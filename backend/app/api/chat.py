@@ -1,10 +1,33 @@
-from flask import Blueprint, request, jsonify
-from datetime import datetime
+import json
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+from ..services.chat_service import chat_history_store
+from ..services.llm_providers import get_provider, ProviderError, ProviderBusy
+from ..services.retrieval_service import retrieve, format_context, format_status
 
 chat_bp = Blueprint('chat', __name__, url_prefix='/api/chat')
 
-# In-memory storage for chat history (in production, use database)
-chat_history = []
+def get_session_id(data=None):
+    """Resolve the chat session from the header, body or query string"""
+    session_id = (request.headers.get('X-Session-ID')
+                  or (data or {}).get('session_id')
+                  or request.args.get('session_id')
+                  or 'default')
+    return str(session_id)[:64]
+
+def build_prompt(session_id, question):
+    """
+    Build the provider messages from the session's recent history plus the
+    documentation and system state retrieved for the question
+    """
+    context = retrieve(question, current_app.config)
+    messages = [{'role': m['role'], 'content': m['content']}
+                for m in chat_history_store.recent(session_id)]
+    
+    system = [current_app.config.get('AI_SYSTEM_PROMPT'), format_context(context)]
+    system = '\n\n'.join(part for part in system if part)
+    if system:
+        messages.insert(0, {'role': 'system', 'content': system})
+    return messages, context
 
 @chat_bp.route('/message', methods=['POST'])
 def send_message():
@@ -14,45 +37,97 @@ def send_message():
     if not data or 'content' not in data:
         return jsonify({'error': 'Message content is required'}), 400
     
-    user_message = {
-        'role': 'user',
-        'content': data['content'],
-        'timestamp': datetime.utcnow().isoformat()
-    }
-    
-    chat_history.append(user_message)
+    session_id = get_session_id(data)
+    user_message = chat_history_store.append(session_id, 'user', data['content'])
     
-    # Generate AI response (mock implementation)
-    # In production, integrate with actual AI API (Qwen, ERNIE, etc.)
-    ai_response = {
-        'role': 'assistant',
-        'content': generate_ai_response(data['content']),
-        'timestamp': datetime.utcnow().isoformat()
-    }
+    prompt, context = build_prompt(session_id, data['content'])
+    try:
+        content = get_provider(current_app).complete(prompt, context)
+    except ProviderBusy as e:
+        # Nothing answered this turn, so drop it rather than leave it orphaned
+        chat_history_store.remove(session_id, user_message['id'])
+        return jsonify({'error': str(e)}), 503
+    except ProviderError as e:
+        current_app.logger.error(f"AI provider failed, using builtin response: {str(e)}")
+        content = generate_ai_response(data['content'], context)
     
-    chat_history.append(ai_response)
+    ai_response = chat_history_store.append(session_id, 'assistant', content)
+    ai_response['session_id'] = session_id
     
     return jsonify(ai_response), 200
 
+@chat_bp.route('/stream', methods=['POST'])
+def stream_message():
+    """Send a message to AI and stream the response as server-sent events"""
+    data = request.get_json()
+    
+    if not data or 'content' not in data:
+        return jsonify({'error': 'Message content is required'}), 400
+    
+    session_id = get_session_id(data)
+    user_message = chat_history_store.append(session_id, 'user', data['content'])
+    prompt, context = build_prompt(session_id, data['content'])
+    provider = get_provider(current_app)
+    
+    def generate():
+        parts = []
+        try:
+            for delta in provider.stream(prompt, context):
+                parts.append(delta)
+                yield f"data: {json.dumps({'delta': delta}, ensure_ascii=False)}\n\n"
+        except ProviderBusy:
+            raise
+        except ProviderError as e:
+            current_app.logger.error(f"AI provider stream failed: {str(e)}")
+            if not parts:
+                fallback = generate_ai_response(data['content'], context)
+                parts.append(fallback)
+                yield f"data: {json.dumps({'delta': fallback}, ensure_ascii=False)}\n\n"
+        
+        message = chat_history_store.append(session_id, 'assistant', ''.join(parts))
+        message['session_id'] = session_id
+        yield f"event: done\ndata: {json.dumps(message, ensure_ascii=False)}\n\n"
+    
+    # Run up to the first event before responding, so a busy provider is a 503 as on /message
+    events = generate()
+    try:
+        first = next(events)
+    except ProviderBusy as e:
+        chat_history_store.remove(session_id, user_message['id'])
+        return jsonify({'error': str(e)}), 503
+    
+    def resume():
+        yield first
+        yield from events
+    
+    return Response(
+        stream_with_context(resume()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @chat_bp.route('/history', methods=['GET'])
 def get_history():
-    """Get chat history"""
-    return jsonify(chat_history), 200
+    """Get one page of chat history for a session"""
+    limit = min(request.args.get('limit', 50, type=int), current_app.config['CHAT_HISTORY_PAGE_MAX'])
+    before = request.args.get('before', type=int)
+    
+    page = chat_history_store.page(get_session_id(), limit=max(limit, 1), before=before)
+    return jsonify(page), 200
 
 @chat_bp.route('/history', methods=['DELETE'])
 def clear_history():
-    """Clear chat history"""
-    chat_history.clear()
+    """Clear chat history for a session"""
+    chat_history_store.clear(get_session_id())
     return jsonify({'message': 'Chat history cleared'}), 200
 
-def generate_ai_response(user_message):
+def generate_ai_response(user_message, context=None):
     """
-    Generate AI response based on user message
-    This is a mock implementation. In production, integrate with:
-    - Qwen API: https://help.aliyun.com/zh/dashscope/
-    - ERNIE API: https://cloud.baidu.com/doc/WENXINWORKSHOP/
-    - ChatGLM API: https://open.bigmodel.cn/
+    Generate AI response based on user message and retrieved context
+    This is the offline fallback used by the builtin provider. Set AI_PROVIDER
+    to qwen, ernie, chatglm or local to use a real model instead.
     """
+    context = context or {}
     message_lower = user_message.lower()
     
     # Simple keyword-based responses
@@ -69,6 +144,9 @@ def generate_ai_response(user_message):
 
 请告诉我您需要哪方面的帮助？"""
     
+    if context.get('status'):
+        return "当前系统状态：\n" + format_status(context['status'])
+    
     if '模型' in message_lower:
         return """关于模型管理：
 
@@ -99,5 +177,10 @@ def generate_ai_response(user_message):
 
 系统支持多任务并行训练，会自动保存训练结果。"""
     
+    documents = context.get('documents')
+    if documents:
+        best = documents[0]
+        return f"以下内容摘自文档《{best['source']}》：\n\n{best['text']}"
+    
     # Default response
     return "抱歉，我不太理解您的问题。您可以询问关于模型管理、数据集管理、训练任务等方面的问题，或者输入'帮助'查看我能提供的服务。"
@@ -1,10 +1,25 @@
 import os
+import io
 import json
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, send_file
+from sqlalchemy.exc import IntegrityError
 from werkzeug.utils import secure_filename
-from ..models import db, Dataset
+from ..models import db, Dataset, DatasetSplit, DatasetVersion, SearchIndexSource, TrainingTask
 from ..utils.file_utils import allowed_file
+from ..utils.lazy_import import lazy_import
 from ..services.dataset_service import analyze_dataset
+from ..services.split_service import get_or_create_split, load_split_part
+from ..services.bulk_service import DatasetBulkOperation
+from ..services.storage_service import task_references, dependency_error, delete_datasets
+from ..services.version_service import (
+    FORMATS as VERSION_FORMATS, get_version, version_details, create_version, iter_version_records,
+    encode_records
+)
+from ..services.export_service import download_response
+from ..services.search_index import search
+from ..services.search_indexer import search_indexer
+
+np = lazy_import('numpy')
 
 dataset_bp = Blueprint('dataset', __name__, url_prefix='/api/datasets')
 
@@ -62,6 +77,7 @@ def create_dataset():
     )
     
     db.session.add(dataset)
+    search_indexer.enqueue(dataset)
     db.session.commit()
     
     # Analyze dataset asynchronously
@@ -80,6 +96,105 @@ def create_dataset():
     
     return jsonify(dataset.to_dict()), 201
 
+@dataset_bp.route('/bulk', methods=['POST'])
+def bulk_datasets():
+    """Register, update and delete many datasets in one transaction"""
+    try:
+        operation = DatasetBulkOperation(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    response, status = operation.run()
+    return jsonify(response), status
+
+@dataset_bp.route('/search', methods=['GET'])
+def search_datasets():
+    """
+    Find records whose code contains `q` across the latest version of all datasets
+    regex=true treats q as a regular expression; filter with label, type and dataset_id,
+    and with one dataset_id search an older version
+    """
+    args = request.args
+    if not args.get('q'):
+        return jsonify({'error': 'Query q is required'}), 400
+    
+    try:
+        label = int(args['label']) if args.get('label') is not None else None
+        dataset_ids = [int(id) for id in args.getlist('dataset_id')]
+        version = int(args['version']) if args.get('version') is not None else None
+        limit = int(args.get('limit', 50))
+    except ValueError:
+        return jsonify({'error': 'label, dataset_id, version and limit must be integers'}), 400
+    if not 1 <= limit <= current_app.config['SEARCH_MAX_RESULTS']:
+        return jsonify({'error': f"limit must be between 1 and {current_app.config['SEARCH_MAX_RESULTS']}"}), 400
+    
+    try:
+        results = search(
+            args['q'],
+            regex=args.get('regex', 'false').lower() == 'true',
+            ignore_case=args.get('ignore_case', 'false').lower() == 'true',
+            label=label,
+            vulnerability_type=args.get('type'),
+            dataset_ids=dataset_ids,
+            version=version,
+            limit=limit,
+            include_code=args.get('include_code', 'false').lower() == 'true'
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    
+    return jsonify(results), 200
+
+@dataset_bp.route('/search/index', methods=['GET'])
+def get_search_index():
+    """Get the indexing state of every dataset file and version"""
+    sources = SearchIndexSource.query.order_by(SearchIndexSource.dataset_id, SearchIndexSource.version).all()
+    totals = {}
+    for source in sources:
+        totals[source.status] = totals.get(source.status, 0) + 1
+    return jsonify({
+        'status': totals,
+        'num_docs': sum(source.num_docs or 0 for source in sources),
+        'size': sum(source.size or 0 for source in sources),
+        'sources': [source.to_dict() for source in sources]
+    }), 200
+
+@dataset_bp.route('/search/index', methods=['POST'])
+def rebuild_search_index():
+    """
+    Queue datasets and versions that have no index yet and retry failed ones
+    rebuild=true also rebuilds indexed ones; dataset_ids limits either to some datasets
+    """
+    data = request.get_json(silent=True) or {}
+    dataset_ids = data.get('dataset_ids')
+    if dataset_ids is not None and (not isinstance(dataset_ids, list) or any(
+            isinstance(id, bool) or not isinstance(id, int) for id in dataset_ids)):
+        return jsonify({'error': 'dataset_ids must be a list of dataset IDs'}), 400
+    
+    query = Dataset.query
+    if dataset_ids:
+        query = query.filter(Dataset.id.in_(dataset_ids))
+    
+    queued = 0
+    for dataset in query:
+        sources = {source.version: source for source in dataset.search_sources}
+        versions = [0] + [version for version, in
+                          db.session.query(DatasetVersion.version).filter_by(dataset_id=dataset.id)]
+        for version in versions:
+            source = sources.get(version)
+            if source is None:
+                queued += search_indexer.enqueue(dataset, version) is not None
+            elif source.status == 'failed' or (data.get('rebuild') and source.status == 'completed'):
+                source.status = 'pending'
+                source.error = None
+                queued += 1
+    db.session.info['search_index'] = True
+    db.session.commit()
+    
+    return jsonify({'queued': queued}), 200
+
 @dataset_bp.route('/<int:dataset_id>', methods=['PUT'])
 def update_dataset(dataset_id):
     """Update a dataset"""
@@ -102,23 +217,43 @@ def update_dataset(dataset_id):
 
 @dataset_bp.route('/<int:dataset_id>', methods=['DELETE'])
 def delete_dataset(dataset_id):
-    """Delete a dataset"""
-    dataset = Dataset.query.get_or_404(dataset_id)
+    """Delete a dataset; with cascade=true also its training tasks. Files are removed in the background"""
+    Dataset.query.get_or_404(dataset_id)
     
-    # Delete associated file if exists
-    if dataset.file_path and os.path.exists(dataset.file_path):
-        os.remove(dataset.file_path)
+    cascade = request.args.get('cascade', 'false').lower() == 'true'
+    references = task_references(TrainingTask.dataset_id, [dataset_id]).get(dataset_id)
+    error = dependency_error('Dataset', references, cascade)
+    if error:
+        return jsonify({'error': error}), 409
     
-    db.session.delete(dataset)
+    delete_datasets([dataset_id])
     db.session.commit()
     
     return jsonify({'message': 'Dataset deleted successfully'}), 200
 
 @dataset_bp.route('/<int:dataset_id>/stats', methods=['GET'])
 def get_dataset_stats(dataset_id):
-    """Get dataset statistics"""
+    """Get dataset statistics; ?version=n gets those of a version"""
     dataset = Dataset.query.get_or_404(dataset_id)
     
+    number = request.args.get('version', 0, type=int)
+    if number:
+        try:
+            version = get_version(dataset, number)
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 404
+        return jsonify({
+            'id': dataset.id,
+            'name': dataset.name,
+            'version': version.version,
+            'num_samples': version.num_samples,
+            'num_vulnerable': version.num_vulnerable,
+            'num_safe': version.num_safe,
+            'size': version.size,
+            'format': dataset.format,
+            'preprocessing_status': 'completed'
+        }), 200
+    
     stats = {
         'id': dataset.id,
         'name': dataset.name,
@@ -131,3 +266,124 @@ def get_dataset_stats(dataset_id):
     }
     
     return jsonify(stats), 200
+
+@dataset_bp.route('/<int:dataset_id>/splits', methods=['GET'])
+def get_dataset_splits(dataset_id):
+    """Get the splits computed for a dataset"""
+    dataset = Dataset.query.get_or_404(dataset_id)
+    splits = dataset.splits.order_by(DatasetSplit.created_at.desc()).all()
+    return jsonify([split.to_dict() for split in splits]), 200
+
+@dataset_bp.route('/<int:dataset_id>/splits', methods=['POST'])
+def create_dataset_split(dataset_id):
+    """Compute a seeded, stratified split, or return the cached one"""
+    dataset = Dataset.query.get_or_404(dataset_id)
+    data = request.get_json(silent=True) or {}
+    seed = data.get('seed', 0)
+    if isinstance(seed, bool) or not isinstance(seed, int):
+        return jsonify({'error': 'seed must be an integer'}), 400
+    
+    try:
+        split, created = get_or_create_split(
+            dataset,
+            ratios=data.get('ratios'),
+            seed=seed,
+            stratify=bool(data.get('stratify', True)),
+            group_key=data.get('group_key')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify(split.to_dict()), 201 if created else 200
+
+@dataset_bp.route('/<int:dataset_id>/splits/<int:split_id>', methods=['GET'])
+def get_dataset_split(dataset_id, split_id):
+    """
+    Get the record indices of one part of a split
+    format=npy returns a NumPy array file instead of JSON
+    """
+    split = DatasetSplit.query.filter_by(id=split_id, dataset_id=dataset_id).first_or_404()
+    part = request.args.get('part')
+    
+    if not part:
+        return jsonify(split.to_dict()), 200
+    
+    try:
+        indices = load_split_part(split, part)
+    except KeyError:
+        return jsonify({'error': f'Unknown split part: {part}'}), 404
+    
+    if request.args.get('format') == 'npy':
+        buffer = io.BytesIO()
+        np.save(buffer, indices)
+        buffer.seek(0)
+        return send_file(buffer, mimetype='application/octet-stream',
+                         download_name=f'split_{split.id}_{part}.npy')
+    
+    return jsonify({'part': part, 'indices': indices.tolist()}), 200
+
+@dataset_bp.route('/<int:dataset_id>/versions', methods=['GET'])
+def get_dataset_versions(dataset_id):
+    """Get the versions of a dataset, newest first"""
+    dataset = Dataset.query.get_or_404(dataset_id)
+    versions = dataset.versions.order_by(DatasetVersion.version.desc()).all()
+    return jsonify([version.to_dict() for version in versions]), 200
+
+@dataset_bp.route('/<int:dataset_id>/versions', methods=['POST'])
+def create_dataset_version(dataset_id):
+    """
+    Create a version that adds records, removes record ids or patches records
+    on top of `parent` (default the latest version; 0 is the uploaded file)
+    """
+    dataset = Dataset.query.get_or_404(dataset_id)
+    data = request.get_json(silent=True) or {}
+    
+    try:
+        version = create_version(
+            dataset,
+            parent=data.get('parent'),
+            add=data.get('add'),
+            remove=data.get('remove'),
+            patch=data.get('patch'),
+            description=data.get('description')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    except IntegrityError:
+        return jsonify({'error': 'Another version was created at the same time; retry'}), 409
+    
+    return jsonify(version_details(dataset, version)), 201
+
+@dataset_bp.route('/<int:dataset_id>/versions/<int:version>', methods=['GET'])
+def get_dataset_version(dataset_id, version):
+    """Get a version with its stats and the files a trainer reads it from"""
+    dataset = Dataset.query.get_or_404(dataset_id)
+    try:
+        row = get_version(dataset, version)
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    if row is None:
+        return jsonify({'error': 'Version 0 is the dataset itself'}), 404
+    return jsonify(version_details(dataset, row)), 200
+
+@dataset_bp.route('/<int:dataset_id>/versions/<int:version>/records', methods=['GET'])
+def get_dataset_version_records(dataset_id, version):
+    """
+    Stream the records of a version as JSON Lines, the base file's first
+    with_ids=true wraps each record as {"id", "record"}; gzip=true compresses
+    """
+    dataset = Dataset.query.get_or_404(dataset_id)
+    try:
+        row = get_version(dataset, version)
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    if dataset.format not in VERSION_FORMATS:
+        return jsonify({'error': f'Versions are not supported for {dataset.format} datasets'}), 400
+    if not dataset.file_path or not os.path.exists(dataset.file_path):
+        return jsonify({'error': 'Dataset file is missing'}), 400
+    
+    with_ids = request.args.get('with_ids', 'false').lower() == 'true'
+    return download_response(encode_records(iter_version_records(dataset, row), with_ids),
+                             'application/jsonl', f'dataset_{dataset.id}_v{version}.jsonl')
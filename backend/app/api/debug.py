@@ -0,0 +1,49 @@
+from flask import Blueprint, request, jsonify, current_app, Response
+from ..services.profiling_service import request_profiler
+from ..services.admission_control import admission
+
+debug_bp = Blueprint('debug', __name__, url_prefix='/api/debug')
+
+@debug_bp.before_request
+def require_profiling():
+    """Debug endpoints only exist when profiling is enabled, and need PROFILING_TOKEN"""
+    if not current_app.config.get('PROFILING_ENABLED'):
+        return jsonify({'error': 'Profiling is disabled'}), 404
+    token = current_app.config.get('PROFILING_TOKEN')
+    if not token:
+        # Profiles hold SQL statements and parameters, so they are never served without one
+        return jsonify({'error': 'Set PROFILING_TOKEN to use the debug endpoints'}), 403
+    if request.headers.get('X-Profile-Token') != token:
+        return jsonify({'error': 'Invalid profiling token'}), 403
+
+@debug_bp.route('/profiles', methods=['GET'])
+def get_profiles():
+    """Get the slowest profiled requests"""
+    return jsonify(request_profiler.list_profiles()), 200
+
+@debug_bp.route('/profiles/<profile_id>', methods=['GET'])
+def get_profile(profile_id):
+    """Get a profile with its SQL statements and stacks"""
+    record = request_profiler.load_profile(profile_id)
+    if record is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return jsonify(record), 200
+
+@debug_bp.route('/profiles/<profile_id>/folded', methods=['GET'])
+def get_profile_folded(profile_id):
+    """Get a profile's folded stacks, for flamegraph.pl or speedscope"""
+    record = request_profiler.load_profile(profile_id)
+    if record is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return Response(record.get('folded', ''), mimetype='text/plain')
+
+@debug_bp.route('/slow-queries', methods=['GET'])
+def get_slow_queries():
+    """Get recent slow SQL statements with their query plans, slowest first"""
+    queries = sorted(request_profiler.slow_queries, key=lambda query: query['duration_ms'], reverse=True)
+    return jsonify(queries), 200
+
+@debug_bp.route('/admission', methods=['GET'])
+def get_admission():
+    """Get this worker's admission pools: limits, requests in flight and rejections"""
+    return jsonify(admission.stats()), 200
@@ -0,0 +1,71 @@
+from flask import Blueprint, request, jsonify
+from ..models import db, ModelEvaluation, Model, Dataset
+from ..services.evaluation_runner import evaluation_runner
+
+evaluation_bp = Blueprint('evaluation', __name__, url_prefix='/api/evaluations')
+
+@evaluation_bp.route('', methods=['GET'])
+def get_evaluations():
+    """Get all evaluations, optionally filtered by model or dataset"""
+    query = ModelEvaluation.query
+    if request.args.get('model_id'):
+        query = query.filter_by(model_id=request.args.get('model_id', type=int))
+    if request.args.get('dataset_id'):
+        query = query.filter_by(dataset_id=request.args.get('dataset_id', type=int))
+    evaluations = query.order_by(ModelEvaluation.created_at.desc()).all()
+    return jsonify([evaluation.to_dict() for evaluation in evaluations]), 200
+
+@evaluation_bp.route('/<int:evaluation_id>', methods=['GET'])
+def get_evaluation(evaluation_id):
+    """Get a specific evaluation including its PR/ROC curves"""
+    evaluation = ModelEvaluation.query.get_or_404(evaluation_id)
+    return jsonify(evaluation.to_dict(include_curves=True)), 200
+
+@evaluation_bp.route('', methods=['POST'])
+def create_evaluation():
+    """Queue an evaluation of a model on a dataset; poll it until completed or failed"""
+    data = request.get_json() or {}
+
+    # Validate required fields
+    if not data.get('model_id'):
+        return jsonify({'error': 'Model ID is required'}), 400
+    if not data.get('dataset_id'):
+        return jsonify({'error': 'Dataset ID is required'}), 400
+
+    # Verify model and dataset exist
+    model = db.session.get(Model, data['model_id'])
+    if not model:
+        return jsonify({'error': 'Model not found'}), 404
+
+    dataset = db.session.get(Dataset, data['dataset_id'])
+    if not dataset:
+        return jsonify({'error': 'Dataset not found'}), 404
+
+    try:
+        threshold = float(data.get('threshold', 0.5))
+        batch_size = int(data.get('batch_size', 256))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'threshold and batch_size must be numbers'}), 400
+    if batch_size < 1:
+        return jsonify({'error': 'batch_size must be positive'}), 400
+
+    evaluation = evaluation_runner.enqueue(ModelEvaluation(
+        model_id=model.id,
+        dataset_id=dataset.id,
+        threshold=threshold,
+        batch_size=batch_size,
+        apply_to_model=bool(data.get('apply_to_model'))
+    ))
+    db.session.commit()
+
+    return jsonify(evaluation.to_dict()), 202
+
+@evaluation_bp.route('/<int:evaluation_id>', methods=['DELETE'])
+def delete_evaluation(evaluation_id):
+    """Delete an evaluation"""
+    evaluation = ModelEvaluation.query.get_or_404(evaluation_id)
+
+    db.session.delete(evaluation)
+    db.session.commit()
+
+    return jsonify({'message': 'Evaluation deleted successfully'}), 200
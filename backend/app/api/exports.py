@@ -0,0 +1,42 @@
+from flask import Blueprint, request, jsonify
+from ..services.export_service import (
+    FORMATS, task_conditions, metrics_query, tasks_query, datasets_query, evaluations_query,
+    encode_rows, download_response
+)
+
+export_bp = Blueprint('export', __name__, url_prefix='/api/exports')
+
+def stream_export(name, build_query):
+    """
+    Stream a query as ?format=csv|jsonl|ndjson, gzip-compressed with gzip=true.
+    Filters are checked before the response starts.
+    """
+    file_format = request.args.get('format', 'csv')
+    if file_format not in FORMATS:
+        return jsonify({'error': f"Format must be one of {', '.join(FORMATS)}"}), 400
+    try:
+        query = build_query()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return download_response(encode_rows(query, file_format), FORMATS[file_format], f'{name}.{file_format}')
+
+@export_bp.route('/metrics', methods=['GET'])
+def export_metrics():
+    """Export every metric of the tasks matching the task filters"""
+    return stream_export('metrics', lambda: metrics_query(task_conditions(request.args)))
+
+@export_bp.route('/tasks', methods=['GET'])
+def export_tasks():
+    """Export the training tasks matching the task filters"""
+    return stream_export('tasks', lambda: tasks_query(task_conditions(request.args)))
+
+@export_bp.route('/datasets', methods=['GET'])
+def export_datasets():
+    """Export dataset profiles: format, size and label counts"""
+    return stream_export('datasets', datasets_query)
+
+@export_bp.route('/evaluations', methods=['GET'])
+def export_evaluations():
+    """Export model evaluation results, filtered by model_id, dataset_id and status"""
+    return stream_export('evaluations', lambda: evaluations_query(request.args))
@@ -0,0 +1,158 @@
+from flask import Blueprint, request, jsonify, current_app
+from ..models import db, LocalizationScan, Model, Dataset
+from ..services.localization_store import (
+    create_scan, append_results, complete_scan, top_lines, riskiest_files, file_heatmap, forget_scan
+)
+from ..services.file_cleaner import file_cleaner
+
+localization_bp = Blueprint('localization', __name__, url_prefix='/api/localization')
+
+@localization_bp.route('/scans', methods=['GET'])
+def get_scans():
+    """Get all localization scans, optionally filtered by model or dataset"""
+    query = LocalizationScan.query
+    if request.args.get('model_id'):
+        query = query.filter_by(model_id=request.args.get('model_id', type=int))
+    if request.args.get('dataset_id'):
+        query = query.filter_by(dataset_id=request.args.get('dataset_id', type=int))
+    scans = query.order_by(LocalizationScan.created_at.desc()).all()
+    return jsonify([scan.to_dict() for scan in scans]), 200
+
+@localization_bp.route('/scans/<int:scan_id>', methods=['GET'])
+def get_scan(scan_id):
+    """Get a specific scan"""
+    scan = LocalizationScan.query.get_or_404(scan_id)
+    return jsonify(scan.to_dict()), 200
+
+@localization_bp.route('/scans', methods=['POST'])
+def create_localization_scan():
+    """Start a scan of a fine-grained localization model; results are then posted in batches"""
+    data = request.get_json() or {}
+
+    if not data.get('model_id'):
+        return jsonify({'error': 'Model ID is required'}), 400
+    model = db.session.get(Model, data['model_id'])
+    if not model:
+        return jsonify({'error': 'Model not found'}), 404
+
+    dataset = None
+    if data.get('dataset_id'):
+        dataset = db.session.get(Dataset, data['dataset_id'])
+        if not dataset:
+            return jsonify({'error': 'Dataset not found'}), 404
+
+    try:
+        scan = create_scan(model, dataset, data.get('name'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(scan.to_dict()), 201
+
+@localization_bp.route('/scans/<int:scan_id>/results', methods=['POST'])
+def post_scan_results(scan_id):
+    """Add a batch of line results: {file, function, line_start, line_end, score, vulnerability_type}"""
+    scan = LocalizationScan.query.get_or_404(scan_id)
+    results = (request.get_json(silent=True) or {}).get('results')
+
+    if isinstance(results, list) and len(results) > current_app.config['LOCALIZATION_MAX_BATCH']:
+        return jsonify({'error': f"At most {current_app.config['LOCALIZATION_MAX_BATCH']} results per request"}), 413
+    if scan.status != 'receiving':
+        return jsonify({'error': f'Scan is {scan.status}'}), 409
+
+    try:
+        stored = append_results(scan, results)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not stored:
+        return jsonify({'error': 'Scan is no longer receiving results'}), 409
+
+    return jsonify({'received': len(results), 'num_ranges': scan.num_ranges}), 200
+
+@localization_bp.route('/scans/<int:scan_id>/complete', methods=['POST'])
+def complete_localization_scan(scan_id):
+    """Stop receiving results and index the scan by file path and score"""
+    scan = LocalizationScan.query.get_or_404(scan_id)
+
+    try:
+        completed = complete_scan(scan)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not completed:
+        return jsonify({'error': f'Scan is {scan.status}'}), 409
+
+    return jsonify(scan.to_dict()), 200
+
+def _completed_scan(scan_id):
+    """The completed scan, or an error response"""
+    scan = LocalizationScan.query.get_or_404(scan_id)
+    if scan.status != 'completed':
+        return None, (jsonify({'error': 'Scan is not completed yet'}), 409)
+    return scan, None
+
+def _limit(name, default):
+    limit = request.args.get(name, default, type=int)
+    if not 1 <= limit <= current_app.config['LOCALIZATION_MAX_RESULTS']:
+        raise ValueError(f"{name} must be between 1 and {current_app.config['LOCALIZATION_MAX_RESULTS']}")
+    return limit
+
+@localization_bp.route('/scans/<int:scan_id>/top', methods=['GET'])
+def get_top_lines(scan_id):
+    """
+    Get the k riskiest line ranges of a scan
+    Filter with type, path_prefix and min_score
+    """
+    scan, error = _completed_scan(scan_id)
+    if error:
+        return error
+
+    try:
+        k = _limit('k', 100)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    results = top_lines(scan, k,
+                        vulnerability_type=request.args.get('type'),
+                        path_prefix=request.args.get('path_prefix'),
+                        min_score=request.args.get('min_score', type=float))
+    return jsonify({'scan_id': scan.id, 'results': results}), 200
+
+@localization_bp.route('/scans/<int:scan_id>/files', methods=['GET'])
+def get_riskiest_files(scan_id):
+    """Get the files of a scan by their highest score, optionally under path_prefix"""
+    scan, error = _completed_scan(scan_id)
+    if error:
+        return error
+
+    try:
+        limit = _limit('limit', 50)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    files = riskiest_files(scan, limit, path_prefix=request.args.get('path_prefix'))
+    return jsonify({'scan_id': scan.id, 'files': files}), 200
+
+@localization_bp.route('/scans/<int:scan_id>/heatmap', methods=['GET'])
+def get_file_heatmap(scan_id):
+    """Get the per-line scores of one file of a scan"""
+    scan, error = _completed_scan(scan_id)
+    if error:
+        return error
+    if not request.args.get('path'):
+        return jsonify({'error': 'path is required'}), 400
+
+    try:
+        heatmap = file_heatmap(scan, request.args['path'])
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    return jsonify(heatmap), 200
+
+@localization_bp.route('/scans/<int:scan_id>', methods=['DELETE'])
+def delete_scan(scan_id):
+    """Delete a scan; its files are removed in the background"""
+    scan = LocalizationScan.query.get_or_404(scan_id)
+
+    forget_scan(scan)
+    file_cleaner.delete([scan.path], reason='scan_deleted')
+    db.session.delete(scan)
+    db.session.commit()
+
+    return jsonify({'message': 'Scan deleted successfully'}), 200
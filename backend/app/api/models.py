@@ -1,8 +1,15 @@
 import os
 from flask import Blueprint, request, jsonify, current_app
 from werkzeug.utils import secure_filename
-from ..models import db, Model
+from ..models import db, Model, TrainingTask, Dataset, ModelOptimization
 from ..utils.file_utils import allowed_file
+from ..services.inference_service import predict
+from ..services.prediction_cache import prediction_cache
+from ..services.bulk_service import ModelBulkOperation
+from ..services.storage_service import task_references, dependency_error, delete_models
+from ..services.optimization_service import (
+    DEFAULT_SAMPLES, DEFAULT_BATCH_SIZE, available_methods, validate_optimization, run_optimization
+)
 
 model_bp = Blueprint('model', __name__, url_prefix='/api/models')
 
@@ -56,6 +63,17 @@ def create_model():
     
     return jsonify(model.to_dict()), 201
 
+@model_bp.route('/bulk', methods=['POST'])
+def bulk_models():
+    """Create, update and delete many models in one transaction"""
+    try:
+        operation = ModelBulkOperation(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    response, status = operation.run()
+    return jsonify(response), status
+
 @model_bp.route('/<int:model_id>', methods=['PUT'])
 def update_model(model_id):
     """Update a model"""
@@ -90,14 +108,120 @@ def update_model(model_id):
 
 @model_bp.route('/<int:model_id>', methods=['DELETE'])
 def delete_model(model_id):
-    """Delete a model"""
-    model = Model.query.get_or_404(model_id)
+    """Delete a model; with cascade=true also its training tasks. Files are removed in the background"""
+    Model.query.get_or_404(model_id)
     
-    # Delete associated file if exists
-    if model.file_path and os.path.exists(model.file_path):
-        os.remove(model.file_path)
+    cascade = request.args.get('cascade', 'false').lower() == 'true'
+    error = dependency_error('Model', task_references(TrainingTask.model_id, [model_id]).get(model_id), cascade)
+    if error:
+        return jsonify({'error': error}), 409
     
-    db.session.delete(model)
+    delete_models([model_id])
     db.session.commit()
     
     return jsonify({'message': 'Model deleted successfully'}), 200
+
+@model_bp.route('/<int:model_id>/predict', methods=['POST'])
+def predict_code(model_id):
+    """Score one code snippet or a batch of samples with a model"""
+    model = Model.query.get_or_404(model_id)
+    data = request.get_json() or {}
+    
+    if 'code' in data:
+        codes = [data['code']]
+    elif 'samples' in data:
+        codes = [sample.get('code', '') if isinstance(sample, dict) else sample
+                 for sample in data['samples']]
+    else:
+        return jsonify({'error': 'Code or samples are required'}), 400
+    
+    if not all(isinstance(code, str) for code in codes):
+        return jsonify({'error': 'Code must be a string'}), 400
+    
+    results = predict(model, codes, use_cache=data.get('use_cache', True))
+    
+    if 'code' in data:
+        return jsonify(results[0]), 200
+    return jsonify({
+        'model_id': model.id,
+        'results': results,
+        'cached': sum(1 for result in results if result.get('cached'))
+    }), 200
+
+@model_bp.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Get prediction cache statistics"""
+    return jsonify(prediction_cache.stats()), 200
+
+@model_bp.route('/optimizations/methods', methods=['GET'])
+def get_optimization_methods():
+    """List the optimization methods and whether their runtimes are installed"""
+    return jsonify(available_methods()), 200
+
+@model_bp.route('/<int:model_id>/optimizations', methods=['GET'])
+def get_optimizations(model_id):
+    """
+    Get a model's optimizations, fastest first; max_accuracy_drop keeps the
+    completed ones that lose at most that much accuracy
+    """
+    Model.query.get_or_404(model_id)
+    query = ModelOptimization.query.filter_by(model_id=model_id)
+    
+    max_drop = request.args.get('max_accuracy_drop', type=float)
+    if max_drop is not None:
+        query = query.filter(ModelOptimization.status == 'completed',
+                             ModelOptimization.accuracy_delta >= -max_drop)
+    
+    optimizations = query.order_by(ModelOptimization.speedup.desc().nullslast(),
+                                   ModelOptimization.created_at.desc()).all()
+    return jsonify([optimization.to_dict() for optimization in optimizations]), 200
+
+@model_bp.route('/optimizations/<int:optimization_id>', methods=['GET'])
+def get_optimization(optimization_id):
+    """Get a specific optimization"""
+    optimization = ModelOptimization.query.get_or_404(optimization_id)
+    return jsonify(optimization.to_dict()), 200
+
+@model_bp.route('/<int:model_id>/optimizations', methods=['POST'])
+def create_optimization(model_id):
+    """Optimize a model, registering the result as a derivative model, and benchmark both on a dataset"""
+    model = Model.query.get_or_404(model_id)
+    data = request.get_json() or {}
+    
+    method = data.get('method')
+    options = data.get('options', {})
+    try:
+        validate_optimization(method, options)
+        num_samples = int(data.get('num_samples', DEFAULT_SAMPLES))
+        batch_size = int(data.get('batch_size', DEFAULT_BATCH_SIZE))
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    if num_samples < 1 or batch_size < 1:
+        return jsonify({'error': 'num_samples and batch_size must be positive'}), 400
+    
+    if not data.get('dataset_id'):
+        return jsonify({'error': 'Dataset ID is required'}), 400
+    dataset = db.session.get(Dataset, data['dataset_id'])
+    if not dataset:
+        return jsonify({'error': 'Dataset not found'}), 404
+    
+    if data.get('name') and Model.query.filter_by(name=data['name']).first():
+        return jsonify({'error': 'Model name already exists'}), 400
+    
+    optimization = ModelOptimization(
+        model_id=model.id,
+        dataset_id=dataset.id,
+        method=method,
+        options=options,
+        status='pending',
+        num_samples=num_samples,
+        batch_size=batch_size
+    )
+    db.session.add(optimization)
+    db.session.commit()
+    
+    run_optimization(optimization.id, name=data.get('name'))
+    if optimization.status == 'failed':
+        current_app.logger.error(f"Optimization {optimization.id} failed: {optimization.error_message}")
+    
+    return jsonify(optimization.to_dict()), 201
@@ -0,0 +1,48 @@
+from flask import Blueprint, request, jsonify
+from ..models import db, FileTombstone
+from ..services.storage_service import storage_usage, scan_orphans
+from ..services.file_cleaner import file_cleaner
+
+storage_bp = Blueprint('storage', __name__, url_prefix='/api/storage')
+
+@storage_bp.route('', methods=['GET'])
+def get_storage_usage():
+    """Get disk usage by record type, files awaiting removal and the latest orphan scan"""
+    return jsonify(storage_usage()), 200
+
+@storage_bp.route('/scan', methods=['POST'])
+def scan_storage():
+    """Reconcile the storage folders with the database now, tombstoning orphaned files"""
+    data = request.get_json(silent=True) or {}
+    
+    grace_seconds = data.get('grace_seconds')
+    if grace_seconds is not None:
+        try:
+            grace_seconds = float(grace_seconds)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'grace_seconds must be a number'}), 400
+        if grace_seconds < 0:
+            return jsonify({'error': 'grace_seconds must not be negative'}), 400
+    
+    return jsonify(scan_orphans(bool(data.get('dry_run')), grace_seconds)), 200
+
+@storage_bp.route('/tombstones', methods=['GET'])
+def get_tombstones():
+    """Get files awaiting removal, oldest first; status=failed lists those given up on"""
+    status = request.args.get('status', 'pending')
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    tombstones = (FileTombstone.query.filter_by(status=status)
+                  .order_by(FileTombstone.id).limit(limit).all())
+    return jsonify([tombstone.to_dict() for tombstone in tombstones]), 200
+
+@storage_bp.route('/reclaim', methods=['POST'])
+def reclaim_storage():
+    """Remove pending files now, optionally retrying those given up on"""
+    data = request.get_json(silent=True) or {}
+    
+    if data.get('retry_failed'):
+        FileTombstone.query.filter_by(status='failed').update({'status': 'pending', 'attempts': 0})
+        db.session.commit()
+    
+    removed, failed = file_cleaner.reclaim()
+    return jsonify({'removed': removed, 'failed': failed}), 200
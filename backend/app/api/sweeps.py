@@ -0,0 +1,100 @@
+from flask import Blueprint, request, jsonify
+from ..models import db, TrainingSweep, TrainingTask, Model, Dataset
+from ..services.sweep_service import create_sweep, stop_sweep, sweep_summary, SWEEP_METRICS
+from ..services.early_stopping import validate_policy
+
+# Integer settings of a sweep: (field, default, minimum)
+SWEEP_LIMITS = [
+    ('num_samples', 10, 1),
+    ('max_concurrency', 2, 1),
+    ('max_epochs', 10, 1),
+    ('grace_epochs', 1, 1),
+    ('reduction_factor', 3, 2)
+]
+
+sweep_bp = Blueprint('sweep', __name__, url_prefix='/api/training/sweeps')
+
+@sweep_bp.route('', methods=['GET'])
+def get_sweeps():
+    """Get all hyperparameter sweeps"""
+    sweeps = TrainingSweep.query.order_by(TrainingSweep.created_at.desc()).all()
+    return jsonify([sweep.to_dict() for sweep in sweeps]), 200
+
+@sweep_bp.route('/<int:sweep_id>', methods=['GET'])
+def get_sweep(sweep_id):
+    """Get a sweep with its trial counts"""
+    sweep = TrainingSweep.query.get_or_404(sweep_id)
+    return jsonify(sweep_summary(sweep)), 200
+
+@sweep_bp.route('/<int:sweep_id>/tasks', methods=['GET'])
+def get_sweep_tasks(sweep_id):
+    """Get the trials of a sweep"""
+    sweep = TrainingSweep.query.get_or_404(sweep_id)
+    tasks = sweep.tasks.order_by(TrainingTask.id).all()
+    return jsonify([task.to_dict() for task in tasks]), 200
+
+@sweep_bp.route('', methods=['POST'])
+def create_training_sweep():
+    """Create a sweep and start its first trials"""
+    data = request.get_json() or {}
+
+    # Validate required fields
+    if not data.get('name'):
+        return jsonify({'error': 'Sweep name is required'}), 400
+    if not data.get('model_id'):
+        return jsonify({'error': 'Model ID is required'}), 400
+    if not data.get('dataset_id'):
+        return jsonify({'error': 'Dataset ID is required'}), 400
+    if not data.get('search_space'):
+        return jsonify({'error': 'Search space is required'}), 400
+    if data.get('metric', 'validation_loss') not in SWEEP_METRICS:
+        return jsonify({'error': f"Metric must be one of {', '.join(SWEEP_METRICS)}"}), 400
+    if data.get('mode', 'min') not in ('min', 'max'):
+        return jsonify({'error': 'Mode must be min or max'}), 400
+    for key, default, minimum in SWEEP_LIMITS:
+        value = data.setdefault(key, default)
+        if isinstance(value, bool) or not isinstance(value, int) or value < minimum:
+            return jsonify({'error': f'{key} must be an integer of at least {minimum}'}), 400
+
+    # Verify model and dataset exist
+    if not db.session.get(Model, data['model_id']):
+        return jsonify({'error': 'Model not found'}), 404
+    if not db.session.get(Dataset, data['dataset_id']):
+        return jsonify({'error': 'Dataset not found'}), 404
+
+    sweep = TrainingSweep(
+        name=data['name'],
+        model_id=data['model_id'],
+        dataset_id=data['dataset_id'],
+        strategy=data.get('strategy', 'grid'),
+        search_space=data['search_space'],
+        num_samples=data['num_samples'],
+        max_concurrency=data['max_concurrency'],
+        metric=data.get('metric', 'validation_loss'),
+        mode=data.get('mode', 'min'),
+        max_epochs=data['max_epochs'],
+        grace_epochs=data['grace_epochs'],
+        reduction_factor=data['reduction_factor'],
+        seed=data.get('seed'),
+        status='running'
+    )
+
+    try:
+        early_stopping = validate_policy(data['early_stopping']) if data.get('early_stopping') else None
+        create_sweep(sweep, early_stopping)
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify(sweep_summary(sweep)), 201
+
+@sweep_bp.route('/<int:sweep_id>/stop', methods=['POST'])
+def stop_training_sweep(sweep_id):
+    """Stop a sweep and all of its unfinished trials"""
+    sweep = TrainingSweep.query.get_or_404(sweep_id)
+
+    if sweep.status != 'running':
+        return jsonify({'error': 'Sweep is not running'}), 400
+
+    stop_sweep(sweep)
+    return jsonify(sweep_summary(sweep)), 200
@@ -1,10 +1,24 @@
-from datetime import datetime
-from flask import Blueprint, request, jsonify, current_app
-from ..models import db, TrainingTask, TrainingMetric, Model, Dataset
-from ..services.training_service import start_training_task
+import json
+from flask import Blueprint, request, jsonify, send_file, current_app
+from ..models import db, TrainingTask, TrainingMetric, Model, Dataset, Checkpoint
+from ..services.training_service import launch_training_task, finish_training_task, process_metric
+from ..services.early_stopping import validate_policy
+from ..services.checkpoint_service import (
+    save_checkpoint, apply_retention, best_checkpoint, latest_checkpoint,
+    resume_task, promote_checkpoint, validate_checkpoint_policy
+)
+from ..services.lease_service import lease_task, renew_lease, release_lease
+from ..services.scheduler_service import queue_snapshot, running_usage, parse_resources
+from ..services.telemetry_service import parse_sample, record_samples, analyze, load_samples
+from ..services.bulk_service import TaskBulkOperation
+from ..services.storage_service import delete_tasks
+from ..services.version_service import get_version, version_details
 
 training_bp = Blueprint('training', __name__, url_prefix='/api/training')
 
+# Numeric fields of a metric report
+METRIC_FIELDS = ('loss', 'accuracy', 'validation_loss', 'validation_accuracy', 'learning_rate')
+
 @training_bp.route('/tasks', methods=['GET'])
 def get_training_tasks():
     """Get all training tasks"""
@@ -39,46 +53,178 @@ def create_training_task():
     if not dataset:
         return jsonify({'error': 'Dataset not found'}), 404
     
+    dataset_version = data.get('dataset_version')
+    if dataset_version is not None:
+        if not isinstance(dataset_version, int) or isinstance(dataset_version, bool):
+            return jsonify({'error': 'dataset_version must be a version number'}), 400
+        try:
+            get_version(dataset, dataset_version)
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 404
+    
+    early_stopping = None
+    if data.get('early_stopping'):
+        try:
+            early_stopping = validate_policy(data['early_stopping'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    
+    try:
+        priority, cpu_request, memory_request = parse_resources(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     task = TrainingTask(
         name=data.get('name'),
         model_id=data['model_id'],
         dataset_id=data['dataset_id'],
+        dataset_version=dataset_version or None,
         status='pending',
-        total_epochs=data.get('epochs', 10)
+        total_epochs=data.get('epochs', 10),
+        early_stopping=early_stopping,
+        priority=priority,
+        owner=data.get('owner') or 'default',
+        queue=data.get('queue') or 'default',
+        cpu_request=cpu_request,
+        memory_request=memory_request
     )
     
     db.session.add(task)
     db.session.commit()
     
     # Start training asynchronously
-    try:
-        start_training_task(task.id, data)
-        task.status = 'running'
-        task.start_time = datetime.utcnow()
-        db.session.commit()
-    except Exception as e:
-        task.status = 'failed'
-        task.error_message = str(e)
-        db.session.commit()
-        current_app.logger.error(f"Failed to start training: {str(e)}")
+    launch_training_task(task, data)
     
     return jsonify(task.to_dict()), 201
 
+@training_bp.route('/tasks/bulk', methods=['POST'])
+def bulk_training_tasks():
+    """Create, update and delete many training tasks in one transaction"""
+    try:
+        operation = TaskBulkOperation(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    response, status = operation.run()
+    return jsonify(response), status
+
 @training_bp.route('/tasks/<int:task_id>/stop', methods=['POST'])
 def stop_training_task(task_id):
-    """Stop a running training task"""
+    """Stop a queued or running training task"""
     task = TrainingTask.query.get_or_404(task_id)
     
-    if task.status != 'running':
+    if task.status not in ('queued', 'running'):
         return jsonify({'error': 'Task is not running'}), 400
     
-    # In a real implementation, this would signal the Celery task to stop
-    task.status = 'stopped'
-    task.end_time = datetime.utcnow()
-    db.session.commit()
+    # The trainer sees the stopped status in its next metric response or heartbeat
+    finish_training_task(task, 'stopped')
     
     return jsonify(task.to_dict()), 200
 
+@training_bp.route('/lease', methods=['POST'])
+def lease_training_task():
+    """
+    Lease the next queued task to a worker agent, waiting up to `wait` seconds
+    (at most TRAINING_LEASE_MAX_WAIT)
+    Workers send their free `cpu` cores and `memory` (MB), optionally their
+    `total_cpu` and `total_memory`, and may pick `queues`
+    """
+    data = request.get_json(silent=True) or {}
+    
+    if not data.get('worker_id'):
+        return jsonify({'error': 'Worker ID is required'}), 400
+    
+    try:
+        cpu = float(data['cpu']) if data.get('cpu') is not None else None
+        memory = int(data['memory']) if data.get('memory') is not None else None
+        total_cpu = float(data['total_cpu']) if data.get('total_cpu') is not None else None
+        total_memory = int(data['total_memory']) if data.get('total_memory') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'cpu, memory, total_cpu and total_memory must be numbers'}), 400
+    
+    try:
+        wait = float(data.get('wait') or 0)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'wait must be a number'}), 400
+    if not 0 <= wait < float('inf'):
+        return jsonify({'error': 'wait must not be negative'}), 400
+    wait = min(wait, current_app.config['TRAINING_LEASE_MAX_WAIT'])
+    
+    queues = data.get('queues')
+    if isinstance(queues, str):
+        queues = [queues]
+    
+    task = lease_task(str(data['worker_id']), wait, cpu, memory, queues, total_cpu, total_memory)
+    if task is None:
+        return '', 204
+    
+    response = task.to_dict()
+    response['config'] = task.launch_config or {}
+    response['lease_seconds'] = current_app.config['TRAINING_LEASE_SECONDS']
+    response['model'] = task.model.to_dict() if task.model else None
+    response['dataset'] = task.dataset.to_dict() if task.dataset else None
+    if task.dataset and task.dataset_version:
+        response['dataset']['version'] = version_details(task.dataset, get_version(task.dataset, task.dataset_version))
+    return jsonify(response), 200
+
+@training_bp.route('/queue', methods=['GET'])
+def get_training_queue():
+    """Get queued tasks in scheduling order with position and estimated start"""
+    queues = request.args.getlist('queue')
+    tasks = queue_snapshot(queues)
+    
+    owner = request.args.get('owner')
+    if owner:
+        tasks = [task for task in tasks if task['owner'] == owner]
+    
+    return jsonify({
+        'tasks': tasks,
+        'running': TrainingTask.query.filter_by(status='running').count(),
+        'running_by_owner': running_usage()
+    }), 200
+
+@training_bp.route('/tasks/<int:task_id>/heartbeat', methods=['POST'])
+def heartbeat_training_task(task_id):
+    """Extend a worker's lease; 409 tells the worker to stop"""
+    task = TrainingTask.query.get_or_404(task_id)
+    data = request.get_json(silent=True) or {}
+    
+    if not renew_lease(task, data.get('worker_id')):
+        return jsonify({'error': 'Worker does not hold the lease', 'task_status': task.status}), 409
+    
+    return jsonify({'task_status': task.status, 'lease_expires_at': task.lease_expires_at.isoformat()}), 200
+
+@training_bp.route('/tasks/<int:task_id>/complete', methods=['POST'])
+def complete_training_task(task_id):
+    """Report the end of a leased task (used by worker agents)"""
+    task = TrainingTask.query.get_or_404(task_id)
+    data = request.get_json(silent=True) or {}
+    
+    if not data.get('worker_id') or task.worker_id != data['worker_id']:
+        return jsonify({'error': 'Worker does not hold the lease', 'task_status': task.status}), 409
+    if data.get('status', 'completed') not in ('completed', 'failed'):
+        return jsonify({'error': 'Status must be completed or failed'}), 400
+    
+    release_lease(task, data.get('status', 'completed'), data.get('error_message'))
+    return jsonify(task.to_dict()), 200
+
+@training_bp.route('/tasks/<int:task_id>/early-stopping', methods=['PUT'])
+def update_early_stopping(task_id):
+    """Set or clear the early-stopping policy of a task"""
+    task = TrainingTask.query.get_or_404(task_id)
+    data = request.get_json()
+    
+    if data:
+        try:
+            task.early_stopping = validate_policy(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    else:
+        task.early_stopping = None
+    
+    db.session.commit()
+    return jsonify(task.to_dict()), 200
+
 @training_bp.route('/tasks/<int:task_id>/metrics', methods=['GET'])
 def get_training_metrics(task_id):
     """Get metrics for a training task"""
@@ -87,14 +233,54 @@ def get_training_metrics(task_id):
     
     return jsonify({
         'task': task.to_dict(),
-        'metrics': [metric.to_dict() for metric in metrics]
+        'metrics': [metric.to_dict() for metric in metrics],
+        'telemetry': analyze(task, load_samples(task))
     }), 200
 
+@training_bp.route('/tasks/<int:task_id>/telemetry', methods=['GET'])
+def get_training_telemetry(task_id):
+    """Get a task's resource usage samples with a summary and flags"""
+    task = TrainingTask.query.get_or_404(task_id)
+    samples = load_samples(task)
+    
+    return jsonify({
+        'summary': analyze(task, samples),
+        'samples': [sample.to_dict() for sample in samples]
+    }), 200
+
+@training_bp.route('/tasks/<int:task_id>/telemetry', methods=['POST'])
+def add_training_telemetry(task_id):
+    """Report resource usage samples of a training process (used by training process)"""
+    task = TrainingTask.query.get_or_404(task_id)
+    data = request.get_json(silent=True)
+    
+    samples = data.get('samples', [data]) if isinstance(data, dict) else data
+    if not isinstance(samples, list) or not samples:
+        return jsonify({'error': 'Telemetry samples are required'}), 400
+    
+    try:
+        recorded = record_samples(task, [parse_sample(sample) for sample in samples])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not recorded:
+        return jsonify({'error': f'Task is {task.status}', 'task_status': task.status}), 409
+    
+    return jsonify({'received': len(samples), 'flags': task.telemetry_flags or []}), 201
+
 @training_bp.route('/tasks/<int:task_id>/metrics', methods=['POST'])
 def add_training_metric(task_id):
     """Add a new metric to a training task (used by training process)"""
     task = TrainingTask.query.get_or_404(task_id)
-    data = request.get_json()
+    data = request.get_json(silent=True) or {}
+    
+    epoch = data.get('epoch')
+    if epoch is not None and (isinstance(epoch, bool) or not isinstance(epoch, int)):
+        return jsonify({'error': 'epoch must be an integer'}), 400
+    for key in METRIC_FIELDS:
+        value = data.get(key)
+        # NaN and infinity are accepted: early stopping reports them as divergence
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+            return jsonify({'error': f'{key} must be a number'}), 400
     
     metric = TrainingMetric(
         task_id=task_id,
@@ -118,19 +304,118 @@ def add_training_metric(task_id):
     if task.total_epochs:
         task.progress = (task.current_epoch / task.total_epochs) * 100
     
+    # Evaluated before committing: reported NaN values are not preserved by every database
+    process_metric(task, metric)
     db.session.commit()
     
-    return jsonify(metric.to_dict()), 201
+    # Trainers stop early when the task is no longer running
+    response = metric.to_dict()
+    response['task_status'] = task.status
+    return jsonify(response), 201
 
 @training_bp.route('/tasks/<int:task_id>', methods=['DELETE'])
 def delete_training_task(task_id):
-    """Delete a training task"""
+    """Delete a training task; its checkpoints and outputs are removed in the background"""
     task = TrainingTask.query.get_or_404(task_id)
     
     if task.status == 'running':
         return jsonify({'error': 'Cannot delete a running task'}), 400
     
-    db.session.delete(task)
+    delete_tasks(TrainingTask.id == task_id)
     db.session.commit()
     
     return jsonify({'message': 'Training task deleted successfully'}), 200
+
+@training_bp.route('/tasks/<int:task_id>/checkpoints', methods=['GET'])
+def get_checkpoints(task_id):
+    """Get the retained checkpoints of a training task"""
+    task = TrainingTask.query.get_or_404(task_id)
+    checkpoints = task.checkpoints.order_by(Checkpoint.epoch).all()
+    return jsonify([checkpoint.to_dict() for checkpoint in checkpoints]), 200
+
+@training_bp.route('/tasks/<int:task_id>/checkpoints', methods=['POST'])
+def create_checkpoint(task_id):
+    """Upload a checkpoint for a training task (used by training process)"""
+    task = TrainingTask.query.get_or_404(task_id)
+    file = request.files.get('file')
+    
+    if not file:
+        return jsonify({'error': 'Checkpoint file is required'}), 400
+    epoch = request.form.get('epoch', type=int)
+    if epoch is None:
+        return jsonify({'error': 'Epoch is required'}), 400
+    
+    metrics = None
+    if request.form.get('metrics'):
+        try:
+            metrics = json.loads(request.form['metrics'])
+        except ValueError:
+            return jsonify({'error': 'Metrics must be a JSON object'}), 400
+    
+    try:
+        return jsonify(save_checkpoint(task, file, epoch, metrics)), 201
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+
+@training_bp.route('/tasks/<int:task_id>/checkpoints/<int:checkpoint_id>/download', methods=['GET'])
+def download_checkpoint(task_id, checkpoint_id):
+    """Download a checkpoint file"""
+    checkpoint = Checkpoint.query.filter_by(id=checkpoint_id, task_id=task_id).first_or_404()
+    return send_file(checkpoint.file_path, as_attachment=True)
+
+@training_bp.route('/tasks/<int:task_id>/checkpoint-policy', methods=['PUT'])
+def update_checkpoint_policy(task_id):
+    """Set the checkpoint retention policy of a task and apply it"""
+    task = TrainingTask.query.get_or_404(task_id)
+    data = request.get_json() or {}
+    
+    try:
+        task.checkpoint_policy = validate_checkpoint_policy(data) or None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    db.session.commit()
+    removed = apply_retention(task)
+    
+    response = task.to_dict()
+    response['removed_checkpoints'] = removed
+    return jsonify(response), 200
+
+@training_bp.route('/tasks/<int:task_id>/resume', methods=['POST'])
+def resume_training_task(task_id):
+    """Restart a stopped or failed task from its latest or a chosen checkpoint"""
+    task = TrainingTask.query.get_or_404(task_id)
+    data = request.get_json(silent=True) or {}
+    
+    if task.status not in ('stopped', 'failed'):
+        return jsonify({'error': 'Only stopped or failed tasks can be resumed'}), 400
+    
+    if data.get('checkpoint_id'):
+        checkpoint = Checkpoint.query.filter_by(id=data['checkpoint_id'], task_id=task_id).first()
+    else:
+        checkpoint = latest_checkpoint(task)
+    if not checkpoint:
+        return jsonify({'error': 'No checkpoint to resume from'}), 404
+    
+    resume_task(task, checkpoint)
+    return jsonify(task.to_dict()), 200
+
+@training_bp.route('/tasks/<int:task_id>/promote', methods=['POST'])
+def promote_training_task(task_id):
+    """Register the best (or a chosen) checkpoint of a task as a new model"""
+    task = TrainingTask.query.get_or_404(task_id)
+    data = request.get_json(silent=True) or {}
+    
+    if data.get('checkpoint_id'):
+        checkpoint = Checkpoint.query.filter_by(id=data['checkpoint_id'], task_id=task_id).first()
+    else:
+        checkpoint = best_checkpoint(task)
+    if not checkpoint:
+        return jsonify({'error': 'No checkpoint to promote'}), 404
+    
+    try:
+        model = promote_checkpoint(checkpoint, data.get('name'), data.get('version'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify(model.to_dict()), 201
@@ -13,6 +13,8 @@ class Model(db.Model):
     version = db.Column(db.String(32))
     model_type = db.Column(db.String(64))  # e.g., 'vulnerability_detection', 'fine_grained_location'
     file_path = db.Column(db.String(256))
+    parent_id = db.Column(db.Integer, db.ForeignKey('models.id'))  # The model this one was optimized from
+    optimization = db.Column(db.String(32))  # Method that produced it from the parent, e.g. 'onnx_int8'
     accuracy = db.Column(db.Float)
     precision = db.Column(db.Float)
     recall = db.Column(db.Float)
@@ -21,6 +23,8 @@ class Model(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     training_tasks = db.relationship('TrainingTask', backref='model', lazy='dynamic')
+    evaluations = db.relationship('ModelEvaluation', backref='model', lazy='dynamic',
+                                  cascade='all, delete-orphan')
     
     def to_dict(self):
         return {
@@ -30,6 +34,8 @@ class Model(db.Model):
             'version': self.version,
             'model_type': self.model_type,
             'file_path': self.file_path,
+            'parent_id': self.parent_id,
+            'optimization': self.optimization,
             'accuracy': self.accuracy,
             'precision': self.precision,
             'recall': self.recall,
@@ -56,6 +62,14 @@ class Dataset(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     training_tasks = db.relationship('TrainingTask', backref='dataset', lazy='dynamic')
+    evaluations = db.relationship('ModelEvaluation', backref='dataset', lazy='dynamic',
+                                  cascade='all, delete-orphan')
+    splits = db.relationship('DatasetSplit', backref='dataset', lazy='dynamic',
+                             cascade='all, delete-orphan')
+    versions = db.relationship('DatasetVersion', backref='dataset', lazy='dynamic',
+                               cascade='all, delete-orphan')
+    search_sources = db.relationship('SearchIndexSource', backref='dataset', lazy='dynamic',
+                                     cascade='all, delete-orphan')
     
     def to_dict(self):
         return {
@@ -73,6 +87,145 @@ class Dataset(db.Model):
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
+class DatasetSplit(db.Model):
+    """Train/validation/test split of a dataset stored as index arrays"""
+    __tablename__ = 'dataset_splits'
+    __table_args__ = (db.UniqueConstraint('dataset_id', 'params_hash'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    dataset_id = db.Column(db.Integer, db.ForeignKey('datasets.id'))
+    params_hash = db.Column(db.String(40), nullable=False)  # Identifies parameters + dataset file
+    ratios = db.Column(db.JSON)  # e.g., {'train': 0.8, 'validation': 0.1, 'test': 0.1}
+    seed = db.Column(db.Integer, default=0)
+    stratify = db.Column(db.Boolean, default=True)  # By label and vulnerability_type
+    group_key = db.Column(db.String(64))  # Record field whose values never straddle parts
+    file_path = db.Column(db.String(256))  # .npz of sorted record indices per part
+    num_samples = db.Column(db.Integer)
+    counts = db.Column(db.JSON)  # {part: number of records}
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'dataset_id': self.dataset_id,
+            'ratios': self.ratios,
+            'seed': self.seed,
+            'stratify': self.stratify,
+            'group_key': self.group_key,
+            'num_samples': self.num_samples,
+            'counts': self.counts,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class DatasetVersion(db.Model):
+    """
+    Version of a dataset stored as a delta on its parent version: records
+    added and ids of records removed. Version 0 is the uploaded file itself.
+    """
+    __tablename__ = 'dataset_versions'
+    __table_args__ = (db.UniqueConstraint('dataset_id', 'version'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    dataset_id = db.Column(db.Integer, db.ForeignKey('datasets.id'))
+    version = db.Column(db.Integer, nullable=False)
+    parent_version = db.Column(db.Integer, default=0)
+    description = db.Column(db.Text)
+    file_path = db.Column(db.String(256))  # .jsonl delta, see services/version_service.py
+    size = db.Column(db.Integer)  # Size of the delta in bytes
+    num_added = db.Column(db.Integer)
+    num_removed = db.Column(db.Integer)
+    first_record_id = db.Column(db.Integer)  # Id of the first added record
+    next_record_id = db.Column(db.Integer)  # Ids below this are taken in this version's lineage
+    num_samples = db.Column(db.Integer)
+    num_vulnerable = db.Column(db.Integer)
+    num_safe = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'dataset_id': self.dataset_id,
+            'version': self.version,
+            'parent_version': self.parent_version,
+            'description': self.description,
+            'file_path': self.file_path,
+            'size': self.size,
+            'num_added': self.num_added,
+            'num_removed': self.num_removed,
+            'first_record_id': self.first_record_id,
+            'next_record_id': self.next_record_id,
+            'num_samples': self.num_samples,
+            'num_vulnerable': self.num_vulnerable,
+            'num_safe': self.num_safe,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class SearchIndexSource(db.Model):
+    """The code search index of one dataset file or version delta, see services/search_index.py"""
+    __tablename__ = 'search_index_sources'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    dataset_id = db.Column(db.Integer, db.ForeignKey('datasets.id'), index=True)
+    version = db.Column(db.Integer, default=0)  # 0 for the uploaded file, else the delta's version
+    status = db.Column(db.String(16), default='pending', index=True)  # pending, indexing, completed, failed
+    path = db.Column(db.String(256))  # Folder of index segments
+    num_docs = db.Column(db.Integer)  # Records with code
+    num_segments = db.Column(db.Integer)
+    size = db.Column(db.BigInteger)  # Bytes on disk
+    error = db.Column(db.Text)
+    claimed_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    indexed_at = db.Column(db.DateTime)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'dataset_id': self.dataset_id,
+            'version': self.version,
+            'status': self.status,
+            'path': self.path,
+            'num_docs': self.num_docs,
+            'num_segments': self.num_segments,
+            'size': self.size,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'indexed_at': self.indexed_at.isoformat() if self.indexed_at else None
+        }
+
+class LocalizationScan(db.Model):
+    """Line-level predictions of a fine-grained localization model, see services/localization_store.py"""
+    __tablename__ = 'localization_scans'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(128))
+    model_id = db.Column(db.Integer, db.ForeignKey('models.id'), index=True)
+    dataset_id = db.Column(db.Integer, db.ForeignKey('datasets.id'))  # What was scanned, if a dataset
+    status = db.Column(db.String(16), default='receiving')  # receiving, completing, completed
+    path = db.Column(db.String(256))  # Folder of result batches, then of the scan's columns
+    num_ranges = db.Column(db.Integer, default=0)  # Line ranges received
+    num_files = db.Column(db.Integer)
+    max_score = db.Column(db.Float)
+    size = db.Column(db.BigInteger)  # Bytes on disk once completed
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
+    
+    model = db.relationship('Model')
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'model_id': self.model_id,
+            'dataset_id': self.dataset_id,
+            'status': self.status,
+            'num_ranges': self.num_ranges,
+            'num_files': self.num_files,
+            'max_score': self.max_score,
+            'size': self.size,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None
+        }
+
 class TrainingTask(db.Model):
     """Training task entity for tracking model training"""
     __tablename__ = 'training_tasks'
@@ -81,7 +234,8 @@ class TrainingTask(db.Model):
     name = db.Column(db.String(128), nullable=False)
     model_id = db.Column(db.Integer, db.ForeignKey('models.id'))
     dataset_id = db.Column(db.Integer, db.ForeignKey('datasets.id'))
-    status = db.Column(db.String(32), default='pending')  # pending, running, completed, failed
+    dataset_version = db.Column(db.Integer)  # Trains on this version of the dataset; None for the file as uploaded
+    status = db.Column(db.String(32), default='pending', index=True)  # pending, queued, running, completed, stopped, failed
     progress = db.Column(db.Float, default=0.0)  # 0-100
     current_epoch = db.Column(db.Integer, default=0)
     total_epochs = db.Column(db.Integer)
@@ -93,10 +247,34 @@ class TrainingTask(db.Model):
     end_time = db.Column(db.DateTime)
     error_message = db.Column(db.Text)
     output_path = db.Column(db.String(256))
+    sweep_id = db.Column(db.Integer, db.ForeignKey('training_sweeps.id'), index=True)
+    hyperparameters = db.Column(db.JSON)  # e.g., {'learning_rate': 0.001, 'batch_size': 32}
+    stop_reason = db.Column(db.Text)  # Why the platform stopped the task early
+    early_stopping = db.Column(db.JSON)  # Policy, see services/early_stopping.py
+    best_metric_value = db.Column(db.Float)  # Best value of the monitored metric so far
+    best_epoch = db.Column(db.Integer)
+    epochs_without_improvement = db.Column(db.Integer, default=0)
+    checkpoint_policy = db.Column(db.JSON)  # {'keep_best', 'keep_last', 'monitor', 'mode'}
+    resume_checkpoint_id = db.Column(db.Integer)  # Checkpoint the current run resumed from
+    launch_config = db.Column(db.JSON)  # Training config handed to the worker that leases the task
+    worker_id = db.Column(db.String(128))  # Worker agent holding the lease
+    lease_expires_at = db.Column(db.DateTime)
+    attempts = db.Column(db.Integer, default=0)  # Leases granted so far
+    priority = db.Column(db.Integer, default=0)  # Higher runs first
+    owner = db.Column(db.String(64), default='default', index=True)  # Fair share is split across owners
+    queue = db.Column(db.String(64), default='default')  # Workers can serve selected queues
+    cpu_request = db.Column(db.Float, default=1.0)  # CPU cores
+    memory_request = db.Column(db.Integer, default=2048)  # MB
+    queued_at = db.Column(db.DateTime)
+    queue_rank = db.Column(db.Float, index=True)  # Lower starts first within an owner, see scheduler_service
+    telemetry_count = db.Column(db.Integer, default=0)  # Telemetry samples received
+    telemetry_flags = db.Column(db.JSON)  # e.g., ['under_utilized', 'memory_leak']
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     metrics = db.relationship('TrainingMetric', backref='task', lazy='dynamic', cascade='all, delete-orphan')
+    checkpoints = db.relationship('Checkpoint', backref='task', lazy='dynamic', cascade='all, delete-orphan')
+    telemetry = db.relationship('TelemetrySample', backref='task', lazy='dynamic', cascade='all, delete-orphan')
     
     def to_dict(self):
         return {
@@ -104,6 +282,7 @@ class TrainingTask(db.Model):
             'name': self.name,
             'model_id': self.model_id,
             'dataset_id': self.dataset_id,
+            'dataset_version': self.dataset_version,
             'status': self.status,
             'progress': self.progress,
             'current_epoch': self.current_epoch,
@@ -116,6 +295,24 @@ class TrainingTask(db.Model):
             'end_time': self.end_time.isoformat() if self.end_time else None,
             'error_message': self.error_message,
             'output_path': self.output_path,
+            'sweep_id': self.sweep_id,
+            'hyperparameters': self.hyperparameters,
+            'stop_reason': self.stop_reason,
+            'early_stopping': self.early_stopping,
+            'best_metric_value': self.best_metric_value,
+            'best_epoch': self.best_epoch,
+            'checkpoint_policy': self.checkpoint_policy,
+            'resume_checkpoint_id': self.resume_checkpoint_id,
+            'worker_id': self.worker_id,
+            'lease_expires_at': self.lease_expires_at.isoformat() if self.lease_expires_at else None,
+            'attempts': self.attempts,
+            'priority': self.priority,
+            'owner': self.owner,
+            'queue': self.queue,
+            'cpu_request': self.cpu_request,
+            'memory_request': self.memory_request,
+            'queued_at': self.queued_at.isoformat() if self.queued_at else None,
+            'telemetry_flags': self.telemetry_flags,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
@@ -125,7 +322,7 @@ class TrainingMetric(db.Model):
     __tablename__ = 'training_metrics'
     
     id = db.Column(db.Integer, primary_key=True)
-    task_id = db.Column(db.Integer, db.ForeignKey('training_tasks.id'))
+    task_id = db.Column(db.Integer, db.ForeignKey('training_tasks.id'), index=True)
     epoch = db.Column(db.Integer)
     loss = db.Column(db.Float)
     accuracy = db.Column(db.Float)
@@ -146,3 +343,275 @@ class TrainingMetric(db.Model):
             'learning_rate': self.learning_rate,
             'timestamp': self.timestamp.isoformat() if self.timestamp else None
         }
+
+class TelemetrySample(db.Model):
+    """Resource usage of a training process; a fixed number of slots per task, reused as a ring buffer"""
+    __tablename__ = 'training_telemetry'
+    __table_args__ = (db.UniqueConstraint('task_id', 'slot'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    task_id = db.Column(db.Integer, db.ForeignKey('training_tasks.id'), nullable=False)
+    slot = db.Column(db.Integer, nullable=False)
+    sequence = db.Column(db.Integer, nullable=False)  # Sample number; slot = sequence % ring size
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    cpu_percent = db.Column(db.Float)  # 100 per fully used core
+    rss = db.Column(db.BigInteger)  # Bytes
+    read_bytes = db.Column(db.BigInteger)  # Cumulative
+    write_bytes = db.Column(db.BigInteger)  # Cumulative
+    samples_per_sec = db.Column(db.Float)
+    
+    def to_dict(self):
+        return {
+            'sequence': self.sequence,
+            'timestamp': self.timestamp.isoformat() if self.timestamp else None,
+            'cpu_percent': self.cpu_percent,
+            'rss': self.rss,
+            'read_bytes': self.read_bytes,
+            'write_bytes': self.write_bytes,
+            'samples_per_sec': self.samples_per_sec
+        }
+
+class Checkpoint(db.Model):
+    """Checkpoint file saved by a training task"""
+    __tablename__ = 'training_checkpoints'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    task_id = db.Column(db.Integer, db.ForeignKey('training_tasks.id'), index=True)
+    epoch = db.Column(db.Integer, nullable=False)
+    metrics = db.Column(db.JSON)  # Metric snapshot at this epoch
+    file_path = db.Column(db.String(256))
+    size = db.Column(db.Integer)  # Size in bytes
+    sha256 = db.Column(db.String(64))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'task_id': self.task_id,
+            'epoch': self.epoch,
+            'metrics': self.metrics,
+            'file_path': self.file_path,
+            'size': self.size,
+            'sha256': self.sha256,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class TrainingSweep(db.Model):
+    """Hyperparameter sweep expanded into child training tasks"""
+    __tablename__ = 'training_sweeps'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(128), nullable=False)
+    model_id = db.Column(db.Integer, db.ForeignKey('models.id'))
+    dataset_id = db.Column(db.Integer, db.ForeignKey('datasets.id'))
+    strategy = db.Column(db.String(16), default='grid')  # grid, random
+    search_space = db.Column(db.JSON)
+    num_samples = db.Column(db.Integer)  # Trials drawn by random search
+    max_concurrency = db.Column(db.Integer, default=2)
+    metric = db.Column(db.String(32), default='validation_loss')
+    mode = db.Column(db.String(8), default='min')  # min, max
+    max_epochs = db.Column(db.Integer, default=10)
+    grace_epochs = db.Column(db.Integer, default=1)  # First rung of successive halving
+    reduction_factor = db.Column(db.Integer, default=3)
+    seed = db.Column(db.Integer)
+    status = db.Column(db.String(32), default='running')  # running, completed, stopped
+    best_task_id = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    tasks = db.relationship('TrainingTask', backref='sweep', lazy='dynamic')
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'model_id': self.model_id,
+            'dataset_id': self.dataset_id,
+            'strategy': self.strategy,
+            'search_space': self.search_space,
+            'num_samples': self.num_samples,
+            'max_concurrency': self.max_concurrency,
+            'metric': self.metric,
+            'mode': self.mode,
+            'max_epochs': self.max_epochs,
+            'grace_epochs': self.grace_epochs,
+            'reduction_factor': self.reduction_factor,
+            'seed': self.seed,
+            'status': self.status,
+            'best_task_id': self.best_task_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class ModelEvaluation(db.Model):
+    """Evaluation of a model on a dataset"""
+    __tablename__ = 'model_evaluations'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    model_id = db.Column(db.Integer, db.ForeignKey('models.id'))
+    dataset_id = db.Column(db.Integer, db.ForeignKey('datasets.id'))
+    status = db.Column(db.String(32), default='pending')  # pending, running, completed, failed
+    threshold = db.Column(db.Float, default=0.5)
+    batch_size = db.Column(db.Integer, default=256)
+    apply_to_model = db.Column(db.Boolean, default=False)  # Store the measured metrics on the model
+    num_samples = db.Column(db.Integer)
+    accuracy = db.Column(db.Float)
+    precision = db.Column(db.Float)
+    recall = db.Column(db.Float)
+    f1_score = db.Column(db.Float)
+    roc_auc = db.Column(db.Float)
+    pr_auc = db.Column(db.Float)
+    confusion_matrix = db.Column(db.JSON)  # {'tp', 'fp', 'tn', 'fn'}
+    per_type_metrics = db.Column(db.JSON)  # {vulnerability_type: {'precision', 'recall', ...}}
+    curves = db.Column(db.JSON)  # {'thresholds', 'precision', 'recall', 'fpr'}
+    start_time = db.Column(db.DateTime)
+    end_time = db.Column(db.DateTime)
+    error_message = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self, include_curves=False):
+        data = {
+            'id': self.id,
+            'model_id': self.model_id,
+            'dataset_id': self.dataset_id,
+            'status': self.status,
+            'threshold': self.threshold,
+            'batch_size': self.batch_size,
+            'apply_to_model': self.apply_to_model,
+            'num_samples': self.num_samples,
+            'accuracy': self.accuracy,
+            'precision': self.precision,
+            'recall': self.recall,
+            'f1_score': self.f1_score,
+            'roc_auc': self.roc_auc,
+            'pr_auc': self.pr_auc,
+            'confusion_matrix': self.confusion_matrix,
+            'per_type_metrics': self.per_type_metrics,
+            'start_time': self.start_time.isoformat() if self.start_time else None,
+            'end_time': self.end_time.isoformat() if self.end_time else None,
+            'error_message': self.error_message,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+        if include_curves:
+            data['curves'] = self.curves
+        return data
+
+class ModelOptimization(db.Model):
+    """Conversion of a model to a faster form, benchmarked against it on a dataset"""
+    __tablename__ = 'model_optimizations'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    model_id = db.Column(db.Integer, db.ForeignKey('models.id'), index=True)
+    dataset_id = db.Column(db.Integer, db.ForeignKey('datasets.id'))
+    output_model_id = db.Column(db.Integer, db.ForeignKey('models.id'))  # The derivative registered on success
+    method = db.Column(db.String(32), nullable=False)  # See services/optimization_service.py
+    options = db.Column(db.JSON)
+    status = db.Column(db.String(32), default='pending')  # pending, running, completed, failed
+    batch_size = db.Column(db.Integer)
+    num_samples = db.Column(db.Integer)
+    baseline = db.Column(db.JSON)  # {'latency_p50_ms', 'latency_p95_ms', 'throughput', 'accuracy', 'f1_score', 'size'}
+    optimized = db.Column(db.JSON)  # The same for the derivative, with its 'agreement' with the baseline
+    speedup = db.Column(db.Float)  # Baseline over optimized p50 latency
+    accuracy_delta = db.Column(db.Float)  # Optimized minus baseline
+    f1_delta = db.Column(db.Float)
+    start_time = db.Column(db.DateTime)
+    end_time = db.Column(db.DateTime)
+    error_message = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    model = db.relationship('Model', foreign_keys=[model_id])
+    dataset = db.relationship('Dataset')
+    output_model = db.relationship('Model', foreign_keys=[output_model_id])
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'model_id': self.model_id,
+            'dataset_id': self.dataset_id,
+            'output_model_id': self.output_model_id,
+            'method': self.method,
+            'options': self.options,
+            'status': self.status,
+            'batch_size': self.batch_size,
+            'num_samples': self.num_samples,
+            'baseline': self.baseline,
+            'optimized': self.optimized,
+            'speedup': self.speedup,
+            'accuracy_delta': self.accuracy_delta,
+            'f1_delta': self.f1_delta,
+            'start_time': self.start_time.isoformat() if self.start_time else None,
+            'end_time': self.end_time.isoformat() if self.end_time else None,
+            'error_message': self.error_message,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class ChatMessage(db.Model):
+    """Chat message belonging to a chat session"""
+    __tablename__ = 'chat_messages'
+    __table_args__ = (db.Index('ix_chat_messages_session_id_id', 'session_id', 'id'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.String(64), nullable=False)
+    role = db.Column(db.String(16), nullable=False)  # user, assistant
+    content = db.Column(db.Text, nullable=False)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'role': self.role,
+            'content': self.content,
+            'timestamp': self.timestamp.isoformat() if self.timestamp else None
+        }
+
+class FileTombstone(db.Model):
+    """File or directory of a deleted record, waiting to be removed from disk in the background"""
+    __tablename__ = 'file_tombstones'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    path = db.Column(db.String(512), nullable=False)
+    reason = db.Column(db.String(32))  # e.g., 'model_deleted', 'retention', 'orphan'
+    size = db.Column(db.BigInteger)  # Bytes when tombstoned; None for directories
+    status = db.Column(db.String(16), default='pending', index=True)  # pending, failed
+    attempts = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'path': self.path,
+            'reason': self.reason,
+            'size': self.size,
+            'status': self.status,
+            'attempts': self.attempts,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class StorageScan(db.Model):
+    """Orphan scan reconciling the storage folders with the paths recorded in the database"""
+    __tablename__ = 'storage_scans'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    dry_run = db.Column(db.Boolean, default=False)
+    num_files = db.Column(db.Integer)
+    total_bytes = db.Column(db.BigInteger)
+    num_orphans = db.Column(db.Integer)  # Untracked files and directories found
+    orphan_bytes = db.Column(db.BigInteger)
+    folders = db.Column(db.JSON)  # {folder: {'files', 'bytes'}}
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'dry_run': self.dry_run,
+            'num_files': self.num_files,
+            'total_bytes': self.total_bytes,
+            'num_orphans': self.num_orphans,
+            'orphan_bytes': self.orphan_bytes,
+            'folders': self.folders,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
@@ -0,0 +1,145 @@
+import math
+import time
+import threading
+from collections import OrderedDict
+from flask import g, request, jsonify
+from .metrics_service import metrics
+
+MAX_BUCKETS = 10000  # Token buckets kept per pool; the least recently used client's goes first
+DURATION_SMOOTHING = 0.2  # Weight of the latest request in a pool's mean duration
+
+
+class Pool:
+    """A bulkhead for one class of heavy requests, with a token bucket per client"""
+
+    def __init__(self, name, limit=0, rate=None, burst=None):
+        self.name = name
+        self.limit = limit
+        self.rate = rate
+        self.burst = burst or 1
+        self.in_flight = 0
+        self.mean_duration = 1.0
+        self.rejected = {'concurrency': 0, 'rate': 0}
+        self.buckets = OrderedDict()  # key -> (tokens, updated)
+
+    def take(self, key, now):
+        """Take a token from key's bucket; returns 0, or the seconds until one is available"""
+        if not self.rate:
+            return 0
+        tokens, updated = self.buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        wait = 0 if tokens >= 1 else (1 - tokens) / self.rate
+        self.buckets[key] = (tokens - 1 if not wait else tokens, now)
+        while len(self.buckets) > MAX_BUCKETS:
+            self.buckets.popitem(last=False)
+        return wait
+
+    def stats(self):
+        return {
+            'limit': self.limit,
+            'in_flight': self.in_flight,
+            'rate': self.rate,
+            'burst': self.burst if self.rate else None,
+            'clients': len(self.buckets),
+            'mean_duration': self.mean_duration,
+            'rejected': dict(self.rejected)
+        }
+
+
+class AdmissionController:
+    """
+    Admission control: bulkheads and rate limits for heavy requests
+
+    The endpoints listed in ADMISSION_ROUTES go to the pool named there, so
+    checkpoint uploads do not compete with dataset uploads, and other
+    multipart uploads to the 'upload' pool; other requests are not limited. A pool admits at most its ADMISSION_POOLS number of concurrent
+    requests and rejects the rest at once with 503. Each client, or each
+    training task for routes about one task, also draws from a token bucket
+    per pool (ADMISSION_RATE_LIMITS) and gets 429 when it is empty. Both
+    carry Retry-After, and both reject before the request body is read.
+
+    Clients are told apart by address; behind a reverse proxy, set
+    TRUSTED_PROXIES so it is taken from X-Forwarded-For.
+
+    Limits apply per worker process. Under gunicorn's threaded workers (see
+    gunicorn.conf.py) the pools cap the threads heavy requests may hold, so
+    the remaining threads keep serving reads.
+    """
+
+    def __init__(self, app=None):
+        self.pools = {}
+        self.routes = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        limits = app.config.get('ADMISSION_RATE_LIMITS', {})
+        self.pools = {name: Pool(name, limit, *limits.get(name, (None, None)))
+                      for name, limit in app.config.get('ADMISSION_POOLS', {}).items()}
+        self.routes = dict(app.config.get('ADMISSION_ROUTES', {}))
+        app.extensions['admission'] = self
+
+        if app.config.get('ADMISSION_ENABLED', True):
+            app.before_request(self._before_request)
+            app.teardown_request(self._teardown_request)
+
+    def classify(self):
+        """The pool of the current request, or None"""
+        if request.endpoint in self.routes:
+            return self.pools.get(self.routes[request.endpoint])
+        if request.method in ('POST', 'PUT') and (request.content_type or '').startswith('multipart/form-data'):
+            return self.pools.get('upload')
+        return None
+
+    def client_key(self):
+        task_id = (request.view_args or {}).get('task_id')
+        if task_id is not None:
+            return f'task:{task_id}'
+        return f'client:{request.remote_addr}'
+
+    def stats(self):
+        """Each pool's limits and state in this process"""
+        with self._lock:
+            return {name: pool.stats() for name, pool in self.pools.items()}
+
+    def _before_request(self):
+        pool = self.classify()
+        if pool is None:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            if pool.limit and pool.in_flight >= pool.limit:
+                reason, retry_after = 'concurrency', pool.mean_duration
+            else:
+                reason, retry_after = 'rate', pool.take(self.client_key(), now)
+                if not retry_after:
+                    pool.in_flight += 1
+                    g.admission = (pool, now)
+                    return None
+            pool.rejected[reason] += 1
+
+        metrics.inc('vulweb_admission_rejected_total', (('pool', pool.name), ('reason', reason)))
+        if reason == 'concurrency':
+            response = jsonify({'error': f'Too many concurrent {pool.name} requests, retry later'})
+            response.status_code = 503
+        else:
+            response = jsonify({'error': f'Rate limit exceeded for {pool.name} requests'})
+            response.status_code = 429
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response
+
+    def _teardown_request(self, exc):
+        admitted = g.pop('admission', None)
+        if admitted is None:
+            return
+        # Teardown runs after streamed responses finish, so the slot covers the whole body
+        pool, started = admitted
+        duration = time.monotonic() - started
+        with self._lock:
+            pool.in_flight -= 1
+            pool.mean_duration += DURATION_SMOOTHING * (duration - pool.mean_duration)
+
+
+admission = AdmissionController()
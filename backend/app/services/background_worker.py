@@ -0,0 +1,92 @@
+import os
+import logging
+import threading
+from sqlalchemy import event
+from ..models import db
+
+
+class BackgroundWorker:
+    """
+    Base of the extensions that work through queued rows on a background
+    thread: one thread per process, started by the first request and again
+    in each forked worker, running a pass every `interval` seconds and as
+    soon as a transaction that queued work commits.
+
+    Subclasses name the interval setting, the app extension and the
+    session.info flag that queuing sets, and implement run_pass.
+    """
+
+    name = 'Background work'  # For log messages
+    extension = None
+    interval_setting = None
+    default_interval = 0  # Seconds between passes; 0 disables the thread
+    wake_flag = None  # session.info key set by transactions that queued work
+
+    def __init__(self, app=None):
+        self.app = None
+        self.logger = logging.getLogger(__name__)
+        self.interval = 0
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._listening = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.logger = app.logger
+        self.interval = app.config.get(self.interval_setting, self.default_interval)
+        self._thread = None  # A running thread serves the previous app and exits
+        app.extensions[self.extension] = self
+        app.before_request(self._before_request)
+        if not self._listening:
+            event.listen(db.session, 'after_commit', self._after_commit)
+            self._listening = True
+
+    def run_pass(self):
+        """Handle the queued work, in an app context"""
+        raise NotImplementedError
+
+    def queued(self):
+        """Wake the thread once the current transaction commits"""
+        db.session.info[self.wake_flag] = True
+
+    def wake(self):
+        """Run a pass now rather than at the next interval"""
+        if self._ensure_thread():
+            self._wake.set()
+
+    def _before_request(self):
+        self._ensure_thread()
+
+    def _after_commit(self, session):
+        if session.info.pop(self.wake_flag, False):
+            self.wake()
+
+    def _ensure_thread(self):
+        """Start the background thread, once per process; returns whether it runs"""
+        if not self.interval or self.app is None:
+            return False
+        if self._thread is None or os.getpid() != self._pid:
+            with self._lock:
+                if self._thread is None or os.getpid() != self._pid:
+                    # A forked worker inherits the attribute but not the thread
+                    self._pid = os.getpid()
+                    self._thread = threading.Thread(target=self._run, daemon=True)
+                    self._thread.start()
+        return True
+
+    def _run(self):
+        app = self.app
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._thread is not threading.current_thread():
+                return
+            try:
+                with app.app_context():
+                    self.run_pass()
+            except Exception as e:
+                self.logger.error(f"{self.name} failed: {e}")
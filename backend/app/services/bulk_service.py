@@ -0,0 +1,499 @@
+"""
+Batch create, update and delete of models, datasets and training tasks.
+
+A request body holds `create` (objects), `update` (objects with an `id`) and
+`delete` (ids) lists. Every item is validated before anything is written,
+using one query per kind of lookup rather than one per item, and the whole
+batch is then written in a single transaction. With `atomic` (the default)
+one invalid item rejects the batch; otherwise the valid items are applied.
+Deleting a model or dataset that training tasks use requires `cascade`,
+which deletes the tasks as well. Files of deleted records are tombstoned in
+the same transaction and removed by the background cleaner.
+"""
+
+import os
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from ..models import db, Model, Dataset, DatasetVersion, TrainingTask, Checkpoint
+from .early_stopping import validate_policy
+from .checkpoint_service import checkpoint_model
+from .training_service import launch_training_task
+from .scheduler_service import parse_resources
+from .dataset_service import analyze_dataset
+from .file_cleaner import file_cleaner
+from .search_indexer import search_indexer
+from .storage_service import (
+    task_references, dependency_error, delete_tasks, delete_models, delete_datasets, referenced
+)
+
+OPERATIONS = ('create', 'update', 'delete')
+
+
+class ItemError(Exception):
+    """An item of a batch that cannot be applied, with its HTTP status"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class BulkOperation:
+    """Applies one batch to one model class; subclasses supply the per-resource rules"""
+
+    model_class = None
+    label = None
+    unique_names = False
+    update_fields = ()
+    shared_file_columns = ()  # Storage references whose files a new record may also use
+
+    def __init__(self, data):
+        if not isinstance(data, dict):
+            raise ValueError('Request body must be an object')
+        unknown = set(data) - set(OPERATIONS) - {'atomic', 'cascade'}
+        if unknown:
+            raise ValueError(f"Unknown bulk settings: {', '.join(sorted(unknown))}")
+
+        self.creates = data.get('create') or []
+        self.updates = data.get('update') or []
+        self.deletes = data.get('delete') or []
+        if not all(isinstance(items, list) for items in (self.creates, self.updates, self.deletes)):
+            raise ValueError('create, update and delete must be lists')
+        if not all(isinstance(id, int) and not isinstance(id, bool) for id in self.deletes):
+            raise ValueError('delete must be a list of ids')
+        total = len(self.creates) + len(self.updates) + len(self.deletes)
+        if not total:
+            raise ValueError('Nothing to do')
+        if total > current_app.config['BULK_MAX_ITEMS']:
+            raise ValueError(f"A batch holds at most {current_app.config['BULK_MAX_ITEMS']} items")
+        self.atomic = data.get('atomic', True) is not False
+        self.cascade = data.get('cascade') is True
+
+        self.results = []
+        self.new_files = []  # Written while building the batch; removed if it is not committed
+
+    def run(self):
+        """Validate and apply the batch; returns (response, status)"""
+        creates, updates, deletes = self.validate()
+        failed = [result for result in self.results if 'error' in result]
+
+        if failed and (self.atomic or len(failed) == len(self.results)):
+            for result in self.results:
+                if 'error' not in result:
+                    result.update(status=424, error='Not applied: another item in the batch failed')
+            return self.response(False), 400
+
+        try:
+            if deletes:
+                self.delete_rows([obj.id for _, obj in deletes])
+            for _, obj, fields in updates:
+                for field, value in fields.items():
+                    setattr(obj, field, value)
+            created = []
+            for result, fields in creates:
+                obj = self.build(fields)
+                db.session.add(obj)
+                created.append((result, obj, fields))
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            file_cleaner.delete(self.new_files, reason='rolled_back')
+            db.session.commit()
+            current_app.logger.warning(f"Bulk {self.label.lower()} batch rejected: {e.orig}")
+            return {'committed': False, 'error': 'The batch conflicts with concurrent changes'}, 409
+
+        self.after_commit(created)
+
+        # Reload the written rows in one query rather than one per to_dict()
+        written = [(result, obj) for result, obj, _ in created] + [(result, obj) for result, obj, _ in updates]
+        if written:
+            self.model_class.query.filter(self.model_class.id.in_([obj.id for _, obj in written])).all()
+        for result, obj in written:
+            result.update(id=obj.id, item=obj.to_dict())
+        return self.response(True), 200
+
+    def validate(self):
+        """
+        Record a result for every item and return the applicable items:
+        creates as (result, fields), updates as (result, obj, fields) and
+        deletes as (result, obj)
+        """
+        ids = [item.get('id') for item in self.updates if isinstance(item, dict)] + self.deletes
+        ids = [id for id in ids if isinstance(id, int) and not isinstance(id, bool)]
+        existing = {obj.id: obj for obj in self.model_class.query.filter(self.model_class.id.in_(ids))} \
+            if ids else {}
+        self.prefetch([item for item in self.creates if isinstance(item, dict)])
+        self.references = self.task_references([id for id in self.deletes if id in existing])
+
+        deletes = []
+        deleted_ids = set()
+        for index, id in enumerate(self.deletes):
+            result = self.result('delete', index, id)
+            try:
+                if id in deleted_ids:
+                    raise ItemError(f'{self.label} {id} is deleted twice')
+                obj = self.lookup(existing, id)
+                self.validate_delete(obj)
+            except ItemError as e:
+                result.update(status=e.status, error=str(e))
+                continue
+            result['status'] = 200
+            deletes.append((result, obj))
+            deleted_ids.add(id)
+
+        updates = []
+        updated_ids = set()
+        for index, item in enumerate(self.updates):
+            id = item.get('id') if isinstance(item, dict) else None
+            result = self.result('update', index, id)
+            try:
+                if not isinstance(item, dict):
+                    raise ItemError('Update items must be objects')
+                if id in deleted_ids or id in updated_ids:
+                    raise ItemError(f'{self.label} {id} appears more than once in the batch')
+                obj = self.lookup(existing, id)
+                unknown = set(item) - set(self.update_fields) - {'id'}
+                if unknown:
+                    raise ItemError(f"Unknown fields: {', '.join(sorted(unknown))}")
+                fields = self.validate_update(obj, item)
+            except (ItemError, ValueError) as e:
+                result.update(status=getattr(e, 'status', 400), error=str(e))
+                continue
+            result['status'] = 200
+            updates.append((result, obj, fields))
+            updated_ids.add(id)
+
+        creates = []
+        for index, item in enumerate(self.creates):
+            result = self.result('create', index)
+            try:
+                if not isinstance(item, dict):
+                    raise ItemError('Create items must be objects')
+                if not item.get('name'):
+                    raise ItemError(f'{self.label} name is required')
+                fields = self.validate_create(item)
+            except (ItemError, ValueError) as e:
+                result.update(status=getattr(e, 'status', 400), error=str(e))
+                continue
+            result['status'] = 201
+            creates.append((result, fields))
+
+        if self.unique_names:
+            self.check_names(creates, updates, deleted_ids)
+        self.check_files(creates)
+        return ([(result, fields) for result, fields in creates if 'error' not in result],
+                [update for update in updates if 'error' not in update[0]],
+                deletes)
+
+    def check_names(self, creates, updates, deleted_ids):
+        """Reject names used twice in the batch or held by a record that is not deleted, in one query"""
+        claims = [(result, fields['name'], None) for result, fields in creates]
+        claims += [(result, fields['name'], obj.id) for result, obj, fields in updates if 'name' in fields]
+        if not claims:
+            return
+
+        holders = dict(db.session.query(self.model_class.name, self.model_class.id)
+                       .filter(self.model_class.name.in_({name for _, name, _ in claims})))
+        claimed = set()
+        for result, name, id in claims:
+            holder = holders.get(name)
+            if name in claimed or (holder is not None and holder != id and holder not in deleted_ids):
+                result.update(status=409, error=f'{self.label} name already exists')
+            claimed.add(name)
+
+    def check_files(self, creates):
+        """
+        Reject files used twice in the batch or already referenced by a row,
+        which would remove them when that row is deleted
+        """
+        claims = [(result, fields['file_path']) for result, fields in creates if fields.get('file_path')]
+        if not claims:
+            return
+
+        taken = referenced([path for _, path in claims], self.shared_file_columns)
+        claimed = set()
+        for result, path in claims:
+            if path in claimed or path in taken:
+                result.update(status=409, error='file_path is already in use')
+            claimed.add(path)
+
+    def result(self, op, index, id=None):
+        result = {'op': op, 'index': index, 'id': id}
+        self.results.append(result)
+        return result
+
+    def lookup(self, existing, id):
+        if id not in existing:
+            raise ItemError(f'{self.label} {id} not found', 404)
+        return existing[id]
+
+    def response(self, committed):
+        counts = {op: 0 for op in OPERATIONS}
+        for result in self.results:
+            if 'error' not in result and committed:
+                counts[result['op']] += 1
+        return {
+            'committed': committed,
+            'created': counts['create'],
+            'updated': counts['update'],
+            'deleted': counts['delete'],
+            'failed': sum(1 for result in self.results if 'error' in result and result['status'] != 424),
+            'results': self.results
+        }
+
+    def prefetch(self, items):
+        """Load whatever the create items refer to, in as few queries as possible"""
+
+    def validate_create(self, item):
+        """Return the fields of a new record, raising ItemError or ValueError"""
+        raise NotImplementedError
+
+    def validate_update(self, obj, item):
+        """Return the fields to change, raising ItemError or ValueError"""
+        return {field: item[field] for field in self.update_fields if field in item}
+
+    def task_references(self, ids):
+        """Training tasks using each record to be deleted, see storage_service.task_references"""
+        return {}
+
+    def validate_delete(self, obj):
+        """Raise ItemError if the record cannot be deleted"""
+        error = dependency_error(self.label, self.references.get(obj.id), self.cascade)
+        if error:
+            raise ItemError(error, 409)
+
+    def build(self, fields):
+        return self.model_class(**fields)
+
+    def delete_rows(self, ids):
+        """Delete the records, their dependent rows and files set-based"""
+        raise NotImplementedError
+
+    def after_commit(self, created):
+        """Work that needs the committed rows; created holds (result, obj, fields)"""
+
+
+def _float(item, field):
+    if item.get(field) is None:
+        return None
+    try:
+        return float(item[field])
+    except (TypeError, ValueError):
+        raise ItemError(f'{field} must be a number')
+
+
+def _stored_file(path, folders):
+    """Resolve a client-supplied path, which must name an existing file inside one of folders"""
+    if not isinstance(path, str):
+        raise ItemError('file_path must be a string')
+    real_path = os.path.realpath(path)
+    if not any(os.path.commonpath([real_path, os.path.realpath(folder)]) == os.path.realpath(folder)
+               for folder in folders):
+        raise ItemError('file_path must be inside the upload or training output folder')
+    if not os.path.isfile(real_path):
+        raise ItemError('File not found', 404)
+    return os.path.abspath(path)
+
+
+class ModelBulkOperation(BulkOperation):
+    """Models are created from an uploaded or trained file, or from a checkpoint"""
+
+    model_class = Model
+    label = 'Model'
+    unique_names = True
+    shared_file_columns = (TrainingTask.output_path,)  # Models are registered from trained files
+    update_fields = ('name', 'description', 'version', 'model_type',
+                     'accuracy', 'precision', 'recall', 'f1_score')
+
+    def prefetch(self, items):
+        ids = [item['checkpoint_id'] for item in items if item.get('checkpoint_id')]
+        self.checkpoints = {checkpoint.id: checkpoint
+                            for checkpoint in Checkpoint.query.filter(Checkpoint.id.in_(ids))} if ids else {}
+
+    def validate_create(self, item):
+        fields = {
+            'name': item['name'],
+            'description': item.get('description'),
+            'version': item.get('version'),
+            'model_type': item.get('model_type'),
+            'accuracy': _float(item, 'accuracy'),
+            'precision': _float(item, 'precision'),
+            'recall': _float(item, 'recall'),
+            'f1_score': _float(item, 'f1_score')
+        }
+        if item.get('checkpoint_id'):
+            checkpoint = self.checkpoints.get(item['checkpoint_id'])
+            if checkpoint is None:
+                raise ItemError('Checkpoint not found', 404)
+            if not checkpoint.file_path or not os.path.exists(checkpoint.file_path):
+                raise ItemError('Checkpoint file is missing')
+            fields['checkpoint'] = checkpoint
+        elif item.get('file_path'):
+            fields['file_path'] = _stored_file(item['file_path'], [
+                current_app.config['UPLOAD_FOLDER'], current_app.config['TRAINING_OUTPUT_FOLDER']])
+        return fields
+
+    def validate_update(self, obj, item):
+        fields = super().validate_update(obj, item)
+        for field in ('accuracy', 'precision', 'recall', 'f1_score'):
+            if field in fields:
+                fields[field] = _float(item, field)
+        return fields
+
+    def build(self, fields):
+        fields = dict(fields)
+        checkpoint = fields.pop('checkpoint', None)
+        if checkpoint is None:
+            fields['model_type'] = fields['model_type'] or 'vulnerability_detection'
+            return Model(**fields)
+
+        model = checkpoint_model(checkpoint, fields.pop('name'), fields.pop('version'))
+        self.new_files.append(model.file_path)
+        for field, value in fields.items():
+            if value is not None:
+                setattr(model, field, value)
+        return model
+
+    def task_references(self, ids):
+        return task_references(TrainingTask.model_id, ids)
+
+    def delete_rows(self, ids):
+        delete_models(ids)
+
+
+class DatasetBulkOperation(BulkOperation):
+    """Datasets are registered from files already in the upload folder"""
+
+    model_class = Dataset
+    label = 'Dataset'
+    unique_names = True
+    update_fields = ('name', 'description')
+
+    def validate_create(self, item):
+        if not item.get('file_path'):
+            raise ItemError('Dataset file_path is required')
+        file_path = _stored_file(item['file_path'], [current_app.config['UPLOAD_FOLDER']])
+        filename = os.path.basename(file_path)
+        if '.' not in filename or filename.rsplit('.', 1)[1].lower() not in current_app.config['ALLOWED_EXTENSIONS']:
+            raise ItemError('Invalid file format')
+        return {
+            'name': item['name'],
+            'description': item.get('description'),
+            'file_path': file_path,
+            'format': filename.rsplit('.', 1)[1].lower(),
+            'size': os.path.getsize(file_path),
+            'preprocessing_status': 'pending'
+        }
+
+    def task_references(self, ids):
+        return task_references(TrainingTask.dataset_id, ids)
+
+    def delete_rows(self, ids):
+        delete_datasets(ids)
+
+    def after_commit(self, created):
+        for _, dataset, _ in created:
+            search_indexer.enqueue(dataset)
+            try:
+                stats = analyze_dataset(dataset.file_path, dataset.format)
+                if stats:
+                    dataset.num_samples = stats.get('num_samples')
+                    dataset.num_vulnerable = stats.get('num_vulnerable')
+                    dataset.num_safe = stats.get('num_safe')
+                    dataset.preprocessing_status = 'completed'
+            except Exception as e:
+                dataset.preprocessing_status = 'failed'
+                current_app.logger.error(f"Failed to analyze dataset: {str(e)}")
+        if created:
+            db.session.commit()
+
+
+class TaskBulkOperation(BulkOperation):
+    """Tasks are created and launched as by POST /api/training/tasks; running tasks cannot be deleted"""
+
+    model_class = TrainingTask
+    label = 'Task'
+    update_fields = ('name', 'priority', 'owner', 'queue', 'early_stopping')
+
+    def prefetch(self, items):
+        model_ids = {item['model_id'] for item in items if item.get('model_id')}
+        dataset_ids = {item['dataset_id'] for item in items if item.get('dataset_id')}
+        self.model_ids = {id for id, in db.session.query(Model.id).filter(Model.id.in_(model_ids))} \
+            if model_ids else set()
+        self.dataset_ids = {id for id, in db.session.query(Dataset.id).filter(Dataset.id.in_(dataset_ids))} \
+            if dataset_ids else set()
+        versioned = {item.get('dataset_id') for item in items if item.get('dataset_version')}
+        self.dataset_versions = set(
+            db.session.query(DatasetVersion.dataset_id, DatasetVersion.version)
+            .filter(DatasetVersion.dataset_id.in_(versioned))
+        ) if versioned else set()
+
+    def validate_create(self, item):
+        if not item.get('model_id'):
+            raise ItemError('Model ID is required')
+        if not item.get('dataset_id'):
+            raise ItemError('Dataset ID is required')
+        if item['model_id'] not in self.model_ids:
+            raise ItemError('Model not found', 404)
+        if item['dataset_id'] not in self.dataset_ids:
+            raise ItemError('Dataset not found', 404)
+        dataset_version = item.get('dataset_version')
+        if dataset_version is not None:
+            if not isinstance(dataset_version, int) or isinstance(dataset_version, bool):
+                raise ItemError('dataset_version must be a version number')
+            if dataset_version and (item['dataset_id'], dataset_version) not in self.dataset_versions:
+                raise ItemError(f'Dataset has no version {dataset_version}', 404)
+
+        try:
+            priority, cpu_request, memory_request = parse_resources(item)
+        except ValueError as e:
+            raise ItemError(str(e))
+
+        return {
+            'name': item['name'],
+            'model_id': item['model_id'],
+            'dataset_id': item['dataset_id'],
+            'dataset_version': dataset_version or None,
+            'status': 'pending',
+            'total_epochs': item.get('epochs', 10),
+            'early_stopping': validate_policy(item['early_stopping']) if item.get('early_stopping') else None,
+            'priority': priority,
+            'owner': item.get('owner') or 'default',
+            'queue': item.get('queue') or 'default',
+            'cpu_request': cpu_request,
+            'memory_request': memory_request,
+            'config': item  # Handed to the trainer, as the whole body is for a single task
+        }
+
+    def validate_update(self, obj, item):
+        fields = super().validate_update(obj, item)
+        if 'name' in fields and not fields['name']:
+            raise ItemError('Task name is required')
+        if 'priority' in fields:
+            try:
+                fields['priority'] = int(fields['priority'])
+            except (TypeError, ValueError):
+                raise ItemError('priority must be a number')
+        if fields.get('early_stopping'):
+            fields['early_stopping'] = validate_policy(fields['early_stopping'])
+        elif 'early_stopping' in fields:
+            fields['early_stopping'] = None
+        return fields
+
+    def validate_delete(self, obj):
+        if obj.status == 'running':
+            raise ItemError('Cannot delete a running task')
+
+    def build(self, fields):
+        fields = dict(fields)
+        fields.pop('config')
+        return TrainingTask(**fields)
+
+    def delete_rows(self, ids):
+        delete_tasks(TrainingTask.id.in_(ids))
+
+    def after_commit(self, created):
+        # Launched only once committed, so a trainer or worker always finds its row
+        for _, task, fields in created:
+            launch_training_task(task, fields['config'], commit=False)
+        if created:
+            db.session.commit()
@@ -0,0 +1,150 @@
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func, select
+from ..models import db, ChatMessage
+
+
+class ChatHistoryStore:
+    """
+    Session-keyed chat history persisted in the database
+
+    The most recent messages of active sessions are kept in bounded ring
+    buffers, and the number of buffered sessions is itself bounded, so memory
+    stays flat no matter how much traffic the chat receives.
+    """
+
+    def __init__(self):
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def init_app(self, app):
+        with self._lock:
+            self._sessions.clear()
+        app.extensions['chat_history_store'] = self
+
+    def append(self, session_id, role, content):
+        """Persist a message and push it into the session's ring buffer"""
+        previous_id = self._latest_id(session_id)
+        message = ChatMessage(session_id=session_id, role=role, content=content)
+        db.session.add(message)
+        db.session.commit()
+
+        with self._lock:
+            buffer = self._sessions.get(session_id)
+            if buffer is not None:
+                if (buffer[-1]['id'] if buffer else None) == previous_id:
+                    buffer.append(message.to_dict())
+                    self._sessions.move_to_end(session_id)
+                else:
+                    # Buffer missed writes from another worker
+                    del self._sessions[session_id]
+            self._writes += 1
+            run_retention = self._writes % current_app.config['CHAT_RETENTION_INTERVAL'] == 0
+
+        if run_retention:
+            self.apply_retention()
+        return message.to_dict()
+
+    def recent(self, session_id):
+        """Return the buffered recent messages of a session, oldest first"""
+        return self._buffered(session_id)[-current_app.config['CHAT_BUFFER_MESSAGES']:]
+
+    def _buffered(self, session_id):
+        """
+        The session's ring buffer, loading it if needed. It holds one message
+        more than CHAT_BUFFER_MESSAGES, as the database path reads one row
+        more than a page, so a full page knows whether older messages exist.
+        """
+        latest_id = self._latest_id(session_id)
+
+        with self._lock:
+            buffer = self._sessions.get(session_id)
+            if buffer is not None and (buffer[-1]['id'] if buffer else None) == latest_id:
+                self._sessions.move_to_end(session_id)
+                return list(buffer)
+
+        # Another worker wrote to this session, or it is not buffered yet
+        size = current_app.config['CHAT_BUFFER_MESSAGES'] + 1
+        messages = self._query_page(session_id, size)['messages']
+        with self._lock:
+            self._sessions[session_id] = deque(messages, maxlen=size)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > current_app.config['CHAT_BUFFER_SESSIONS']:
+                self._sessions.popitem(last=False)
+        return messages
+
+    def _latest_id(self, session_id):
+        return db.session.query(func.max(ChatMessage.id)).filter_by(
+            session_id=session_id).scalar()
+
+    def page(self, session_id, limit=50, before=None):
+        """
+        Read one page of history, newest page first, messages oldest first
+        Pass the returned next_cursor as before to read the previous page
+        """
+        if before is None and limit <= current_app.config['CHAT_BUFFER_MESSAGES']:
+            buffered = self._buffered(session_id)
+            messages = buffered[-limit:]
+            has_more = len(buffered) > limit
+            return {
+                'session_id': session_id,
+                'messages': messages,
+                'next_cursor': messages[0]['id'] if has_more and messages else None
+            }
+        return self._query_page(session_id, limit, before)
+
+    def _query_page(self, session_id, limit, before=None):
+        query = ChatMessage.query.filter_by(session_id=session_id)
+        if before is not None:
+            query = query.filter(ChatMessage.id < before)
+        rows = query.order_by(ChatMessage.id.desc()).limit(limit + 1).all()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        return {
+            'session_id': session_id,
+            'messages': [row.to_dict() for row in reversed(rows)],
+            'next_cursor': rows[-1].id if has_more else None
+        }
+
+    def clear(self, session_id):
+        """Delete all messages of a session"""
+        ChatMessage.query.filter_by(session_id=session_id).delete()
+        db.session.commit()
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def remove(self, session_id, message_id):
+        """Delete one message of a session, such as a turn that got no reply"""
+        ChatMessage.query.filter_by(session_id=session_id, id=message_id).delete()
+        db.session.commit()
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def apply_retention(self):
+        """Delete messages older than the retention period or beyond the per-session cap"""
+        config = current_app.config
+        if config.get('CHAT_RETENTION_DAYS'):
+            cutoff = datetime.utcnow() - timedelta(days=config['CHAT_RETENTION_DAYS'])
+            ChatMessage.query.filter(ChatMessage.timestamp < cutoff).delete()
+
+        if config.get('CHAT_MAX_MESSAGES_PER_SESSION'):
+            ranked = select(
+                ChatMessage.id,
+                func.row_number().over(
+                    partition_by=ChatMessage.session_id,
+                    order_by=ChatMessage.id.desc()
+                ).label('rank')
+            ).subquery()
+            expired = select(ranked.c.id).where(ranked.c.rank > config['CHAT_MAX_MESSAGES_PER_SESSION'])
+            ChatMessage.query.filter(ChatMessage.id.in_(expired)).delete(synchronize_session=False)
+
+        db.session.commit()
+        with self._lock:
+            self._sessions.clear()
+
+
+chat_history_store = ChatHistoryStore()
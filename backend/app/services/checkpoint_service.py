@@ -0,0 +1,213 @@
+import os
+import uuid
+import shutil
+import hashlib
+from flask import current_app
+from werkzeug.utils import secure_filename
+from ..models import db, Checkpoint, TrainingMetric, TelemetrySample, Model
+from .early_stopping import MONITORED_METRICS, evaluate
+from .training_service import launch_training_task
+from .file_cleaner import file_cleaner
+
+POLICY_KEYS = ['keep_best', 'keep_last', 'monitor', 'mode']
+
+
+def validate_checkpoint_policy(policy):
+    """Return a complete retention policy, raising ValueError for invalid settings"""
+    if not isinstance(policy, dict):
+        raise ValueError("Checkpoint policy must be an object")
+
+    unknown = set(policy) - set(POLICY_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown checkpoint policy settings: {', '.join(sorted(unknown))}")
+
+    for key in ('keep_best', 'keep_last'):
+        if key in policy and (not isinstance(policy[key], int) or policy[key] < 0):
+            raise ValueError(f"{key} must be a non-negative integer")
+    if policy.get('monitor', 'validation_loss') not in MONITORED_METRICS:
+        raise ValueError(f"Monitor must be one of {', '.join(MONITORED_METRICS)}")
+    if policy.get('mode', 'min') not in ('min', 'max'):
+        raise ValueError("Mode must be min or max")
+    return policy
+
+
+def effective_policy(task):
+    """The task's retention policy with defaults filled in"""
+    config = current_app.config
+    early_stopping = task.early_stopping or {}
+    policy = {
+        'keep_best': config['CHECKPOINT_KEEP_BEST'],
+        'keep_last': config['CHECKPOINT_KEEP_LAST'],
+        'monitor': early_stopping.get('monitor', 'validation_loss'),
+        'mode': early_stopping.get('mode', 'min'),
+    }
+    policy.update(task.checkpoint_policy or {})
+    return policy
+
+
+def save_checkpoint(task, file, epoch, metrics=None):
+    """
+    Store an uploaded checkpoint under the task's output folder, hashing it as
+    it is written, then apply the retention policy. Returns the checkpoint's
+    data, since the policy may already have removed it. Raises ValueError
+    unless the task is running.
+    """
+    if task.status != 'running':
+        raise ValueError(f'Task is {task.status}')
+
+    output_path = task.output_path or os.path.join(
+        current_app.config['TRAINING_OUTPUT_FOLDER'], f'task_{task.id}')
+    os.makedirs(output_path, exist_ok=True)
+    task.output_path = output_path
+
+    filename = secure_filename(file.filename or 'checkpoint') or 'checkpoint'
+    # Unique, so an epoch uploaded again after a rewind does not overwrite a retained file
+    file_path = os.path.join(output_path, f'epoch_{epoch}_{uuid.uuid4().hex[:8]}_{filename}')
+
+    digest = hashlib.sha256()
+    size = 0
+    with open(file_path, 'wb') as f:
+        for chunk in iter(lambda: file.stream.read(1024 * 1024), b''):
+            digest.update(chunk)
+            f.write(chunk)
+            size += len(chunk)
+
+    if metrics is None:
+        # Snapshot the metrics reported for this epoch
+        reported = (TrainingMetric.query.filter_by(task_id=task.id, epoch=epoch)
+                    .order_by(TrainingMetric.id.desc()).first())
+        metrics = ({name: getattr(reported, name) for name in MONITORED_METRICS + ['learning_rate']}
+                   if reported else {})
+
+    checkpoint = Checkpoint(
+        task_id=task.id,
+        epoch=epoch,
+        metrics=metrics,
+        file_path=file_path,
+        size=size,
+        sha256=digest.hexdigest()
+    )
+    db.session.add(checkpoint)
+    db.session.commit()
+
+    data = checkpoint.to_dict()
+    data['retained'] = checkpoint.id not in apply_retention(task)
+    return data
+
+
+def _rank_best(checkpoints, monitor, mode):
+    scored = [c for c in checkpoints if (c.metrics or {}).get(monitor) is not None]
+    return sorted(scored, key=lambda c: c.metrics[monitor], reverse=mode == 'max')
+
+
+def apply_retention(task):
+    """Delete checkpoints that are neither among the best k nor the last n"""
+    policy = effective_policy(task)
+    checkpoints = task.checkpoints.order_by(Checkpoint.epoch.desc(), Checkpoint.id.desc()).all()
+
+    keep = {c.id for c in checkpoints[:policy['keep_last']]}
+    keep.update(c.id for c in _rank_best(checkpoints, policy['monitor'], policy['mode'])[:policy['keep_best']])
+
+    removed = [checkpoint for checkpoint in checkpoints if checkpoint.id not in keep]
+    for checkpoint in removed:
+        db.session.delete(checkpoint)
+    file_cleaner.delete([checkpoint.file_path for checkpoint in removed], reason='retention')
+    db.session.commit()
+    return [checkpoint.id for checkpoint in removed]
+
+
+def best_checkpoint(task):
+    """The best checkpoint by the policy's monitored metric, else the latest"""
+    policy = effective_policy(task)
+    checkpoints = task.checkpoints.all()
+    ranked = _rank_best(checkpoints, policy['monitor'], policy['mode'])
+    if ranked:
+        return ranked[0]
+    return latest_checkpoint(task)
+
+
+def latest_checkpoint(task):
+    return task.checkpoints.order_by(Checkpoint.epoch.desc(), Checkpoint.id.desc()).first()
+
+
+def rewind_task(task, checkpoint=None):
+    """
+    Reset a task to a checkpoint, or to the start without one: metrics and
+    checkpoints from after that point are discarded and the early-stopping
+    state is rebuilt from the metrics kept. Telemetry starts over. Returns the training config that
+    continues from there.
+    """
+    epoch = checkpoint.epoch if checkpoint else 0
+    TrainingMetric.query.filter(TrainingMetric.task_id == task.id,
+                                TrainingMetric.epoch > epoch).delete()
+    later = task.checkpoints.filter(Checkpoint.epoch > epoch).all()
+    for removed in later:
+        db.session.delete(removed)
+    file_cleaner.delete([removed.file_path for removed in later], reason='rewound')
+    TelemetrySample.query.filter_by(task_id=task.id).delete()
+    task.telemetry_count = 0
+    task.telemetry_flags = None
+
+    task.status = 'pending'
+    task.current_epoch = epoch
+    task.progress = (epoch / task.total_epochs) * 100 if task.total_epochs else 0
+    task.resume_checkpoint_id = checkpoint.id if checkpoint else None
+    task.end_time = None
+    task.error_message = None
+    task.stop_reason = None
+    task.best_metric_value = None
+    task.best_epoch = None
+    task.epochs_without_improvement = 0
+    for metric in task.metrics.order_by(TrainingMetric.epoch, TrainingMetric.id):
+        evaluate(task, metric)
+    db.session.commit()
+
+    config = dict(task.hyperparameters or {}, epochs=task.total_epochs)
+    if checkpoint:
+        config.update(resume_from=checkpoint.file_path, start_epoch=checkpoint.epoch + 1)
+    return config
+
+
+def resume_task(task, checkpoint):
+    """
+    Restart a stopped or failed task from a checkpoint: metrics reported after
+    the checkpoint are discarded and training continues at the next epoch
+    """
+    launch_training_task(task, rewind_task(task, checkpoint))
+    return task
+
+
+def promote_checkpoint(checkpoint, name=None, version=None):
+    """Register a checkpoint as a new Model with its own copy of the file"""
+    name = name or f'{checkpoint.task.name} (epoch {checkpoint.epoch})'
+    if Model.query.filter_by(name=name).first():
+        raise ValueError('Model name already exists')
+
+    model = checkpoint_model(checkpoint, name, version)
+    db.session.add(model)
+    db.session.commit()
+    return model
+
+
+def checkpoint_model(checkpoint, name, version=None):
+    """Copy a checkpoint's file into the model uploads and return an unsaved Model for it"""
+    task = checkpoint.task
+    if not checkpoint.file_path or not os.path.exists(checkpoint.file_path):
+        raise ValueError('Checkpoint file is missing')
+
+    models_folder = os.path.join(current_app.config['UPLOAD_FOLDER'], 'models')
+    os.makedirs(models_folder, exist_ok=True)
+    file_path = os.path.join(
+        models_folder, f'task_{task.id}_{uuid.uuid4().hex[:8]}_{os.path.basename(checkpoint.file_path)}')
+    shutil.copyfile(checkpoint.file_path, file_path)
+
+    metrics = checkpoint.metrics or {}
+    base_model = task.model
+    return Model(
+        name=name,
+        description=f'Promoted from training task {task.id} at epoch {checkpoint.epoch}',
+        version=version,
+        model_type=base_model.model_type if base_model else 'vulnerability_detection',
+        file_path=file_path,
+        accuracy=metrics.get('validation_accuracy', metrics.get('accuracy'))
+    )
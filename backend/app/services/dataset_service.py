@@ -1,6 +1,9 @@
+import re
 import json
 import csv
 
+SEPARATORS = re.compile(r'[\s,]*')  # Between the elements of a JSON array
+
 def analyze_dataset(file_path, file_format):
     """Analyze dataset and extract statistics"""
     try:
@@ -48,3 +51,82 @@ def analyze_csv_dataset(file_path):
         'num_vulnerable': num_vulnerable,
         'num_safe': num_safe
     }
+
+def iter_records(file_path, file_format, chunk_size=1024 * 1024):
+    """Stream dataset records one at a time without loading the whole file"""
+    if file_format == 'json':
+        return iter_json_records(file_path, chunk_size)
+    elif file_format == 'jsonl':
+        return iter_jsonl_records(file_path)
+    elif file_format == 'csv':
+        return iter_csv_records(file_path)
+    raise ValueError(f"Unsupported dataset format: {file_format}")
+
+def iter_json_records(file_path, chunk_size=1024 * 1024):
+    """Incrementally decode the elements of a top-level JSON array"""
+    decoder = json.JSONDecoder()
+    with open(file_path, 'r', encoding='utf-8') as f:
+        chunk = f.read(chunk_size)
+        buffer = chunk.lstrip()
+        while chunk and not buffer:
+            # Leading whitespace may fill whole chunks
+            chunk = f.read(chunk_size)
+            buffer = chunk.lstrip()
+        if not buffer.startswith('['):
+            raise ValueError("JSON dataset must be an array of records")
+        position = 1
+        eof = False
+        
+        # Records are decoded in place by offset; the consumed prefix is only
+        # dropped when refilling, as slicing per record copies the whole buffer
+        while True:
+            position = SEPARATORS.match(buffer, position).end()
+            if buffer.startswith(']', position):
+                return
+            try:
+                record, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # Record spans the chunk boundary
+                if eof:
+                    raise
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer, position = buffer[position:] + chunk, 0
+                continue
+            yield record
+            if len(buffer) - position < chunk_size and not eof:
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer, position = buffer[position:] + chunk, 0
+
+def iter_jsonl_records(file_path, chunk_size=1024 * 1024):
+    """Stream records from a JSON Lines file"""
+    with open(file_path, 'rb') as f:
+        while True:
+            lines = [line for line in f.readlines(chunk_size) if line.strip()]
+            if not lines:
+                return
+            # Decoding a chunk of lines as one array is much faster than line by line
+            try:
+                records = json.loads(b'[' + b','.join(lines) + b']')
+            except json.JSONDecodeError:
+                records = [json.loads(line) for line in lines]
+            yield from records
+
+def iter_csv_records(file_path):
+    """Stream records from a CSV file"""
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
+        yield from csv.DictReader(f)
+
+def record_label(record):
+    """Return 1 for a vulnerable record and 0 for a safe one"""
+    label = record.get('label')
+    vulnerable = record.get('vulnerable')
+    return 1 if label in (1, '1') or vulnerable in (True, 'True', 'true') else 0
+
+def record_type(record):
+    """Return the record's vulnerability type, or None for safe/untyped records"""
+    vuln_type = record.get('vulnerability_type')
+    if not vuln_type or vuln_type == 'None':
+        return None
+    return vuln_type
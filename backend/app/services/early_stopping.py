@@ -0,0 +1,93 @@
+import math
+
+# Metrics an early-stopping policy can monitor
+MONITORED_METRICS = ['loss', 'accuracy', 'validation_loss', 'validation_accuracy']
+
+DEFAULT_POLICY = {
+    'monitor': 'validation_loss',
+    'mode': 'min',
+    'patience': None,  # Epochs without improvement before stopping
+    'min_delta': 0.0,  # Smallest change that counts as an improvement
+    'target': None,  # Stop once the monitored metric reaches this value
+    'divergence_threshold': None,  # Stop once the metric is this much worse than the best
+    'stop_on_nan': True
+}
+
+
+def validate_policy(policy):
+    """Return a complete policy, raising ValueError for invalid settings"""
+    if not isinstance(policy, dict):
+        raise ValueError("Early stopping policy must be an object")
+
+    unknown = set(policy) - set(DEFAULT_POLICY)
+    if unknown:
+        raise ValueError(f"Unknown early stopping settings: {', '.join(sorted(unknown))}")
+
+    policy = dict(DEFAULT_POLICY, **policy)
+    if policy['monitor'] not in MONITORED_METRICS:
+        raise ValueError(f"Monitor must be one of {', '.join(MONITORED_METRICS)}")
+    if policy['mode'] not in ('min', 'max'):
+        raise ValueError("Mode must be min or max")
+    patience = policy['patience']
+    if patience is not None and (isinstance(patience, bool) or not isinstance(patience, int) or patience < 1):
+        raise ValueError("Patience must be a positive integer")
+    for key in ('min_delta', 'target', 'divergence_threshold'):
+        value = policy[key]
+        if value is None and key != 'min_delta':
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            raise ValueError(f"{key} must be a finite number")
+    if policy['min_delta'] < 0:
+        raise ValueError("min_delta must not be negative")
+    return policy
+
+
+def evaluate(task, metric):
+    """
+    Update the task's running early-stopping state with a new metric and
+    return the stop reason, if the policy says to stop. Constant time per
+    metric: only the best value and the epochs since it are kept.
+    """
+    policy = task.early_stopping
+    if not policy:
+        return None
+
+    # Diverged runs produce NaN/inf losses regardless of the monitored metric
+    if policy.get('stop_on_nan', True):
+        for name in MONITORED_METRICS:
+            value = getattr(metric, name)
+            if value is not None and not math.isfinite(value):
+                return f'Diverged: {name} is {value} at epoch {metric.epoch}'
+
+    monitor = policy.get('monitor', 'validation_loss')
+    value = getattr(metric, monitor)
+    if value is None:
+        return None
+
+    # Normalize so that larger is always better
+    sign = 1 if policy.get('mode', 'min') == 'max' else -1
+    score = sign * value
+    best = task.best_metric_value
+
+    if best is None or score > sign * best + policy.get('min_delta', 0.0):
+        task.best_metric_value = value
+        task.best_epoch = metric.epoch
+        task.epochs_without_improvement = 0
+    else:
+        task.epochs_without_improvement = (task.epochs_without_improvement or 0) + 1
+
+    target = policy.get('target')
+    if target is not None and score >= sign * target:
+        return f'Target reached: {monitor}={value:.4g} at epoch {metric.epoch}'
+
+    threshold = policy.get('divergence_threshold')
+    if threshold is not None and sign * task.best_metric_value - score > threshold:
+        return (f'Diverged: {monitor}={value:.4g} is more than {threshold} worse than '
+                f'best {task.best_metric_value:.4g} (epoch {task.best_epoch})')
+
+    patience = policy.get('patience')
+    if patience and task.epochs_without_improvement >= patience:
+        return (f'No improvement in {monitor} for {patience} epochs '
+                f'(best {task.best_metric_value:.4g} at epoch {task.best_epoch})')
+
+    return None
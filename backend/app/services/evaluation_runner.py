@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+from sqlalchemy import or_, and_
+from ..models import db, ModelEvaluation
+from .background_worker import BackgroundWorker
+from .evaluation_service import run_evaluation
+
+STALE_CLAIM = timedelta(hours=6)  # An evaluation claimed this long ago is assumed to have died
+
+
+class EvaluationRunner(BackgroundWorker):
+    """
+    Runs evaluations in the background, so scoring a large dataset does not
+    hold a request thread.
+
+    Creating an evaluation queues it as pending; a background thread runs
+    queued evaluations once the transaction commits. Several processes may
+    run evaluations: one is claimed with a conditional update before it runs.
+    """
+
+    name = 'Evaluation'
+    extension = 'evaluation_runner'
+    interval_setting = 'EVALUATION_INTERVAL'
+    default_interval = 10
+    wake_flag = 'evaluations'
+
+    def enqueue(self, evaluation):
+        """Queue an evaluation in the current transaction"""
+        evaluation.status = 'pending'
+        db.session.add(evaluation)
+        self.queued()
+        return evaluation
+
+    def claim(self):
+        """Claim the oldest queued evaluation for this process, or return None"""
+        stale = datetime.utcnow() - STALE_CLAIM
+        claimable = or_(ModelEvaluation.status == 'pending',
+                        and_(ModelEvaluation.status == 'running', ModelEvaluation.start_time < stale))
+        while True:
+            evaluation = ModelEvaluation.query.filter(claimable).order_by(ModelEvaluation.id).first()
+            if evaluation is None:
+                return None
+            claimed = (ModelEvaluation.query
+                       .filter(ModelEvaluation.id == evaluation.id, claimable)
+                       .update({'status': 'running', 'start_time': datetime.utcnow()},
+                               synchronize_session=False))
+            db.session.commit()
+            if claimed:
+                db.session.refresh(evaluation)
+                return evaluation
+
+    def run_pending(self, limit=None):
+        """Run queued evaluations, up to `limit`; returns how many were run"""
+        count = 0
+        while limit is None or count < limit:
+            evaluation = self.claim()
+            if evaluation is None:
+                break
+            run_evaluation(evaluation.id)
+            if evaluation.status == 'failed':
+                self.logger.error(f"Evaluation {evaluation.id} failed: {evaluation.error_message}")
+            count += 1
+        return count
+
+    def run_pass(self):
+        self.run_pending()
+
+
+evaluation_runner = EvaluationRunner()
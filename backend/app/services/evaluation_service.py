@@ -0,0 +1,179 @@
+from datetime import datetime
+from ..models import db, ModelEvaluation
+from .dataset_service import iter_records, record_label, record_type
+from .inference_service import predict
+from ..utils.lazy_import import lazy_import
+
+np = lazy_import('numpy')
+
+# Maximum number of points kept for each PR/ROC curve
+MAX_CURVE_POINTS = 200
+
+
+def run_evaluation(evaluation_id):
+    """
+    Score a dataset with a model in streaming batches and store the metrics,
+    on the model as well if the evaluation asks to
+    """
+    evaluation = db.session.get(ModelEvaluation, evaluation_id)
+    if not evaluation:
+        raise Exception("Evaluation not found")
+
+    evaluation.status = 'running'
+    evaluation.start_time = datetime.utcnow()
+    db.session.commit()
+
+    try:
+        scores, labels, true_types, pred_types, type_names = score_dataset(
+            evaluation.model, evaluation.dataset, evaluation.batch_size or 256
+        )
+        results = compute_metrics(scores, labels, true_types, pred_types, type_names,
+                                  evaluation.threshold)
+
+        evaluation.num_samples = int(labels.size)
+        for name in ('accuracy', 'precision', 'recall', 'f1_score', 'roc_auc', 'pr_auc',
+                     'confusion_matrix', 'per_type_metrics', 'curves'):
+            setattr(evaluation, name, results[name])
+        evaluation.status = 'completed'
+        if evaluation.apply_to_model:
+            # Replace the uploader-supplied metrics with measured ones
+            for name in ('accuracy', 'precision', 'recall', 'f1_score'):
+                setattr(evaluation.model, name, results[name])
+    except Exception as e:
+        evaluation.status = 'failed'
+        evaluation.error_message = str(e)
+
+    evaluation.end_time = datetime.utcnow()
+    db.session.commit()
+    return evaluation
+
+
+def score_dataset(model, dataset, batch_size):
+    """
+    Run the model over the dataset batch by batch, collecting scores, labels
+    and integer-coded vulnerability types into NumPy arrays
+    """
+    if not dataset.file_path:
+        raise Exception("Dataset has no file")
+
+    type_codes = {}
+    score_chunks, label_chunks, true_chunks, pred_chunks = [], [], [], []
+    codes, labels, true_types = [], [], []
+
+    def type_code(name):
+        if name is None:
+            return -1
+        return type_codes.setdefault(name, len(type_codes))
+
+    def flush():
+        results = predict(model, codes)
+        score_chunks.append(np.fromiter((r['score'] for r in results), np.float32, len(results)))
+        pred_chunks.append(np.fromiter((type_code(r.get('vulnerability_type')) for r in results),
+                                       np.int32, len(results)))
+        label_chunks.append(np.asarray(labels, dtype=np.int8))
+        true_chunks.append(np.asarray(true_types, dtype=np.int32))
+        codes.clear()
+        labels.clear()
+        true_types.clear()
+
+    for record in iter_records(dataset.file_path, dataset.format):
+        codes.append(record.get('code') or '')
+        labels.append(record_label(record))
+        true_types.append(type_code(record_type(record)))
+        if len(codes) >= batch_size:
+            flush()
+    if codes:
+        flush()
+
+    if not score_chunks:
+        raise Exception("Dataset has no samples")
+
+    type_names = sorted(type_codes, key=type_codes.get)
+    return (np.concatenate(score_chunks), np.concatenate(label_chunks),
+            np.concatenate(true_chunks), np.concatenate(pred_chunks), type_names)
+
+
+def _ratio(numerator, denominator):
+    """Elementwise division that yields 0 where the denominator is 0"""
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator),
+                     where=denominator > 0)
+
+
+def _auc(x, y):
+    """Trapezoidal area under a curve given by points sorted on x"""
+    return float(np.sum(np.diff(x) * (y[1:] + y[:-1]) / 2)) if x.size > 1 else 0.0
+
+
+def compute_metrics(scores, labels, true_types, pred_types, type_names, threshold=0.5):
+    """Compute binary, per-type and threshold-sweep metrics with array reductions"""
+    predicted = (scores >= threshold).astype(np.int8)
+
+    # Confusion matrix: index = 2 * label + prediction
+    tn, fp, fn, tp = np.bincount(2 * labels + predicted, minlength=4)[:4].tolist()
+    precision = float(_ratio(tp, tp + fp))
+    recall = float(_ratio(tp, tp + fn))
+    f1 = float(_ratio(2 * precision * recall, precision + recall))
+
+    # Per-type one-vs-rest metrics, all types at once
+    num_types = len(type_names)
+    positive = labels == 1
+    flagged = predicted == 1
+    support = np.bincount(true_types[positive & (true_types >= 0)], minlength=num_types)
+    detected = np.bincount(true_types[positive & flagged & (true_types >= 0)], minlength=num_types)
+    typed_flags = flagged & (pred_types >= 0)
+    predicted_count = np.bincount(pred_types[typed_flags], minlength=num_types)
+    correct = np.bincount(true_types[typed_flags & positive & (true_types == pred_types)],
+                          minlength=num_types)
+    type_precision = _ratio(correct, predicted_count)
+    type_recall = _ratio(correct, support)
+    type_f1 = _ratio(2 * type_precision * type_recall, type_precision + type_recall)
+    detection_recall = _ratio(detected, support)
+
+    per_type = {
+        name: {
+            'support': int(support[i]),
+            'precision': float(type_precision[i]),
+            'recall': float(type_recall[i]),
+            'f1_score': float(type_f1[i]),
+            'detection_recall': float(detection_recall[i])
+        }
+        for i, name in enumerate(type_names)
+    }
+
+    # Threshold sweep over every distinct score
+    order = np.argsort(-scores, kind='stable')
+    sorted_scores = scores[order]
+    sorted_labels = labels[order].astype(np.int64)
+    cut = np.r_[np.flatnonzero(np.diff(sorted_scores)), sorted_scores.size - 1]
+    tps = np.cumsum(sorted_labels)[cut]
+    fps = (cut + 1) - tps
+    total_pos = int(positive.sum())
+    total_neg = int(labels.size - total_pos)
+
+    curve_recall = _ratio(tps, total_pos)
+    curve_precision = _ratio(tps, tps + fps)
+    curve_fpr = _ratio(fps, total_neg)
+    roc_auc = _auc(np.r_[0.0, curve_fpr], np.r_[0.0, curve_recall]) if total_pos and total_neg else None
+    pr_auc = _auc(np.r_[0.0, curve_recall], np.r_[1.0, curve_precision]) if total_pos else None
+
+    keep = np.unique(np.linspace(0, cut.size - 1, min(cut.size, MAX_CURVE_POINTS)).astype(np.int64))
+    curves = {
+        'thresholds': sorted_scores[cut][keep].astype(float).tolist(),
+        'precision': curve_precision[keep].tolist(),
+        'recall': curve_recall[keep].tolist(),
+        'fpr': curve_fpr[keep].tolist()
+    }
+
+    return {
+        'accuracy': float((tp + tn) / labels.size),
+        'precision': precision,
+        'recall': recall,
+        'f1_score': f1,
+        'roc_auc': roc_auc,
+        'pr_auc': pr_auc,
+        'confusion_matrix': {'tp': tp, 'fp': fp, 'tn': tn, 'fn': fn},
+        'per_type_metrics': per_type,
+        'curves': curves
+    }
@@ -0,0 +1,180 @@
+"""
+Streaming exports of query results as CSV or JSON lines. Rows are fetched
+through a server-side cursor in batches and encoded as they arrive, so the
+memory an export uses does not grow with its size.
+"""
+
+import io
+import csv
+import json
+import zlib
+from datetime import datetime
+from flask import request, Response, stream_with_context
+from ..models import db, TrainingTask, TrainingMetric, Dataset, ModelEvaluation
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/jsonl',
+    'ndjson': 'application/x-ndjson'  # Same encoding as jsonl
+}
+
+FETCH_SIZE = 1000  # Rows per cursor fetch
+CHUNK_SIZE = 64 * 1024  # Bytes encoded before they are handed to the server
+
+METRIC_COLUMNS = [
+    TrainingMetric.task_id, TrainingMetric.epoch, TrainingMetric.loss, TrainingMetric.accuracy,
+    TrainingMetric.validation_loss, TrainingMetric.validation_accuracy, TrainingMetric.learning_rate,
+    TrainingMetric.timestamp
+]
+
+TASK_COLUMNS = [
+    TrainingTask.id, TrainingTask.name, TrainingTask.model_id, TrainingTask.dataset_id, TrainingTask.sweep_id,
+    TrainingTask.status, TrainingTask.owner, TrainingTask.queue, TrainingTask.priority,
+    TrainingTask.total_epochs, TrainingTask.current_epoch, TrainingTask.progress,
+    TrainingTask.loss, TrainingTask.accuracy, TrainingTask.validation_loss, TrainingTask.validation_accuracy,
+    TrainingTask.best_metric_value, TrainingTask.best_epoch, TrainingTask.hyperparameters,
+    TrainingTask.stop_reason, TrainingTask.error_message, TrainingTask.attempts,
+    TrainingTask.cpu_request, TrainingTask.memory_request, TrainingTask.telemetry_flags,
+    TrainingTask.created_at, TrainingTask.start_time, TrainingTask.end_time
+]
+
+DATASET_COLUMNS = [
+    Dataset.id, Dataset.name, Dataset.description, Dataset.format, Dataset.size, Dataset.num_samples,
+    Dataset.num_vulnerable, Dataset.num_safe, Dataset.preprocessing_status, Dataset.created_at,
+    Dataset.updated_at
+]
+
+EVALUATION_COLUMNS = [
+    ModelEvaluation.id, ModelEvaluation.model_id, ModelEvaluation.dataset_id, ModelEvaluation.status,
+    ModelEvaluation.threshold, ModelEvaluation.num_samples, ModelEvaluation.accuracy,
+    ModelEvaluation.precision, ModelEvaluation.recall, ModelEvaluation.f1_score, ModelEvaluation.roc_auc,
+    ModelEvaluation.pr_auc, ModelEvaluation.confusion_matrix, ModelEvaluation.per_type_metrics,
+    ModelEvaluation.start_time, ModelEvaluation.end_time
+]
+
+
+def _parse_time(value, name):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an ISO 8601 time')
+
+
+def task_conditions(args):
+    """
+    Filters on training tasks from query arguments: task_id, status, owner
+    and queue may repeat; model_id, dataset_id and sweep_id select one;
+    created_after and created_before bound the creation time
+    """
+    conditions = []
+    try:
+        task_ids = [int(id) for id in args.getlist('task_id')]
+        for name in ('model_id', 'dataset_id', 'sweep_id'):
+            if args.get(name) is not None:
+                conditions.append(getattr(TrainingTask, name) == int(args[name]))
+    except ValueError:
+        raise ValueError('Ids must be integers')
+    if task_ids:
+        conditions.append(TrainingTask.id.in_(task_ids))
+
+    for name in ('status', 'owner', 'queue'):
+        values = args.getlist(name)
+        if values:
+            conditions.append(getattr(TrainingTask, name).in_(values))
+    if args.get('created_after'):
+        conditions.append(TrainingTask.created_at >= _parse_time(args['created_after'], 'created_after'))
+    if args.get('created_before'):
+        conditions.append(TrainingTask.created_at < _parse_time(args['created_before'], 'created_before'))
+    return conditions
+
+
+def metrics_query(conditions):
+    """All metrics of the matching tasks, in the order of the task_id index"""
+    query = db.select(*METRIC_COLUMNS)
+    if conditions:
+        query = query.where(TrainingMetric.task_id.in_(db.select(TrainingTask.id).where(*conditions)))
+    return query.order_by(TrainingMetric.task_id, TrainingMetric.id)
+
+
+def tasks_query(conditions):
+    return db.select(*TASK_COLUMNS).where(*conditions).order_by(TrainingTask.id)
+
+
+def datasets_query():
+    return db.select(*DATASET_COLUMNS).order_by(Dataset.id)
+
+
+def evaluations_query(args):
+    query = db.select(*EVALUATION_COLUMNS)
+    try:
+        for name in ('model_id', 'dataset_id'):
+            if args.get(name) is not None:
+                query = query.where(getattr(ModelEvaluation, name) == int(args[name]))
+    except ValueError:
+        raise ValueError('Ids must be integers')
+    if args.getlist('status'):
+        query = query.where(ModelEvaluation.status.in_(args.getlist('status')))
+    return query.order_by(ModelEvaluation.id)
+
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def encode_rows(query, file_format):
+    """Yield the rows of a Core select as encoded chunks of about CHUNK_SIZE bytes"""
+    result = db.session.execute(query.execution_options(yield_per=FETCH_SIZE))
+    names = list(result.keys())
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if file_format == 'csv' else None
+    if writer:
+        writer.writerow(names)
+    for rows in result.partitions():
+        for row in rows:
+            if writer:
+                writer.writerow([_csv_value(value) for value in row])
+            else:
+                buffer.write(json.dumps({name: _json_value(value) for name, value in zip(names, row)},
+                                        ensure_ascii=False, default=str))
+                buffer.write('\n')
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def gzip_chunks(chunks):
+    """Compress a stream of chunks into one gzip member as it is produced"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def download_response(chunks, mimetype, filename):
+    """Stream chunks as an attachment, gzip-compressed when the request asks for gzip=true"""
+    if request.args.get('gzip', 'false').lower() == 'true':
+        chunks = gzip_chunks(chunks)
+        mimetype = 'application/gzip'
+        filename += '.gz'
+    
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}', 'X-Accel-Buffering': 'no'}
+    )
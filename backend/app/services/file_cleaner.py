@@ -0,0 +1,118 @@
+import os
+import time
+import errno
+import shutil
+from datetime import timezone
+from ..models import db, FileTombstone
+from .background_worker import BackgroundWorker
+
+RECLAIM_BATCH = 1000  # Tombstones handled per transaction
+
+
+def remove(tombstone):
+    """Remove a tombstoned path; directories go with everything in them"""
+    path = tombstone.path
+    if tombstone.reason == 'orphan':
+        # Found by a scan rather than through its record: spare it if it was written
+        # to since, and remove directories only while they are still empty
+        created = tombstone.created_at.replace(tzinfo=timezone.utc).timestamp()
+        if os.lstat(path).st_mtime > created:
+            return
+        if os.path.isdir(path) and not os.path.islink(path):
+            try:
+                os.rmdir(path)
+            except OSError as e:
+                if e.errno != errno.ENOTEMPTY:
+                    raise
+            return
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+
+class FileCleaner(BackgroundWorker):
+    """
+    Removes the files of deleted records in the background, so a request that
+    deletes many or very large artifacts does not wait on the storage.
+
+    A deletion is recorded as a tombstone row in the same transaction as the
+    records that referenced the files; a background thread removes the files
+    once it commits and retries failures, so a crash only delays removal. The
+    same thread runs the periodic orphan scan (see storage_service).
+    """
+
+    name = 'File reclamation'
+    extension = 'file_cleaner'
+    interval_setting = 'FILE_RECLAIM_INTERVAL'
+    default_interval = 30
+    wake_flag = 'file_tombstones'
+
+    def __init__(self, app=None):
+        self.scan_interval = 0
+        self.max_attempts = 5
+        self._last_scan = time.monotonic()
+        super().__init__(app)
+
+    def init_app(self, app):
+        super().init_app(app)
+        self.scan_interval = app.config.get('ORPHAN_SCAN_INTERVAL', 0)
+        self.max_attempts = app.config.get('FILE_RECLAIM_MAX_ATTEMPTS', 5)
+        self._last_scan = time.monotonic()
+
+    def delete(self, paths, reason='deleted'):
+        """
+        Tombstone files or directories in the current transaction; they are
+        removed once it commits. Missing paths are ignored.
+        """
+        count = 0
+        for path in paths:
+            try:
+                size = os.path.getsize(path) if os.path.isfile(path) else None
+            except (OSError, TypeError):
+                continue  # Missing, or no path at all
+            if size is None and not os.path.isdir(path):
+                continue
+            db.session.add(FileTombstone(path=path, reason=reason, size=size, status='pending'))
+            count += 1
+        if count:
+            self.queued()
+        return count
+
+    def reclaim(self, limit=RECLAIM_BATCH):
+        """Remove the files of up to `limit` pending tombstones; returns (removed, failed)"""
+        tombstones = (FileTombstone.query.filter_by(status='pending')
+                      .order_by(FileTombstone.id).limit(limit).all())
+        removed, failed = [], 0
+        for tombstone in tombstones:
+            try:
+                remove(tombstone)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                tombstone.attempts = (tombstone.attempts or 0) + 1
+                tombstone.last_error = str(e)
+                if tombstone.attempts >= self.max_attempts:
+                    tombstone.status = 'failed'
+                    self.logger.error(f"Giving up deleting {tombstone.path}: {e}")
+                failed += 1
+                continue
+            removed.append(tombstone.id)
+
+        if removed:
+            # Another worker may have reclaimed the same rows; a bulk DELETE does not mind
+            db.session.execute(db.delete(FileTombstone).where(FileTombstone.id.in_(removed))
+                               .execution_options(synchronize_session=False))
+        db.session.commit()
+        return len(removed), failed
+
+    def run_pass(self):
+        from .storage_service import scan_orphans
+        while self.reclaim(RECLAIM_BATCH)[0] == RECLAIM_BATCH:
+            pass
+        if self.scan_interval and time.monotonic() - self._last_scan >= self.scan_interval:
+            self._last_scan = time.monotonic()
+            scan_orphans()
+
+
+file_cleaner = FileCleaner()
@@ -0,0 +1,124 @@
+import time
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import event
+from ..models import db, TrainingTask
+from .training_service import launch_training_task, finish_training_task
+from .checkpoint_service import latest_checkpoint, rewind_task
+from .scheduler_service import pick_candidates
+
+# Notified when this process queues a task; tasks queued by other processes
+# are found at the next poll
+_queued = threading.Condition()
+
+
+@event.listens_for(db.session, 'after_commit')
+def _notify_queued(session):
+    if session.info.pop('training_queued', False):
+        with _queued:
+            _queued.notify_all()
+
+
+def lease_expiry():
+    return datetime.utcnow() + timedelta(seconds=current_app.config['TRAINING_LEASE_SECONDS'])
+
+
+def requeue_expired_leases():
+    """
+    Put running tasks whose worker stopped heartbeating back in the queue,
+    resuming from their latest checkpoint. Tasks that used up their attempts
+    fail instead. Returns the ids of the requeued tasks.
+    """
+    now = datetime.utcnow()
+    expired = TrainingTask.query.filter(TrainingTask.status == 'running',
+                                        TrainingTask.lease_expires_at < now).all()
+    requeued = []
+    for task in expired:
+        # Taking over the lease is a conditional update, so only one process
+        # requeues the task; if that process dies, the lease expires again
+        worker_id = task.worker_id
+        claimed = (TrainingTask.query
+                   .filter(TrainingTask.id == task.id, TrainingTask.status == 'running',
+                           TrainingTask.lease_expires_at < now)
+                   .update({'worker_id': None, 'lease_expires_at': lease_expiry()},
+                           synchronize_session=False))
+        db.session.commit()
+        if not claimed:
+            continue
+        db.session.refresh(task)
+        if (task.attempts or 0) >= current_app.config['TRAINING_MAX_ATTEMPTS']:
+            task.lease_expires_at = None
+            task.error_message = f'Lease held by {worker_id} expired after {task.attempts} attempts'
+            finish_training_task(task, 'failed')
+            continue
+        current_app.logger.warning(f"Lease on task {task.id} held by {worker_id} expired, requeueing")
+        launch_training_task(task, rewind_task(task, latest_checkpoint(task)))
+        requeued.append(task.id)
+    return requeued
+
+
+def claim_task(worker_id, cpu=None, memory=None, queues=None, total_cpu=None, total_memory=None):
+    """
+    Claim the best queued task that fits a worker's free capacity, or return
+    None. The claim is a conditional update on the task's status, so two
+    workers racing for the same task cannot both win it.
+    """
+    candidates = [task.id for task in pick_candidates(cpu, memory, queues, limit=8,
+                                                      total_cpu=total_cpu, total_memory=total_memory)]
+    db.session.commit()
+    for task_id in candidates:
+        claimed = (TrainingTask.query
+                   .filter(TrainingTask.id == task_id, TrainingTask.status == 'queued')
+                   .update({
+                       'status': 'running',
+                       'worker_id': worker_id,
+                       'lease_expires_at': lease_expiry(),
+                       'attempts': db.func.coalesce(TrainingTask.attempts, 0) + 1,
+                       'start_time': datetime.utcnow()
+                   }, synchronize_session=False))
+        db.session.commit()
+        if claimed:
+            return db.session.get(TrainingTask, task_id, populate_existing=True)
+    return None
+
+
+def lease_task(worker_id, wait=0, cpu=None, memory=None, queues=None, total_cpu=None, total_memory=None):
+    """
+    Claim a queued task, long-polling for up to wait seconds. The poll holds
+    a request thread; the 'lease' admission pool caps how many may wait.
+    """
+    deadline = time.monotonic() + min(max(wait, 0), current_app.config['TRAINING_LEASE_MAX_WAIT'])
+    requeue_expired_leases()
+    while True:
+        task = claim_task(worker_id, cpu, memory, queues, total_cpu, total_memory)
+        remaining = deadline - time.monotonic()
+        if task or remaining <= 0:
+            return task
+        with _queued:
+            _queued.wait(min(remaining, current_app.config['TRAINING_LEASE_POLL_INTERVAL']))
+
+
+def holds_lease(task, worker_id):
+    return task.status == 'running' and task.worker_id == worker_id
+
+
+def renew_lease(task, worker_id):
+    """Extend a worker's lease; returns False if the worker no longer holds it"""
+    if not holds_lease(task, worker_id):
+        return False
+    task.lease_expires_at = lease_expiry()
+    db.session.commit()
+    return True
+
+
+def release_lease(task, status, error_message=None):
+    """Finish a leased task with the worker's final status"""
+    task.lease_expires_at = None
+    if error_message:
+        task.error_message = error_message
+    if task.status == 'running':
+        finish_training_task(task, status)
+    else:
+        # The platform already finished the task, e.g. at its last epoch
+        db.session.commit()
@@ -0,0 +1,271 @@
+import json
+import queue
+import threading
+import http.client
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+# OpenAI-compatible endpoints of the supported providers
+DEFAULT_ENDPOINTS = {
+    'qwen': 'https://dashscope.aliyuncs.com/compatible-mode/v1',
+    'ernie': 'https://qianfan.baidubce.com/v2',
+    'qianfan': 'https://qianfan.baidubce.com/v2',
+    'chatglm': 'https://open.bigmodel.cn/api/paas/v4',
+    'local': 'http://localhost:8000/v1',
+}
+
+DEFAULT_MODELS = {
+    'qwen': 'qwen-turbo',
+    'ernie': 'ernie-speed-8k',
+    'qianfan': 'ernie-speed-8k',
+    'chatglm': 'glm-4-flash',
+    'local': 'local',
+}
+
+
+class ProviderError(Exception):
+    """Raised when a provider cannot produce a response"""
+
+
+class ProviderBusy(ProviderError):
+    """Raised when the provider's concurrency cap is reached"""
+
+
+class ConnectionPool:
+    """
+    Keep-alive HTTP(S) connections to a single host
+
+    Idle connections are reused LIFO; at most max_idle are kept around.
+    """
+
+    def __init__(self, url, timeout=30, max_idle=8):
+        parts = urlsplit(url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.base_path = parts.path.rstrip('/')
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+        self.created = 0
+
+    def _new_connection(self):
+        connection_class = (http.client.HTTPSConnection if self.scheme == 'https'
+                            else http.client.HTTPConnection)
+        self.created += 1
+        return connection_class(self.host, self.port, timeout=self.timeout)
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._new_connection()
+
+    def release(self, connection, reusable=True):
+        if not reusable:
+            connection.close()
+            return
+        try:
+            self._idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def request(self, method, path, body, headers):
+        """Send a request, retrying once on a stale keep-alive connection"""
+        for attempt in range(2):
+            connection = self.acquire()
+            try:
+                connection.request(method, self.base_path + path, body=body, headers=headers)
+                return connection, connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                if attempt:
+                    raise
+            except Exception:
+                connection.close()
+                raise
+
+
+class AnswerCache:
+    """LRU cache of complete answers for identical prompts"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        return None
+
+    def set(self, key, answer):
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._entries[key] = answer
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class BaseProvider:
+    """Chat completion provider"""
+
+    name = 'base'
+    # Stateless providers answer from the last message only, so their answers
+    # can be cached regardless of conversation history
+    stateless = False
+
+    def __init__(self, model=None, max_concurrency=8, queue_timeout=5, cache_size=256):
+        self.model = model
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self.answer_cache = AnswerCache(cache_size)
+
+    def stream(self, messages, context=None):
+        """
+        Yield the response to messages as text deltas, using the answer cache
+        context is the retrieval result already rendered into the system prompt
+        """
+        key = self._cache_key(messages)
+        if key is not None:
+            cached = self.answer_cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise ProviderBusy(f"Too many concurrent requests to {self.name}")
+        try:
+            parts = []
+            for delta in self._stream(messages, context):
+                parts.append(delta)
+                yield delta
+        finally:
+            self._slots.release()
+
+        if key is not None:
+            self.answer_cache.set(key, ''.join(parts))
+
+    def complete(self, messages, context=None):
+        """Return the full response to messages"""
+        return ''.join(self.stream(messages, context))
+
+    def _cache_key(self, messages):
+        user_turns = [m for m in messages if m['role'] == 'user']
+        if not self.stateless and len(user_turns) > 1:
+            return None
+        # System messages carry retrieved context, so live state changes miss the cache
+        system = tuple(m['content'] for m in messages if m['role'] == 'system')
+        return (self.model, system, user_turns[-1]['content'].strip()) if user_turns else None
+
+    def _stream(self, messages, context=None):
+        raise NotImplementedError
+
+
+class BuiltinProvider(BaseProvider):
+    """Offline keyword-based responses, used when no AI service is configured"""
+
+    name = 'builtin'
+    stateless = True
+
+    def _stream(self, messages, context=None):
+        from ..api.chat import generate_ai_response
+
+        answer = generate_ai_response(messages[-1]['content'], context)
+        for line in answer.splitlines(keepends=True):
+            yield line
+
+
+class OpenAICompatibleProvider(BaseProvider):
+    """
+    Provider speaking the OpenAI chat completions protocol, which Qwen
+    (DashScope compatible mode), ERNIE (Qianfan v2), ChatGLM and most local
+    inference servers implement
+    """
+
+    def __init__(self, name, endpoint, api_key=None, timeout=30, pool_size=8, **kwargs):
+        super().__init__(**kwargs)
+        self.name = name
+        self.api_key = api_key
+        self.pool = ConnectionPool(endpoint, timeout=timeout, max_idle=pool_size)
+
+    def _stream(self, messages, context=None):
+        body = json.dumps({
+            'model': self.model,
+            'messages': [{'role': m['role'], 'content': m['content']} for m in messages],
+            'stream': True
+        }).encode('utf-8')
+        headers = {'Content-Type': 'application/json', 'Accept': 'text/event-stream'}
+        if self.api_key:
+            headers['Authorization'] = f'Bearer {self.api_key}'
+
+        try:
+            connection, response = self.pool.request('POST', '/chat/completions', body, headers)
+        except (OSError, http.client.HTTPException) as e:
+            raise ProviderError(f"{self.name} request failed: {e}")
+
+        reusable = False
+        try:
+            if response.status != 200:
+                raise ProviderError(f"{self.name} returned HTTP {response.status}: "
+                                    f"{response.read(500).decode('utf-8', 'replace')}")
+
+            for raw_line in response:
+                line = raw_line.decode('utf-8').strip()
+                if not line.startswith('data:'):
+                    continue
+                payload = line[5:].strip()
+                if payload == '[DONE]':
+                    break
+                choices = json.loads(payload).get('choices') or [{}]
+                delta = (choices[0].get('delta') or {}).get('content')
+                if delta:
+                    yield delta
+
+            # Drain the body so the connection can be reused
+            response.read()
+            reusable = not response.will_close
+        except (OSError, http.client.HTTPException) as e:
+            # HTTPException covers a body cut short (IncompleteRead) or a bad status line
+            raise ProviderError(f"{self.name} stream failed: {e}")
+        except ValueError as e:
+            # json.JSONDecodeError or UnicodeDecodeError from a malformed event
+            raise ProviderError(f"{self.name} sent an invalid event: {e}")
+        finally:
+            self.pool.release(connection, reusable)
+
+
+def create_provider(config):
+    """Build the chat provider named by the AI_* settings"""
+    name = (config.get('AI_PROVIDER') or 'builtin').lower()
+    options = {
+        'max_concurrency': config.get('AI_MAX_CONCURRENCY', 8),
+        'queue_timeout': config.get('AI_QUEUE_TIMEOUT', 5),
+        'cache_size': config.get('AI_ANSWER_CACHE_SIZE', 256),
+    }
+
+    if name == 'builtin':
+        return BuiltinProvider(**options)
+    if name not in DEFAULT_ENDPOINTS:
+        raise ValueError(f"Unknown AI provider: {name}")
+
+    return OpenAICompatibleProvider(
+        name,
+        config.get('AI_ENDPOINT') or DEFAULT_ENDPOINTS[name],
+        api_key=config.get('AI_API_KEY'),
+        timeout=config.get('AI_TIMEOUT', 30),
+        pool_size=config.get('AI_POOL_SIZE', 8),
+        model=config.get('AI_MODEL') or DEFAULT_MODELS[name],
+        **options
+    )
+
+
+def get_provider(app):
+    """Return the app's provider, creating it on first use"""
+    provider = app.extensions.get('llm_provider')
+    if provider is None:
+        provider = app.extensions['llm_provider'] = create_provider(app.config)
+    return provider
@@ -0,0 +1,383 @@
+"""
+Results store for fine-grained localization models: the line ranges a scan
+flags in each file, with their scores and vulnerability types.
+
+Results arrive in batches while a scan runs, each saved as one columnar
+.npz file. Completing the scan sorts all its rows once, by file then line,
+and writes the columns as .npy arrays that are memory-mapped when read:
+
+    paths                 sorted unique file paths (UTF-8); a file's id is
+                          its position, so a path is found by binary search
+    file_offsets          the rows of file i are file_offsets[i]:file_offsets[i + 1]
+    file_ids, function_ids, line_starts, line_ends, scores, type_ids
+                          one entry per line range
+    functions             function names by function id, b'' for none
+    score_order           rows by descending score
+    file_scores, file_order
+                          each file's highest score, and files by it
+
+Top lines and riskiest files read a prefix of an order array and a file's
+heatmap reads its slice of the rows, so none of them loads the scan.
+"""
+
+import os
+import json
+import uuid
+import heapq
+from datetime import datetime
+from flask import current_app
+from ..models import db, LocalizationScan
+from ..utils.lazy_import import lazy_import
+
+np = lazy_import('numpy')
+
+BATCH_COLUMNS = ('paths', 'functions', 'line_starts', 'line_ends', 'scores', 'types')
+COLUMNS = ('paths', 'file_offsets', 'file_ids', 'function_ids', 'line_starts', 'line_ends', 'scores',
+           'type_ids', 'functions', 'score_order', 'file_scores', 'file_order')
+FIRST_CHUNK = 1024  # Entries of an order array read at first when filtering; doubles each time
+
+
+def scans_folder():
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], 'localization')
+
+
+def create_scan(model, dataset=None, name=None):
+    """Register a scan of model, optionally over dataset, ready to receive results"""
+    if model.model_type != 'fine_grained_location':
+        raise ValueError('Localization scans need a fine_grained_location model')
+    scan = LocalizationScan(
+        name=name,
+        model_id=model.id,
+        dataset_id=dataset.id if dataset else None,
+        status='receiving',
+        path=os.path.join(scans_folder(), uuid.uuid4().hex),
+        num_ranges=0
+    )
+    os.makedirs(scan.path, exist_ok=True)
+    db.session.add(scan)
+    db.session.commit()
+    return scan
+
+
+def _line(value):
+    return (isinstance(value, int) and not isinstance(value, bool)
+            and 1 <= value <= current_app.config['LOCALIZATION_MAX_LINE'])
+
+
+def validate_results(results):
+    """The columns of a batch of results, raising ValueError for an invalid one"""
+    if not isinstance(results, list) or not results:
+        raise ValueError('results must be a non-empty list')
+    columns = {name: [] for name in BATCH_COLUMNS}
+    for i, result in enumerate(results):
+        if not isinstance(result, dict):
+            raise ValueError(f'Result {i} must be an object')
+        path = result.get('file')
+        if not isinstance(path, str) or not path:
+            raise ValueError(f'Result {i}: file is required')
+        start = result.get('line_start')
+        end = result.get('line_end', start)
+        if not _line(start) or not _line(end) or end < start:
+            raise ValueError(f"Result {i}: line_start and line_end must be line numbers up to "
+                             f"{current_app.config['LOCALIZATION_MAX_LINE']}, start first")
+        score = result.get('score')
+        if not isinstance(score, (int, float)) or isinstance(score, bool) or not 0 <= score <= 1:
+            raise ValueError(f'Result {i}: score must be between 0 and 1')
+        function = result.get('function') or ''
+        vuln_type = result.get('vulnerability_type') or ''
+        if not isinstance(function, str) or not isinstance(vuln_type, str):
+            raise ValueError(f'Result {i}: function and vulnerability_type must be strings')
+
+        columns['paths'].append(path.encode('utf-8'))
+        columns['functions'].append(function.encode('utf-8'))
+        columns['line_starts'].append(start)
+        columns['line_ends'].append(end)
+        columns['scores'].append(score)
+        columns['types'].append(vuln_type)
+    return columns
+
+
+def append_results(scan, results):
+    """
+    Store a batch of line results, a list of {file, function, line_start,
+    line_end, score, vulnerability_type}; returns False if the scan stopped
+    receiving before it took the batch, in which case nothing is stored
+    """
+    columns = validate_results(results)
+    arrays = {
+        'paths': np.array(columns['paths'], dtype=bytes),
+        'functions': np.array(columns['functions'], dtype=bytes),
+        'line_starts': np.array(columns['line_starts'], dtype=np.int32),
+        'line_ends': np.array(columns['line_ends'], dtype=np.int32),
+        'scores': np.array(columns['scores'], dtype=np.float32),
+        'types': np.array(columns['types'], dtype=str)
+    }
+    path = os.path.join(scan.path, f'batch-{uuid.uuid4().hex}.npz')
+    with open(f'{path}.tmp', 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(f'{path}.tmp', path)
+
+    # Written before counting, so a scan completed after this update sees the batch
+    counted = (LocalizationScan.query.filter_by(id=scan.id, status='receiving')
+               .update({'num_ranges': LocalizationScan.num_ranges + len(results)},
+                       synchronize_session=False))
+    db.session.commit()
+    if not counted:
+        # Completion renames the batches it takes, so exactly one of us has the file
+        try:
+            os.remove(path)
+            return False
+        except FileNotFoundError:
+            pass
+    db.session.refresh(scan)
+    return True
+
+
+def complete_scan(scan):
+    """
+    Stop receiving results and build the scan's columns from its batches.
+    Returns False if the scan was not receiving; raises ValueError if it
+    has no results, leaving it receiving.
+    """
+    claimed = (LocalizationScan.query.filter_by(id=scan.id, status='receiving')
+               .update({'status': 'completing'}, synchronize_session=False))
+    db.session.commit()
+    if not claimed:
+        return False
+
+    # Renaming takes a batch; an upload that lost the race may remove its file first
+    batches = []
+    for name in sorted(os.listdir(scan.path)):
+        if name.startswith('batch-') and name.endswith('.npz'):
+            path = os.path.join(scan.path, name)
+            try:
+                os.rename(path, f'{path}.taken')
+            except FileNotFoundError:
+                continue
+            batches.append(f'{path}.taken')
+    try:
+        if not batches:
+            raise ValueError('Scan has no results')
+        size = write_columns(scan.path, batches)
+    except Exception:
+        for path in batches:
+            os.rename(path, path[:-len('.taken')])
+        scan.status = 'receiving'
+        db.session.commit()
+        raise
+
+    columns = ScanColumns(scan.path)
+    scan.status = 'completed'
+    scan.num_ranges = columns.num_ranges
+    scan.num_files = columns.num_files
+    scan.max_score = _score(columns.file_scores.max())
+    scan.size = size
+    scan.completed_at = datetime.utcnow()
+    db.session.commit()
+    for path in batches:
+        os.remove(path)
+    return True
+
+
+def write_columns(folder, batches):
+    """Sort the rows of the batch files by file and line and write the columns; returns their size"""
+    rows = {name: [] for name in BATCH_COLUMNS}
+    for path in batches:
+        with np.load(path) as batch:
+            for name in BATCH_COLUMNS:
+                rows[name].append(batch[name])
+    rows = {name: np.concatenate(arrays) for name, arrays in rows.items()}
+
+    paths, file_ids = np.unique(rows['paths'], return_inverse=True)
+    functions, function_ids = np.unique(rows['functions'], return_inverse=True)
+    type_names, type_ids = np.unique(rows['types'], return_inverse=True)
+    order = np.lexsort((rows['line_ends'], rows['line_starts'], file_ids))
+
+    file_ids = file_ids[order].astype(np.int32)
+    scores = rows['scores'][order]
+    file_offsets = np.searchsorted(file_ids, np.arange(paths.size + 1)).astype(np.int64)
+    file_scores = np.maximum.reduceat(scores, file_offsets[:-1])
+
+    arrays = {
+        'paths': paths,
+        'file_offsets': file_offsets,
+        'file_ids': file_ids,
+        'function_ids': function_ids[order].astype(np.int32),
+        'line_starts': rows['line_starts'][order],
+        'line_ends': rows['line_ends'][order],
+        'scores': scores,
+        'type_ids': type_ids[order].astype(np.int16),
+        'functions': functions,
+        # Stable, so equal scores keep file and line order
+        'score_order': np.argsort(-scores, kind='stable'),
+        'file_scores': file_scores,
+        'file_order': np.argsort(-file_scores, kind='stable')
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(folder, f'{name}.npy'), array)
+    with open(os.path.join(folder, 'meta.json'), 'w') as f:
+        json.dump({'num_ranges': int(scores.size), 'types': type_names.tolist()}, f)
+    return sum(os.path.getsize(os.path.join(folder, f'{name}.npy')) for name in arrays)
+
+
+def _score(value):
+    # Scores are stored as float32; rounding drops the noise of widening them
+    return round(float(value), 6)
+
+
+class ScanColumns:
+    """The columns of a completed scan, memory-mapped from its folder"""
+
+    def __init__(self, folder):
+        with open(os.path.join(folder, 'meta.json')) as f:
+            meta = json.load(f)
+        self.num_ranges = meta['num_ranges']
+        self.type_names = meta['types']
+        for name in COLUMNS:
+            setattr(self, name, np.load(os.path.join(folder, f'{name}.npy'), mmap_mode='r'))
+        self.num_files = self.paths.size
+
+    def file_id(self, path):
+        """The id of a file path, or None if the scan has no results for it"""
+        key = path.encode('utf-8')
+        index = int(np.searchsorted(self.paths, key))
+        if index < self.num_files and self.paths[index] == key:
+            return index
+        return None
+
+    def file_range(self, prefix):
+        """The ids [lo, hi) of the files whose path starts with prefix"""
+        if not prefix:
+            return 0, self.num_files
+        key = prefix.encode('utf-8')
+        # No UTF-8 sequence contains 0xff, so this sorts after every path with the prefix
+        return int(np.searchsorted(self.paths, key)), int(np.searchsorted(self.paths, key + b'\xff'))
+
+    def row(self, index):
+        vuln_type = self.type_names[self.type_ids[index]]
+        function = self.functions[self.function_ids[index]]
+        return {
+            'file': self.paths[self.file_ids[index]].decode('utf-8'),
+            'function': function.decode('utf-8') or None,
+            'line_start': int(self.line_starts[index]),
+            'line_end': int(self.line_ends[index]),
+            'score': _score(self.scores[index]),
+            'vulnerability_type': vuln_type or None
+        }
+
+
+_scans = {}  # Scan folder -> loaded columns
+
+
+def scan_columns(scan):
+    """The columns of a completed scan, loaded once per process"""
+    columns = _scans.get(scan.path)
+    if columns is None:
+        columns = _scans[scan.path] = ScanColumns(scan.path)
+    return columns
+
+
+def forget_scan(scan):
+    _scans.pop(scan.path, None)
+
+
+def _take(order, keep, limit):
+    """Up to limit entries of an order array that keep(entries) accepts, reading it in growing chunks"""
+    found, start, chunk = [], 0, FIRST_CHUNK
+    while start < order.size and len(found) < limit:
+        entries = np.asarray(order[start:start + chunk])
+        accepted, done = keep(entries)
+        found.extend(entries[accepted][:limit - len(found)].tolist())
+        if done:
+            break
+        start += chunk
+        chunk *= 2
+    return found
+
+
+def top_lines(scan, k, vulnerability_type=None, path_prefix=None, min_score=None):
+    """The k highest-scoring line ranges, optionally of one type, under a path prefix or above a score"""
+    columns = scan_columns(scan)
+    if vulnerability_type is not None and vulnerability_type not in columns.type_names:
+        return []
+    lo, hi = columns.file_range(path_prefix)
+
+    def keep(rows):
+        scores = columns.scores[rows]
+        accepted = np.ones(rows.size, dtype=bool)
+        if min_score is not None:
+            accepted &= scores >= min_score
+        if vulnerability_type is not None:
+            accepted &= columns.type_ids[rows] == columns.type_names.index(vulnerability_type)
+        if path_prefix:
+            file_ids = columns.file_ids[rows]
+            accepted &= (file_ids >= lo) & (file_ids < hi)
+        # Scores only fall from here on
+        return accepted, min_score is not None and scores[-1] < min_score
+
+    return [columns.row(index) for index in _take(columns.score_order, keep, k)]
+
+
+def riskiest_files(scan, limit, path_prefix=None):
+    """The files with the highest-scoring line ranges, optionally under a path prefix"""
+    columns = scan_columns(scan)
+    lo, hi = columns.file_range(path_prefix)
+
+    def keep(file_ids):
+        return (file_ids >= lo) & (file_ids < hi), False
+
+    return [{
+        'file': columns.paths[file_id].decode('utf-8'),
+        'max_score': _score(columns.file_scores[file_id]),
+        'num_ranges': int(columns.file_offsets[file_id + 1] - columns.file_offsets[file_id])
+    } for file_id in _take(columns.file_order, keep, limit)]
+
+
+def _segments(line_starts, line_ends, scores):
+    """
+    The flagged lines of overlapping ranges as disjoint [first, last] runs
+    with the highest score covering each, merging neighbours of equal score
+    """
+    order = np.argsort(line_starts, kind='stable')
+    bounds = np.unique(np.concatenate([line_starts, line_ends + 1]))
+    segments, covering, added = [], [], 0
+    for first, following in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        while added < order.size and line_starts[order[added]] <= first:
+            index = order[added]
+            heapq.heappush(covering, (-float(scores[index]), int(line_ends[index])))
+            added += 1
+        while covering and covering[0][1] < first:
+            heapq.heappop(covering)
+        if not covering:
+            continue
+        score = -covering[0][0]
+        if segments and segments[-1][2] == score and segments[-1][1] == first - 1:
+            segments[-1][1] = following - 1
+        else:
+            segments.append([first, following - 1, score])
+    return segments
+
+
+def file_heatmap(scan, path):
+    """
+    The line ranges of one file and its heatmap: the flagged lines as runs
+    with the highest score covering them, so its size follows the number of
+    ranges rather than of lines. Raises LookupError if the scan has no
+    results for the file.
+    """
+    columns = scan_columns(scan)
+    file_id = columns.file_id(path)
+    if file_id is None:
+        raise LookupError(f'No results for {path}')
+    start, end = int(columns.file_offsets[file_id]), int(columns.file_offsets[file_id + 1])
+
+    segments = _segments(np.asarray(columns.line_starts[start:end]), np.asarray(columns.line_ends[start:end]),
+                         np.asarray(columns.scores[start:end]))
+    return {
+        'file': path,
+        'num_ranges': end - start,
+        'max_score': _score(columns.file_scores[file_id]),
+        'segments': [{'line_start': first, 'line_end': last, 'score': _score(score)}
+                     for first, last, score in segments],
+        'ranges': [columns.row(index) for index in range(start, end)]
+    }
@@ -0,0 +1,447 @@
+import os
+import json
+import time
+import bisect
+import tempfile
+import threading
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000, 100000000)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+RETIRED_FILE = 'metrics_retired.json'  # Totals of exited processes, see retire_processes
+
+HELP = {
+    'vulweb_http_requests_total': ('counter', 'HTTP requests by endpoint, method and status'),
+    'vulweb_http_request_duration_seconds': ('histogram', 'HTTP request latency'),
+    'vulweb_http_request_size_bytes': ('histogram', 'HTTP request body size'),
+    'vulweb_http_response_size_bytes': ('histogram', 'HTTP response body size'),
+    'vulweb_db_queries_per_request': ('histogram', 'SQL statements executed per request'),
+    'vulweb_db_query_duration_seconds_total': ('counter', 'Time spent in SQL statements'),
+    'vulweb_db_pool_checked_out': ('gauge', 'Database connections in use'),
+    'vulweb_db_pool_size': ('gauge', 'Database connection pool size'),
+    'vulweb_uploads_in_flight': ('gauge', 'Multipart uploads being received'),
+    'vulweb_requests_in_flight': ('gauge', 'Requests being handled'),
+    'vulweb_training_tasks': ('gauge', 'Training tasks by status'),
+    'vulweb_evaluations': ('gauge', 'Model evaluations by status'),
+    'vulweb_admission_rejected_total': ('counter', 'Requests rejected by admission control by pool and reason'),
+}
+
+
+class MetricsRegistry:
+    """
+    Request, database and queue instrumentation exposed in Prometheus format
+
+    Each request collects its measurements in flask.g and merges them into
+    the process's totals under a single short lock acquisition. With
+    METRICS_DIR set, every process periodically writes its totals to its own
+    file there and a scrape sums the files, so counters cover all gunicorn
+    workers without any cross-process locking. Gunicorn's master folds the
+    files of exited workers into one, see retire_processes.
+    """
+
+    def __init__(self, app=None):
+        self.directory = None
+        self.flush_interval = 5
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._in_flight = {'vulweb_requests_in_flight': 0, 'vulweb_uploads_in_flight': 0}
+        self._flusher = None
+        self._pid = os.getpid()
+        self._file_name = self._new_file_name()
+        self._engines = set()
+        self._collectors = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.directory = app.config.get('METRICS_DIR')
+        self.flush_interval = app.config.get('METRICS_FLUSH_INTERVAL', 5)
+        self.reset()
+        self._flusher = None
+        self._engines = set()
+        self._collectors = []
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        app.extensions['metrics'] = self
+
+        if not app.config.get('METRICS_ENABLED', True):
+            return
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        watch_queries(_count_query)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            for name in self._in_flight:
+                self._in_flight[name] = 0
+
+    def _new_file_name(self):
+        # The start time keeps a recycled pid from overwriting a dead worker's totals
+        return f'metrics_{os.getpid()}_{time.time_ns()}.json'
+
+    def _check_fork(self):
+        """
+        A forked worker starts from zero rather than the parent's totals, and
+        gets its own thread writing them to METRICS_DIR
+        """
+        if os.getpid() != self._pid:
+            self._pid = os.getpid()
+            self._file_name = self._new_file_name()
+            self._flusher = None
+            self.reset()
+        if self.directory and self._flusher is None:
+            with self._lock:
+                if self._flusher is None:
+                    self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+                    self._flusher.start()
+
+    def _flush_periodically(self):
+        # Off the request path, so requests never wait on file IO
+        while self._flusher is threading.current_thread():
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def add_collector(self, collector):
+        """Register a function returning gauge samples [(name, labels, value)] at scrape time"""
+        self._collectors.append(collector)
+
+    def track_engine(self, engine):
+        self._engines.add(engine)
+
+    def inc(self, name, labels=(), value=1):
+        """Add to a counter outside the request hooks"""
+        with self._lock:
+            self._inc(name, labels, value)
+
+    # Request hooks
+
+    def _before_request(self):
+        self._check_fork()
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_query_time = 0.0
+        g.metrics_upload = (request.method in ('POST', 'PUT')
+                            and (request.content_type or '').startswith('multipart/form-data'))
+        with self._lock:
+            self._in_flight['vulweb_requests_in_flight'] += 1
+            if g.metrics_upload:
+                self._in_flight['vulweb_uploads_in_flight'] += 1
+
+    def _after_request(self, response):
+        g.metrics_status = response.status_code
+        g.metrics_response_size = response.calculate_content_length()
+        return response
+
+    def _teardown_request(self, exc):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return
+        # Teardown runs after streamed responses finish, so latency covers the whole body
+        duration = time.perf_counter() - start
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        method = request.method
+        status = str(g.pop('metrics_status', 500))
+        labels = (('endpoint', endpoint), ('method', method))
+
+        with self._lock:
+            self._in_flight['vulweb_requests_in_flight'] -= 1
+            if g.pop('metrics_upload', False):
+                self._in_flight['vulweb_uploads_in_flight'] -= 1
+            self._inc('vulweb_http_requests_total', labels + (('status', status),), 1)
+            self._observe('vulweb_http_request_duration_seconds', labels, duration, LATENCY_BUCKETS)
+            self._observe('vulweb_http_request_size_bytes', labels,
+                          request.content_length or 0, SIZE_BUCKETS)
+            response_size = g.pop('metrics_response_size', None)
+            if response_size is not None:
+                self._observe('vulweb_http_response_size_bytes', labels, response_size, SIZE_BUCKETS)
+            self._observe('vulweb_db_queries_per_request', labels,
+                          g.pop('metrics_queries', 0), QUERY_COUNT_BUCKETS)
+            self._inc('vulweb_db_query_duration_seconds_total', labels, g.pop('metrics_query_time', 0.0))
+
+
+    # Accumulation, called with the lock held
+
+    def _inc(self, name, labels, value):
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def _observe(self, name, labels, value, buckets):
+        key = (name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = {'buckets': list(buckets),
+                                                 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+        index = bisect.bisect_left(histogram['buckets'], value)
+        if index < len(histogram['counts']):
+            histogram['counts'][index] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+    # Multi-process aggregation
+
+    def snapshot(self):
+        """This process's totals in a JSON-serializable form"""
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, list(labels), dict(h, counts=list(h['counts']))]
+                               for (name, labels), h in self._histograms.items()],
+                'gauges': [[name, [], value] for name, value in self._in_flight.items()]
+                + [[name, list(labels), value] for name, labels, value in self._pool_gauges()]
+            }
+
+    def flush(self):
+        """Atomically write this process's totals to METRICS_DIR"""
+        if not self.directory:
+            return
+        data = self.snapshot()
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(temp_path, os.path.join(self.directory, self._file_name))
+
+    def _snapshots(self):
+        if not self.directory:
+            return [self.snapshot()]
+        self.flush()
+        snapshots = {name: _read_snapshot(self.directory, name) for name in _snapshot_files(self.directory)}
+        # Read last: a file it has absorbed is counted there, even if it was read before being removed
+        retired = _read_snapshot(self.directory, RETIRED_FILE)
+        if retired:
+            for name in retired['files']:
+                snapshots.pop(name, None)
+            snapshots[RETIRED_FILE] = retired
+        return [data for data in snapshots.values() if data]
+
+    def _pool_gauges(self):
+        samples = []
+        for engine in list(self._engines):
+            pool = engine.pool
+            labels = (('database', engine.url.get_backend_name()),)
+            if hasattr(pool, 'checkedout'):
+                samples.append(('vulweb_db_pool_checked_out', labels, pool.checkedout()))
+            if hasattr(pool, 'size'):
+                samples.append(('vulweb_db_pool_size', labels, pool.size()))
+        return samples
+
+    def collect(self):
+        """
+        Merge all processes: counters and histograms of every process ever
+        flushed are summed so totals never go backwards when a worker is
+        recycled, while gauges only count processes that are still alive
+        """
+        counters = {}
+        histograms = {}
+        gauges = {}
+        for data in self._snapshots():
+            _merge(counters, histograms, data)
+            if data['pid'] is not None and (data['pid'] == os.getpid() or _alive(data['pid'])):
+                for name, labels, value in data['gauges']:
+                    key = (name, tuple(map(tuple, labels)))
+                    gauges[key] = gauges.get(key, 0) + value
+
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                gauges[(name, tuple(labels))] = value
+        return counters, histograms, gauges
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        counters, histograms, gauges = self.collect()
+        lines = []
+        families = {}
+        for (name, labels), value in list(counters.items()) + list(gauges.items()):
+            families.setdefault(name, []).append(f'{name}{_labels(labels)} {_number(value)}')
+        for (name, labels), h in histograms.items():
+            samples = families.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(h['buckets'], h['counts']):
+                cumulative += count
+                samples.append(f'{name}_bucket{_labels(labels + (("le", _number(bound)),))} {cumulative}')
+            samples.append(f'{name}_bucket{_labels(labels + (("le", "+Inf"),))} {h["count"]}')
+            samples.append(f'{name}_sum{_labels(labels)} {_number(h["sum"])}')
+            samples.append(f'{name}_count{_labels(labels)} {h["count"]}')
+
+        for name in sorted(families):
+            kind, description = HELP.get(name, ('untyped', name))
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(sorted(families[name]))
+        return '\n'.join(lines) + '\n'
+
+
+def _snapshot_files(directory):
+    """The per-process files in METRICS_DIR"""
+    return sorted(name for name in os.listdir(directory)
+                  if name.startswith('metrics_') and name.endswith('.json') and name != RETIRED_FILE)
+
+
+def _read_snapshot(directory, name):
+    try:
+        with open(os.path.join(directory, name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _merge(counters, histograms, data):
+    """Add a snapshot's counters and histograms to totals keyed by (name, labels)"""
+    for name, labels, value in data['counters']:
+        key = (name, tuple(map(tuple, labels)))
+        counters[key] = counters.get(key, 0) + value
+    for name, labels, h in data['histograms']:
+        key = (name, tuple(map(tuple, labels)))
+        merged = histograms.setdefault(key, {'buckets': h['buckets'], 'counts': [0] * len(h['counts']),
+                                             'sum': 0.0, 'count': 0})
+        merged['counts'] = [a + b for a, b in zip(merged['counts'], h['counts'])]
+        merged['sum'] += h['sum']
+        merged['count'] += h['count']
+
+
+def retire_processes(directory, pids=None):
+    """
+    Fold the totals of exited processes into RETIRED_FILE and remove their
+    files, so METRICS_DIR does not grow with every recycled worker while
+    counters still never go backwards. pids names the exited processes; by
+    default every process that is no longer alive. Only one process may run
+    this at a time, so it is called from gunicorn's master (gunicorn.conf.py).
+    """
+    if not directory or not os.path.isdir(directory):
+        return 0
+    names = _snapshot_files(directory)
+    retired = _read_snapshot(directory, RETIRED_FILE) or {'counters': [], 'histograms': [], 'files': []}
+    counters, histograms = {}, {}
+    _merge(counters, histograms, retired)
+
+    # Files absorbed earlier but not removed yet stay marked until they are gone
+    absorbed = [name for name in retired['files'] if name in names]
+    exited = []
+    for name in names:
+        if name in absorbed:
+            continue
+        try:
+            pid = int(name.split('_')[1])
+        except (IndexError, ValueError):
+            continue
+        if (pid not in pids) if pids is not None else _alive(pid):
+            continue
+        data = _read_snapshot(directory, name)
+        if data:
+            _merge(counters, histograms, data)
+        exited.append(name)
+    if not exited:
+        return 0
+    absorbed += exited
+
+    data = {
+        'pid': None,
+        'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+        'histograms': [[name, list(labels), h] for (name, labels), h in histograms.items()],
+        'gauges': [],
+        'files': absorbed
+    }
+    # Written before the files are removed; scrapes skip the files it lists
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp_path, os.path.join(directory, RETIRED_FILE))
+    for name in absorbed:
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+    return len(exited)
+
+
+def collect_queue_depths():
+    """Training and evaluation backlogs, read from the database at scrape time"""
+    from ..models import db, TrainingTask, ModelEvaluation
+    samples = []
+    for model, name in ((TrainingTask, 'vulweb_training_tasks'), (ModelEvaluation, 'vulweb_evaluations')):
+        counts = dict(db.session.query(model.status, db.func.count(model.id)).group_by(model.status).all())
+        for status, count in counts.items():
+            samples.append((name, (('status', status or 'unknown'),), count))
+    return samples
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+_query_watchers = []
+
+
+def watch_queries(callback):
+    """
+    Call callback(conn, statement, parameters, executemany, duration) after
+    every SQL statement; one pair of engine listeners times the statements
+    for all watchers
+    """
+    if callback not in _query_watchers:
+        _query_watchers.append(callback)
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_start')
+    if not starts:
+        return
+    duration = time.perf_counter() - starts.pop()
+    for callback in _query_watchers:
+        callback(conn, statement, parameters, executemany, duration)
+
+
+def _handle_error(context):
+    # A failed statement never reaches after_cursor_execute; drop its start time
+    starts = context.connection.info.get('query_start') if context.connection is not None else None
+    if starts and context.execution_context is not None:
+        starts.pop()
+
+
+def _count_query(conn, statement, parameters, executemany, duration):
+    if has_request_context() and 'metrics_start' in g:
+        g.metrics_queries += 1
+        g.metrics_query_time += duration
+
+
+metrics = MetricsRegistry()
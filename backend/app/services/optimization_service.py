@@ -0,0 +1,347 @@
+"""
+Model optimization for CPU serving: convert a registered model to a faster
+form, register the result as a derivative Model linked to its parent, and
+benchmark both on a sample of a dataset.
+
+Methods
+    onnx                  ONNX export, then ONNX Runtime's offline graph
+                          optimizations (constant folding, redundant node
+                          elimination, operator fusion)
+    onnx_int8             ONNX export with int8 dynamic quantization of the
+                          weights
+    dynamic_quantization  PyTorch dynamic int8 quantization of Linear and
+                          recurrent layers
+    torchscript           Traced, frozen and fused TorchScript
+
+The conversions need torch and, for the ONNX methods, onnx and onnxruntime;
+these are optional and a method whose runtime is not installed is reported
+as unavailable. Conversions load the uploaded file as TorchScript or, only
+where OPTIMIZATION_ALLOW_PICKLE trusts uploads, as a pickled full module: a
+file holding only a state dict cannot be converted.
+
+Each model is benchmarked in the runtime that serves its file: the original
+as a torch module, the derivative in ONNX Runtime or torch (RUNTIMES). Both
+are fed the same inputs, the sampled records' code as UTF-8 byte ids
+zero-padded or cut to input_shape, and an output is read as a vulnerability
+score: the sigmoid of a single logit, else the softmax probability of class
+1. Models trained with another tokenizer get inputs of the right shape but
+not of their vocabulary; their latencies and the difference between the
+two models still hold, their absolute accuracy does not.
+"""
+
+import os
+import time
+import importlib.util
+from datetime import datetime
+from itertools import islice
+from flask import current_app
+from ..models import db, Model, ModelOptimization
+from .dataset_service import iter_records, record_label
+from .evaluation_service import compute_metrics
+from .file_cleaner import file_cleaner
+from ..utils.lazy_import import lazy_import
+
+np = lazy_import('numpy')
+
+DEFAULT_SAMPLES = 1000  # Records of the dataset benchmarked
+DEFAULT_BATCH_SIZE = 32
+INPUT_DTYPES = ('int64', 'int32', 'float32')
+OPTION_KEYS = ('input_shape', 'input_dtype', 'opset')
+QUANTIZED_LAYERS = ('Linear', 'LSTM', 'GRU')
+
+
+def _load_module(path):
+    """
+    The module saved at path, as TorchScript or, if OPTIMIZATION_ALLOW_PICKLE
+    is set, a pickled nn.Module, in eval mode
+    """
+    torch = lazy_import('torch')
+    try:
+        return torch.jit.load(path, map_location='cpu').eval()
+    except RuntimeError:
+        pass  # Not TorchScript
+    if not current_app.config['OPTIMIZATION_ALLOW_PICKLE']:
+        # Unpickling runs whatever code the file holds, and uploads are not authenticated
+        raise ValueError('Model file is not TorchScript; pickled modules are only loaded '
+                         'with OPTIMIZATION_ALLOW_PICKLE set, for trusted uploads')
+    module = torch.load(path, map_location='cpu', weights_only=False)
+    if not isinstance(module, torch.nn.Module):
+        raise ValueError('Model file holds weights only; optimizing needs a saved module or TorchScript')
+    return module.eval()
+
+
+def load_torch(path, options):
+    """Run a batch of inputs through the module saved at path"""
+    torch = lazy_import('torch')
+    module = _load_module(path)
+    dtype = getattr(torch, options.get('input_dtype', 'int64'))
+
+    def run(batch):
+        with torch.inference_mode():
+            output = module(torch.from_numpy(batch).to(dtype))
+        if isinstance(output, (tuple, list)):
+            output = output[0]
+        return output.float().numpy()
+    return run
+
+
+def load_onnx(path, options):
+    """Run a batch of inputs through an ONNX Runtime session of the model at path"""
+    ort = lazy_import('onnxruntime')
+    session = ort.InferenceSession(path, providers=['CPUExecutionProvider'])
+    name = session.get_inputs()[0].name
+
+    def run(batch):
+        return session.run(None, {name: batch})[0]
+    return run
+
+
+# Loaders of the runtime a file is served by: function(path, options) returning
+# a function from a batch of inputs to the model's outputs
+RUNTIMES = {'torch': load_torch, 'onnxruntime': load_onnx}
+
+
+def _example_input(options):
+    """An input of the shape and type the model is called with, token ids by default"""
+    torch = lazy_import('torch')
+    shape = options.get('input_shape', [1, 512])
+    dtype = getattr(torch, options.get('input_dtype', 'int64'))
+    if dtype.is_floating_point:
+        return torch.randn(shape, dtype=dtype)
+    return torch.zeros(shape, dtype=dtype)
+
+
+def _export_onnx(source, target, options):
+    torch = lazy_import('torch')
+    example = _example_input(options)
+    # Batch size and sequence length vary at serving time
+    axes = {0: 'batch', 1: 'sequence'} if example.dim() > 1 else {0: 'batch'}
+    torch.onnx.export(_load_module(source), (example,), target,
+                      input_names=['input'], output_names=['output'],
+                      dynamic_axes={'input': axes, 'output': {0: 'batch'}},
+                      opset_version=options.get('opset', 17))
+
+
+def optimize_onnx(source, target, options):
+    ort = lazy_import('onnxruntime')
+    exported = f'{target}.export'
+    try:
+        _export_onnx(source, exported, options)
+        session_options = ort.SessionOptions()
+        # Extended rather than all: layout optimizations are specific to the machine running them
+        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+        session_options.optimized_model_filepath = target
+        ort.InferenceSession(exported, session_options, providers=['CPUExecutionProvider'])
+    finally:
+        if os.path.exists(exported):
+            os.remove(exported)
+
+
+def quantize_onnx(source, target, options):
+    quantization = lazy_import('onnxruntime.quantization')
+    exported = f'{target}.export'
+    try:
+        _export_onnx(source, exported, options)
+        quantization.quantize_dynamic(exported, target, weight_type=quantization.QuantType.QInt8)
+    finally:
+        if os.path.exists(exported):
+            os.remove(exported)
+
+
+def quantize_torch(source, target, options):
+    torch = lazy_import('torch')
+    module = _load_module(source)
+    if isinstance(module, torch.jit.ScriptModule):
+        raise ValueError('Dynamic quantization needs a saved module, not TorchScript')
+    layers = {getattr(torch.nn, name) for name in QUANTIZED_LAYERS}
+    torch.save(torch.ao.quantization.quantize_dynamic(module, layers, dtype=torch.qint8), target)
+
+
+def fuse_torchscript(source, target, options):
+    torch = lazy_import('torch')
+    module = _load_module(source)
+    with torch.no_grad():
+        if not isinstance(module, torch.jit.ScriptModule):
+            module = torch.jit.trace(module, (_example_input(options),))
+        torch.jit.save(torch.jit.optimize_for_inference(torch.jit.freeze(module)), target)
+
+
+# method: the modules it needs, the extension of the file it writes, the
+# function(source, target, options) that writes it and the runtime serving it
+OPTIMIZERS = {
+    'onnx': {'requires': ('torch', 'onnx', 'onnxruntime'), 'extension': '.onnx', 'run': optimize_onnx,
+             'runtime': 'onnxruntime'},
+    'onnx_int8': {'requires': ('torch', 'onnx', 'onnxruntime'), 'extension': '.onnx', 'run': quantize_onnx,
+                  'runtime': 'onnxruntime'},
+    'dynamic_quantization': {'requires': ('torch',), 'extension': '.pt', 'run': quantize_torch,
+                             'runtime': 'torch'},
+    'torchscript': {'requires': ('torch',), 'extension': '.pt', 'run': fuse_torchscript, 'runtime': 'torch'},
+}
+
+
+def missing_requirements(method):
+    return [name for name in OPTIMIZERS[method]['requires'] if importlib.util.find_spec(name) is None]
+
+
+def available_methods():
+    return [{'method': method, 'requires': list(optimizer['requires']),
+             'missing': missing_requirements(method), 'available': not missing_requirements(method)}
+            for method, optimizer in OPTIMIZERS.items()]
+
+
+def validate_optimization(method, options):
+    """Raise ValueError unless method can run here with these options"""
+    if method not in OPTIMIZERS:
+        raise ValueError(f"Method must be one of {', '.join(OPTIMIZERS)}")
+    missing = missing_requirements(method)
+    if missing:
+        raise ValueError(f"{method} needs {', '.join(missing)}, which is not installed")
+    if not isinstance(options, dict):
+        raise ValueError('Options must be an object')
+    unknown = set(options) - set(OPTION_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown options: {', '.join(sorted(unknown))}")
+    shape = options.get('input_shape', [1])
+    if (not isinstance(shape, list) or not shape
+            or any(not isinstance(size, int) or isinstance(size, bool) or size < 1 for size in shape)):
+        raise ValueError('input_shape must be a list of positive integers')
+    if options.get('input_dtype', 'int64') not in INPUT_DTYPES:
+        raise ValueError(f"input_dtype must be one of {', '.join(INPUT_DTYPES)}")
+    if not isinstance(options.get('opset', 17), int):
+        raise ValueError('opset must be an integer')
+
+
+def sample_records(dataset, num_samples):
+    """(codes, labels) of the first num_samples records of a dataset"""
+    if not dataset.file_path or not os.path.exists(dataset.file_path):
+        raise ValueError('Dataset file is missing')
+    codes, labels = [], []
+    for record in islice(iter_records(dataset.file_path, dataset.format), num_samples):
+        codes.append(record.get('code') or '')
+        labels.append(record_label(record))
+    if not codes:
+        raise ValueError('Dataset has no samples')
+    return codes, labels
+
+
+def encode_inputs(codes, options):
+    """Codes as one model input each: UTF-8 byte ids, zero-padded or cut to input_shape"""
+    shape = options.get('input_shape', [1, 512])[1:]
+    length = int(np.prod(shape)) if shape else 1
+    inputs = np.zeros((len(codes), length), dtype=options.get('input_dtype', 'int64'))
+    for row, code in enumerate(codes):
+        data = np.frombuffer(code.encode('utf-8')[:length], dtype=np.uint8)
+        inputs[row, :data.size] = data
+    return inputs.reshape([len(codes)] + list(shape))
+
+
+def output_scores(outputs):
+    """Vulnerability scores of a batch of outputs: sigmoid of one logit, else softmax of class 1"""
+    outputs = np.asarray(outputs, dtype=np.float64).reshape(len(outputs), -1)
+    if outputs.shape[1] == 1:
+        return 1 / (1 + np.exp(-outputs[:, 0]))
+    exp = np.exp(outputs - outputs.max(axis=1, keepdims=True))
+    return exp[:, 1] / exp.sum(axis=1)
+
+
+def benchmark(run, inputs, labels, batch_size, path):
+    """
+    Latency of a batch, throughput and accuracy of a loaded model over the
+    inputs, after one warm-up batch; returns (numbers, scores)
+    """
+    batches = [inputs[start:start + batch_size] for start in range(0, len(inputs), batch_size)]
+    run(batches[0])
+
+    outputs, latencies = [], []
+    for batch in batches:
+        started = time.perf_counter()
+        outputs.append(np.asarray(run(batch)))
+        latencies.append(time.perf_counter() - started)
+
+    scores = output_scores(np.concatenate(outputs)).astype(np.float32)
+    no_types = np.full(len(scores), -1, dtype=np.int32)
+    metrics = compute_metrics(scores, np.asarray(labels, dtype=np.int8), no_types, no_types, [])
+
+    latencies = np.asarray(latencies) * 1000
+    return {
+        'latency_p50_ms': float(np.percentile(latencies, 50)),
+        'latency_p95_ms': float(np.percentile(latencies, 95)),
+        'throughput': len(inputs) / float(latencies.sum() / 1000) if latencies.sum() else None,
+        'accuracy': metrics['accuracy'],
+        'precision': metrics['precision'],
+        'recall': metrics['recall'],
+        'f1_score': metrics['f1_score'],
+        'size': os.path.getsize(path)
+    }, scores
+
+
+def run_optimization(optimization_id, name=None):
+    """
+    Convert the optimization's model, register the result as a derivative
+    named name and benchmark both on the dataset, storing the numbers
+    """
+    optimization = db.session.get(ModelOptimization, optimization_id)
+    if not optimization:
+        raise Exception("Optimization not found")
+
+    optimization.status = 'running'
+    optimization.start_time = datetime.utcnow()
+    db.session.commit()
+
+    model = optimization.model
+    method = optimization.method
+    options = optimization.options or {}
+    output_path = None
+    try:
+        if not model.file_path or not os.path.exists(model.file_path):
+            raise ValueError('Model file is missing')
+        codes, labels = sample_records(optimization.dataset, optimization.num_samples)
+
+        folder = os.path.join(current_app.config['UPLOAD_FOLDER'], 'models', 'optimized')
+        os.makedirs(folder, exist_ok=True)
+        output_path = os.path.join(
+            folder, f'model_{model.id}_{optimization.id}_{method}{OPTIMIZERS[method]["extension"]}')
+        OPTIMIZERS[method]['run'](model.file_path, output_path, options)
+
+        derivative = Model(
+            name=name or f'{model.name} ({method} #{optimization.id})',
+            description=f'{method} optimization of model {model.id}',
+            version=model.version,
+            model_type=model.model_type,
+            file_path=output_path,
+            parent_id=model.id,
+            optimization=method
+        )
+        db.session.add(derivative)
+        db.session.flush()
+
+        inputs = encode_inputs(codes, options)
+        baseline, baseline_scores = benchmark(RUNTIMES['torch'](model.file_path, options), inputs, labels,
+                                              optimization.batch_size, model.file_path)
+        runtime = RUNTIMES[OPTIMIZERS[method]['runtime']]
+        optimized, optimized_scores = benchmark(runtime(output_path, options), inputs, labels,
+                                                optimization.batch_size, output_path)
+        # Share of records the derivative labels as the original does
+        optimized['agreement'] = float(np.mean((baseline_scores >= 0.5) == (optimized_scores >= 0.5)))
+        for metric in ('accuracy', 'precision', 'recall', 'f1_score'):
+            setattr(derivative, metric, optimized[metric])
+
+        optimization.output_model_id = derivative.id
+        optimization.num_samples = len(codes)
+        optimization.baseline = baseline
+        optimization.optimized = optimized
+        optimization.speedup = (baseline['latency_p50_ms'] / optimized['latency_p50_ms']
+                                if optimized['latency_p50_ms'] else None)
+        optimization.accuracy_delta = optimized['accuracy'] - baseline['accuracy']
+        optimization.f1_delta = optimized['f1_score'] - baseline['f1_score']
+        optimization.status = 'completed'
+    except Exception as e:
+        db.session.rollback()
+        optimization.status = 'failed'
+        optimization.error_message = str(e)
+        if output_path:
+            file_cleaner.delete([output_path], reason='optimization_failed')
+
+    optimization.end_time = datetime.utcnow()
+    db.session.commit()
+    return optimization
@@ -0,0 +1,209 @@
+import os
+import json
+import hashlib
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+DISK_COUNT_TTL = 30  # Seconds stats() reuses the disk tier's entry count
+
+
+def normalize_code(code):
+    """Normalize source code so formatting-only changes share a cache entry"""
+    lines = code.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    return '\n'.join(line.rstrip() for line in lines if line.strip())
+
+
+def hash_code(code):
+    """Hash normalized source code"""
+    return hashlib.sha256(normalize_code(code).encode('utf-8')).hexdigest()
+
+
+_file_hashes = {}
+_file_hashes_lock = threading.Lock()
+
+
+def hash_file(file_path):
+    """
+    Hash a file's content, memoized on (path, size, mtime) so a model file
+    is only re-read when it actually changes on disk
+    """
+    if not file_path or not os.path.exists(file_path):
+        return 'none'
+
+    stat = os.stat(file_path)
+    signature = (stat.st_size, stat.st_mtime_ns)
+
+    with _file_hashes_lock:
+        cached = _file_hashes.get(file_path)
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    file_hash = digest.hexdigest()
+
+    with _file_hashes_lock:
+        _file_hashes[file_path] = (signature, file_hash)
+    return file_hash
+
+
+class PredictionCache:
+    """
+    Two-tier prediction cache keyed by (code hash, model id, model file hash)
+
+    The memory tier is an LRU dict; the disk tier is a SQLite table shared by
+    every worker process pointing at the same PREDICTION_CACHE_PATH.
+    """
+
+    def __init__(self, app=None):
+        self.max_entries = 10000
+        self.path = None
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._model_hashes = {}
+        self._disk_count = None  # (count, monotonic time it was taken)
+        self._stats = {'hits': 0, 'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_entries = app.config.get('PREDICTION_CACHE_SIZE', 10000)
+        self.path = app.config.get('PREDICTION_CACHE_PATH')
+        self._close()
+        self.clear_memory()
+        app.extensions['prediction_cache'] = self
+
+    def _connection(self):
+        if not self.path:
+            return None
+        if self._conn is None:
+            if self.path != ':memory:':
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS predictions ('
+                'code_hash TEXT NOT NULL, model_id INTEGER NOT NULL, '
+                'model_hash TEXT NOT NULL, result TEXT NOT NULL, '
+                'PRIMARY KEY (code_hash, model_id, model_hash))'
+            )
+            self._conn.commit()
+        return self._conn
+
+    def after_fork(self):
+        """Forget a connection inherited from the parent process without closing it"""
+        self._conn = None
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def get_many(self, keys):
+        """Look up many keys, returning {key: result} for the hits only"""
+        found = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+                    self._stats['memory_hits'] += 1
+                else:
+                    missing.append(key)
+
+            conn = self._connection()
+            if conn is not None:
+                for key in missing:
+                    row = conn.execute(
+                        'SELECT result FROM predictions '
+                        'WHERE code_hash = ? AND model_id = ? AND model_hash = ?',
+                        key
+                    ).fetchone()
+                    if row:
+                        result = json.loads(row[0])
+                        found[key] = result
+                        self._remember(key, result)
+                        self._stats['disk_hits'] += 1
+
+            self._stats['hits'] += len(found)
+            self._stats['misses'] += len(keys) - len(found)
+        return found
+
+    def set_many(self, items):
+        """Store {key: result} in both tiers"""
+        with self._lock:
+            for key, result in items.items():
+                self._remember(key, result)
+
+            conn = self._connection()
+            if conn is not None and items:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO predictions '
+                    '(code_hash, model_id, model_hash, result) VALUES (?, ?, ?, ?)',
+                    [key + (json.dumps(result),) for key, result in items.items()]
+                )
+                conn.commit()
+
+    def _remember(self, key, result):
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def track_model_hash(self, model_id, model_hash):
+        """Invalidate a model's entries the first time its file hash changes"""
+        with self._lock:
+            previous = self._model_hashes.get(model_id)
+            self._model_hashes[model_id] = model_hash
+        if previous is not None and previous != model_hash:
+            self.invalidate_model(model_id, keep_hash=model_hash)
+
+    def invalidate_model(self, model_id, keep_hash=None):
+        """Drop entries for a model, optionally keeping those of its current file"""
+        with self._lock:
+            for key in [k for k in self._memory if k[1] == model_id and k[2] != keep_hash]:
+                del self._memory[key]
+
+            conn = self._connection()
+            if conn is not None:
+                conn.execute(
+                    'DELETE FROM predictions WHERE model_id = ? AND model_hash != ?',
+                    (model_id, keep_hash or '')
+                )
+                conn.commit()
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
+            self._model_hashes.clear()
+            self._disk_count = None
+            for name in self._stats:
+                self._stats[name] = 0
+
+    def stats(self):
+        """Return hit-rate statistics for this process"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+            stats['disk_entries'] = self._count_disk()
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def _count_disk(self):
+        # Counting scans the table, which other processes share; reuse the count for a while
+        now = time.monotonic()
+        if self._disk_count is None or now - self._disk_count[1] >= DISK_COUNT_TTL:
+            conn = self._connection()
+            count = conn.execute('SELECT COUNT(*) FROM predictions').fetchone()[0] if conn is not None else 0
+            self._disk_count = (count, now)
+        return self._disk_count[0]
+
+
+prediction_cache = PredictionCache()
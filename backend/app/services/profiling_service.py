@@ -0,0 +1,253 @@
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import pstats
+import cProfile
+import threading
+from collections import deque, Counter
+from datetime import datetime
+from flask import g, request, current_app, has_request_context
+from .metrics_service import watch_queries
+
+PROFILE_MODES = ('sample', 'cprofile')
+
+
+class StackSampler:
+    """
+    Sample one thread's Python stack at a fixed interval from a background
+    thread and count identical stacks, root first, in the folded format read
+    by flamegraph.pl and speedscope
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def folded(self):
+        return '\n'.join(f'{stack} {count}' for stack, count in self.stacks.most_common())
+
+
+class RequestProfiler:
+    """
+    Opt-in request profiling and slow-query log
+
+    A request is profiled when it carries an X-Profile header (value
+    'sample' or 'cprofile', with PROFILING_TOKEN in X-Profile-Token) or
+    falls in the PROFILING_SAMPLE_RATE fraction of requests. Its profile and
+    SQL statements are written to PROFILING_FOLDER, keeping only the
+    PROFILING_KEEP slowest. When profiling is off, the only per-request cost
+    is one config check.
+    """
+
+    def __init__(self, app=None):
+        self.slow_queries = deque(maxlen=200)
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.slow_queries = deque(maxlen=app.config.get('SLOW_QUERY_LOG_SIZE', 200))
+        app.extensions['request_profiler'] = self
+
+        if app.config.get('PROFILING_ENABLED'):
+            app.before_request(self._before_request)
+            app.teardown_request(self._teardown_request)
+        watch_queries(_record_query)
+
+    def _profile_mode(self):
+        config = current_app.config
+        mode = request.headers.get('X-Profile')
+        if mode:
+            token = config.get('PROFILING_TOKEN')
+            if not token or request.headers.get('X-Profile-Token') != token:
+                return None
+            return mode if mode in PROFILE_MODES else 'sample'
+        rate = config.get('PROFILING_SAMPLE_RATE', 0)
+        if rate and random.random() < rate:
+            return 'sample'
+        return None
+
+    def _before_request(self):
+        mode = self._profile_mode()
+        if mode is None:
+            return
+        if mode == 'cprofile':
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Newer Pythons allow one active cProfile per process
+                mode = 'sample'
+        if mode == 'sample':
+            profiler = StackSampler(threading.get_ident(), current_app.config['PROFILING_INTERVAL']).start()
+        g.profile = {'mode': mode, 'profiler': profiler, 'queries': [], 'start': time.perf_counter()}
+
+    def _teardown_request(self, exc):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+        duration = time.perf_counter() - profile['start']
+        profiler = profile['profiler']
+
+        record = {
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'endpoint': request.url_rule.rule if request.url_rule else None,
+            'mode': profile['mode'],
+            'duration_ms': round(duration * 1000, 3),
+            'timestamp': datetime.utcnow().isoformat(),
+            'error': repr(exc) if exc else None,
+            'queries': profile['queries'],
+            'sql_ms': round(sum(query['duration_ms'] for query in profile['queries']), 3)
+        }
+        if profile['mode'] == 'cprofile':
+            profiler.disable()
+            stats = io.StringIO()
+            pstats.Stats(profiler, stream=stats).sort_stats('cumulative').print_stats(40)
+            record['stats'] = stats.getvalue()
+            record['folded'] = cprofile_folded(profiler)
+        else:
+            profiler.stop()
+            record['folded'] = profiler.folded()
+        self.save(record)
+
+    def save(self, record):
+        """Persist a profile, keeping only the PROFILING_KEEP slowest"""
+        folder = current_app.config['PROFILING_FOLDER']
+        os.makedirs(folder, exist_ok=True)
+        # Zero-padded duration first, so file names sort by duration
+        record['id'] = f'{int(record["duration_ms"] * 1000):012d}-{uuid.uuid4().hex[:8]}'
+        with open(os.path.join(folder, f'{record["id"]}.json'), 'w') as f:
+            json.dump(record, f)
+
+        with self._lock:
+            profiles = sorted(name for name in os.listdir(folder) if name.endswith('.json'))
+            for name in profiles[:-current_app.config['PROFILING_KEEP']]:
+                try:
+                    os.remove(os.path.join(folder, name))
+                except OSError:
+                    pass
+
+    def list_profiles(self):
+        """Profile summaries, slowest first"""
+        folder = current_app.config['PROFILING_FOLDER']
+        if not os.path.isdir(folder):
+            return []
+        summaries = []
+        for name in sorted(os.listdir(folder), reverse=True):
+            record = self.load_profile(name[:-len('.json')]) if name.endswith('.json') else None
+            if record:
+                summary = {key: record.get(key) for key in
+                           ('id', 'method', 'path', 'mode', 'duration_ms', 'sql_ms', 'timestamp')}
+                summary['num_queries'] = len(record.get('queries', []))
+                summaries.append(summary)
+        return summaries
+
+    def load_profile(self, profile_id):
+        if not profile_id or '/' in profile_id or profile_id.startswith('.'):
+            return None
+        try:
+            with open(os.path.join(current_app.config['PROFILING_FOLDER'], f'{profile_id}.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def log_slow_query(self, entry):
+        self.slow_queries.append(entry)
+        current_app.logger.warning(f"Slow query ({entry['duration_ms']:.1f} ms): {entry['statement'][:200]}")
+
+
+def cprofile_folded(profiler):
+    """
+    Approximate folded stacks from cProfile's caller/callee edges, following
+    the heaviest caller of each function; flamegraph tools read this format
+    """
+    stats = pstats.Stats(profiler).stats
+    folded = []
+
+    def label(func):
+        filename, line, name = func
+        return f'{os.path.basename(filename)}:{name}:{line}'
+
+    for func, (_, _, total_time, _, callers) in stats.items():
+        if total_time <= 0:
+            continue
+        stack = [label(func)]
+        seen = {func}
+        current = callers
+        while current:
+            caller = max(current, key=lambda c: current[c][3] if isinstance(current[c], tuple) else 0)
+            if caller in seen or caller not in stats:
+                break
+            seen.add(caller)
+            stack.append(label(caller))
+            current = stats[caller][4]
+        folded.append(f'{";".join(reversed(stack))} {int(total_time * 1e6)}')
+    return '\n'.join(folded)
+
+
+def explain(cursor_connection, dialect, statement, parameters):
+    """Query plan of a SELECT statement, read on a raw DBAPI cursor so no events fire"""
+    if not statement.lstrip().upper().startswith('SELECT'):
+        return None
+    prefix = 'EXPLAIN QUERY PLAN ' if dialect == 'sqlite' else 'EXPLAIN '
+    try:
+        cursor = cursor_connection.cursor()
+        try:
+            cursor.execute(prefix + statement, parameters)
+            return [' '.join(str(value) for value in row) for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+    except Exception as e:
+        return [f'EXPLAIN failed: {e}']
+
+
+def _record_query(conn, statement, parameters, executemany, duration):
+    duration_ms = duration * 1000
+    if not has_request_context():
+        return
+
+    profile = g.get('profile')
+    if profile is not None:
+        profile['queries'].append({'statement': statement, 'duration_ms': round(duration_ms, 3)})
+
+    threshold = current_app.config.get('SLOW_QUERY_THRESHOLD_MS')
+    if threshold and duration_ms >= threshold:
+        request_profiler.log_slow_query({
+            'statement': statement,
+            'parameters': repr(parameters)[:500],
+            'duration_ms': round(duration_ms, 3),
+            'endpoint': request.url_rule.rule if request.url_rule else None,
+            'timestamp': datetime.utcnow().isoformat(),
+            'plan': None if executemany else explain(conn.connection.dbapi_connection, conn.dialect.name,
+                                                     statement, parameters)
+        })
+
+
+request_profiler = RequestProfiler()
@@ -0,0 +1,254 @@
+import os
+import re
+import glob
+import math
+import time
+import pickle
+import threading
+from collections import Counter, defaultdict
+from sqlalchemy import func
+from ..models import db, Model, Dataset, TrainingTask
+
+# Markdown files indexed for the chat assistant, relative to DOCS_FOLDER
+DOC_PATTERNS = ['*.md', 'docs/*.md', 'datasets/*.md', 'models/*.md']
+
+# Bump when the index layout changes so stale caches are rebuilt
+INDEX_VERSION = 1
+
+MAX_CHUNK_CHARS = 1500
+
+STATUS_KEYWORDS = ['状态', '多少', '几个', '数量', '统计', '进度', 'status', 'how many', 'progress']
+
+_WORD_RE = re.compile(r'[a-z0-9_]+|[一-鿿]+')
+_HEADING_RE = re.compile(r'^#{1,4}\s+(.*)$', re.MULTILINE)
+
+
+def tokenize(text):
+    """Split text into latin words and CJK character bigrams"""
+    tokens = []
+    for run in _WORD_RE.findall(text.lower()):
+        if run[0] >= '一':
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def split_markdown(text):
+    """Split a markdown document into (heading, body) chunks"""
+    chunks = []
+    matches = list(_HEADING_RE.finditer(text))
+    starts = [0] + [m.start() for m in matches] + [len(text)]
+    for start, end in zip(starts, starts[1:]):
+        section = text[start:end].strip()
+        if not section:
+            continue
+        heading_match = _HEADING_RE.match(section)
+        heading = heading_match.group(1).strip() if heading_match else ''
+        for offset in range(0, len(section), MAX_CHUNK_CHARS):
+            chunks.append((heading, section[offset:offset + MAX_CHUNK_CHARS]))
+    return chunks
+
+
+class BM25Index:
+    """Inverted index over document chunks scored with Okapi BM25"""
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.chunks = []  # (source, heading, text)
+        self.postings = {}  # term -> [(chunk id, term frequency)]
+        self.lengths = []
+        self.idf = {}
+        self.signature = None
+
+    @classmethod
+    def build(cls, files, signature=None):
+        index = cls()
+        postings = defaultdict(list)
+        for path, source in files:
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                text = f.read()
+            for heading, chunk in split_markdown(text):
+                chunk_id = len(index.chunks)
+                index.chunks.append((source, heading, chunk))
+                counts = Counter(tokenize(chunk))
+                index.lengths.append(sum(counts.values()))
+                for term, tf in counts.items():
+                    postings[term].append((chunk_id, tf))
+
+        total = len(index.chunks)
+        index.postings = dict(postings)
+        index.idf = {
+            term: math.log(1 + (total - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in postings.items()
+        }
+        index.average_length = sum(index.lengths) / total if total else 0
+        index.signature = signature
+        return index
+
+    def search(self, query, top_k=3):
+        """Return the top_k (score, chunk) matches for a query"""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for chunk_id, tf in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[chunk_id] / self.average_length)
+                scores[chunk_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [
+            {'source': self.chunks[i][0], 'heading': self.chunks[i][1],
+             'text': self.chunks[i][2], 'score': round(score, 4)}
+            for i, score in best
+        ]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def _doc_files(docs_folder):
+    files = []
+    for pattern in DOC_PATTERNS:
+        for path in sorted(glob.glob(os.path.join(docs_folder, pattern))):
+            files.append((path, os.path.relpath(path, docs_folder)))
+    return files
+
+
+def _signature(files):
+    signature = [INDEX_VERSION]
+    for path, source in files:
+        stat = os.stat(path)
+        signature.append((source, stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+def get_index(config):
+    """
+    Return the documentation index, loading it from the on-disk cache when
+    the docs are unchanged and rebuilding it otherwise
+    """
+    global _index
+    files = _doc_files(config['DOCS_FOLDER'])
+    signature = _signature(files)
+    if _index is not None and _index.signature == signature:
+        return _index
+
+    with _index_lock:
+        if _index is not None and _index.signature == signature:
+            return _index
+
+        cache_path = config.get('RETRIEVAL_INDEX_PATH')
+        index = None
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'rb') as f:
+                    index = pickle.load(f)
+            except Exception:
+                index = None
+            if getattr(index, 'signature', None) != signature:
+                index = None
+
+        if index is None:
+            index = BM25Index.build(files, signature)
+            if cache_path:
+                os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+                temp_path = f'{cache_path}.{os.getpid()}.tmp'
+                with open(temp_path, 'wb') as f:
+                    pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(temp_path, cache_path)
+
+        _index = index
+        return index
+
+
+_status_cache = {'expires': 0, 'value': None}
+_status_lock = threading.Lock()
+
+
+def get_system_status(ttl=5):
+    """Aggregate model, dataset and task counts, cached for ttl seconds"""
+    now = time.monotonic()
+    if _status_cache['value'] is not None and now < _status_cache['expires']:
+        return _status_cache['value']
+
+    with _status_lock:
+        if _status_cache['value'] is not None and now < _status_cache['expires']:
+            return _status_cache['value']
+
+        num_datasets, num_samples, num_vulnerable = db.session.query(
+            func.count(Dataset.id), func.sum(Dataset.num_samples), func.sum(Dataset.num_vulnerable)
+        ).one()
+        task_counts = dict(db.session.query(TrainingTask.status, func.count(TrainingTask.id))
+                           .group_by(TrainingTask.status).all())
+        running = (TrainingTask.query.filter_by(status='running')
+                   .order_by(TrainingTask.start_time.desc()).limit(5).all())
+
+        status = {
+            'num_models': db.session.query(func.count(Model.id)).scalar(),
+            'num_datasets': num_datasets,
+            'num_samples': num_samples or 0,
+            'num_vulnerable': num_vulnerable or 0,
+            'tasks_by_status': task_counts,
+            'running_tasks': [
+                {'id': task.id, 'name': task.name, 'progress': task.progress}
+                for task in running
+            ]
+        }
+        _status_cache['value'] = status
+        _status_cache['expires'] = now + ttl
+        return status
+
+
+def invalidate_system_status():
+    _status_cache['value'] = None
+
+
+def is_status_question(question):
+    question = question.lower()
+    return any(keyword in question for keyword in STATUS_KEYWORDS)
+
+
+def retrieve(question, config):
+    """Collect the documents and live state relevant to a chat question"""
+    context = {
+        'documents': get_index(config).search(question, config.get('RETRIEVAL_TOP_K', 3)),
+        'status': None
+    }
+    if is_status_question(question):
+        context['status'] = get_system_status(config.get('SYSTEM_STATUS_TTL', 5))
+    return context
+
+
+def format_status(status):
+    task_counts = status['tasks_by_status']
+    lines = [
+        f"模型数量：{status['num_models']}",
+        f"数据集数量：{status['num_datasets']}（共{status['num_samples']}个样本，"
+        f"其中漏洞样本{status['num_vulnerable']}个）",
+        f"训练任务：共{sum(task_counts.values())}个，" + (
+            '，'.join(f'{name} {count}个' for name, count in sorted(task_counts.items()))
+            or '暂无任务'
+        )
+    ]
+    for task in status['running_tasks']:
+        lines.append(f"运行中：{task['name']}（进度{task['progress'] or 0:.0f}%）")
+    return '\n'.join(lines)
+
+
+def format_context(context):
+    """Render retrieved context as text for a system prompt"""
+    sections = []
+    if context.get('status'):
+        sections.append('当前系统状态：\n' + format_status(context['status']))
+    if context.get('documents'):
+        sections.append('相关文档：\n' + '\n\n'.join(
+            f"[{doc['source']}] {doc['text']}" for doc in context['documents']
+        ))
+    return '\n\n'.join(sections)
@@ -0,0 +1,212 @@
+import math
+import heapq
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import event, or_, and_
+from ..models import db, TrainingTask
+
+DEFAULT_CPU = 1.0
+DEFAULT_MEMORY = 2048
+SCHEDULE_PAGE = 50  # Queued tasks read per owner at a time
+EPOCH = datetime(1970, 1, 1)
+
+
+def task_cpu(task):
+    return task.cpu_request if task.cpu_request is not None else DEFAULT_CPU
+
+
+def task_memory(task):
+    return task.memory_request if task.memory_request is not None else DEFAULT_MEMORY
+
+
+def parse_resources(data):
+    """
+    A task's priority, cpu_request and memory_request from a request body,
+    raising ValueError unless they are finite and the requests positive
+    """
+    try:
+        priority = int(data.get('priority', 0))
+        cpu_request = float(data.get('cpu_request', DEFAULT_CPU))
+        memory_request = int(data.get('memory_request', DEFAULT_MEMORY))
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError('priority, cpu_request and memory_request must be numbers')
+    if not math.isfinite(cpu_request):
+        raise ValueError('priority, cpu_request and memory_request must be numbers')
+    if cpu_request <= 0 or memory_request <= 0:
+        raise ValueError('Resource requests must be positive')
+    return priority, cpu_request, memory_request
+
+
+def base_score(task, now):
+    """Priority plus aging: one level per TRAINING_AGING_SECONDS spent queued"""
+    waited = (now - (task.queued_at or task.created_at or now)).total_seconds()
+    return (task.priority or 0) + max(waited, 0) / current_app.config['TRAINING_AGING_SECONDS']
+
+
+@event.listens_for(TrainingTask, 'before_insert')
+@event.listens_for(TrainingTask, 'before_update')
+def set_queue_rank(mapper, connection, task):
+    """
+    Store the order of base_score as a column: the time queued, in seconds,
+    less TRAINING_AGING_SECONDS per priority level. Unlike the score it does
+    not change while the task waits, so the database can sort by it.
+    """
+    queued = task.queued_at or task.created_at or datetime.utcnow()
+    task.queue_rank = ((queued - EPOCH).total_seconds()
+                       - (task.priority or 0) * current_app.config['TRAINING_AGING_SECONDS'])
+
+
+def running_usage():
+    """CPU cores requested by running tasks, per owner"""
+    rows = (db.session.query(TrainingTask.owner,
+                             db.func.sum(db.func.coalesce(TrainingTask.cpu_request, DEFAULT_CPU)))
+            .filter(TrainingTask.status == 'running')
+            .group_by(TrainingTask.owner).all())
+    return {owner or 'default': usage for owner, usage in rows}
+
+
+def owner_queue(query, owner):
+    """Yield an owner's queued tasks best first, reading a page at a time"""
+    if owner == 'default':
+        query = query.filter(or_(TrainingTask.owner.is_(None), TrainingTask.owner == 'default'))
+    else:
+        query = query.filter(TrainingTask.owner == owner)
+    query = query.order_by(TrainingTask.queue_rank, TrainingTask.id)
+
+    last = None
+    while True:
+        page = query
+        if last is not None:
+            page = page.filter(or_(TrainingTask.queue_rank > last.queue_rank,
+                                   and_(TrainingTask.queue_rank == last.queue_rank, TrainingTask.id > last.id)))
+        page = page.limit(SCHEDULE_PAGE).all()
+        yield from page
+        if len(page) < SCHEDULE_PAGE:
+            return
+        last = page[-1]
+
+
+def schedule_order(queues=None, now=None):
+    """
+    Order queued tasks the way the scheduler would start them
+
+    Within an owner, tasks go by priority plus aging. Across owners, each
+    pick goes to the owner whose best task scores highest after a penalty
+    for the owner's share of running capacity, counting the tasks picked so
+    far as running. Yields (task, score) pairs; owners' tasks are read by
+    queue_rank as they are needed, so the first picks do not load the
+    whole queue.
+    """
+    now = now or datetime.utcnow()
+    query = TrainingTask.query.filter_by(status='queued')
+    if queues:
+        query = query.filter(TrainingTask.queue.in_(queues))
+
+    owners = {owner or 'default' for owner, in query.with_entities(TrainingTask.owner).distinct()}
+    streams = {owner: owner_queue(query, owner) for owner in owners}
+    heads = {}
+
+    def advance(owner):
+        task = next(streams[owner], None)
+        if task is None:
+            heads.pop(owner, None)
+        else:
+            heads[owner] = (base_score(task, now), task)
+
+    for owner in owners:
+        advance(owner)
+
+    usage = running_usage()
+    total = sum(usage.values())
+    weight = current_app.config['TRAINING_FAIR_SHARE_WEIGHT']
+
+    def effective(owner):
+        score, task = heads[owner]
+        share = usage.get(owner, 0) / total if total else 0
+        return score - weight * share, -task.id
+
+    while heads:
+        owner = max(heads, key=effective)
+        score = effective(owner)[0]
+        task = heads[owner][1]
+        yield task, round(score, 4)
+        advance(owner)
+        usage[owner] = usage.get(owner, 0) + task_cpu(task)
+        total += task_cpu(task)
+
+
+def fits(task, cpu=None, memory=None):
+    """Whether a task's requests fit a worker's free capacity; None means unlimited"""
+    return ((cpu is None or task_cpu(task) <= cpu + 1e-9) and
+            (memory is None or task_memory(task) <= memory))
+
+
+def pick_candidates(cpu=None, memory=None, queues=None, limit=None, total_cpu=None, total_memory=None):
+    """
+    Queued tasks that fit the free capacity, best first, at most limit
+
+    Smaller tasks further down may backfill a task that does not fit yet,
+    but only until it has waited TRAINING_BACKFILL_SECONDS. From then on it
+    holds a reservation: a worker whose total capacity could run it is not
+    given the tasks ranked below it, so its capacity frees up for the task.
+    Workers that do not report their totals are assumed large enough.
+    """
+    now = datetime.utcnow()
+    reserve_after = current_app.config['TRAINING_BACKFILL_SECONDS']
+    candidates = []
+    for task, _ in schedule_order(queues, now):
+        if fits(task, cpu, memory):
+            candidates.append(task)
+            if limit is not None and len(candidates) >= limit:
+                break
+            continue
+        waited = (now - (task.queued_at or task.created_at or now)).total_seconds()
+        if waited >= reserve_after and fits(task, total_cpu, total_memory):
+            break
+    return candidates
+
+
+def epoch_seconds():
+    """Average seconds per epoch over recently completed tasks"""
+    recent = (TrainingTask.query
+              .filter(TrainingTask.status == 'completed', TrainingTask.start_time.isnot(None),
+                      TrainingTask.end_time.isnot(None), TrainingTask.current_epoch > 0)
+              .order_by(TrainingTask.end_time.desc()).limit(20).all())
+    if not recent:
+        return current_app.config['TRAINING_DEFAULT_EPOCH_SECONDS']
+    seconds = sum((task.end_time - task.start_time).total_seconds() for task in recent)
+    return seconds / sum(task.current_epoch for task in recent)
+
+
+def queue_snapshot(queues=None):
+    """
+    Queued tasks in scheduling order with position and estimated start
+
+    Start times are estimated by replaying the queue onto as many slots as
+    there are running tasks, each slot freeing up when its task is expected
+    to finish at the observed seconds per epoch.
+    """
+    now = datetime.utcnow()
+    per_epoch = epoch_seconds()
+
+    slots = []
+    for task in TrainingTask.query.filter_by(status='running'):
+        remaining = max((task.total_epochs or 0) - (task.current_epoch or 0), 0)
+        heapq.heappush(slots, remaining * per_epoch)
+    if not slots:
+        slots = [0.0]
+
+    snapshot = []
+    for position, (task, score) in enumerate(schedule_order(queues), 1):
+        duration = max((task.total_epochs or 0) - (task.current_epoch or 0), 1) * per_epoch
+        start = heapq.heappop(slots)
+        heapq.heappush(slots, start + duration)
+        data = task.to_dict()
+        data.update({
+            'position': position,
+            'score': score,
+            'estimated_start': (now + timedelta(seconds=start)).isoformat(),
+            'estimated_duration': round(duration, 1)
+        })
+        snapshot.append(data)
+    return snapshot
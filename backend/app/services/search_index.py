@@ -0,0 +1,448 @@
+"""
+Trigram index over the `code` field of dataset records, for literal and
+regex search across every dataset.
+
+Each dataset file and each version delta is indexed on its own as one or
+more immutable segments of at most SEGMENT_DOCS records, so ingestion only
+ever indexes new records. A segment is a folder of .npy arrays, memory-mapped
+when searched:
+
+    keys, offsets, widths, postings  trigram -> sorted record positions in
+                                     the segment, delta-encoded and packed
+                                     into 1, 2 or 4 bytes per entry
+    record_ids, labels, types        per-record columns for results and filters
+    text, block_offsets, text_offsets
+                                     the code itself, zlib-compressed in blocks
+                                     of BLOCK_SIZE records, to confirm matches
+
+A query is reduced to trigrams every match must contain, combined with AND
+and OR. Their posting lists give the candidates, and only the candidates are
+decompressed and matched against the real pattern.
+"""
+
+import os
+import re
+import json
+import time
+import zlib
+from functools import lru_cache
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+from ..models import db, Dataset, DatasetVersion, SearchIndexSource
+from ..utils.lazy_import import lazy_import
+
+np = lazy_import('numpy')
+
+SEGMENT_DOCS = 65536  # Records per segment
+BLOCK_SIZE = 64  # Records per compressed block of code
+BATCH_DOCS = 4096  # Records whose trigrams are extracted at once while building
+MAX_CLASS_SIZE = 4  # Characters in a class like [\"'] still used as trigram alternatives
+SNIPPET_CHARS = 200
+
+# Opcodes of atomic groups and possessive repeats, added in Python 3.11
+ATOMIC_GROUP = getattr(sre_parse, 'ATOMIC_GROUP', None)
+POSSESSIVE_REPEAT = getattr(sre_parse, 'POSSESSIVE_REPEAT', None)
+
+WIDTHS = {1: '<u1', 2: '<u2', 4: '<u4'}
+ARRAYS = ('keys', 'offsets', 'widths', 'postings', 'record_ids', 'labels', 'types',
+          'text', 'block_offsets', 'text_offsets')
+
+# Characters that IGNORECASE also matches outside ASCII (e.g. the Kelvin sign for k)
+UNSAFE_CASEFOLD = set(map(ord, 'iksIKS'))
+
+
+def _trigram_pairs(encoded, first_doc):
+    """Sorted unique (trigram << 32 | doc) of a batch of encoded records"""
+    lengths = np.fromiter((len(code) for code in encoded), dtype=np.int64, count=len(encoded))
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8).astype(np.uint64)
+    if data.size < 3:
+        return np.empty(0, dtype=np.uint64)
+    docs = np.repeat(np.arange(first_doc, first_doc + len(encoded), dtype=np.uint64), lengths)
+    valid = docs[:-2] == docs[2:]  # Trigrams must not span two records
+    keys = (data[:-2] << np.uint64(16)) | (data[1:-1] << np.uint64(8)) | data[2:]
+    pairs = (keys[valid] << np.uint64(32)) | docs[:-2][valid]
+    pairs.sort()  # Much faster than np.unique, which hashes
+    return pairs[np.r_[True, pairs[1:] != pairs[:-1]]]
+
+
+def _pack_postings(pairs):
+    """Group sorted (trigram, doc) pairs into delta-encoded posting lists of the narrowest width"""
+    keys = (pairs >> np.uint64(32)).astype(np.uint32)
+    docs = (pairs & np.uint64(0xFFFFFFFF)).astype(np.int64)
+    if not keys.size:
+        return keys, np.zeros(1, dtype=np.uint64), np.empty(0, dtype=np.uint8), np.empty(0, dtype=np.uint8)
+
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    counts = np.diff(np.r_[starts, keys.size])
+    deltas = np.diff(docs, prepend=0)
+    deltas[starts] = docs[starts]
+    maxima = np.maximum.reduceat(deltas, starts)
+    widths = np.where(maxima < 1 << 8, 1, np.where(maxima < 1 << 16, 2, 4)).astype(np.uint8)
+
+    offsets = np.zeros(starts.size + 1, dtype=np.uint64)
+    offsets[1:] = np.cumsum(counts * widths)
+    entry_widths = np.repeat(widths, counts)
+    entry_starts = (np.repeat(offsets[:-1], counts).astype(np.int64)
+                    + (np.arange(keys.size) - np.repeat(starts, counts)) * entry_widths)
+    postings = np.empty(int(offsets[-1]), dtype=np.uint8)
+    for width, dtype in WIDTHS.items():
+        mask = entry_widths == width
+        if mask.any():
+            values = deltas[mask].astype(dtype).view(np.uint8)
+            postings[(entry_starts[mask][:, None] + np.arange(width)).ravel()] = values
+    return keys[starts], offsets, widths, postings
+
+
+def write_segment(folder, record_ids, labels, types, codes, type_names):
+    """Write one segment of records (codes as str) to folder; returns its size in bytes"""
+    encoded = [code.encode('utf-8') for code in codes]
+    pairs = [_trigram_pairs(encoded[start:start + BATCH_DOCS], start)
+             for start in range(0, len(encoded), BATCH_DOCS)]
+    # Batches cover increasing record positions, so one sort orders by trigram then record
+    keys, offsets, widths, postings = _pack_postings(np.sort(np.concatenate(pairs)))
+
+    text_offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    text_offsets[1:] = np.cumsum([len(code) for code in encoded])
+    blocks = [zlib.compress(b''.join(encoded[start:start + BLOCK_SIZE]))
+              for start in range(0, len(encoded), BLOCK_SIZE)]
+    block_offsets = np.zeros(len(blocks) + 1, dtype=np.uint64)
+    block_offsets[1:] = np.cumsum([len(block) for block in blocks])
+
+    arrays = {
+        'keys': keys,
+        'offsets': offsets,
+        'widths': widths,
+        'postings': postings,
+        'record_ids': np.asarray(record_ids, dtype=np.int64),
+        'labels': np.asarray(labels, dtype=np.uint8),
+        'types': np.asarray(types, dtype=np.int16),
+        'text': np.frombuffer(b''.join(blocks), dtype=np.uint8),
+        'block_offsets': block_offsets,
+        'text_offsets': text_offsets
+    }
+    os.makedirs(folder, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(folder, f'{name}.npy'), array)
+    with open(os.path.join(folder, 'meta.json'), 'w') as f:
+        json.dump({'num_docs': len(encoded), 'types': type_names, 'block_size': BLOCK_SIZE}, f)
+    return sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))
+
+
+class Segment:
+    """A segment memory-mapped from its folder"""
+
+    def __init__(self, folder):
+        with open(os.path.join(folder, 'meta.json')) as f:
+            meta = json.load(f)
+        self.num_docs = meta['num_docs']
+        self.type_names = meta['types']
+        self.block_size = meta['block_size']
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(folder, f'{name}.npy'), mmap_mode='r'))
+
+    def _find(self, key):
+        index = int(np.searchsorted(self.keys, key))
+        if index < self.keys.size and self.keys[index] == key:
+            return index
+        return None
+
+    def count(self, key):
+        index = self._find(key)
+        if index is None:
+            return 0
+        return int(self.offsets[index + 1] - self.offsets[index]) // int(self.widths[index])
+
+    def posting(self, key):
+        """Sorted record positions containing the trigram"""
+        index = self._find(key)
+        if index is None:
+            return np.empty(0, dtype=np.int64)
+        data = self.postings[int(self.offsets[index]):int(self.offsets[index + 1])]
+        return np.cumsum(np.frombuffer(data, dtype=WIDTHS[int(self.widths[index])]), dtype=np.int64)
+
+    def evaluate(self, query):
+        """Record positions satisfying a trigram query, or None if it does not narrow them"""
+        if query is None:
+            return None
+        if isinstance(query, int):
+            return self.posting(query)
+        operator, children = query
+        if operator == 'or':
+            results = [self.evaluate(child) for child in children]
+            if any(result is None for result in results):
+                return None
+            docs = np.sort(np.concatenate(results))
+            return docs[np.r_[True, docs[1:] != docs[:-1]]] if docs.size else docs
+
+        # Rarest trigrams first, so the intersection shrinks quickly
+        children = sorted(children, key=lambda child: self.count(child) if isinstance(child, int) else 1 << 62)
+        result = None
+        for child in children:
+            docs = self.evaluate(child)
+            if docs is None:
+                continue
+            result = docs if result is None else np.intersect1d(result, docs, assume_unique=True)
+            if not result.size:
+                break
+        return result
+
+    def codes(self, docs):
+        """Yield (position, code) for sorted record positions, decompressing each block once"""
+        block, data, base = None, None, 0
+        for doc in docs:
+            doc = int(doc)
+            if doc // self.block_size != block:
+                block = doc // self.block_size
+                start, end = int(self.block_offsets[block]), int(self.block_offsets[block + 1])
+                data = zlib.decompress(self.text[start:end].tobytes())
+                base = int(self.text_offsets[block * self.block_size])
+            start, end = int(self.text_offsets[doc]) - base, int(self.text_offsets[doc + 1]) - base
+            yield doc, data[start:end].decode('utf-8')
+
+
+_segments = {}  # Source folder -> loaded segments
+
+
+def source_segments(source):
+    """The segments of an indexed source, loaded once per process"""
+    segments = _segments.get(source.path)
+    if segments is None:
+        folders = sorted(name for name in os.listdir(source.path) if name.startswith('seg-'))
+        segments = [Segment(os.path.join(source.path, name)) for name in folders]
+        _segments[source.path] = segments
+    return segments
+
+
+def _char_bytes(code, ignore_case):
+    """Byte alternatives of a literal character, or None if it cannot be used"""
+    if code < 128:
+        if ignore_case and chr(code).isalpha():
+            if code in UNSAFE_CASEFOLD:
+                return None
+            return [{ord(chr(code).lower()), ord(chr(code).upper())}]
+        return [{code}]
+    if ignore_case:
+        return None
+    return [{byte} for byte in chr(code).encode('utf-8')]
+
+
+def _class_bytes(items, ignore_case):
+    """Byte alternatives of a small class of ASCII characters such as [\"'], or None"""
+    if len(items) > MAX_CLASS_SIZE or any(op is not sre_parse.LITERAL for op, _ in items):
+        return None
+    alternatives = set()
+    for _, code in items:
+        chars = _char_bytes(code, ignore_case)
+        if chars is None or len(chars) != 1:
+            return None
+        alternatives |= chars[0]
+    return [alternatives] if len(alternatives) <= MAX_CLASS_SIZE else None
+
+
+def _run_query(run):
+    """Trigrams of a run of adjacent byte alternatives"""
+    trigrams = []
+    for i in range(len(run) - 2):
+        keys = sorted({a << 16 | b << 8 | c for a in run[i] for b in run[i + 1] for c in run[i + 2]})
+        trigrams.append(keys[0] if len(keys) == 1 else ('or', keys))
+    return trigrams
+
+
+def _combine(operator, children):
+    children = [child for child in children if child is not None]
+    if not children:
+        return None
+    return children[0] if len(children) == 1 else (operator, children)
+
+
+def _sequence_query(items, ignore_case):
+    """Trigram query implied by a parsed regex sequence; None if it implies none"""
+    parts, run = [], []
+
+    def flush():
+        parts.extend(_run_query(run))
+        run.clear()
+
+    for op, value in items:
+        if op is sre_parse.LITERAL:
+            chars = _char_bytes(value, ignore_case)
+            if chars is None:
+                flush()
+            else:
+                run.extend(chars)
+        elif op is sre_parse.IN:
+            chars = _class_bytes(value, ignore_case)
+            if chars is None:
+                flush()
+            else:
+                run.extend(chars)
+        elif op is sre_parse.AT:
+            pass  # Anchors take no characters
+        elif op is sre_parse.SUBPATTERN:
+            flush()
+            _, add_flags, del_flags, pattern = value
+            case = (ignore_case or add_flags & re.IGNORECASE) and not del_flags & re.IGNORECASE
+            parts.append(_sequence_query(pattern, case))
+        elif op is ATOMIC_GROUP:
+            flush()
+            parts.append(_sequence_query(value, ignore_case))
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, POSSESSIVE_REPEAT):
+            flush()
+            minimum, _, pattern = value
+            if minimum >= 1:
+                parts.append(_sequence_query(pattern, ignore_case))
+        elif op is sre_parse.BRANCH:
+            flush()
+            branches = [_sequence_query(branch, ignore_case) for branch in value[1]]
+            if all(branch is not None for branch in branches):
+                parts.append(_combine('or', branches))
+        else:
+            flush()
+    flush()
+    return _combine('and', parts)
+
+
+def pattern_query(pattern, flags=0):
+    """The trigram query every match of a regex satisfies, or None if it cannot narrow the search"""
+    parsed = sre_parse.parse(pattern, flags)
+    return _sequence_query(parsed, bool(parsed.state.flags & re.IGNORECASE))
+
+
+def _snippet(code, match):
+    """The line of a match, cut to SNIPPET_CHARS around it, and its line number"""
+    start = code.rfind('\n', 0, match.start()) + 1
+    end = code.find('\n', match.end())
+    end = len(code) if end == -1 else end
+    if end - start > SNIPPET_CHARS:
+        start = max(start, match.start() - SNIPPET_CHARS // 4)
+        end = min(end, start + SNIPPET_CHARS)
+    return code.count('\n', 0, match.start()) + 1, code[start:end]
+
+
+@lru_cache(maxsize=1024)
+def _delta_removed(path):
+    """The record ids a version delta removes, from its header; deltas never change"""
+    with open(path, 'rb') as f:
+        return tuple(json.loads(f.readline())['removed'])
+
+
+def dataset_views(dataset_ids, version=None):
+    """
+    What to search of each dataset: {dataset_id: (index versions, removed ids)}
+    for its latest version, or `version` of a single dataset. Records that
+    version removed or patched are left out, as are other branches' records.
+    Raises LookupError for an unknown version.
+    """
+    rows = {dataset_id: {} for dataset_id in dataset_ids}
+    for row in DatasetVersion.query.filter(DatasetVersion.dataset_id.in_(dataset_ids)):
+        rows[row.dataset_id][row.version] = row
+
+    views = {}
+    for dataset_id, versions in rows.items():
+        number = max(versions, default=0) if version is None else version
+        if number and number not in versions:
+            raise LookupError(f'Dataset has no version {number}')
+        chain = []
+        while number:
+            chain.append(versions[number])
+            number = versions[number].parent_version
+        removed = set()
+        for row in chain:
+            removed.update(_delta_removed(row.file_path))
+        views[dataset_id] = ({0} | {row.version for row in chain},
+                             np.fromiter(removed, dtype=np.int64, count=len(removed)))
+    return views
+
+
+def search(query, regex=False, ignore_case=False, label=None, vulnerability_type=None,
+           dataset_ids=None, version=None, limit=50, include_code=False):
+    """
+    Find records whose code contains the query, a literal string or with
+    regex=True a Python regular expression. Each dataset is searched as of
+    its latest version, or of `version` when searching one dataset. Returns
+    up to `limit` results in dataset, version and record order. Raises
+    ValueError for a query that is invalid or has no literal part of at
+    least three characters to look up, and LookupError for an unknown version.
+    """
+    started = time.perf_counter()
+    flags = re.IGNORECASE if ignore_case else 0
+    expression = query if regex else re.escape(query)
+    try:
+        compiled = re.compile(expression, flags)
+        trigrams = pattern_query(expression, flags)
+    except re.error as e:
+        raise ValueError(f'Invalid regular expression: {e}')
+    if trigrams is None:
+        raise ValueError('The query must contain a literal of at least 3 characters')
+    if version is not None and len(dataset_ids or ()) != 1:
+        raise ValueError('version requires a single dataset_id')
+
+    sources = SearchIndexSource.query.filter_by(status='completed')
+    pending = SearchIndexSource.query.filter(SearchIndexSource.status.in_(('pending', 'indexing')))
+    if dataset_ids:
+        sources = sources.filter(SearchIndexSource.dataset_id.in_(dataset_ids))
+        pending = pending.filter(SearchIndexSource.dataset_id.in_(dataset_ids))
+    sources = sources.order_by(SearchIndexSource.dataset_id, SearchIndexSource.version).all()
+    names = dict(db.session.query(Dataset.id, Dataset.name)
+                 .filter(Dataset.id.in_({source.dataset_id for source in sources})))
+    views = dataset_views(set(dataset_ids or ()) | {source.dataset_id for source in sources}, version)
+
+    # Drop the segments of sources since deleted or rebuilt
+    completed = {path for path, in db.session.query(SearchIndexSource.path).filter_by(status='completed')}
+    for path in [path for path in _segments if path not in completed]:
+        _segments.pop(path, None)
+
+    results, candidates, truncated = [], 0, False
+    for source in sources:
+        versions, removed = views[source.dataset_id]
+        if source.version not in versions:
+            continue
+        for segment in source_segments(source):
+            docs = segment.evaluate(trigrams)
+            if removed.size:
+                docs = docs[~np.isin(segment.record_ids[docs], removed)]
+            if label is not None:
+                docs = docs[segment.labels[docs] == label]
+            if vulnerability_type is not None:
+                if vulnerability_type not in segment.type_names:
+                    continue
+                docs = docs[segment.types[docs] == segment.type_names.index(vulnerability_type)]
+            candidates += docs.size
+
+            for doc, code in segment.codes(docs):
+                match = compiled.search(code)
+                if not match:
+                    continue
+                if len(results) == limit:
+                    truncated = True
+                    break
+                line, snippet = _snippet(code, match)
+                type_code = int(segment.types[doc])
+                result = {
+                    'dataset_id': source.dataset_id,
+                    'dataset_name': names.get(source.dataset_id),
+                    'version': source.version,
+                    'record_id': int(segment.record_ids[doc]),
+                    'label': int(segment.labels[doc]),
+                    'vulnerability_type': segment.type_names[type_code] if type_code >= 0 else None,
+                    'line': line,
+                    'snippet': snippet
+                }
+                if include_code:
+                    result['code'] = code
+                results.append(result)
+            if truncated:
+                break
+        if truncated:
+            break
+
+    return {
+        'results': results,
+        'count': len(results),
+        'truncated': truncated,
+        'candidates': candidates,
+        'pending_sources': pending.count(),
+        'took_ms': round((time.perf_counter() - started) * 1000, 2)
+    }
@@ -0,0 +1,146 @@
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import or_, and_
+from ..models import db, SearchIndexSource
+from .background_worker import BackgroundWorker
+from .dataset_service import iter_records, iter_jsonl_records, record_label, record_type
+from .search_index import SEGMENT_DOCS, write_segment
+from .file_cleaner import file_cleaner
+
+FORMATS = ('json', 'jsonl', 'csv')  # Formats whose records can be read, as for versions
+STALE_CLAIM = timedelta(hours=1)  # An index build claimed this long ago is assumed to have died
+
+
+def index_folder():
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], 'search_index')
+
+
+def source_records(source):
+    """(record_id, record) of the file or version delta a source indexes"""
+    dataset = source.dataset
+    if not source.version:
+        return enumerate(iter_records(dataset.file_path, dataset.format))
+    version = dataset.versions.filter_by(version=source.version).first()
+    records = iter_jsonl_records(version.file_path)
+    header = next(records)
+    return enumerate(records, header['first_id'])
+
+
+def build_source(source):
+    """Index the records of a source into segments under a new folder; returns (docs, segments, bytes)"""
+    folder = os.path.join(index_folder(), str(source.dataset_id), f'v{source.version}-{uuid.uuid4().hex[:8]}')
+    if source.path:
+        # Rebuilt, or claimed again after a process died building it
+        file_cleaner.delete([source.path], reason='index_rebuilt')
+    source.path = folder
+    db.session.commit()  # Recorded before writing, so a crash leaves no untracked files
+
+    num_docs, num_segments, size = 0, 0, 0
+    type_names = []
+    columns = ([], [], [], [])
+
+    def flush():
+        nonlocal num_segments, size
+        size += write_segment(os.path.join(folder, f'seg-{num_segments:05d}'), *columns, type_names)
+        num_segments += 1
+        for column in columns:
+            column.clear()
+        type_names.clear()
+
+    for record_id, record in source_records(source):
+        code = record.get('code')
+        if not isinstance(code, str) or not code:
+            continue
+        vuln_type = record_type(record)
+        if vuln_type is not None and vuln_type not in type_names:
+            type_names.append(vuln_type)
+        columns[0].append(record_id)
+        columns[1].append(record_label(record))
+        columns[2].append(type_names.index(vuln_type) if vuln_type is not None else -1)
+        columns[3].append(code)
+        num_docs += 1
+        if len(columns[0]) == SEGMENT_DOCS:
+            flush()
+    if columns[0]:
+        flush()
+    return num_docs, num_segments, size
+
+
+class SearchIndexer(BackgroundWorker):
+    """
+    Keeps the code search index up to date in the background.
+
+    Ingesting a dataset or creating a version queues a source row in the
+    same transaction; a background thread indexes queued sources once it
+    commits. Several processes may run indexers: a source is claimed with a
+    conditional update before it is built.
+    """
+
+    name = 'Search indexing'
+    extension = 'search_indexer'
+    interval_setting = 'SEARCH_INDEX_INTERVAL'
+    default_interval = 10
+    wake_flag = 'search_index'
+
+    def enqueue(self, dataset, version=0):
+        """Queue a dataset file or version delta for indexing in the current transaction"""
+        if dataset.format not in FORMATS:
+            return None
+        source = SearchIndexSource(dataset=dataset, version=version, status='pending')
+        db.session.add(source)
+        self.queued()
+        return source
+
+    def claim(self):
+        """Claim the oldest queued source for this process, or return None"""
+        stale = datetime.utcnow() - STALE_CLAIM
+        claimable = or_(SearchIndexSource.status == 'pending',
+                        and_(SearchIndexSource.status == 'indexing', SearchIndexSource.claimed_at < stale))
+        while True:
+            source = SearchIndexSource.query.filter(claimable).order_by(SearchIndexSource.id).first()
+            if source is None:
+                return None
+            claimed = (SearchIndexSource.query
+                       .filter(SearchIndexSource.id == source.id, claimable)
+                       .update({'status': 'indexing', 'claimed_at': datetime.utcnow()},
+                               synchronize_session=False))
+            db.session.commit()
+            if claimed:
+                db.session.refresh(source)
+                return source
+
+    def index_pending(self, limit=None):
+        """Index queued sources, up to `limit`; returns how many were indexed"""
+        count = 0
+        while limit is None or count < limit:
+            source = self.claim()
+            if source is None:
+                break
+            started = time.perf_counter()
+            try:
+                source.num_docs, source.num_segments, source.size = build_source(source)
+            except Exception as e:
+                db.session.rollback()
+                source.status = 'failed'
+                source.error = str(e)
+                file_cleaner.delete([source.path], reason='index_failed')
+                db.session.commit()
+                self.logger.error(f"Failed to index dataset {source.dataset_id} version {source.version}: {e}")
+                continue
+            source.status = 'completed'
+            source.error = None
+            source.indexed_at = datetime.utcnow()
+            db.session.commit()
+            self.logger.info(f"Indexed {source.num_docs} records of dataset {source.dataset_id} "
+                             f"version {source.version} in {time.perf_counter() - started:.1f}s")
+            count += 1
+        return count
+
+    def run_pass(self):
+        self.index_pending()
+
+
+search_indexer = SearchIndexer()
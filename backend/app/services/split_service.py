@@ -0,0 +1,146 @@
+import os
+import json
+import math
+import hashlib
+import threading
+from array import array
+from sqlalchemy.exc import IntegrityError
+from ..models import db, DatasetSplit
+from .dataset_service import iter_records, record_label, record_type
+from ..utils.lazy_import import lazy_import
+
+np = lazy_import('numpy')
+
+DEFAULT_RATIOS = {'train': 0.8, 'validation': 0.1, 'test': 0.1}
+
+
+def validate_ratios(ratios):
+    """Return ratios normalized to sum to 1, raising ValueError if invalid"""
+    if not isinstance(ratios, dict) or not ratios:
+        raise ValueError("Ratios must be an object of part names to fractions")
+    if any(isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value)
+           or value < 0 for value in ratios.values()):
+        raise ValueError("Ratios must be non-negative numbers")
+    total = sum(ratios.values())
+    if total <= 0:
+        raise ValueError("Ratios must not all be zero")
+    return {name: value / total for name, value in ratios.items()}
+
+
+def split_params_hash(dataset, ratios, seed, stratify, group_key):
+    """Hash the split parameters together with the dataset file's identity"""
+    stat = os.stat(dataset.file_path)
+    params = {
+        'ratios': sorted(ratios.items()),
+        'seed': seed,
+        'stratify': stratify,
+        'group_key': group_key,
+        'file': [os.path.basename(dataset.file_path), stat.st_size, stat.st_mtime_ns]
+    }
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def splits_folder(dataset):
+    return f'{dataset.file_path}.splits'
+
+
+def get_or_create_split(dataset, ratios=None, seed=0, stratify=True, group_key=None):
+    """
+    Return the split for these parameters, computing it only if it does not
+    exist yet. The second value tells whether the split was newly created.
+    """
+    if not dataset.file_path or not os.path.exists(dataset.file_path):
+        raise ValueError("Dataset file is missing")
+    ratios = validate_ratios(ratios or DEFAULT_RATIOS)
+    params_hash = split_params_hash(dataset, ratios, seed, stratify, group_key)
+
+    split = DatasetSplit.query.filter_by(dataset_id=dataset.id, params_hash=params_hash).first()
+    if split and split.file_path and os.path.exists(split.file_path):
+        return split, False
+
+    parts = compute_split(dataset, ratios, seed, stratify, group_key)
+
+    # Concurrent requests compute the same file; each writes its own and renames it
+    os.makedirs(splits_folder(dataset), exist_ok=True)
+    file_path = os.path.join(splits_folder(dataset), f'{params_hash}.npz')
+    temp_path = f'{file_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'wb') as f:
+        np.savez_compressed(f, **parts)
+    os.replace(temp_path, file_path)
+
+    if split is None:
+        split = DatasetSplit(dataset_id=dataset.id, params_hash=params_hash)
+        db.session.add(split)
+    split.ratios = ratios
+    split.seed = seed
+    split.stratify = stratify
+    split.group_key = group_key
+    split.file_path = file_path
+    split.counts = {name: int(indices.size) for name, indices in parts.items()}
+    split.num_samples = sum(split.counts.values())
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another request created the split first
+        db.session.rollback()
+        return DatasetSplit.query.filter_by(dataset_id=dataset.id, params_hash=params_hash).one(), False
+    return split, True
+
+
+def compute_split(dataset, ratios, seed=0, stratify=True, group_key=None):
+    """
+    Assign every record to a part in one streaming pass over the dataset
+
+    Records are stratified by (label, vulnerability_type) and shuffled with
+    a seeded generator inside each stratum. With a group_key, whole groups are
+    assigned by a seeded hash of the group value, so a group never straddles
+    parts; stratification is then approximate.
+    """
+    strata = array('i')
+    groups = array('Q')
+    stratum_codes = {}
+    salt = str(seed).encode('utf-8')
+
+    for record in iter_records(dataset.file_path, dataset.format):
+        key = (record_label(record), record_type(record)) if stratify else None
+        strata.append(stratum_codes.setdefault(key, len(stratum_codes)))
+        if group_key:
+            value = json.dumps(record.get(group_key), sort_keys=True).encode('utf-8')
+            digest = hashlib.blake2b(value, digest_size=8, key=salt).digest()
+            groups.append(int.from_bytes(digest, 'little'))
+
+    names = sorted(ratios)  # The order split_params_hash hashes them in
+    cumulative = np.cumsum([ratios[name] for name in names])
+    count = len(strata)
+    assignment = np.empty(count, dtype=np.int8)
+
+    if group_key:
+        # Map each group's hash to [0, 1) and cut it at the cumulative ratios
+        position = (np.frombuffer(groups, dtype=np.uint64) >> np.uint64(11)) / float(1 << 53)
+        assignment[:] = np.minimum(np.searchsorted(cumulative, position, side='right'), len(names) - 1)
+    else:
+        rng = np.random.default_rng(seed)
+        codes = np.frombuffer(strata, dtype=np.int32)
+        order = np.argsort(codes, kind='stable')
+        boundaries = np.flatnonzero(np.diff(codes[order])) + 1
+        for members in np.split(order, boundaries):
+            members = rng.permutation(members)
+            # Largest-remainder rounding keeps each stratum's parts proportional
+            exact = np.asarray([ratios[name] for name in names]) * members.size
+            sizes = np.floor(exact).astype(np.int64)
+            shortfall = members.size - sizes.sum()
+            sizes[np.argsort(sizes - exact, kind='stable')[:shortfall]] += 1
+            for part, chunk in enumerate(np.split(members, np.cumsum(sizes)[:-1])):
+                assignment[chunk] = part
+
+    index_type = np.uint32 if count < 2 ** 32 else np.uint64
+    return {name: np.flatnonzero(assignment == part).astype(index_type)
+            for part, name in enumerate(names)}
+
+
+def load_split_part(split, part):
+    """Load the sorted record indices of one part of a split"""
+    with np.load(split.file_path) as parts:
+        if part not in parts.files:
+            raise KeyError(part)
+        return parts[part]
@@ -0,0 +1,292 @@
+"""
+Storage reclamation and accounting: deletes that cascade through dependent
+rows and tombstone the files left behind, orphan scans that reconcile the
+storage folders with the paths recorded in the database, and disk usage
+"""
+
+import os
+import time
+import shutil
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import func, case, or_
+from ..models import (
+    db, Model, Dataset, DatasetSplit, DatasetVersion, ModelEvaluation, ModelOptimization, TrainingTask,
+    TrainingSweep, TrainingMetric, TelemetrySample, Checkpoint, FileTombstone, StorageScan, SearchIndexSource,
+    LocalizationScan
+)
+from .file_cleaner import file_cleaner
+from .prediction_cache import prediction_cache
+
+# Columns holding paths in the storage folders, and whether each names a
+# directory whose whole content belongs to the row
+REFERENCES = [
+    (Model.file_path, False),
+    (Dataset.file_path, False),
+    (DatasetSplit.file_path, False),
+    (Dataset.file_path + '.versions', True),  # Version deltas and label index, see version_service
+    (Checkpoint.file_path, False),
+    (TrainingTask.output_path, True),
+    (SearchIndexSource.path, True),
+    (LocalizationScan.path, True),
+    (FileTombstone.path, True)  # Already queued for removal
+]
+
+ORPHAN_SAMPLE = 100  # Orphan paths listed in a scan's response
+REFERENCE_CHUNK = 500  # File names matched per query when looking up references
+
+
+def storage_folders():
+    return {
+        'uploads': current_app.config['UPLOAD_FOLDER'],
+        'training_outputs': current_app.config['TRAINING_OUTPUT_FOLDER']
+    }
+
+
+def _delete(model_class, condition):
+    db.session.execute(db.delete(model_class).where(condition)
+                       .execution_options(synchronize_session=False))
+
+
+def unreferenced(paths):
+    """
+    The paths no remaining row refers to, to it or to a file inside it; call
+    after deleting the rows that referred to them
+    """
+    kept = []
+    for path in dict.fromkeys(path for path in paths if path):
+        inside = path.rstrip(os.sep) + os.sep
+        if not any(db.session.query(column).filter(or_(column == path, column.startswith(inside, autoescape=True)))
+                   .first() for column, _ in REFERENCES if column is not FileTombstone.path):
+            kept.append(path)
+    return kept
+
+
+def referenced(paths, exclude=()):
+    """
+    The paths some row already refers to, or that lie inside a directory a
+    row owns, leaving out the columns in exclude. Stored paths need not be
+    normalized, so rows are found by file name and compared once resolved.
+    """
+    wanted, ancestors = {}, {}
+    for path in paths:
+        real_path = os.path.realpath(path)
+        wanted.setdefault(real_path, []).append(path)
+        parent = os.path.dirname(real_path)
+        while parent != os.path.dirname(parent):
+            ancestors.setdefault(parent, []).append(path)
+            parent = os.path.dirname(parent)
+
+    found = set()
+    for column, is_directory in REFERENCES:
+        if any(column is other for other in exclude):
+            continue
+        names = sorted({os.path.basename(path) for path in list(wanted) + (list(ancestors) if is_directory else [])})
+        for start in range(0, len(names), REFERENCE_CHUNK):
+            matches = [column.endswith(os.sep + name, autoescape=True) for name in names[start:start + REFERENCE_CHUNK]]
+            for stored, in db.session.query(column).filter(or_(*matches)):
+                stored = os.path.realpath(stored)
+                found.update(wanted.get(stored, ()))
+                if is_directory:
+                    found.update(ancestors.get(stored, ()))
+    return found
+
+
+def task_references(column, ids):
+    """Count the training tasks referring to each id through column: {id: (tasks, running)}"""
+    if not ids:
+        return {}
+    running = func.sum(case((TrainingTask.status == 'running', 1), else_=0))
+    rows = (db.session.query(column, func.count(TrainingTask.id), running)
+            .filter(column.in_(ids)).group_by(column))
+    return {id: (tasks, running or 0) for id, tasks, running in rows}
+
+
+def dependency_error(label, references, cascade):
+    """Why a record referenced by (tasks, running) training tasks cannot be deleted, if it cannot"""
+    tasks, running = references or (0, 0)
+    if running:
+        return f'{label} is used by {running} running training tasks'
+    if tasks and not cascade:
+        return f'{label} is used by {tasks} training tasks; pass cascade=true to delete them as well'
+    return None
+
+
+def delete_tasks(condition):
+    """
+    Delete the training tasks matching condition with their metrics,
+    telemetry and checkpoints, tombstoning their output folders. The caller
+    commits.
+    """
+    task_ids = db.select(TrainingTask.id).where(condition)
+    paths = [path for path, in db.session.query(TrainingTask.output_path).filter(condition)]
+    # Checkpoints normally live in the task's output folder, but not necessarily
+    paths += [path for path, output_path in
+              db.session.query(Checkpoint.file_path, TrainingTask.output_path)
+              .join(TrainingTask, Checkpoint.task_id == TrainingTask.id).filter(condition)
+              if not output_path or os.path.dirname(path or '') != output_path]
+
+    for child in (TrainingMetric, TelemetrySample, Checkpoint):
+        _delete(child, child.task_id.in_(task_ids))
+    count = db.session.query(TrainingTask.id).filter(condition).count()
+    _delete(TrainingTask, condition)
+    file_cleaner.delete(unreferenced(paths), reason='task_deleted')
+    return count
+
+
+def delete_models(ids):
+    """
+    Delete models with their evaluations, optimizations, localization scans
+    and, if any, their training tasks and sweeps; callers check
+    dependency_error first. Models optimized from them are kept, unlinked.
+    Files another row still refers to are kept. The caller commits.
+    """
+    delete_tasks(TrainingTask.model_id.in_(ids))
+    _delete(TrainingSweep, TrainingSweep.model_id.in_(ids))
+    _delete(ModelEvaluation, ModelEvaluation.model_id.in_(ids))
+    _delete(ModelOptimization, ModelOptimization.model_id.in_(ids))
+    for column in (ModelOptimization.output_model_id, Model.parent_id):
+        db.session.execute(db.update(column.class_).where(column.in_(ids)).values({column: None})
+                           .execution_options(synchronize_session=False))
+    paths = [path for path, in db.session.query(LocalizationScan.path)
+             .filter(LocalizationScan.model_id.in_(ids))]
+    _delete(LocalizationScan, LocalizationScan.model_id.in_(ids))
+    paths += [path for path, in db.session.query(Model.file_path).filter(Model.id.in_(ids))]
+    _delete(Model, Model.id.in_(ids))
+    file_cleaner.delete(unreferenced(paths), reason='model_deleted')
+    for model_id in ids:
+        prediction_cache.invalidate_model(model_id)
+
+
+def delete_datasets(ids):
+    """
+    Delete datasets with their splits, versions, search index, evaluations,
+    optimization benchmarks and, if any, their training tasks and sweeps;
+    callers check dependency_error first. Localization scans of them are
+    kept, unlinked, and so are files another row still refers to. The caller
+    commits.
+    """
+    delete_tasks(TrainingTask.dataset_id.in_(ids))
+    _delete(TrainingSweep, TrainingSweep.dataset_id.in_(ids))
+    _delete(ModelEvaluation, ModelEvaluation.dataset_id.in_(ids))
+    _delete(ModelOptimization, ModelOptimization.dataset_id.in_(ids))
+    db.session.execute(db.update(LocalizationScan).where(LocalizationScan.dataset_id.in_(ids))
+                       .values(dataset_id=None).execution_options(synchronize_session=False))
+    _delete(DatasetSplit, DatasetSplit.dataset_id.in_(ids))
+    _delete(DatasetVersion, DatasetVersion.dataset_id.in_(ids))
+    paths = [path for path, in db.session.query(SearchIndexSource.path)
+             .filter(SearchIndexSource.dataset_id.in_(ids))]
+    _delete(SearchIndexSource, SearchIndexSource.dataset_id.in_(ids))
+    for path, in db.session.query(Dataset.file_path).filter(Dataset.id.in_(ids)):
+        if path:
+            # See split_service.splits_folder and version_service.versions_folder
+            paths += [path, f'{path}.splits', f'{path}.versions']
+    _delete(Dataset, Dataset.id.in_(ids))
+    file_cleaner.delete(unreferenced(paths), reason='dataset_deleted')
+
+
+def referenced_paths():
+    """Normalized paths recorded in the database: (files, directories)"""
+    files, directories = set(), set()
+    for column, is_directory in REFERENCES:
+        for path, in db.session.query(column).filter(column.isnot(None)).yield_per(10000):
+            path = os.path.abspath(path)
+            files.add(path)
+            if is_directory:
+                directories.add(path)
+    return files, directories
+
+
+def _covered(path, directories, root):
+    """Whether path is one of directories or inside one, without leaving root"""
+    while len(path) > len(root):
+        if path in directories:
+            return True
+        path = os.path.dirname(path)
+    return False
+
+
+def scan_orphans(dry_run=False, grace_seconds=None):
+    """
+    Walk the storage folders and tombstone files that no row refers to and
+    that are older than the grace period, which protects uploads still being
+    saved, along with old empty directories. Records the scan, including
+    folder totals, and returns it.
+    """
+    if grace_seconds is None:
+        grace_seconds = current_app.config['ORPHAN_GRACE_SECONDS']
+    cutoff = time.time() - grace_seconds
+    files, directories = referenced_paths()
+
+    scan = StorageScan(dry_run=dry_run, started_at=datetime.utcnow(), folders={})
+    orphans = {}
+    for name, root in storage_folders().items():
+        root = os.path.abspath(root)
+        usage = {'files': 0, 'bytes': 0}
+        scan.folders[name] = usage
+
+        for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+            protected = _covered(dirpath, directories, root)
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.lstat(path)
+                except FileNotFoundError:
+                    continue
+                usage['files'] += 1
+                usage['bytes'] += stat.st_size
+                if not protected and path not in files and stat.st_mtime < cutoff:
+                    orphans[path] = stat.st_size
+            try:
+                if (dirpath != root and not protected and not dirnames and not filenames
+                        and os.stat(dirpath).st_mtime < cutoff):
+                    orphans[dirpath] = 0
+            except FileNotFoundError:
+                pass
+
+    scan.num_files = sum(usage['files'] for usage in scan.folders.values())
+    scan.total_bytes = sum(usage['bytes'] for usage in scan.folders.values())
+    scan.num_orphans = len(orphans)
+    scan.orphan_bytes = sum(orphans.values())
+    if not dry_run:
+        file_cleaner.delete(sorted(orphans), reason='orphan')
+    scan.finished_at = datetime.utcnow()
+    db.session.add(scan)
+    db.session.commit()
+
+    current_app.logger.info(f"Orphan scan found {scan.num_orphans} orphans ({scan.orphan_bytes} bytes)")
+    data = scan.to_dict()
+    data['orphans'] = sorted(orphans)[:ORPHAN_SAMPLE]
+    return data
+
+
+def storage_usage():
+    """Disk usage by record type, pending reclamation, free space and the latest scan"""
+    def totals(query):
+        count, size = query.one()
+        return {'count': count, 'bytes': size or 0}
+
+    tombstones = {status: {'count': count, 'bytes': size or 0} for status, count, size in
+                  db.session.query(FileTombstone.status, func.count(FileTombstone.id),
+                                   func.sum(FileTombstone.size)).group_by(FileTombstone.status)}
+    disks = {}
+    for name, folder in storage_folders().items():
+        if os.path.isdir(folder):
+            disk = shutil.disk_usage(folder)
+            disks[name] = {'total': disk.total, 'used': disk.used, 'free': disk.free}
+
+    last_scan = StorageScan.query.filter_by(dry_run=False).order_by(StorageScan.id.desc()).first()
+    return {
+        'models': {
+            'count': Model.query.count(),
+            'with_file': Model.query.filter(Model.file_path.isnot(None)).count()
+        },
+        'datasets': totals(db.session.query(func.count(Dataset.id), func.sum(Dataset.size))),
+        'checkpoints': totals(db.session.query(func.count(Checkpoint.id), func.sum(Checkpoint.size))),
+        'tombstones': {
+            'pending': tombstones.get('pending', {'count': 0, 'bytes': 0}),
+            'failed': tombstones.get('failed', {'count': 0, 'bytes': 0})
+        },
+        'disks': disks,
+        'last_scan': last_scan.to_dict() if last_scan else None
+    }
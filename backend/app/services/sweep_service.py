@@ -0,0 +1,198 @@
+import math
+import random
+import itertools
+from datetime import datetime
+from ..models import db, TrainingSweep, TrainingTask, TrainingMetric
+from .training_service import launch_training_task
+
+# Metrics a sweep can optimize, as reported to add_training_metric
+SWEEP_METRICS = ['loss', 'accuracy', 'validation_loss', 'validation_accuracy']
+
+MAX_SWEEP_TRIALS = 1000
+
+
+def expand_search_space(space, strategy='grid', num_samples=10, seed=None):
+    """
+    Expand a search space into a list of hyperparameter dicts
+
+    Each parameter is either a list of choices or a distribution such as
+    {'distribution': 'log_uniform', 'min': 1e-5, 'max': 1e-2}. Grid search
+    takes the cartesian product of the choices; random search draws
+    num_samples configurations.
+    """
+    if not isinstance(space, dict) or not space:
+        raise ValueError("Search space must be a non-empty object")
+
+    names = sorted(space)
+    if strategy == 'grid':
+        choices = []
+        for name in names:
+            values = space[name]
+            if not isinstance(values, list) or not values:
+                raise ValueError(f"Grid search needs a list of values for '{name}'")
+            choices.append(values)
+        if math.prod(len(values) for values in choices) > MAX_SWEEP_TRIALS:
+            raise ValueError(f"Grid has more than {MAX_SWEEP_TRIALS} trials")
+        return [dict(zip(names, combination)) for combination in itertools.product(*choices)]
+
+    if strategy == 'random':
+        if not 0 < num_samples <= MAX_SWEEP_TRIALS:
+            raise ValueError(f"num_samples must be between 1 and {MAX_SWEEP_TRIALS}")
+        rng = random.Random(seed)
+        return [{name: _sample(rng, name, space[name]) for name in names}
+                for _ in range(num_samples)]
+
+    raise ValueError(f"Unknown search strategy: {strategy}")
+
+
+def _sample(rng, name, spec):
+    if isinstance(spec, list):
+        if not spec:
+            raise ValueError(f"No choices for '{name}'")
+        return rng.choice(spec)
+    if not isinstance(spec, dict) or 'min' not in spec or 'max' not in spec:
+        raise ValueError(f"Invalid distribution for '{name}'")
+
+    distribution = spec.get('distribution', 'uniform')
+    low, high = spec['min'], spec['max']
+    if any(isinstance(bound, bool) or not isinstance(bound, (int, float)) or not math.isfinite(bound)
+           for bound in (low, high)) or low > high:
+        raise ValueError(f"'{name}' needs finite numbers with min <= max")
+    if distribution == 'log_uniform' and low <= 0:
+        raise ValueError(f"'{name}' needs a positive min for log_uniform")
+    if distribution == 'uniform':
+        return rng.uniform(low, high)
+    if distribution == 'log_uniform':
+        return math.exp(rng.uniform(math.log(low), math.log(high)))
+    if distribution == 'int_uniform':
+        return rng.randint(int(low), int(high))
+    raise ValueError(f"Unknown distribution for '{name}': {distribution}")
+
+
+def create_sweep(sweep, early_stopping=None):
+    """
+    Persist a sweep with one pending child task per trial and start it
+    early_stopping is a validated policy applied to every trial
+    """
+    trials = expand_search_space(sweep.search_space, sweep.strategy,
+                                 sweep.num_samples or 10, sweep.seed)
+    db.session.add(sweep)
+    db.session.flush()
+
+    for number, hyperparameters in enumerate(trials, 1):
+        db.session.add(TrainingTask(
+            name=f'{sweep.name} #{number}',
+            model_id=sweep.model_id,
+            dataset_id=sweep.dataset_id,
+            status='pending',
+            total_epochs=sweep.max_epochs,
+            sweep_id=sweep.id,
+            hyperparameters=hyperparameters,
+            early_stopping=early_stopping
+        ))
+    db.session.commit()
+
+    schedule_sweep(sweep)
+    return sweep
+
+
+def schedule_sweep(sweep):
+    """Start pending trials up to the sweep's concurrency budget"""
+    if sweep.status != 'running':
+        return
+
+    active = ['queued', 'running']
+    running = sweep.tasks.filter(TrainingTask.status.in_(active)).count()
+    while running < (sweep.max_concurrency or 1):
+        task = sweep.tasks.filter_by(status='pending').order_by(TrainingTask.id).first()
+        if task is None:
+            break
+        launch_training_task(task, dict(task.hyperparameters or {}, epochs=task.total_epochs))
+        if task.status in active:
+            running += 1
+
+    if running == 0 and sweep.tasks.filter_by(status='pending').count() == 0:
+        sweep.status = 'completed'
+        sweep.best_task_id = best_task_id(sweep)
+        db.session.commit()
+
+
+def stop_sweep(sweep):
+    """Stop a sweep, cancelling its pending and running trials"""
+    sweep.status = 'stopped'
+    now = datetime.utcnow()
+    for task in sweep.tasks.filter(TrainingTask.status.in_(['pending', 'queued', 'running'])):
+        task.status = 'stopped'
+        task.stop_reason = 'Sweep stopped'
+        task.end_time = now
+    sweep.best_task_id = best_task_id(sweep)
+    db.session.commit()
+
+
+def rungs(sweep):
+    """Epochs at which successive halving compares trials"""
+    epochs = []
+    rung = max(sweep.grace_epochs or 1, 1)
+    factor = max(sweep.reduction_factor or 3, 2)
+    while rung < (sweep.max_epochs or 0):
+        epochs.append(rung)
+        rung *= factor
+    return epochs
+
+
+def check_rung(task, metric):
+    """
+    Asynchronous successive halving: when a trial reaches a rung, it keeps
+    running only if it is in the top 1/reduction_factor of the trials that
+    have reached the same rung so far. Returns the stop reason, if any.
+    """
+    sweep = task.sweep
+    if sweep.metric not in SWEEP_METRICS or metric.epoch not in rungs(sweep):
+        return None
+
+    value = getattr(metric, sweep.metric)
+    if value is None:
+        return None
+
+    column = getattr(TrainingMetric, sweep.metric)
+    values = [row[0] for row in db.session.query(column)
+              .join(TrainingTask, TrainingMetric.task_id == TrainingTask.id)
+              .filter(TrainingTask.sweep_id == sweep.id,
+                      TrainingMetric.epoch == metric.epoch,
+                      column.isnot(None))
+              .all()]
+
+    factor = max(sweep.reduction_factor or 3, 2)
+    if len(values) < factor:
+        return None
+
+    values.sort(reverse=sweep.mode == 'max')
+    cutoff = values[math.ceil(len(values) / factor) - 1]
+    worse = value > cutoff if sweep.mode != 'max' else value < cutoff
+    if worse:
+        return (f'Pruned by successive halving at epoch {metric.epoch}: '
+                f'{sweep.metric}={value:.4g} outside top 1/{factor} (cutoff {cutoff:.4g})')
+    return None
+
+
+def best_task_id(sweep):
+    """Return the trial with the best final value of the sweep metric"""
+    if sweep.metric not in SWEEP_METRICS:
+        return None
+    column = getattr(TrainingTask, sweep.metric)
+    order = column.desc() if sweep.mode == 'max' else column.asc()
+    best = (sweep.tasks.filter(TrainingTask.status == 'completed', column.isnot(None))
+            .order_by(order).first())
+    return best.id if best else None
+
+
+def sweep_summary(sweep):
+    """Sweep details with trial counts by status"""
+    counts = dict(db.session.query(TrainingTask.status, db.func.count(TrainingTask.id))
+                  .filter(TrainingTask.sweep_id == sweep.id)
+                  .group_by(TrainingTask.status).all())
+    data = sweep.to_dict()
+    data['rungs'] = rungs(sweep)
+    data['trials_by_status'] = counts
+    data['num_trials'] = sum(counts.values())
+    return data
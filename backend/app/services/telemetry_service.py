@@ -0,0 +1,181 @@
+import math
+from datetime import datetime, timezone
+from flask import current_app
+from ..models import db, TelemetrySample
+
+SAMPLE_FIELDS = ['cpu_percent', 'rss', 'read_bytes', 'write_bytes', 'samples_per_sec']
+
+IO_BOUND_BYTES_PER_SEC = 1024 * 1024  # Disk reads that count as IO-bound when the CPU waits
+
+
+def parse_sample(data):
+    """Validate one reported sample, raising ValueError for bad values"""
+    if not isinstance(data, dict):
+        raise ValueError("Each telemetry sample must be an object")
+    sample = {}
+    for name in SAMPLE_FIELDS:
+        value = data.get(name)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))
+                                  or not math.isfinite(value) or value < 0):
+            raise ValueError(f"{name} must be a finite, non-negative number")
+        sample[name] = value
+    try:
+        timestamp = datetime.fromisoformat(data['timestamp']) if data.get('timestamp') else datetime.utcnow()
+    except (TypeError, ValueError):
+        raise ValueError("timestamp must be an ISO 8601 string")
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    sample['timestamp'] = timestamp
+    return sample
+
+
+def record_samples(task, samples):
+    """
+    Write samples into the task's ring buffer: sample n goes to slot
+    n % TELEMETRY_RING_SIZE, overwriting the oldest sample once full, so
+    storage per task stays fixed however long it runs. Returns False if the
+    task is not running, in which case nothing is stored: late samples would
+    overwrite the downsampled ring of a finished task.
+    """
+    if task.status != 'running':
+        return False
+    size = current_app.config['TELEMETRY_RING_SIZE']
+    first = task.telemetry_count or 0
+    numbered = list(enumerate(samples, first))[-size:]
+
+    slots = [sequence % size for sequence, _ in numbered]
+    existing = {row.slot: row for row in
+                task.telemetry.filter(TelemetrySample.slot.in_(slots))}
+    for sequence, sample in numbered:
+        slot = sequence % size
+        row = existing.get(slot)
+        if row is None:
+            row = TelemetrySample(task_id=task.id, slot=slot)
+            db.session.add(row)
+        row.sequence = sequence
+        for name, value in sample.items():
+            setattr(row, name, value)
+
+    task.telemetry_count = first + len(samples)
+
+    # Re-check the flags every few samples rather than on every report
+    every = current_app.config['TELEMETRY_MIN_SAMPLES']
+    if task.telemetry_count // every != first // every:
+        db.session.flush()
+        task.telemetry_flags = analyze(task, load_samples(task))['flags']
+    db.session.commit()
+    return True
+
+
+def load_samples(task):
+    return task.telemetry.order_by(TelemetrySample.sequence).all()
+
+
+def _rate(samples, name):
+    """Average per-second rate of a cumulative counter"""
+    points = [(s.timestamp, getattr(s, name)) for s in samples if getattr(s, name) is not None]
+    if len(points) < 2:
+        return None
+    seconds = (points[-1][0] - points[0][0]).total_seconds()
+    return max(points[-1][1] - points[0][1], 0) / seconds if seconds > 0 else None
+
+
+def _mean(values):
+    values = [value for value in values if value is not None]
+    return sum(values) / len(values) if values else None
+
+
+def rss_trend(samples):
+    """
+    Fit RSS against time after a warm-up and return the relative growth
+    over the run and how well a straight line explains it (R squared)
+    """
+    points = [(s.timestamp, s.rss) for s in samples if s.rss is not None]
+    points = points[len(points) // 10:]
+    if len(points) < 3:
+        return None, None
+
+    start = points[0][0]
+    xs = [(timestamp - start).total_seconds() for timestamp, _ in points]
+    ys = [rss for _, rss in points]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    var_x = sum((x - mean_x) ** 2 for x in xs)
+    var_y = sum((y - mean_y) ** 2 for y in ys)
+    if var_x == 0 or var_y == 0:
+        return 0.0, 0.0
+
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var_x
+    r_squared = slope * slope * var_x / var_y
+    fitted_start = mean_y - slope * mean_x
+    growth = slope * (xs[-1] - xs[0]) / fitted_start if fitted_start > 0 else 0.0
+    return growth, r_squared
+
+
+def analyze(task, samples):
+    """Summarize a task's telemetry and flag what bounds the run"""
+    config = current_app.config
+    cpu_request = task.cpu_request or 1.0
+    mean_cpu = _mean(s.cpu_percent for s in samples)
+    utilization = mean_cpu / (100 * cpu_request) if mean_cpu is not None else None
+    peak_rss = max((s.rss for s in samples if s.rss is not None), default=None)
+    read_rate = _rate(samples, 'read_bytes')
+    growth, r_squared = rss_trend(samples)
+
+    flags = []
+    if len(samples) >= config['TELEMETRY_MIN_SAMPLES']:
+        if utilization is not None:
+            if utilization >= 0.8:
+                flags.append('cpu_bound')
+            elif read_rate is not None and read_rate >= IO_BOUND_BYTES_PER_SEC:
+                flags.append('io_bound')
+            if utilization < config['TELEMETRY_UNDERUTILIZED_RATIO']:
+                flags.append('under_utilized')
+        if peak_rss is not None and task.memory_request and peak_rss >= 0.9 * task.memory_request * 1024 * 1024:
+            flags.append('memory_bound')
+        if growth is not None and growth > config['TELEMETRY_LEAK_GROWTH'] and r_squared >= 0.8:
+            flags.append('memory_leak')
+
+    return {
+        'samples': len(samples),
+        'mean_cpu_percent': mean_cpu,
+        'cpu_utilization': utilization,
+        'peak_rss': peak_rss,
+        'rss_growth': growth,
+        'read_bytes_per_sec': read_rate,
+        'write_bytes_per_sec': _rate(samples, 'write_bytes'),
+        'mean_samples_per_sec': _mean(s.samples_per_sec for s in samples),
+        'flags': flags
+    }
+
+
+def downsample(task):
+    """
+    Shrink a finished task's ring to TELEMETRY_DOWNSAMPLED_SIZE samples:
+    each kept sample averages a run of consecutive samples, keeping peak RSS
+    and the counters' final values. Flags are computed from the full data first.
+    """
+    samples = load_samples(task)
+    if not samples:
+        return
+    task.telemetry_flags = analyze(task, samples)['flags']
+
+    size = current_app.config['TELEMETRY_DOWNSAMPLED_SIZE']
+    if len(samples) > size:
+        buckets = [samples[i * len(samples) // size:(i + 1) * len(samples) // size] for i in range(size)]
+        merged = []
+        for slot, bucket in enumerate(buckets):
+            last = bucket[-1]
+            merged.append(TelemetrySample(
+                task_id=task.id,
+                slot=slot,
+                sequence=last.sequence,
+                timestamp=last.timestamp,
+                cpu_percent=_mean(s.cpu_percent for s in bucket),
+                rss=max((s.rss for s in bucket if s.rss is not None), default=None),
+                read_bytes=last.read_bytes,
+                write_bytes=last.write_bytes,
+                samples_per_sec=_mean(s.samples_per_sec for s in bucket)
+            ))
+        TelemetrySample.query.filter_by(task_id=task.id).delete()
+        db.session.add_all(merged)
+    db.session.commit()
@@ -3,6 +3,7 @@ import time
 from datetime import datetime
 from flask import current_app
 from ..models import db, TrainingTask, TrainingMetric
+from . import early_stopping, telemetry_service
 
 def start_training_task(task_id, config):
     """
@@ -23,6 +24,74 @@ def start_training_task(task_id, config):
     
     pass
 
+def launch_training_task(task, config, commit=True):
+    """
+    Start a pending task and record whether it started. With worker dispatch
+    the task is queued instead, for a worker agent to lease. Bulk launches
+    pass commit=False and commit all tasks at once.
+    """
+    if current_app.config.get('TRAINING_DISPATCH') == 'worker':
+        task.status = 'queued'
+        task.queued_at = datetime.utcnow()
+        task.launch_config = config
+        task.worker_id = None
+        task.lease_expires_at = None
+        db.session.info['training_queued'] = True  # Wakes long-polling workers on commit
+        if commit:
+            db.session.commit()
+        return
+    
+    try:
+        start_training_task(task.id, config)
+        task.status = 'running'
+        task.start_time = datetime.utcnow()
+    except Exception as e:
+        task.status = 'failed'
+        task.error_message = str(e)
+        current_app.logger.error(f"Failed to start training: {str(e)}")
+    if commit:
+        db.session.commit()
+
+def finish_training_task(task, status, reason=None):
+    """Move a task to a final status, recording why the platform stopped it"""
+    task.status = status
+    task.end_time = datetime.utcnow()
+    if reason:
+        task.stop_reason = reason
+    db.session.commit()
+    telemetry_service.downsample(task)
+    on_task_finished(task)
+
+def on_task_finished(task):
+    """Release the task's slot so queued work can start"""
+    if task.sweep_id:
+        from .sweep_service import schedule_sweep
+        schedule_sweep(task.sweep)
+
+def process_metric(task, metric):
+    """
+    React to a newly reported metric: finish tasks that reached their last
+    epoch, apply the task's early-stopping policy and let sweeps prune tasks
+    that are falling behind
+    """
+    if task.status != 'running':
+        return
+    
+    reason = early_stopping.evaluate(task, metric)
+    if reason:
+        finish_training_task(task, 'stopped', reason)
+        return
+    
+    if task.total_epochs and metric.epoch and metric.epoch >= task.total_epochs:
+        finish_training_task(task, 'completed')
+        return
+    
+    if task.sweep_id:
+        from .sweep_service import check_rung
+        reason = check_rung(task, metric)
+        if reason:
+            finish_training_task(task, 'stopped', reason)
+
 def simulate_training(task_id, epochs=10):
     """
     Simulate training process for demonstration purposes
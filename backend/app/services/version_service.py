@@ -0,0 +1,242 @@
+"""
+Dataset versions stored as deltas. Version 0 is the uploaded file; every
+later version names a parent and stores only the records it adds and the ids
+of the records it removes, so appending 5k records to a corpus of millions
+writes 5k records.
+
+Record ids are positions: the base file's records are 0..n-1 and each
+version numbers its additions from its parent's next_record_id. Patching a
+record removes its id and adds the new record under a fresh id.
+
+A delta is a JSON Lines file whose first line is a header
+    {"parent": 2, "first_id": 2000000, "removed": [17, 42], "labels": "0110"}
+followed by the added records. labels holds the label of each added record,
+and the base file's labels are kept in an index built by one scan on first
+use, so a version's stats are its parent's adjusted by the delta alone.
+"""
+
+import io
+import os
+import json
+import uuid
+from sqlalchemy.exc import IntegrityError
+from ..models import db, DatasetVersion
+from .dataset_service import iter_records, iter_jsonl_records, record_label
+from .export_service import CHUNK_SIZE
+from .search_indexer import search_indexer
+
+FORMATS = ('json', 'jsonl', 'csv')
+
+
+def versions_folder(dataset):
+    return f'{dataset.file_path}.versions'
+
+
+def label_index(dataset):
+    """
+    Labels of the base file's records as one byte each. The file is scanned
+    once per size and modification time, so re-uploading it in place
+    rebuilds the index.
+    """
+    stat = os.stat(dataset.file_path)
+    folder = versions_folder(dataset)
+    name = f'labels-{stat.st_size}-{stat.st_mtime_ns}.bin'
+    path = os.path.join(folder, name)
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+
+    labels = bytes(bytearray(record_label(record) for record in iter_records(dataset.file_path, dataset.format)))
+    os.makedirs(folder, exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(labels)
+    os.replace(temp_path, path)
+    for stale in os.listdir(folder):
+        if stale.startswith('labels') and stale.endswith('.bin') and stale != name:
+            try:
+                os.remove(os.path.join(folder, stale))
+            except FileNotFoundError:
+                pass
+    return labels
+
+
+def read_header(version):
+    with open(version.file_path, 'rb') as f:
+        return json.loads(f.readline())
+
+
+def get_version(dataset, number):
+    """The DatasetVersion with this number, or None for version 0; raises LookupError if unknown"""
+    if number == 0:
+        return None
+    version = dataset.versions.filter_by(version=number).first()
+    if version is None:
+        raise LookupError(f'Dataset has no version {number}')
+    return version
+
+
+def version_chain(dataset, version):
+    """The versions from the first delta on top of the base file up to version, oldest first"""
+    if version is None:
+        return []
+    versions = {row.version: row for row in dataset.versions}
+    chain = [version]
+    while chain[-1].parent_version:
+        chain.append(versions[chain[-1].parent_version])
+    return chain[::-1]
+
+
+def version_details(dataset, version):
+    """
+    A version with what a trainer needs to read it from the shared storage:
+    the base file and the deltas of its lineage, oldest first
+    """
+    data = version.to_dict()
+    data['dataset_path'] = dataset.file_path
+    data['format'] = dataset.format
+    data['deltas'] = [row.file_path for row in version_chain(dataset, version)]
+    return data
+
+
+def removed_ids(headers):
+    removed = set()
+    for header in headers:
+        removed.update(header['removed'])
+    return removed
+
+
+def create_version(dataset, parent=None, add=None, remove=None, patch=None, description=None):
+    """
+    Create a version on top of parent (default the latest version) that adds
+    the records in add, removes the record ids in remove and replaces the
+    records in patch, a list of {'id', 'record'}. Raises ValueError for an
+    invalid delta and LookupError for an unknown parent.
+    """
+    if dataset.format not in FORMATS:
+        raise ValueError(f'Versions are not supported for {dataset.format} datasets')
+    if not dataset.file_path or not os.path.exists(dataset.file_path):
+        raise ValueError('Dataset file is missing')
+
+    latest = db.session.query(db.func.max(DatasetVersion.version)).filter_by(dataset_id=dataset.id).scalar() or 0
+    if parent is None:
+        parent = latest
+    elif not isinstance(parent, int) or isinstance(parent, bool):
+        raise ValueError('parent must be a version number')
+    parent_version = get_version(dataset, parent)
+
+    add, remove, patch = add or [], remove or [], patch or []
+    if not isinstance(add, list) or any(not isinstance(record, dict) for record in add):
+        raise ValueError('add must be a list of record objects')
+    if not isinstance(remove, list):
+        raise ValueError('remove must be a list of record ids')
+    if not isinstance(patch, list) or any(not isinstance(item, dict) or 'id' not in item
+                                          or not isinstance(item.get('record'), dict) for item in patch):
+        raise ValueError('patch must be a list of {id, record} objects')
+    add = add + [item['record'] for item in patch]
+    remove = remove + [item['id'] for item in patch]
+    if not add and not remove:
+        raise ValueError('A version must add or remove records')
+
+    base_labels = label_index(dataset)
+    chain = version_chain(dataset, parent_version)
+    headers = [read_header(version) for version in chain]
+    next_id = parent_version.next_record_id if parent_version else len(base_labels)
+
+    # Every id must name a record present in the parent
+    if any(not isinstance(id, int) or isinstance(id, bool) for id in remove):
+        raise ValueError('Record ids must be integers')
+    removed = removed_ids(headers)
+    if len(set(remove)) != len(remove):
+        raise ValueError('Record ids must not repeat')
+    missing = [id for id in remove if not 0 <= id < next_id or id in removed]
+    if missing:
+        raise ValueError(f'Records not in version {parent}: {sorted(missing)[:10]}')
+
+    # Stats follow from the parent's and the labels of the records added and removed
+    added_labels = ''.join(str(record_label(record)) for record in add)
+    removed_vulnerable = 0
+    for id in remove:
+        if id < len(base_labels):
+            removed_vulnerable += base_labels[id]
+            continue
+        for header in headers:
+            if header['first_id'] <= id < header['first_id'] + len(header['labels']):
+                removed_vulnerable += header['labels'][id - header['first_id']] == '1'
+                break
+    if parent_version:
+        num_samples, num_vulnerable = parent_version.num_samples, parent_version.num_vulnerable
+    else:
+        num_samples, num_vulnerable = len(base_labels), base_labels.count(1)
+    num_samples += len(add) - len(remove)
+    num_vulnerable += added_labels.count('1') - removed_vulnerable
+
+    number = latest + 1
+    os.makedirs(versions_folder(dataset), exist_ok=True)
+    file_path = os.path.join(versions_folder(dataset), f'v{number}-{uuid.uuid4().hex[:8]}.jsonl')
+    header = {'parent': parent, 'first_id': next_id, 'removed': sorted(remove), 'labels': added_labels}
+    with open(file_path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(header) + '\n')
+        for record in add:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    version = DatasetVersion(
+        dataset_id=dataset.id,
+        version=number,
+        parent_version=parent,
+        description=description,
+        file_path=file_path,
+        size=os.path.getsize(file_path),
+        num_added=len(add),
+        num_removed=len(remove),
+        first_record_id=next_id,
+        next_record_id=next_id + len(add),
+        num_samples=num_samples,
+        num_vulnerable=num_vulnerable,
+        num_safe=num_samples - num_vulnerable
+    )
+    db.session.add(version)
+    search_indexer.enqueue(dataset, number)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another request took the version number first
+        db.session.rollback()
+        os.remove(file_path)
+        raise
+    return version
+
+
+def iter_version_records(dataset, version):
+    """
+    Stream the records of a version as (id, record): the base file's records,
+    then each delta's additions, oldest first, skipping removed records
+    """
+    chain = version_chain(dataset, version)
+    removed = removed_ids(read_header(row) for row in chain)
+
+    for id, record in enumerate(iter_records(dataset.file_path, dataset.format)):
+        if id not in removed:
+            yield id, record
+    for row in chain:
+        records = iter_jsonl_records(row.file_path)
+        header = next(records)
+        for id, record in enumerate(records, header['first_id']):
+            if id not in removed:
+                yield id, record
+
+
+def encode_records(records, with_ids=False):
+    """Encode (id, record) pairs as JSON Lines in chunks of about CHUNK_SIZE bytes"""
+    buffer = io.StringIO()
+    for id, record in records:
+        buffer.write(json.dumps({'id': id, 'record': record} if with_ids else record, ensure_ascii=False))
+        buffer.write('\n')
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
@@ -0,0 +1,21 @@
+import sys
+import importlib.util
+
+
+def lazy_import(name):
+    """
+    Return a module that is only executed on first attribute access, so
+    heavy libraries (numpy, model runtimes, tokenizers) imported at module
+    level cost nothing at startup or in requests that never use them
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
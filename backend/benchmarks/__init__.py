@@ -0,0 +1,14 @@
+"""
+VulWeb benchmark suite
+
+Synthetic fixtures at production scale, a concurrent load harness for the
+API routes, micro-benchmarks of hot helpers, the app's cold-start time, and
+machine-readable baselines with a regression comparison. Run from the backend directory:
+
+    python -m benchmarks generate --database sqlite:///bench.db
+    python -m benchmarks files --output bench_data --size 2GB
+    python -m benchmarks routes --database sqlite:///bench.db --output routes.json
+    python -m benchmarks micro --output micro.json
+    python -m benchmarks startup --output startup.json
+    python -m benchmarks compare baseline.json routes.json
+"""
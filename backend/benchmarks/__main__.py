@@ -0,0 +1,172 @@
+"""
+Benchmark command line; see the package docstring for usage
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+
+def create_app_for(database):
+    """The production app on the benchmark database; DATABASE_URL is read at import"""
+    if database:
+        os.environ['DATABASE_URL'] = database
+    from app import create_app
+    return create_app('production')
+
+
+def manifest_path(database):
+    """Fixture id ranges are kept next to a SQLite database, else in the working directory"""
+    if database and database.startswith('sqlite:///') and database != 'sqlite:///:memory:':
+        return database[len('sqlite:///'):] + '.manifest.json'
+    return 'benchmark-manifest.json'
+
+
+def generate(args):
+    from .fixtures import populate_database
+
+    app = create_app_for(args.database)
+    start = time.perf_counter()
+    with app.app_context():
+        ranges = populate_database(args.models, args.datasets, args.tasks, args.metrics_per_task,
+                                   dataset_file=args.dataset_file, seed=args.seed,
+                                   batch_size=args.batch_size)
+    with open(manifest_path(args.database), 'w') as f:
+        json.dump(ranges, f)
+    print(f"Inserted {ranges} in {time.perf_counter() - start:.1f}s; manifest {manifest_path(args.database)}")
+
+
+def files(args):
+    from .fixtures import parse_size, write_dataset_file
+
+    os.makedirs(args.output, exist_ok=True)
+    size = parse_size(args.size) if args.size else None
+    for file_format in args.formats:
+        path = os.path.join(args.output, f'synthetic_dataset.{file_format}')
+        start = time.perf_counter()
+        count, written = write_dataset_file(path, file_format, size=size, num_records=args.records, seed=args.seed)
+        print(f"Wrote {count} records ({written / 1024 ** 2:.1f} MB) to {path} "
+              f"in {time.perf_counter() - start:.1f}s")
+
+
+def routes(args):
+    from .harness import route_targets, run_routes, serve_app
+    from .baseline import save_results
+
+    app = create_app_for(args.database)
+    path = manifest_path(args.database)
+    if os.path.exists(path):
+        with open(path) as f:
+            ranges = json.load(f)
+    else:
+        print(f"No fixture manifest at {path}; routes with ids use id 1")
+        ranges = {'models': [1, 1], 'datasets': [1, 1], 'tasks': [1, 1]}
+    targets = route_targets(app, ranges, writes=args.writes, only=args.only)
+
+    process = None
+    base_url = args.url
+    if not base_url:
+        base_url, process = serve_app()
+    try:
+        results = run_routes(base_url, targets, args.clients, args.requests, args.warmup)
+    finally:
+        if process:
+            process.terminate()
+
+    if args.output:
+        save_results(args.output, 'routes', results, {
+            'clients': args.clients, 'requests': args.requests, 'writes': args.writes,
+            'fixtures': ranges, 'server': args.url or 'werkzeug'
+        })
+
+
+def micro(args):
+    from .micro import run_micro
+    from .baseline import save_results
+    from app import create_app
+
+    results = run_micro(create_app('testing'), args.records, args.rows, args.repeat)
+    if args.output:
+        save_results(args.output, 'micro', results,
+                     {'records': args.records, 'rows': args.rows, 'repeat': args.repeat})
+
+
+def startup(args):
+    from .startup import run_startup
+    from .baseline import save_results
+
+    results = run_startup(args.repeat, args.config)
+    if args.output:
+        save_results(args.output, 'startup', results, {'repeat': args.repeat, 'config': args.config})
+
+
+def compare(args):
+    from .baseline import report
+    return 1 if report(args.baseline, args.current, args.threshold, args.min_delta_ms) else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='VulWeb benchmark suite')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('generate', help='Bulk insert synthetic database fixtures')
+    command.add_argument('--database', default=os.environ.get('DATABASE_URL'),
+                         help='SQLAlchemy URL of an empty database')
+    command.add_argument('--models', type=int, default=100000)
+    command.add_argument('--datasets', type=int, default=100000)
+    command.add_argument('--tasks', type=int, default=10000)
+    command.add_argument('--metrics-per-task', type=int, default=100)
+    command.add_argument('--dataset-file', help='File path stored on the synthetic datasets')
+    command.add_argument('--batch-size', type=int, default=10000)
+    command.add_argument('--seed', type=int, default=0)
+    command.set_defaults(handler=generate)
+
+    command = commands.add_parser('files', help='Write large synthetic dataset files')
+    command.add_argument('--output', default='bench_data')
+    command.add_argument('--size', help="Target size per file, e.g. '2GB'")
+    command.add_argument('--records', type=int, help='Records per file instead of a size')
+    command.add_argument('--formats', nargs='+', default=['json', 'csv'], choices=['json', 'jsonl', 'csv'])
+    command.add_argument('--seed', type=int, default=0)
+    command.set_defaults(handler=files)
+
+    command = commands.add_parser('routes', help='Load every route with concurrent clients')
+    command.add_argument('--database', default=os.environ.get('DATABASE_URL'))
+    command.add_argument('--url', help='Benchmark a running server instead of starting one')
+    command.add_argument('--clients', type=int, default=8)
+    command.add_argument('--requests', type=int, default=200, help='Requests per route')
+    command.add_argument('--warmup', type=int, default=5)
+    command.add_argument('--writes', action='store_true', help='Include the update and reporting routes')
+    command.add_argument('--only', nargs='+', help='Only rules containing one of these substrings')
+    command.add_argument('--output', help='Write results as JSON')
+    command.set_defaults(handler=routes)
+
+    command = commands.add_parser('micro', help='Micro-benchmark dataset analysis and serialization')
+    command.add_argument('--records', type=int, default=100000, help='Records per dataset file')
+    command.add_argument('--rows', type=int, default=10000, help='Rows serialized')
+    command.add_argument('--repeat', type=int, default=5)
+    command.add_argument('--output', help='Write results as JSON')
+    command.set_defaults(handler=micro)
+
+    command = commands.add_parser('startup', help='Cold-start time of the app factory in fresh processes')
+    command.add_argument('--repeat', type=int, default=10)
+    command.add_argument('--config', default='production')
+    command.add_argument('--output', help='Write results as JSON')
+    command.set_defaults(handler=startup)
+
+    command = commands.add_parser('compare', help='Compare results against a baseline')
+    command.add_argument('baseline')
+    command.add_argument('current')
+    command.add_argument('--threshold', type=float, default=0.2, help='Allowed slowdown, as a fraction')
+    command.add_argument('--min-delta-ms', type=float, default=1.0, help='Ignore smaller latency changes')
+    command.set_defaults(handler=compare)
+
+    args = parser.parse_args(argv)
+    if args.command == 'files' and not args.size and not args.records:
+        parser.error('files needs --size or --records')
+    return args.handler(args) or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
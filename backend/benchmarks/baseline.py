@@ -0,0 +1,109 @@
+"""
+Machine-readable benchmark results and regression comparison
+"""
+
+import os
+import sys
+import json
+import platform
+import subprocess
+from datetime import datetime
+
+# Result fields compared between runs; True when a larger value is worse
+COMPARED_FIELDS = {
+    'p50_ms': True,
+    'p95_ms': True,
+    'p99_ms': True,
+    'median_ms': True,
+    'throughput_rps': False
+}
+
+
+def environment():
+    """Where the results were measured; only comparable on a similar machine"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'timestamp': datetime.utcnow().isoformat(),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def save_results(path, suite, results, parameters):
+    """Write results with their parameters and environment as JSON"""
+    document = {
+        'suite': suite,
+        'environment': environment(),
+        'parameters': parameters,
+        'results': results
+    }
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+    return document
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(baseline, current, threshold=0.2, min_delta_ms=1.0):
+    """
+    Compare the benchmarks present in both documents. A field regresses when
+    it is more than threshold (a fraction) worse than the baseline; latency
+    changes under min_delta_ms are treated as noise. Returns (regressions,
+    improvements, missing benchmark names).
+    """
+    regressions = []
+    improvements = []
+    missing = sorted(set(baseline['results']) - set(current['results']))
+
+    for name in sorted(set(baseline['results']) & set(current['results'])):
+        before, after = baseline['results'][name], current['results'][name]
+        for field, larger_is_worse in COMPARED_FIELDS.items():
+            old, new = before.get(field), after.get(field)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if field.endswith('_ms') and abs(new - old) < min_delta_ms:
+                continue
+            entry = {'benchmark': name, 'field': field, 'baseline': old, 'current': new,
+                     'change': round(change, 4)}
+            worse = change > threshold if larger_is_worse else change < -threshold
+            better = change < -threshold if larger_is_worse else change > threshold
+            if worse:
+                regressions.append(entry)
+            elif better:
+                improvements.append(entry)
+    return regressions, improvements, missing
+
+
+def report(baseline_path, current_path, threshold=0.2, min_delta_ms=1.0, out=sys.stdout):
+    """Print the comparison of two result files; returns the number of regressions"""
+    baseline, current = load_results(baseline_path), load_results(current_path)
+    if baseline.get('suite') != current.get('suite'):
+        print(f"Warning: comparing suite {current.get('suite')} against {baseline.get('suite')}", file=out)
+    if baseline.get('parameters') != current.get('parameters'):
+        print("Warning: the runs used different parameters", file=out)
+    regressions, improvements, missing = compare(baseline, current, threshold, min_delta_ms)
+
+    for title, entries in (('Regressions', regressions), ('Improvements', improvements)):
+        if entries:
+            print(f"{title}:", file=out)
+            for entry in entries:
+                print(f"  {entry['benchmark']:<64} {entry['field']:<15} "
+                      f"{entry['baseline']} -> {entry['current']} ({entry['change']:+.1%})", file=out)
+    if missing:
+        print(f"Missing from the current run: {', '.join(missing)}", file=out)
+    print(f"{len(regressions)} regressions, {len(improvements)} improvements "
+          f"(threshold {threshold:.0%})", file=out)
+    return len(regressions)
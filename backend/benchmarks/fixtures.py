@@ -0,0 +1,247 @@
+"""
+Synthetic fixtures: bulk database rows and large dataset files shaped like
+datasets/sample_dataset.json
+"""
+
+import csv
+import json
+import random
+from datetime import datetime, timedelta
+
+# (vulnerability type, code template); safe records use the same shapes done right
+VULNERABLE_TEMPLATES = [
+    ('SQL Injection',
+     'def {name}(user_input):\n    query = "SELECT * FROM {table} WHERE id = \'" + user_input + "\'"\n'
+     '    return execute_query(query)'),
+    ('Command Injection',
+     'import os\n\ndef {name}(filename):\n    os.system("cat " + filename)'),
+    ('Insecure Deserialization',
+     'import pickle\n\ndef {name}(path):\n    with open(path, \'rb\') as f:\n        return pickle.load(f)'),
+    ('Cross-Site Scripting',
+     'def {name}(request):\n    return "<div>" + request.args.get("{table}") + "</div>"'),
+    ('Path Traversal',
+     'def {name}(request):\n    with open("/var/data/" + request.args["{table}"]) as f:\n        return f.read()'),
+    ('Code Injection',
+     'def {name}(expression):\n    return eval(expression)')
+]
+
+SAFE_TEMPLATES = [
+    'def {name}(user_input):\n    query = "SELECT * FROM {table} WHERE id = ?"\n'
+    '    return execute_query(query, (user_input,))',
+    'import subprocess\n\ndef {name}(filename):\n    subprocess.run(["cat", filename], check=True)',
+    'import json\n\ndef {name}(path):\n    with open(path, \'r\') as f:\n        return json.load(f)',
+    'from markupsafe import escape\n\ndef {name}(request):\n'
+    '    return "<div>" + escape(request.args.get("{table}")) + "</div>"',
+    'import ast\n\ndef {name}(expression):\n    return ast.literal_eval(expression)'
+]
+
+WORDS = ['user', 'order', 'invoice', 'session', 'account', 'report', 'profile', 'cart', 'token', 'upload']
+
+UNITS = {'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3}
+
+
+def parse_size(value):
+    """Parse a size such as '512MB' or '2GB' into bytes"""
+    value = str(value).strip().upper()
+    for unit, scale in UNITS.items():
+        if value.endswith(unit):
+            return int(float(value[:-len(unit)]) * scale)
+    return int(value)
+
+
+def make_record(rng, vulnerable_ratio=0.5, max_extra_lines=12):
+    """One synthetic record with a code snippet, label and vulnerability type"""
+    name = f'{rng.choice(WORDS)}_{rng.choice(WORDS)}_{rng.randrange(10 ** 6)}'
+    table = rng.choice(WORDS) + 's'
+    if rng.random() < vulnerable_ratio:
+        vulnerability_type, template = rng.choice(VULNERABLE_TEMPLATES)
+        label = 1
+    else:
+        vulnerability_type, template, label = 'None', rng.choice(SAFE_TEMPLATES), 0
+
+    # Unrelated statements vary the record length like real functions do
+    extra = [f'    {rng.choice(WORDS)}_{i} = {rng.randrange(1000)}' for i in range(rng.randrange(max_extra_lines + 1))]
+    code = template.format(name=name, table=table)
+    if extra:
+        head, _, body = code.rpartition('\n')
+        code = '\n'.join([head] + extra + [body])
+    return {'code': code, 'label': label, 'vulnerability_type': vulnerability_type}
+
+
+def iter_synthetic_records(seed=0, vulnerable_ratio=0.5):
+    rng = random.Random(seed)
+    while True:
+        yield make_record(rng, vulnerable_ratio)
+
+
+def write_dataset_file(path, file_format, size=None, num_records=None, seed=0):
+    """
+    Stream synthetic records to a JSON array, JSONL or CSV file until it
+    holds num_records records or reaches size bytes; memory use stays flat
+    however large the file. Returns (records written, bytes written).
+    """
+    if size is None and num_records is None:
+        raise ValueError("Either size or num_records is required")
+    written = 0
+    count = 0
+
+    def done():
+        return (num_records is not None and count >= num_records) or (size is not None and written >= size)
+
+    records = iter_synthetic_records(seed)
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        if file_format == 'csv':
+            writer = csv.writer(f)
+            writer.writerow(['code', 'label', 'vulnerability_type'])
+            while not done():
+                record = next(records)
+                writer.writerow([record['code'], record['label'], record['vulnerability_type']])
+                count += 1
+                # Byte count is approximate for CSV; tell() is exact but slow to call per row
+                written += len(record['code']) + len(record['vulnerability_type']) + 8
+            written = f.tell()
+        elif file_format in ('json', 'jsonl'):
+            separator = '\n' if file_format == 'jsonl' else ',\n'
+            if file_format == 'json':
+                written += f.write('[\n')
+            while not done():
+                text = json.dumps(next(records))
+                if count:
+                    written += f.write(separator)
+                written += f.write(text)
+                count += 1
+            written += f.write('\n]\n' if file_format == 'json' else '\n')
+        else:
+            raise ValueError(f"Unsupported dataset format: {file_format}")
+    return count, written
+
+
+def _insert(db, table, rows, batch_size):
+    batch = []
+    total = 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            db.session.execute(table.insert(), batch)
+            db.session.commit()
+            total += len(batch)
+            batch = []
+    if batch:
+        db.session.execute(table.insert(), batch)
+        db.session.commit()
+        total += len(batch)
+    return total
+
+
+def populate_database(num_models=100000, num_datasets=100000, num_tasks=10000, metrics_per_task=100,
+                      dataset_file=None, seed=0, batch_size=10000):
+    """
+    Bulk insert synthetic models, datasets, training tasks and their epoch
+    metrics with Core executemany, which is far faster than the ORM at
+    this scale. Needs an app context on an empty database; returns the
+    [first, last] id of each table and the number of metric rows.
+    """
+    from app.models import db, Model, Dataset, TrainingTask, TrainingMetric
+
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    ranges = {}
+
+    def id_range(model):
+        return [db.session.query(db.func.min(model.id)).scalar(),
+                db.session.query(db.func.max(model.id)).scalar()]
+
+    def models():
+        for i in range(num_models):
+            accuracy = rng.uniform(0.6, 0.99)
+            yield {
+                'name': f'bench-model-{i}',
+                'description': f'Synthetic {rng.choice(WORDS)} vulnerability detector',
+                'version': f'1.{i % 10}.0',
+                'model_type': rng.choice(['vulnerability_detection', 'fine_grained_location']),
+                'file_path': None,
+                'accuracy': accuracy,
+                'precision': accuracy - rng.uniform(0, 0.05),
+                'recall': accuracy - rng.uniform(0, 0.05),
+                'f1_score': accuracy - rng.uniform(0, 0.03),
+                'created_at': now - timedelta(minutes=i),
+                'updated_at': now
+            }
+    _insert(db, Model.__table__, models(), batch_size)
+    ranges['models'] = id_range(Model)
+
+    def datasets():
+        for i in range(num_datasets):
+            num_samples = rng.randrange(100, 100000)
+            num_vulnerable = rng.randrange(num_samples)
+            yield {
+                'name': f'bench-dataset-{i}',
+                'description': 'Synthetic dataset',
+                'file_path': dataset_file,
+                'format': 'json',
+                'size': num_samples * 200,
+                'num_samples': num_samples,
+                'num_vulnerable': num_vulnerable,
+                'num_safe': num_samples - num_vulnerable,
+                'preprocessing_status': 'completed',
+                'created_at': now - timedelta(minutes=i),
+                'updated_at': now
+            }
+    _insert(db, Dataset.__table__, datasets(), batch_size)
+    ranges['datasets'] = id_range(Dataset)
+
+    statuses = ['completed'] * 6 + ['failed', 'stopped', 'running', 'queued']
+
+    def tasks():
+        for i in range(num_tasks):
+            status = rng.choice(statuses)
+            start = now - timedelta(hours=rng.randrange(1, 24 * 30))
+            yield {
+                'name': f'bench-task-{i}',
+                'model_id': rng.randint(*ranges['models']) if num_models else None,
+                'dataset_id': rng.randint(*ranges['datasets']) if num_datasets else None,
+                'status': status,
+                'progress': 100.0 if status == 'completed' else rng.uniform(0, 100),
+                'current_epoch': metrics_per_task,
+                'total_epochs': metrics_per_task,
+                'loss': rng.uniform(0.05, 1.0),
+                'accuracy': rng.uniform(0.6, 0.99),
+                'hyperparameters': {'learning_rate': rng.choice([0.01, 0.001, 0.0001]),
+                                    'batch_size': rng.choice([16, 32, 64])},
+                'priority': rng.randrange(3),
+                'owner': f'user-{rng.randrange(20)}',
+                'queue': 'default',
+                'cpu_request': 1.0,
+                'memory_request': 2048,
+                'attempts': 1,
+                'epochs_without_improvement': 0,
+                'telemetry_count': 0,
+                'queued_at': start if status == 'queued' else None,
+                'start_time': start if status != 'queued' else None,
+                'end_time': start + timedelta(hours=1) if status in ('completed', 'failed', 'stopped') else None,
+                'created_at': start,
+                'updated_at': now
+            }
+    _insert(db, TrainingTask.__table__, tasks(), batch_size)
+    ranges['tasks'] = id_range(TrainingTask)
+
+    def metrics():
+        if not num_tasks:
+            return
+        for task_id in range(ranges['tasks'][0], ranges['tasks'][1] + 1):
+            loss = rng.uniform(0.8, 1.5)
+            start = now - timedelta(hours=rng.randrange(1, 24 * 30))
+            for epoch in range(1, metrics_per_task + 1):
+                loss *= rng.uniform(0.9, 1.0)
+                yield {
+                    'task_id': task_id,
+                    'epoch': epoch,
+                    'loss': loss,
+                    'accuracy': 1 - loss / 2,
+                    'validation_loss': loss * rng.uniform(1.0, 1.2),
+                    'validation_accuracy': 1 - loss / 1.8,
+                    'learning_rate': 0.001,
+                    'timestamp': start + timedelta(minutes=epoch)
+                }
+    ranges['metric_rows'] = _insert(db, TrainingMetric.__table__, metrics(), batch_size)
+    return ranges
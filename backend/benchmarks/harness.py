@@ -0,0 +1,202 @@
+"""
+Concurrent load harness: every route of the API under N concurrent clients,
+reporting latency percentiles and throughput per route
+"""
+
+import time
+import random
+import threading
+import requests
+
+# Route arguments and the fixture ranges they are drawn from
+ARGUMENT_RANGES = {
+    'model_id': 'models',
+    'dataset_id': 'datasets',
+    'task_id': 'tasks'
+}
+
+# Routes that call external services, stream, or need files the fixtures do not create
+SKIPPED_RULES = {
+    '/static/<path:filename>',
+    '/api/chat/stream',
+    '/api/models/<int:model_id>/predict',
+    '/api/training/lease',
+    '/api/training/tasks/<int:task_id>/checkpoints/<int:checkpoint_id>/download',
+    # Not found unless profiling is enabled
+    '/api/debug/profiles',
+    '/api/debug/slow-queries'
+}
+
+# Writes that leave the fixtures reusable: request bodies for the routes that
+# are benchmarked with --writes. Other mutating routes create or delete rows;
+# telemetry is only accepted while a task runs, which few fixture tasks do.
+WRITE_BODIES = {
+    ('PUT', '/api/models/<int:model_id>'): lambda rng: {'description': f'Updated {rng.randrange(10 ** 6)}'},
+    ('PUT', '/api/datasets/<int:dataset_id>'): lambda rng: {'description': f'Updated {rng.randrange(10 ** 6)}'},
+    ('POST', '/api/training/tasks/<int:task_id>/metrics'): lambda rng: {
+        'epoch': rng.randrange(1, 100), 'loss': rng.uniform(0.1, 1), 'accuracy': rng.uniform(0.5, 1)},
+    ('POST', '/api/chat/message'): lambda rng: {'content': '什么是SQL注入？', 'session_id': f'bench-{rng.randrange(100)}'}
+}
+
+
+class Target:
+    """One method and rule to load, with a way to draw concrete URLs and bodies"""
+
+    def __init__(self, method, rule, arguments, ranges, body=None):
+        self.method = method
+        self.rule = rule
+        self.arguments = arguments
+        self.ranges = ranges
+        self.body = body
+
+    @property
+    def name(self):
+        return f'{self.method} {self.rule}'
+
+    def path(self, rng):
+        path = self.rule
+        for argument in self.arguments:
+            low, high = self.ranges[ARGUMENT_RANGES[argument]]
+            path = path.replace(f'<int:{argument}>', str(rng.randint(low, high)))
+        return path
+
+
+def route_targets(app, ranges, writes=False, only=None):
+    """
+    Benchmark targets for the app's routes: every GET route whose arguments
+    can be drawn from the fixture id ranges, and with writes the routes in
+    WRITE_BODIES. only filters by substring of the rule.
+    """
+    targets = []
+    for rule in sorted(app.url_map.iter_rules(), key=lambda rule: rule.rule):
+        if rule.rule in SKIPPED_RULES or (only and not any(part in rule.rule for part in only)):
+            continue
+        arguments = sorted(rule.arguments)
+        if any(ARGUMENT_RANGES.get(argument) not in ranges or not ranges[ARGUMENT_RANGES[argument]][0]
+               for argument in arguments):
+            continue
+        for method in sorted(rule.methods - {'HEAD', 'OPTIONS'}):
+            if method == 'GET':
+                targets.append(Target(method, rule.rule, arguments, ranges))
+            elif writes and (method, rule.rule) in WRITE_BODIES:
+                targets.append(Target(method, rule.rule, arguments, ranges, WRITE_BODIES[(method, rule.rule)]))
+    return targets
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = min(int(fraction * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        'requests': count,
+        'errors': errors,
+        'mean_ms': round(sum(latencies) / count * 1000, 3) if count else None,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3) if count else None,
+        'p90_ms': round(percentile(latencies, 0.90) * 1000, 3) if count else None,
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3) if count else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3) if count else None,
+        'max_ms': round(latencies[-1] * 1000, 3) if count else None,
+        'throughput_rps': round(count / elapsed, 2) if elapsed > 0 else None
+    }
+
+
+def load_target(base_url, target, clients=8, num_requests=200, warmup=5, timeout=60, seed=0):
+    """
+    Send num_requests requests for one target from clients concurrent
+    threads, each on its own keep-alive session, after a few warm-up
+    requests. Error responses are counted and left out of the latencies.
+    """
+    remaining = [num_requests]
+    lock = threading.Lock()
+    latencies = []
+    errors = [0]
+
+    def send(session, rng):
+        kwargs = {'json': target.body(rng)} if target.body else {}
+        start = time.perf_counter()
+        response = session.request(target.method, base_url + target.path(rng), timeout=timeout, **kwargs)
+        response.content  # Include reading the body
+        return time.perf_counter() - start, response.status_code < 400
+
+    def client(index):
+        rng = random.Random(seed * 1000 + index)
+        local = []
+        failures = 0
+        with requests.Session() as session:
+            while True:
+                with lock:
+                    if remaining[0] <= 0:
+                        break
+                    remaining[0] -= 1
+                try:
+                    latency, ok = send(session, rng)
+                except requests.RequestException:
+                    failures += 1
+                    continue
+                if ok:
+                    local.append(latency)
+                else:
+                    failures += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += failures
+
+    with requests.Session() as session:
+        rng = random.Random(seed)
+        for _ in range(warmup):
+            try:
+                send(session, rng)
+            except requests.RequestException:
+                pass
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, errors[0], time.perf_counter() - start)
+
+
+def serve_app(config_name='production'):
+    """
+    Serve the app on a free local port from a child process, so the server
+    does not share the client threads' interpreter lock. Returns (base URL,
+    process); terminate the process when done.
+    """
+    import multiprocessing
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, args=(config_name, ready), daemon=True)
+    process.start()
+    port = ready.get(timeout=120)
+    return f'http://127.0.0.1:{port}', process
+
+
+def _serve(config_name, ready):
+    import logging
+    from werkzeug.serving import make_server
+    from app import create_app
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, create_app(config_name), threaded=True)
+    ready.put(server.server_port)
+    server.serve_forever()
+
+
+def run_routes(base_url, targets, clients=8, num_requests=200, warmup=5, log=print):
+    """Benchmark each target in turn; returns {target name: summary}"""
+    results = {}
+    for target in targets:
+        summary = load_target(base_url, target, clients, num_requests, warmup)
+        summary.update(method=target.method, rule=target.rule)
+        results[target.name] = summary
+        log(f"{target.name:<70} p50 {summary['p50_ms']} ms  p99 {summary['p99_ms']} ms  "
+            f"{summary['throughput_rps']} req/s  {summary['errors']} errors")
+    return results
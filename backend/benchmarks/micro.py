@@ -0,0 +1,88 @@
+"""
+Micro-benchmarks of the hot helpers behind the slow routes: dataset
+analysis and parsing, and model serialization
+"""
+
+import os
+import json
+import time
+import random
+import tempfile
+from datetime import datetime, timedelta
+from .fixtures import write_dataset_file
+
+
+def measure(func, items, repeat=5):
+    """Run func repeat times; returns timings in ms and items per second at the median"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    median = timings[len(timings) // 2]
+    return {
+        'items': items,
+        'repeat': repeat,
+        'min_ms': round(timings[0] * 1000, 3),
+        'median_ms': round(median * 1000, 3),
+        'items_per_sec': round(items / median, 1) if median > 0 else None
+    }
+
+
+def dataset_benchmarks(folder, num_records, repeat):
+    from app.services.dataset_service import analyze_dataset, iter_records
+
+    results = {}
+    for file_format in ('json', 'jsonl', 'csv'):
+        path = os.path.join(folder, f'micro.{file_format}')
+        write_dataset_file(path, file_format, num_records=num_records)
+        if file_format != 'jsonl':
+            results[f'analyze_dataset[{file_format}]'] = measure(
+                lambda: analyze_dataset(path, file_format), num_records, repeat)
+        results[f'iter_records[{file_format}]'] = measure(
+            lambda: sum(1 for _ in iter_records(path, file_format)), num_records, repeat)
+    return results
+
+
+def serialization_benchmarks(app, num_rows, repeat):
+    from flask import jsonify
+    from app.models import Model, TrainingTask, TrainingMetric
+
+    rng = random.Random(0)
+    now = datetime.utcnow()
+    models = [Model(id=i, name=f'model-{i}', description='Synthetic model', version='1.0.0',
+                    model_type='vulnerability_detection', accuracy=rng.random(), precision=rng.random(),
+                    recall=rng.random(), f1_score=rng.random(), created_at=now, updated_at=now)
+              for i in range(num_rows)]
+    metrics = [TrainingMetric(id=i, task_id=1, epoch=i, loss=rng.random(), accuracy=rng.random(),
+                              validation_loss=rng.random(), validation_accuracy=rng.random(),
+                              learning_rate=0.001, timestamp=now + timedelta(seconds=i))
+               for i in range(num_rows)]
+    tasks = [TrainingTask(id=i, name=f'task-{i}', status='completed', progress=100.0, total_epochs=10,
+                          hyperparameters={'learning_rate': 0.001, 'batch_size': 32},
+                          created_at=now, updated_at=now)
+             for i in range(num_rows)]
+
+    results = {
+        'Model.to_dict': measure(lambda: [model.to_dict() for model in models], num_rows, repeat),
+        'TrainingTask.to_dict': measure(lambda: [task.to_dict() for task in tasks], num_rows, repeat),
+        'TrainingMetric.to_dict': measure(lambda: [metric.to_dict() for metric in metrics], num_rows, repeat),
+        'json.dumps[models]': measure(
+            lambda: json.dumps([model.to_dict() for model in models]), num_rows, repeat)
+    }
+    with app.test_request_context():
+        results['jsonify[models]'] = measure(
+            lambda: jsonify([model.to_dict() for model in models]).get_data(), num_rows, repeat)
+    return results
+
+
+def run_micro(app, num_records=100000, num_rows=10000, repeat=5, log=print):
+    """Run every micro-benchmark; returns {benchmark name: timings}"""
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        results.update(dataset_benchmarks(folder, num_records, repeat))
+    results.update(serialization_benchmarks(app, num_rows, repeat))
+    for name, timing in results.items():
+        log(f"{name:<32} median {timing['median_ms']} ms  {timing['items_per_sec']} items/s")
+    return results
@@ -0,0 +1,75 @@
+"""
+Cold-start benchmark of the app factory: each run is a fresh interpreter,
+as when a worker or container restarts
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child; prints the phase timings as JSON
+PROBE = '''
+import sys, json, time
+start = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app(sys.argv[1])
+created = time.perf_counter()
+app.test_client().get('/health')
+served = time.perf_counter()
+print(json.dumps({
+    'import': imported - start,
+    'create_app': created - imported,
+    'first_request': served - created,
+    'modules': len(sys.modules),
+    'numpy_loaded': type(sys.modules.get('numpy')).__name__ == 'module',  # Not still lazy
+    'alembic_loaded': 'alembic' in sys.modules
+}))
+'''
+
+PHASES = ('process', 'import', 'create_app', 'first_request')
+
+
+def probe(config_name, environment):
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', PROBE, config_name], cwd=BACKEND, env=environment,
+                            capture_output=True, text=True, check=True).stdout
+    timings = json.loads(output.strip().splitlines()[-1])
+    timings['process'] = time.perf_counter() - start
+    return timings
+
+
+def run_startup(repeat=10, config_name='production', log=print):
+    """
+    Time a fresh process through import, create_app and its first request,
+    with and without schema creation, on a database that already exists
+    (the restart case). Returns {phase[mode]: timings}.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        environment = dict(os.environ, DATABASE_URL=f'sqlite:///{os.path.join(folder, "startup.db")}',
+                           METRICS_DIR='')
+        probe(config_name, environment)  # Creates the schema and warms the bytecode cache
+
+        for mode, auto_create in (('auto_create_schema', 'true'), ('no_schema', 'false')):
+            environment['AUTO_CREATE_SCHEMA'] = auto_create
+            runs = [probe(config_name, environment) for _ in range(repeat)]
+            for phase in PHASES:
+                timings = sorted(run[phase] for run in runs)
+                results[f'{phase}[{mode}]'] = {
+                    'repeat': repeat,
+                    'min_ms': round(timings[0] * 1000, 3),
+                    'median_ms': round(timings[len(timings) // 2] * 1000, 3)
+                }
+            results[f'process[{mode}]'].update(modules=runs[-1]['modules'],
+                                               numpy_loaded=runs[-1]['numpy_loaded'],
+                                               alembic_loaded=runs[-1]['alembic_loaded'])
+
+    for name, timing in results.items():
+        log(f"{name:<36} median {timing['median_ms']} ms  min {timing['min_ms']} ms")
+    return results
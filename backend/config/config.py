@@ -9,11 +9,36 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, '..', 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Create missing tables on startup; disable where `flask db upgrade` manages the schema
+    AUTO_CREATE_SCHEMA = os.environ.get('AUTO_CREATE_SCHEMA', 'true').lower() == 'true'
     
     # File upload settings
     UPLOAD_FOLDER = os.path.join(basedir, '..', 'uploads')
     MAX_CONTENT_LENGTH = 500 * 1024 * 1024  # 500MB max file size
-    ALLOWED_EXTENSIONS = {'py', 'json', 'csv', 'txt', 'zip', 'pkl', 'pt', 'pth', 'h5'}
+    ALLOWED_EXTENSIONS = {'py', 'json', 'jsonl', 'csv', 'txt', 'zip', 'pkl', 'pt', 'pth', 'h5'}
+    BULK_MAX_ITEMS = int(os.environ.get('BULK_MAX_ITEMS', 5000))  # Items per bulk create/update/delete request
+    
+    # Storage reclamation settings
+    FILE_RECLAIM_INTERVAL = int(os.environ.get('FILE_RECLAIM_INTERVAL', 30))  # Seconds between passes; 0 disables the thread
+    FILE_RECLAIM_MAX_ATTEMPTS = 5  # Failed removals before a tombstone is marked failed
+    ORPHAN_SCAN_INTERVAL = int(os.environ.get('ORPHAN_SCAN_INTERVAL', 6 * 3600))  # 0 disables periodic scans
+    ORPHAN_GRACE_SECONDS = 3600  # Untracked files younger than this are left alone, e.g. uploads being saved
+    
+    # Code search settings
+    SEARCH_INDEX_INTERVAL = int(os.environ.get('SEARCH_INDEX_INTERVAL', 10))  # Seconds between passes; 0 disables the thread
+    SEARCH_MAX_RESULTS = 1000  # Largest `limit` of a search
+    
+    # Evaluation settings
+    EVALUATION_INTERVAL = int(os.environ.get('EVALUATION_INTERVAL', 10))  # Seconds between passes; 0 disables the thread
+    
+    # Localization results settings
+    LOCALIZATION_MAX_RESULTS = 1000  # Largest `k` of top lines and `limit` of riskiest files
+    LOCALIZATION_MAX_BATCH = 100000  # Most line results accepted in one request
+    LOCALIZATION_MAX_LINE = 10000000  # Largest line number a result may name
+    
+    # Model optimization settings
+    # Unpickle uploaded modules that are not TorchScript; this runs code from the file, so trusted uploads only
+    OPTIMIZATION_ALLOW_PICKLE = os.environ.get('OPTIMIZATION_ALLOW_PICKLE', 'false').lower() == 'true'
     
     # Celery configuration
     CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL') or 'redis://localhost:6379/0'
@@ -21,6 +46,97 @@ class Config:
     
     # Training settings
     TRAINING_OUTPUT_FOLDER = os.path.join(basedir, '..', 'training_outputs')
+    CHECKPOINT_KEEP_BEST = 3  # Default checkpoint retention: best k by monitored metric
+    CHECKPOINT_KEEP_LAST = 2  # ...plus the latest n
+    TRAINING_DISPATCH = os.environ.get('TRAINING_DISPATCH') or 'inline'  # inline, worker
+    TRAINING_LEASE_SECONDS = int(os.environ.get('TRAINING_LEASE_SECONDS', 60))
+    TRAINING_LEASE_MAX_WAIT = 30  # Longest long-poll for a lease, in seconds
+    TRAINING_LEASE_POLL_INTERVAL = 1
+    TRAINING_MAX_ATTEMPTS = int(os.environ.get('TRAINING_MAX_ATTEMPTS', 3))
+    TRAINING_AGING_SECONDS = 600  # Queued tasks gain one priority level per this many seconds
+    TRAINING_FAIR_SHARE_WEIGHT = 2.0  # Priority levels an owner loses when using all running capacity
+    TRAINING_BACKFILL_SECONDS = int(os.environ.get('TRAINING_BACKFILL_SECONDS', 1800))  # Wait after which a task that does not fit stops smaller ones overtaking it
+    TRAINING_DEFAULT_EPOCH_SECONDS = 60  # Epoch duration assumed before any task has completed
+    
+    # Training telemetry settings
+    TELEMETRY_RING_SIZE = 720  # Samples kept per running task, e.g. one hour at 5 s
+    TELEMETRY_DOWNSAMPLED_SIZE = 120  # Samples kept once a task finishes
+    TELEMETRY_MIN_SAMPLES = 6  # Samples needed before flagging a run
+    TELEMETRY_UNDERUTILIZED_RATIO = 0.3  # Mean CPU below this fraction of the request
+    TELEMETRY_LEAK_GROWTH = 0.2  # RSS growing steadily by more than this fraction
+    
+    # Prediction cache settings
+    PREDICTION_CACHE_PATH = os.environ.get('PREDICTION_CACHE_PATH') or \
+        os.path.join(basedir, '..', 'cache', 'predictions.db')
+    PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', 10000))
+    
+    # Chat history settings
+    CHAT_BUFFER_MESSAGES = 50  # Recent messages kept in memory per session
+    CHAT_BUFFER_SESSIONS = 1000  # Sessions kept in memory
+    CHAT_HISTORY_PAGE_MAX = 200
+    CHAT_RETENTION_DAYS = int(os.environ.get('CHAT_RETENTION_DAYS', 30))
+    CHAT_MAX_MESSAGES_PER_SESSION = int(os.environ.get('CHAT_MAX_MESSAGES_PER_SESSION', 1000))
+    CHAT_RETENTION_INTERVAL = 100  # Apply retention every N messages
+    
+    # AI assistant settings
+    AI_PROVIDER = os.environ.get('AI_PROVIDER') or 'builtin'  # builtin, qwen, ernie, chatglm, qianfan, local
+    AI_API_KEY = os.environ.get('AI_API_KEY')
+    AI_ENDPOINT = os.environ.get('AI_ENDPOINT')
+    AI_MODEL = os.environ.get('AI_MODEL')
+    AI_SYSTEM_PROMPT = os.environ.get('AI_SYSTEM_PROMPT') or \
+        '你是VulWeb代码漏洞检测平台的AI助手，帮助用户管理模型、数据集和训练任务。'
+    AI_TIMEOUT = int(os.environ.get('AI_TIMEOUT', 30))
+    AI_MAX_CONCURRENCY = int(os.environ.get('AI_MAX_CONCURRENCY', 8))
+    AI_QUEUE_TIMEOUT = 5  # Seconds to wait for a free provider slot
+    AI_POOL_SIZE = 8  # Idle keep-alive connections per provider
+    AI_ANSWER_CACHE_SIZE = 256
+    
+    # Chat retrieval settings
+    DOCS_FOLDER = os.environ.get('DOCS_FOLDER') or os.path.join(basedir, '..', '..')
+    RETRIEVAL_INDEX_PATH = os.path.join(basedir, '..', 'cache', 'docs_index.pkl')
+    RETRIEVAL_TOP_K = 3
+    SYSTEM_STATUS_TTL = 5  # Seconds system status aggregates are cached
+    
+    # Metrics settings
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+    METRICS_DIR = os.environ.get('METRICS_DIR')  # Shared by all worker processes; unset for one process
+    METRICS_FLUSH_INTERVAL = 5  # Seconds between writes of a process's totals to METRICS_DIR
+    
+    # Profiling settings
+    PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'false').lower() == 'true'
+    PROFILING_TOKEN = os.environ.get('PROFILING_TOKEN')  # Required in X-Profile-Token; debug endpoints refuse all requests without it
+    PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0))  # Fraction of requests profiled
+    PROFILING_INTERVAL = 0.005  # Stack sampling interval in seconds
+    PROFILING_KEEP = 20  # Slowest profiled requests kept
+    PROFILING_FOLDER = os.path.join(basedir, '..', 'cache', 'profiles')
+    SLOW_QUERY_THRESHOLD_MS = int(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 500))  # 0 disables the log
+    SLOW_QUERY_LOG_SIZE = 200
+    
+    # Admission control settings, per worker process; see services/admission_control.py
+    ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', 'true').lower() == 'true'
+    TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))  # Proxies whose X-Forwarded-For is trusted
+    ADMISSION_POOLS = {  # Concurrent requests admitted to each pool; 0 for no limit
+        'upload': int(os.environ.get('ADMISSION_UPLOAD_CONCURRENCY', 2)),
+        'checkpoint': int(os.environ.get('ADMISSION_CHECKPOINT_CONCURRENCY', 2)),
+        'inference': int(os.environ.get('ADMISSION_INFERENCE_CONCURRENCY', 4)),
+        'ingest': int(os.environ.get('ADMISSION_INGEST_CONCURRENCY', 4)),
+        'lease': int(os.environ.get('ADMISSION_LEASE_CONCURRENCY', 4)),  # Long-polling workers
+    }
+    ADMISSION_RATE_LIMITS = {  # (requests per second, burst) per client, or per training task
+        'upload': (1, 5),
+        'checkpoint': (1, 5),
+        'inference': (20, 50),
+        'ingest': (10, 50),
+    }
+    ADMISSION_ROUTES = {  # Endpoints of each pool; other multipart uploads go to 'upload'
+        'training.create_checkpoint': 'checkpoint',
+        'model.predict_code': 'inference',
+        'model.create_optimization': 'inference',
+        'training.add_training_metric': 'ingest',
+        'training.add_training_telemetry': 'ingest',
+        'localization.post_scan_results': 'ingest',
+        'training.lease_training_task': 'lease',
+    }
     
     @staticmethod
     def init_app(app):
@@ -40,6 +156,14 @@ class TestingConfig(Config):
     """Testing configuration"""
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    PREDICTION_CACHE_PATH = ':memory:'
+    RETRIEVAL_INDEX_PATH = None
+    SYSTEM_STATUS_TTL = 0
+    METRICS_DIR = None
+    FILE_RECLAIM_INTERVAL = 0  # Tests reclaim explicitly
+    SEARCH_INDEX_INTERVAL = 0  # Tests index explicitly
+    EVALUATION_INTERVAL = 0  # Tests run evaluations explicitly
+    ADMISSION_RATE_LIMITS = {}  # Tests upload and report faster than any client would
 
 config = {
     'development': DevelopmentConfig,
@@ -0,0 +1,326 @@
+"""
+Streaming Data Loader
+
+Feeds training batches from VulWeb datasets without loading the dataset into
+memory. Records are streamed from JSON, JSONL, CSV or ZIP files, shuffled
+through a bounded buffer, batched and prefetched on a background thread, so
+the first batch is ready as soon as the first records are parsed.
+
+    loader = DataLoader('uploads/dataset.jsonl', batch_size=32, seed=0)
+    for epoch in range(1, epochs + 1):
+        loader.set_epoch(epoch)
+        for batch in loader:
+            ...
+
+For data-parallel training every worker creates the loader with the same
+seed and its own shard_index; each record then goes to exactly one worker.
+
+A dataset version is read from its base file and the delta files of its
+lineage, as listed by GET /api/datasets/<id>/versions/<n>:
+
+    loader = DataLoader(version['dataset_path'], deltas=version['deltas'])
+"""
+
+import io
+import re
+import csv
+import json
+import queue
+import random
+import zipfile
+import threading
+
+FORMATS = ('json', 'jsonl', 'csv')
+
+SEPARATORS = re.compile(r'[\s,]*')  # Between the elements of a JSON array
+
+
+def detect_format(path):
+    """Return the dataset format from a file name"""
+    extension = path.rsplit('.', 1)[-1].lower() if '.' in path else ''
+    if extension in FORMATS or extension == 'zip':
+        return extension
+    raise ValueError(f"Unsupported dataset format: {path}")
+
+
+def iter_records(dataset_path, file_format=None, chunk_size=1024 * 1024):
+    """Stream records from a dataset file in file order"""
+    file_format = file_format or detect_format(dataset_path)
+    if file_format == 'zip':
+        yield from iter_zip_records(dataset_path, chunk_size)
+        return
+    with open(dataset_path, 'rb') as f:
+        yield from iter_stream_records(f, file_format, chunk_size)
+
+
+def iter_zip_records(dataset_path, chunk_size=1024 * 1024):
+    """Stream records from every dataset file inside a ZIP archive, by name"""
+    with zipfile.ZipFile(dataset_path) as archive:
+        for name in sorted(archive.namelist()):
+            try:
+                file_format = detect_format(name)
+            except ValueError:
+                continue
+            if file_format == 'zip' or name.endswith('/'):
+                continue
+            with archive.open(name) as f:
+                yield from iter_stream_records(f, file_format, chunk_size)
+
+
+def iter_stream_records(f, file_format, chunk_size=1024 * 1024):
+    """Stream records from a binary file object"""
+    if file_format == 'jsonl':
+        while True:
+            lines = [line for line in f.readlines(chunk_size) if line.strip()]
+            if not lines:
+                return
+            # Decoding a chunk of lines as one array is much faster than line by line
+            try:
+                records = json.loads(b'[' + b','.join(lines) + b']')
+            except json.JSONDecodeError:
+                records = [json.loads(line) for line in lines]
+            yield from records
+    elif file_format == 'csv':
+        yield from csv.DictReader(io.TextIOWrapper(f, encoding='utf-8', newline=''))
+    elif file_format == 'json':
+        yield from _iter_json_array(io.TextIOWrapper(f, encoding='utf-8'), chunk_size)
+    else:
+        raise ValueError(f"Unsupported dataset format: {file_format}")
+
+
+def _iter_json_array(f, chunk_size):
+    """Incrementally decode the elements of a top-level JSON array"""
+    decoder = json.JSONDecoder()
+    chunk = f.read(chunk_size)
+    buffer = chunk.lstrip()
+    while chunk and not buffer:
+        # Leading whitespace may fill whole chunks
+        chunk = f.read(chunk_size)
+        buffer = chunk.lstrip()
+    if not buffer.startswith('['):
+        raise ValueError("JSON dataset must be an array of records")
+    position = 1
+    eof = False
+
+    # Records are decoded in place by offset; the consumed prefix is only
+    # dropped when refilling, as slicing per record copies the whole buffer
+    while True:
+        position = SEPARATORS.match(buffer, position).end()
+        if buffer.startswith(']', position):
+            return
+        try:
+            record, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # Record spans the chunk boundary
+            if eof:
+                raise
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        yield record
+        if len(buffer) - position < chunk_size and not eof:
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+
+
+def iter_version_records(dataset_path, deltas, file_format=None, chunk_size=1024 * 1024):
+    """
+    Stream a dataset version: the base file's records, then the records added
+    by each delta, oldest first, without the records any delta removed.
+    Record ids are positions, numbered on from the base file by each delta.
+    """
+    removed = set()
+    for path in deltas:
+        with open(path, 'rb') as f:
+            removed.update(json.loads(f.readline())['removed'])
+
+    for record_id, record in enumerate(iter_records(dataset_path, file_format, chunk_size)):
+        if record_id not in removed:
+            yield record
+    for path in deltas:
+        with open(path, 'rb') as f:
+            header = json.loads(f.readline())
+            records = iter_stream_records(f, 'jsonl', chunk_size)
+            for record_id, record in enumerate(records, header['first_id']):
+                if record_id not in removed:
+                    yield record
+
+
+def select_indices(records, indices):
+    """Keep only the records at the given sorted positions, e.g. a dataset split"""
+    positions = iter(indices)
+    wanted = next(positions, None)
+    for position, record in enumerate(records):
+        if wanted is None:
+            return
+        if position == wanted:
+            yield record
+            wanted = next(positions, None)
+
+
+def shard(records, num_shards, shard_index):
+    """Deterministically keep every num_shards-th record, starting at shard_index"""
+    for position, record in enumerate(records):
+        if position % num_shards == shard_index:
+            yield record
+
+
+def shuffle_buffer(records, buffer_size, rng):
+    """
+    Approximately shuffle a stream using a fixed-size buffer: each incoming
+    record replaces a random element of the buffer, which is emitted
+    """
+    buffer = []
+    for record in records:
+        if len(buffer) < buffer_size:
+            buffer.append(record)
+            continue
+        index = rng.randrange(buffer_size)
+        yield buffer[index]
+        buffer[index] = record
+    rng.shuffle(buffer)
+    yield from buffer
+
+
+def batches(records, batch_size, drop_last=False):
+    """Group a stream into lists of batch_size records"""
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch and not drop_last:
+        yield batch
+
+
+class DataLoader:
+    """
+    Iterable of training batches streamed from a dataset file
+
+    Args:
+        dataset_path: Path to a .json, .jsonl, .csv or .zip dataset
+        batch_size: Records per batch
+        shuffle: Shuffle records through a buffer of buffer_size records
+        buffer_size: Shuffle buffer size; larger is more random, but uses more memory
+        seed: Base seed; combined with the epoch so each epoch is shuffled differently
+        num_shards: Number of data-parallel workers
+        shard_index: This worker's shard, in range(num_shards)
+        indices: Sorted record positions to load, e.g. from VulWebTrainer.get_split
+        prefetch: Batches prepared ahead of the training loop; 0 disables the background thread
+        collate_fn: Optional function turning a list of records into a batch
+        drop_last: Skip the final incomplete batch
+        file_format: Dataset format, detected from the file name by default
+        deltas: Delta files of a dataset version, oldest first; the version is loaded instead
+    """
+
+    def __init__(self, dataset_path, batch_size=32, shuffle=True, buffer_size=10000, seed=0,
+                 num_shards=1, shard_index=0, indices=None, prefetch=4, collate_fn=None,
+                 drop_last=False, file_format=None, deltas=None):
+        if batch_size < 1:
+            raise ValueError("batch_size must be positive")
+        if not 0 <= shard_index < num_shards:
+            raise ValueError("shard_index must be in range(num_shards)")
+        self.dataset_path = dataset_path
+        self.file_format = file_format or detect_format(dataset_path)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.buffer_size = max(buffer_size, 1)
+        self.seed = seed
+        self.num_shards = num_shards
+        self.shard_index = shard_index
+        self.indices = indices
+        self.prefetch = prefetch
+        self.collate_fn = collate_fn
+        self.drop_last = drop_last
+        self.deltas = deltas
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        """Reshuffle for a new epoch; all shards must use the same epoch"""
+        self.epoch = epoch
+
+    def _batches(self):
+        if self.deltas:
+            records = iter_version_records(self.dataset_path, self.deltas, self.file_format)
+        else:
+            records = iter_records(self.dataset_path, self.file_format)
+        if self.indices is not None:
+            records = select_indices(records, self.indices)
+        if self.num_shards > 1:
+            records = shard(records, self.num_shards, self.shard_index)
+        if self.shuffle:
+            rng = random.Random(f'{self.seed}:{self.epoch}:{self.shard_index}')
+            records = shuffle_buffer(records, self.buffer_size, rng)
+        for batch in batches(records, self.batch_size, self.drop_last):
+            yield self.collate_fn(batch) if self.collate_fn else batch
+
+    def __iter__(self):
+        if self.prefetch <= 0:
+            return self._batches()
+        return _Prefetcher(self._batches(), self.prefetch)
+
+
+_DONE = object()
+
+
+def _produce(generator, batches, stopped):
+    """
+    Fill the queue from the generator until it is exhausted or stopped. The
+    thread holds no reference to its _Prefetcher, so dropping the iterator
+    closes it and ends the thread.
+    """
+    try:
+        for batch in generator:
+            if not _put(batches, stopped, batch):
+                return
+        _put(batches, stopped, _DONE)
+    except BaseException as e:
+        _put(batches, stopped, e)
+    finally:
+        generator.close()
+
+
+def _put(batches, stopped, item):
+    # Poll so that an abandoned iterator does not leave the thread blocked
+    while not stopped.is_set():
+        try:
+            batches.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+class _Prefetcher:
+    """Run a batch generator on a background thread, a bounded number of batches ahead"""
+
+    def __init__(self, generator, size):
+        self.queue = queue.Queue(maxsize=size)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=_produce, args=(generator, self.queue, self.stopped),
+                                       daemon=True)
+        self.thread.start()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.stopped.is_set():
+            raise StopIteration
+        item = self.queue.get()
+        if item is _DONE:
+            self.close()
+            raise StopIteration
+        if isinstance(item, BaseException):
+            self.close()
+            raise item
+        return item
+
+    def close(self):
+        self.stopped.set()
+
+    def __del__(self):
+        self.close()
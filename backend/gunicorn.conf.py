@@ -0,0 +1,41 @@
+"""
+Gunicorn settings: gunicorn -c gunicorn.conf.py run:app
+
+With preload_app the app is created once in the master and forked into the
+workers, so a worker (re)start costs no imports or configuration and schema
+creation runs once instead of racing in every worker. post_fork drops the
+database connections each worker inherits from the master. With
+METRICS_DIR set, the master folds the metrics files of exited workers into
+one (see app/services/metrics_service.py), so the directory stays small.
+
+Workers are threaded so that a slow request holds one thread rather than a
+whole worker. Admission control (app/services/admission_control.py) caps
+how many of a worker's threads uploads, inference, metric ingestion and
+long-polling lease requests may take; keep its pool sizes below `threads`
+so the rest stay free for reads.
+"""
+
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 4))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        from run import app
+        from app import after_fork
+        after_fork(app)
+
+
+def on_starting(server):
+    from app.services.metrics_service import retire_processes
+    retire_processes(os.environ.get('METRICS_DIR'))  # Left by the workers of a previous run
+
+
+def child_exit(server, worker):
+    from app.services.metrics_service import retire_processes
+    retire_processes(os.environ.get('METRICS_DIR'), [worker.pid])
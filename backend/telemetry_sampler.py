@@ -0,0 +1,149 @@
+"""
+Training Telemetry Sampler
+
+Samples the CPU, memory and IO usage of a training process at a fixed
+interval on a background thread, together with the training throughput,
+and reports them to POST /api/training/tasks/<id>/telemetry. The platform
+keeps the samples in a per-task ring buffer and flags under-utilized and
+memory-leaking runs.
+
+    sampler = TelemetrySampler(task_id, api_url)
+    sampler.start()
+    for batch in loader:
+        ...
+        sampler.count(len(batch))
+    sampler.stop()
+
+Usage is read from /proc on Linux; elsewhere CPU time and peak RSS come
+from the resource module and IO counters are not reported.
+"""
+
+import os
+import time
+import random
+import threading
+from datetime import datetime, timezone
+import requests
+
+RETRY_STATUSES = (429, 503)  # The platform's admission control rejected the request, see Retry-After
+MAX_RETRY_WAIT = 60
+
+
+def post_with_retry(url, attempts=5, files=None, **kwargs):
+    """
+    POST to the platform, retrying requests it rejects as busy or rate
+    limited after the Retry-After it sends, with jitter so that rejected
+    clients do not all come back at once. Returns the last response.
+    """
+    for attempt in range(attempts):
+        for f in (files or {}).values():
+            f.seek(0)  # Resend uploads from the start
+        response = requests.post(url, files=files, **kwargs)
+        if response.status_code not in RETRY_STATUSES or attempt == attempts - 1:
+            return response
+        try:
+            wait = float(response.headers.get('Retry-After', 1))
+        except ValueError:
+            wait = 1
+        time.sleep(min(wait, MAX_RETRY_WAIT) * random.uniform(1, 1.5))
+
+
+def read_proc_usage(pid):
+    """Return (cpu seconds, rss bytes, read bytes, write bytes) for a process from /proc"""
+    with open(f'/proc/{pid}/stat') as f:
+        # The command name may contain spaces; fields resume after its closing paren
+        fields = f.read().rsplit(')', 1)[1].split()
+    ticks = os.sysconf('SC_CLK_TCK')
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / ticks
+    rss = int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+
+    read_bytes = write_bytes = None
+    try:
+        with open(f'/proc/{pid}/io') as f:
+            counters = dict(line.split(':', 1) for line in f if ':' in line)
+        read_bytes = int(counters['read_bytes'])
+        write_bytes = int(counters['write_bytes'])
+    except (OSError, KeyError, ValueError):
+        pass
+    return cpu_seconds, rss, read_bytes, write_bytes
+
+
+def read_resource_usage():
+    """Fallback without /proc: CPU time and peak RSS of the current process"""
+    import resource
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    scale = 1 if os.uname().sysname == 'Darwin' else 1024
+    return usage.ru_utime + usage.ru_stime, usage.ru_maxrss * scale, None, None
+
+
+class TelemetrySampler:
+    """Background sampler of one training process"""
+
+    def __init__(self, task_id, api_url='http://localhost:5000', interval=5.0, pid=None):
+        self.task_id = task_id
+        self.api_url = api_url
+        self.interval = interval
+        self.pid = pid or os.getpid()
+        self.samples_seen = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._last = None
+
+    def count(self, samples):
+        """Record training samples processed since the last call"""
+        with self._lock:
+            self.samples_seen += samples
+
+    def read_usage(self):
+        if os.path.exists(f'/proc/{self.pid}/stat'):
+            return read_proc_usage(self.pid)
+        return read_resource_usage()
+
+    def sample(self):
+        """Take a sample; rates cover the time since the previous sample"""
+        now = time.monotonic()
+        cpu_seconds, rss, read_bytes, write_bytes = self.read_usage()
+        with self._lock:
+            seen = self.samples_seen
+
+        sample = {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'rss': rss,
+            'read_bytes': read_bytes,
+            'write_bytes': write_bytes
+        }
+        if self._last:
+            elapsed = now - self._last[0]
+            if elapsed > 0:
+                sample['cpu_percent'] = 100 * (cpu_seconds - self._last[1]) / elapsed
+                sample['samples_per_sec'] = (seen - self._last[2]) / elapsed
+        self._last = (now, cpu_seconds, seen)
+        return sample
+
+    def report(self, sample):
+        try:
+            response = post_with_retry(f'{self.api_url}/api/training/tasks/{self.task_id}/telemetry',
+                                       attempts=3, json=sample, timeout=10)
+            if response.status_code == 409:
+                self._stopped.set()  # The task is no longer running
+        except requests.RequestException as e:
+            print(f"Error reporting telemetry: {e}")
+
+    def _run(self):
+        self.sample()  # Baseline for the first rates
+        while not self._stopped.wait(self.interval):
+            self.report(self.sample())
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
@@ -5,11 +5,26 @@ Run with: pytest tests/
 """
 
 import pytest
+import io
+import csv
+import gzip
 import json
 import os
 import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from app import create_app
-from app.models import db, Model, Dataset, TrainingTask
+from app.models import db, Model, Dataset, TrainingTask, TrainingMetric
+
+
+@pytest.fixture(autouse=True)
+def temp_folders(monkeypatch, tmp_path):
+    """Keep every test's uploads and training outputs in its own temporary folder"""
+    from config.config import TestingConfig
+    monkeypatch.setattr(TestingConfig, 'UPLOAD_FOLDER', str(tmp_path / 'uploads'))
+    monkeypatch.setattr(TestingConfig, 'TRAINING_OUTPUT_FOLDER', str(tmp_path / 'outputs'))
+    return tmp_path
 
 
 @pytest.fixture
@@ -30,6 +45,234 @@ def client(app):
     return app.test_client()
 
 
+class TestMetricsEndpoint:
+    """Test Prometheus instrumentation"""
+    
+    def test_request_and_db_metrics(self, client):
+        """Test per-endpoint counters, histograms and queue depths"""
+        client.get('/api/models')
+        client.get('/api/models')
+        client.get('/api/models/999')
+        
+        response = client.get('/metrics')
+        assert response.status_code == 200
+        assert response.mimetype == 'text/plain'
+        text = response.data.decode()
+        assert '# TYPE vulweb_http_requests_total counter' in text
+        assert 'vulweb_http_requests_total{endpoint="/api/models",method="GET",status="200"} 2' in text
+        assert 'vulweb_http_requests_total{endpoint="/api/models/<int:model_id>",method="GET",status="404"} 1' in text
+        assert 'vulweb_http_request_duration_seconds_count{endpoint="/api/models",method="GET"} 2' in text
+        assert 'vulweb_db_queries_per_request_bucket{endpoint="/api/models",method="GET",le="+Inf"} 2' in text
+    
+    def test_failed_statement_is_not_timed(self, app):
+        """Test that a failing statement does not leave its start time on the connection"""
+        from sqlalchemy import text
+        from sqlalchemy.exc import OperationalError
+        with app.app_context():
+            with db.engine.connect() as conn:
+                with pytest.raises(OperationalError):
+                    conn.execute(text('SELECT * FROM missing_table'))
+                conn.rollback()
+                conn.execute(text('SELECT 1'))
+                assert conn.info.get('query_start') == []
+    
+    def test_aggregates_worker_processes(self, app, client, tmp_path):
+        """Test that totals written by other processes are summed"""
+        from app.services.metrics_service import metrics
+        metrics.directory = str(tmp_path)
+        other = {
+            'pid': 2 ** 22 + 1,  # Not a running process: counters count, gauges do not
+            'counters': [['vulweb_http_requests_total',
+                          [['endpoint', '/api/models'], ['method', 'GET'], ['status', '200']], 5]],
+            'histograms': [],
+            'gauges': [['vulweb_uploads_in_flight', [], 3]]
+        }
+        (tmp_path / 'metrics_other.json').write_text(json.dumps(other))
+        
+        client.get('/api/models')
+        text = client.get('/metrics').data.decode()
+        assert 'vulweb_http_requests_total{endpoint="/api/models",method="GET",status="200"} 6' in text
+        assert 'vulweb_uploads_in_flight 0' in text
+        assert len(list(tmp_path.glob('metrics_*.json'))) == 2
+    
+    def test_exited_processes_are_retired(self, app, client, tmp_path):
+        """Test that exited workers' files are folded into one without losing counts"""
+        from app.services.metrics_service import metrics, retire_processes
+        metrics.directory = str(tmp_path)
+        labels = [['endpoint', '/api/models'], ['method', 'GET'], ['status', '200']]
+        for pid in (2 ** 22 + 1, 2 ** 22 + 2):
+            (tmp_path / f'metrics_{pid}_1.json').write_text(json.dumps({
+                'pid': pid, 'counters': [['vulweb_http_requests_total', labels, 5]], 'histograms': [], 'gauges': []}))
+        client.get('/api/models')
+        
+        assert retire_processes(str(tmp_path), [2 ** 22 + 1]) == 1
+        assert retire_processes(str(tmp_path)) == 1
+        assert retire_processes(str(tmp_path)) == 0
+        assert [path.name for path in tmp_path.glob('metrics_*.json')] == ['metrics_retired.json']
+        text = client.get('/metrics').data.decode()
+        assert 'vulweb_http_requests_total{endpoint="/api/models",method="GET",status="200"} 11' in text
+        assert retire_processes(str(tmp_path)) == 0  # This process's file stays
+
+
+class TestProfiling:
+    """Test on-demand request profiling and the slow-query log"""
+    
+    @pytest.fixture
+    def profiled_client(self, monkeypatch, tmp_path):
+        from config.config import TestingConfig
+        monkeypatch.setattr(TestingConfig, 'PROFILING_ENABLED', True)
+        monkeypatch.setattr(TestingConfig, 'PROFILING_FOLDER', str(tmp_path / 'profiles'))
+        monkeypatch.setattr(TestingConfig, 'PROFILING_KEEP', 2)
+        monkeypatch.setattr(TestingConfig, 'PROFILING_TOKEN', 'secret')
+        app = create_app('testing')
+        with app.app_context():
+            db.create_all()
+            client = app.test_client()
+            client.environ_base['HTTP_X_PROFILE_TOKEN'] = 'secret'
+            yield client
+            db.session.remove()
+            db.drop_all()
+    
+    def test_profile_on_header(self, profiled_client):
+        """Test that only requests asking for a profile are profiled"""
+        profiled_client.get('/api/models')
+        assert profiled_client.get('/api/debug/profiles').json == []
+        
+        profiled_client.get('/api/models', headers={'X-Profile': 'cprofile'})
+        profiles = profiled_client.get('/api/debug/profiles').json
+        assert len(profiles) == 1
+        assert profiles[0]['path'] == '/api/models'
+        assert profiles[0]['num_queries'] >= 1
+        
+        profile = profiled_client.get(f'/api/debug/profiles/{profiles[0]["id"]}').json
+        assert 'SELECT' in profile['queries'][0]['statement']
+        assert 'cumulative' in profile['stats']
+        folded = profiled_client.get(f'/api/debug/profiles/{profiles[0]["id"]}/folded').data.decode()
+        assert all(line.rsplit(' ', 1)[1].isdigit() for line in folded.splitlines())
+    
+    def test_keeps_slowest_profiles(self, profiled_client):
+        """Test that only PROFILING_KEEP profiles are kept, slowest first"""
+        for _ in range(4):
+            profiled_client.get('/api/models', headers={'X-Profile': 'sample'})
+        durations = [p['duration_ms'] for p in profiled_client.get('/api/debug/profiles').json]
+        assert len(durations) == 2
+        assert durations == sorted(durations, reverse=True)
+    
+    def test_slow_query_log(self, profiled_client):
+        """Test that slow statements are logged with their plan"""
+        from flask import current_app
+        current_app.config['SLOW_QUERY_THRESHOLD_MS'] = 1e-9
+        profiled_client.get('/api/models')
+        
+        slow = profiled_client.get('/api/debug/slow-queries').json
+        assert slow and slow[0]['endpoint'] == '/api/models'
+        assert any('SCAN' in line for line in slow[0]['plan'])
+    
+    def test_disabled_by_default(self, client):
+        """Test that debug endpoints are unavailable unless enabled"""
+        assert client.get('/api/debug/profiles').status_code == 404
+    
+    def test_token_required(self, profiled_client):
+        """Test that debug endpoints and profiling on demand need the token"""
+        profiled_client.environ_base.pop('HTTP_X_PROFILE_TOKEN')
+        assert profiled_client.get('/api/debug/profiles').status_code == 403
+        assert profiled_client.get('/api/debug/profiles', headers={'X-Profile-Token': 'wrong'}).status_code == 403
+        
+        profiled_client.get('/api/models', headers={'X-Profile': 'sample'})
+        profiled_client.application.config['PROFILING_TOKEN'] = None
+        response = profiled_client.get('/api/debug/slow-queries', headers={'X-Profile-Token': 'secret'})
+        assert response.status_code == 403
+        assert 'PROFILING_TOKEN' in response.json['error']
+        profiled_client.application.config['PROFILING_TOKEN'] = 'secret'
+        assert profiled_client.get('/api/debug/profiles', headers={'X-Profile-Token': 'secret'}).json == []
+
+
+class TestStartup:
+    """Test startup modes of the app factory"""
+    
+    def test_heavy_imports_deferred(self):
+        """Test that a fresh app loads neither numpy nor alembic until used"""
+        import subprocess
+        import sys
+        probe = ("import sys\nfrom app import create_app\napp = create_app('testing')\n"
+                 "print(type(sys.modules.get('numpy')).__name__, 'alembic' in sys.modules)\n"
+                 "from app.services.split_service import np\nnp.zeros(1)\n"
+                 "print(type(sys.modules.get('numpy')).__name__)")
+        output = subprocess.run([sys.executable, '-c', probe], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout
+        assert output.split() == ['_LazyModule', 'False', 'module']
+    
+    def test_skip_schema_creation(self, monkeypatch):
+        """Test that AUTO_CREATE_SCHEMA=False leaves the schema to migrations"""
+        from config.config import TestingConfig
+        from sqlalchemy import inspect
+        from app import after_fork
+        monkeypatch.setattr(TestingConfig, 'AUTO_CREATE_SCHEMA', False)
+        app = create_app('testing')
+        with app.app_context():
+            assert inspect(db.engine).get_table_names() == []
+        after_fork(app)
+        
+        result = app.test_cli_runner().invoke(args=['init-db'])
+        assert 'created' in result.output
+        with app.app_context():
+            assert 'models' in inspect(db.engine).get_table_names()
+
+
+class TestBenchmarks:
+    """Test the benchmark fixtures and baseline comparison"""
+    
+    def test_synthetic_dataset_files(self, tmp_path):
+        """Test that generated files parse like uploaded datasets"""
+        from benchmarks.fixtures import write_dataset_file
+        from app.services.dataset_service import analyze_dataset, iter_records
+        
+        for file_format in ('json', 'csv'):
+            path = str(tmp_path / f'data.{file_format}')
+            count, _ = write_dataset_file(path, file_format, num_records=500)
+            stats = analyze_dataset(path, file_format)
+            assert count == stats['num_samples'] == 500
+            assert 0 < stats['num_vulnerable'] < 500
+            # A small chunk size puts records across chunk boundaries
+            assert len(list(iter_records(path, file_format, chunk_size=64))) == 500
+        
+        _, written = write_dataset_file(str(tmp_path / 'sized.json'), 'json', size=64 * 1024)
+        assert written >= 64 * 1024
+    
+    def test_populate_database_and_targets(self, app):
+        """Test bulk fixtures and that route targets resolve to existing rows"""
+        from benchmarks.fixtures import populate_database
+        from benchmarks.harness import route_targets
+        import random
+        
+        ranges = populate_database(num_models=50, num_datasets=20, num_tasks=10, metrics_per_task=5,
+                                   batch_size=16)
+        assert Model.query.count() == 50
+        assert ranges['metric_rows'] == 50
+        
+        client = app.test_client()
+        rng = random.Random(0)
+        targets = route_targets(app, ranges, writes=True, only=['/api/models', '/api/training/tasks'])
+        assert 'PUT /api/models/<int:model_id>' in [target.name for target in targets]
+        for target in targets:
+            path = target.path(rng)
+            response = client.open(path, method=target.method, json=target.body(rng) if target.body else None)
+            assert response.status_code < 400, path
+    
+    def test_compare_flags_regressions(self):
+        """Test that slower results beyond the threshold are regressions"""
+        from benchmarks.baseline import compare
+        
+        baseline = {'results': {'GET /api/models': {'p50_ms': 10.0, 'p99_ms': 40.0, 'throughput_rps': 100.0},
+                                'analyze_dataset[json]': {'median_ms': 50.0}}}
+        current = {'results': {'GET /api/models': {'p50_ms': 10.5, 'p99_ms': 80.0, 'throughput_rps': 60.0}}}
+        regressions, improvements, missing = compare(baseline, current, threshold=0.2)
+        assert {(r['benchmark'], r['field']) for r in regressions} == {
+            ('GET /api/models', 'p99_ms'), ('GET /api/models', 'throughput_rps')}
+        assert improvements == []
+        assert missing == ['analyze_dataset[json]']
+
+
 class TestModelAPI:
     """Test Model API endpoints"""
     
@@ -106,6 +349,46 @@ class TestModelAPI:
         assert response.status_code == 400
 
 
+class TestPredictionAPI:
+    """Test prediction endpoint and cache"""
+    
+    def test_predict_uses_cache(self, client):
+        """Test that repeated code is served from the cache"""
+        data = {'name': 'Test Model', 'model_type': 'vulnerability_detection'}
+        model_id = client.post('/api/models', data=data).json['id']
+        
+        code = 'data = pickle.load(f)\n'
+        first = client.post(f'/api/models/{model_id}/predict', json={'code': code})
+        assert first.status_code == 200
+        assert first.json['cached'] is False
+        assert first.json['vulnerability_type'] == 'Insecure Deserialization'
+        
+        # Formatting-only changes hit the same entry
+        second = client.post(
+            f'/api/models/{model_id}/predict',
+            json={'samples': [{'code': code + '\n\n'}, {'code': 'x = 1'}]}
+        )
+        assert second.status_code == 200
+        assert second.json['cached'] == 1
+        
+        stats = client.get('/api/models/cache/stats').json
+        assert stats['hits'] == 1
+        assert stats['misses'] == 2
+        assert stats['disk_entries'] == 2
+        
+        # The disk tier's entry count is reused rather than counted on every call
+        client.post(f'/api/models/{model_id}/predict', json={'code': 'y = 2'})
+        assert client.get('/api/models/cache/stats').json['disk_entries'] == 2
+    
+    def test_predict_requires_code(self, client):
+        """Test predicting without code"""
+        data = {'name': 'Test Model', 'model_type': 'vulnerability_detection'}
+        model_id = client.post('/api/models', data=data).json['id']
+        
+        response = client.post(f'/api/models/{model_id}/predict', json={})
+        assert response.status_code == 400
+
+
 class TestDatasetAPI:
     """Test Dataset API endpoints"""
     
@@ -167,6 +450,202 @@ class TestDatasetAPI:
         finally:
             os.unlink(temp_file)
 
+    def test_iter_json_records_across_chunks(self, tmp_path):
+        """Test that streamed records match json.load at every chunk size"""
+        from app.services.dataset_service import iter_json_records
+        records = [{'code': 'x' * (i % 37), 'label': i % 2, 'nested': [i, {'s': '],'}]} for i in range(200)]
+        path = tmp_path / 'data.json'
+        path.write_text(' [\n' + ',\n '.join(json.dumps(r) for r in records) + '\n]\n')
+
+        for chunk_size in (1, 7, 64, 1000, 1024 * 1024):
+            assert list(iter_json_records(str(path), chunk_size=chunk_size)) == records
+
+        path.write_text('[{"code": "a"}, {"code": ')
+        with pytest.raises(json.JSONDecodeError):
+            list(iter_json_records(str(path), chunk_size=8))
+
+
+class TestDatasetSplitAPI:
+    """Test dataset split endpoints"""
+    
+    def create_dataset(self, client, records, name='Split Dataset'):
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as f:
+            json.dump(records, f)
+            temp_file = f.name
+        try:
+            with open(temp_file, 'rb') as f:
+                return client.post('/api/datasets', data={'name': name, 'file': (f, f'{name}.json')}).json['id']
+        finally:
+            os.unlink(temp_file)
+    
+    def test_split_is_stratified_and_cached(self, client):
+        """Test stratification, determinism and reuse of splits"""
+        records = [{'code': str(i), 'label': i % 2, 'vulnerability_type': 'XSS' if i % 2 else 'None'}
+                   for i in range(100)]
+        dataset_id = self.create_dataset(client, records)
+        params = {'ratios': {'train': 0.8, 'validation': 0.1, 'test': 0.1}, 'seed': 42}
+        
+        response = client.post(f'/api/datasets/{dataset_id}/splits', json=params)
+        assert response.status_code == 201
+        assert response.json['counts'] == {'train': 80, 'validation': 10, 'test': 10}
+        split_id = response.json['id']
+        
+        # Same parameters reuse the stored split
+        again = client.post(f'/api/datasets/{dataset_id}/splits', json=params)
+        assert again.status_code == 200
+        assert again.json['id'] == split_id
+        
+        test = client.get(f'/api/datasets/{dataset_id}/splits/{split_id}?part=test').json['indices']
+        assert sum(records[i]['label'] for i in test) == 5
+        train = client.get(f'/api/datasets/{dataset_id}/splits/{split_id}?part=train').json['indices']
+        assert not set(train) & set(test)
+    
+    def test_group_aware_split(self, client):
+        """Test that a group never straddles parts"""
+        records = [{'code': str(i), 'label': i % 2, 'project': i % 10} for i in range(200)]
+        dataset_id = self.create_dataset(client, records)
+        
+        split = client.post(f'/api/datasets/{dataset_id}/splits', json={'group_key': 'project'}).json
+        parts = {}
+        for part in ('train', 'validation', 'test'):
+            indices = client.get(f'/api/datasets/{dataset_id}/splits/{split["id"]}?part={part}').json['indices']
+            for i in indices:
+                parts.setdefault(records[i]['project'], set()).add(part)
+        assert all(len(assigned) == 1 for assigned in parts.values())
+    
+    def test_npy_download(self, client):
+        """Test downloading indices as a NumPy file"""
+        import numpy as np
+        dataset_id = self.create_dataset(client, [{'code': str(i), 'label': 0} for i in range(10)])
+        split_id = client.post(f'/api/datasets/{dataset_id}/splits', json={}).json['id']
+        
+        response = client.get(f'/api/datasets/{dataset_id}/splits/{split_id}?part=train&format=npy')
+        assert np.load(io.BytesIO(response.data)).size == 8
+    
+    def test_invalid_parameters(self, client):
+        """Test rejecting seeds and ratios that are not numbers"""
+        dataset_id = self.create_dataset(client, [{'code': str(i), 'label': 0} for i in range(10)])
+        url = f'/api/datasets/{dataset_id}/splits'
+        for params in ({'seed': None}, {'seed': [1]}, {'seed': '1'}, {'ratios': {'train': True, 'test': 0.2}}):
+            assert client.post(url, json=params).status_code == 400
+        response = client.post(url, data='{"ratios": {"train": NaN, "test": 0.2}}', content_type='application/json')
+        assert response.status_code == 400
+    
+    def test_ratio_order_does_not_matter(self, app, client):
+        """Test that ratios listed in any order give the split they are cached under"""
+        from app.services.split_service import compute_split
+        dataset_id = self.create_dataset(client, [{'code': str(i), 'label': i % 2} for i in range(50)])
+        with app.app_context():
+            dataset = db.session.get(Dataset, dataset_id)
+            first = compute_split(dataset, {'train': 0.8, 'test': 0.2}, seed=3)
+            second = compute_split(dataset, {'test': 0.2, 'train': 0.8}, seed=3)
+        assert all((first[name] == second[name]).all() for name in ('train', 'test'))
+    
+    def test_concurrent_create_returns_existing(self, app, client, tmp_path, monkeypatch):
+        """Test that losing the race to create a split returns the winner's"""
+        from app.models import DatasetSplit
+        from app.services import split_service
+        dataset_id = self.create_dataset(client, [{'code': str(i), 'label': 0} for i in range(10)])
+        compute_split = split_service.compute_split
+        
+        def racing(dataset, ratios, *args):
+            parts = compute_split(dataset, ratios, *args)
+            # Another request commits the same split meanwhile
+            params_hash = split_service.split_params_hash(dataset, ratios, *args)
+            winner = DatasetSplit(dataset_id=dataset.id, params_hash=params_hash, counts={})
+            db.session.add(winner)
+            db.session.commit()
+            racing.winner_id = winner.id
+            return parts
+        
+        monkeypatch.setattr(split_service, 'compute_split', racing)
+        response = client.post(f'/api/datasets/{dataset_id}/splits', json={})
+        assert response.status_code == 200
+        assert response.json['id'] == racing.winner_id
+        assert [name.endswith('.npz') for name in os.listdir(tmp_path / 'uploads' / 'datasets' / 'Split_Dataset.json.splits')] == [True]
+
+
+class TestDataLoader:
+    """Test the trainer SDK's streaming data loader"""
+    
+    def write_jsonl(self, path, count):
+        with open(path, 'w') as f:
+            for i in range(count):
+                f.write(json.dumps({'id': i, 'code': f'print({i})', 'label': i % 2}) + '\n')
+    
+    def test_shards_cover_dataset_once(self, tmp_path):
+        """Test that shards are disjoint, complete and reproducible"""
+        from data_loader import DataLoader
+        path = str(tmp_path / 'data.jsonl')
+        self.write_jsonl(path, 103)
+        
+        seen = []
+        for shard_index in range(3):
+            loader = DataLoader(path, batch_size=10, buffer_size=16, seed=7,
+                                num_shards=3, shard_index=shard_index)
+            loader.set_epoch(2)
+            first = [r['id'] for batch in loader for r in batch]
+            assert first == [r['id'] for batch in loader for r in batch]
+            seen.extend(first)
+        assert sorted(seen) == list(range(103))
+        assert seen != sorted(seen)
+    
+    def test_formats_and_indices(self, tmp_path):
+        """Test JSON, CSV and ZIP datasets and split indices"""
+        import zipfile
+        from data_loader import DataLoader
+        records = [{'code': f'x{i}', 'label': str(i % 2)} for i in range(20)]
+        (tmp_path / 'data.json').write_text(json.dumps(records))
+        (tmp_path / 'data.csv').write_text('code,label\n' + ''.join(f"{r['code']},{r['label']}\n" for r in records))
+        with zipfile.ZipFile(tmp_path / 'data.zip', 'w') as archive:
+            archive.write(tmp_path / 'data.json', 'a.json')
+            archive.write(tmp_path / 'data.csv', 'b.csv')
+        
+        for name, expected in (('data.json', 20), ('data.csv', 20), ('data.zip', 40)):
+            loader = DataLoader(str(tmp_path / name), batch_size=8, shuffle=False)
+            batches = list(loader)
+            assert [len(b) for b in batches][:2] == [8, 8]
+            assert sum(len(b) for b in batches) == expected
+        
+        loader = DataLoader(str(tmp_path / 'data.json'), batch_size=4, shuffle=False, indices=[1, 5, 19])
+        assert [r['code'] for batch in loader for r in batch] == ['x1', 'x5', 'x19']
+    
+    def test_json_array_across_chunks(self, tmp_path):
+        """Test that the JSON reader matches json.load at every chunk size"""
+        from data_loader import _iter_json_array
+        records = [{'code': 'y' * (i % 29), 'label': i % 2, 'tokens': ['[', ',', i]} for i in range(150)]
+        text = '  [ ' + ' , '.join(json.dumps(r) for r in records) + ' ]'
+
+        for chunk_size in (1, 5, 64, 4096):
+            assert list(_iter_json_array(io.StringIO(text), chunk_size)) == records
+
+    def test_errors_reach_training_loop(self, tmp_path):
+        """Test that parse errors in the prefetch thread are raised to the caller"""
+        from data_loader import DataLoader
+        path = tmp_path / 'bad.json'
+        path.write_text('{"not": "an array"}')
+        with pytest.raises(ValueError):
+            list(DataLoader(str(path)))
+    
+    def test_breaking_out_stops_the_thread(self, tmp_path):
+        """Test that abandoning an epoch early ends its prefetch thread"""
+        from data_loader import DataLoader
+        path = str(tmp_path / 'data.jsonl')
+        self.write_jsonl(path, 500)
+        loader = DataLoader(path, batch_size=4, prefetch=2)
+        
+        threads = []
+        for epoch in range(3):
+            loader.set_epoch(epoch)
+            batches = iter(loader)
+            threads.append(batches.thread)
+            for batch in batches:
+                break
+            del batches, batch
+        for thread in threads:
+            thread.join(5)
+            assert not thread.is_alive()
+
 
 class TestTrainingAPI:
     """Test Training API endpoints"""
@@ -233,6 +712,1735 @@ class TestTrainingAPI:
         assert 'metrics' in response.json
 
 
+class TestEvaluationAPI:
+    """Test model evaluation endpoints"""
+    
+    def test_evaluate_model(self, app, client):
+        """Test that an evaluation is queued and run in the background"""
+        samples = [
+            {'code': 'eval(user_input)', 'label': 1, 'vulnerability_type': 'Code Injection'},
+            {'code': 'obj = pickle.loads(blob)', 'label': 1, 'vulnerability_type': 'Insecure Deserialization'},
+            {'code': 'return a + b', 'label': 1, 'vulnerability_type': 'Code Injection'},
+            {'code': 'print(x)', 'label': 0, 'vulnerability_type': 'None'},
+        ]
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as f:
+            json.dump(samples, f)
+            temp_file = f.name
+        
+        try:
+            with open(temp_file, 'rb') as f:
+                dataset_id = client.post(
+                    '/api/datasets',
+                    data={'name': 'Eval Dataset', 'file': (f, 'eval.json')}
+                ).json['id']
+        finally:
+            os.unlink(temp_file)
+        
+        model_id = client.post('/api/models', data={'name': 'Test Model'}).json['id']
+        
+        response = client.post('/api/evaluations', json={
+            'model_id': model_id,
+            'dataset_id': dataset_id,
+            'batch_size': 3,
+            'apply_to_model': True
+        })
+        assert response.status_code == 202
+        assert response.json['status'] == 'pending'
+        
+        from app.services.evaluation_runner import evaluation_runner
+        with app.app_context():
+            assert evaluation_runner.run_pending() == 1
+            assert evaluation_runner.run_pending() == 0
+        response = client.get(f"/api/evaluations/{response.json['id']}")
+        assert response.json['status'] == 'completed'
+        assert response.json['num_samples'] == 4
+        assert response.json['confusion_matrix'] == {'tp': 2, 'fp': 0, 'tn': 1, 'fn': 1}
+        assert response.json['per_type_metrics']['Code Injection']['recall'] == 0.5
+        assert response.json['curves']['thresholds']
+        
+        model = client.get(f'/api/models/{model_id}').json
+        assert model['accuracy'] == 0.75
+        assert model['precision'] == 1.0
+    
+    def test_evaluate_missing_dataset(self, client):
+        """Test evaluating against a dataset that does not exist"""
+        model_id = client.post('/api/models', data={'name': 'Test Model'}).json['id']
+        response = client.post('/api/evaluations', json={'model_id': model_id, 'dataset_id': 999})
+        assert response.status_code == 404
+
+
+class TestChatAPI:
+    """Test chat endpoints"""
+    
+    def test_history_is_per_session(self, client):
+        """Test that sessions do not see each other's messages"""
+        client.post('/api/chat/message', json={'content': 'hello'}, headers={'X-Session-ID': 'a'})
+        client.post('/api/chat/message', json={'content': 'help'}, headers={'X-Session-ID': 'b'})
+        
+        response = client.get('/api/chat/history', headers={'X-Session-ID': 'a'})
+        assert response.status_code == 200
+        assert [m['role'] for m in response.json['messages']] == ['user', 'assistant']
+        assert response.json['messages'][0]['content'] == 'hello'
+        
+        client.delete('/api/chat/history', headers={'X-Session-ID': 'a'})
+        assert client.get('/api/chat/history?session_id=a').json['messages'] == []
+        assert len(client.get('/api/chat/history?session_id=b').json['messages']) == 2
+    
+    def test_history_pagination(self, client):
+        """Test reading history page by page with a cursor"""
+        for i in range(3):
+            client.post('/api/chat/message', json={'content': f'message {i}', 'session_id': 's'})
+        
+        page = client.get('/api/chat/history?session_id=s&limit=4').json
+        assert [m['content'] for m in page['messages']][::2] == ['message 1', 'message 2']
+        
+        older = client.get(f'/api/chat/history?session_id=s&limit=4&before={page["next_cursor"]}').json
+        assert [m['content'] for m in older['messages']][0] == 'message 0'
+        assert older['next_cursor'] is None
+    
+    def test_full_buffer_page_has_no_cursor(self, client, app):
+        """Test that a page ending at the session's first message has no cursor"""
+        from app.services.chat_service import chat_history_store
+        app.config['CHAT_BUFFER_MESSAGES'] = 4
+        for i in range(2):
+            client.post('/api/chat/message', json={'content': f'message {i}', 'session_id': 's'})
+        
+        for reload in (False, True):
+            if reload:
+                chat_history_store.init_app(app)  # Read the buffer back from the database
+            page = client.get('/api/chat/history?session_id=s&limit=4').json
+            assert len(page['messages']) == 4 and page['next_cursor'] is None
+        
+        client.post('/api/chat/message', json={'content': 'message 2', 'session_id': 's'})
+        page = client.get('/api/chat/history?session_id=s&limit=4').json
+        assert page['next_cursor'] == page['messages'][0]['id']
+    
+    def test_retention_caps_session(self, client, app):
+        """Test that retention trims sessions to the configured size"""
+        app.config['CHAT_MAX_MESSAGES_PER_SESSION'] = 4
+        for i in range(5):
+            client.post('/api/chat/message', json={'content': f'message {i}', 'session_id': 's'})
+        
+        from app.services.chat_service import chat_history_store
+        chat_history_store.apply_retention()
+        
+        messages = client.get('/api/chat/history?session_id=s').json['messages']
+        assert len(messages) == 4
+        assert messages[0]['content'] == 'message 3'
+
+
+class StubCompletionHandler(BaseHTTPRequestHandler):
+    """OpenAI-compatible streaming endpoint answering with fixed tokens"""
+    protocol_version = 'HTTP/1.1'
+    requests_seen = 0
+    failure = None  # 'malformed' or 'truncated' to break the response
+    
+    def do_POST(self):
+        StubCompletionHandler.requests_seen += 1
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        assert body['stream'] is True
+        
+        events = [{'choices': [{'delta': {'content': token}}]} for token in ['Hi', ' there']]
+        payload = ''.join(f'data: {json.dumps(e)}\n\n' for e in events) + 'data: [DONE]\n\n'
+        if self.failure == 'malformed':
+            payload = 'data: {"choices": [\n\n'
+        payload = payload.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Content-Length', str(len(payload) + (100 if self.failure == 'truncated' else 0)))
+        self.end_headers()
+        self.wfile.write(payload)
+        if self.failure == 'truncated':
+            self.close_connection = True
+    
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def local_llm(app):
+    """Point the chat assistant at a stub local provider"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubCompletionHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    StubCompletionHandler.requests_seen = 0
+    StubCompletionHandler.failure = None
+    
+    app.config['AI_PROVIDER'] = 'local'
+    app.config['AI_ENDPOINT'] = f'http://127.0.0.1:{server.server_port}/v1'
+    app.extensions.pop('llm_provider', None)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class TestChatProviders:
+    """Test chat provider integration"""
+    
+    def test_local_provider_message(self, client, local_llm):
+        """Test a full response from the local provider"""
+        response = client.post('/api/chat/message', json={'content': 'hello'})
+        assert response.status_code == 200
+        assert response.json['content'] == 'Hi there'
+    
+    def test_stream_reuses_connection_and_caches(self, client, app, local_llm):
+        """Test SSE streaming, keep-alive reuse and the answer cache"""
+        response = client.post('/api/chat/stream', json={'content': 'hello', 'session_id': 'a'})
+        assert response.mimetype == 'text/event-stream'
+        body = response.get_data(as_text=True)
+        assert body.count('"delta"') == 2
+        assert 'event: done' in body
+        
+        client.post('/api/chat/stream', json={'content': 'other', 'session_id': 'b'}).get_data()
+        assert StubCompletionHandler.requests_seen == 2
+        assert app.extensions['llm_provider'].pool.created == 1
+        
+        # Same first-turn prompt is answered from the cache
+        client.post('/api/chat/stream', json={'content': 'hello', 'session_id': 'c'}).get_data()
+        assert StubCompletionHandler.requests_seen == 2
+    
+    def test_unreachable_provider_falls_back(self, client, app):
+        """Test that a provider failure falls back to builtin answers"""
+        app.config['AI_PROVIDER'] = 'local'
+        app.config['AI_ENDPOINT'] = 'http://127.0.0.1:9/v1'
+        app.extensions.pop('llm_provider', None)
+        
+        response = client.post('/api/chat/message', json={'content': 'hello'})
+        assert response.status_code == 200
+        assert 'VulWeb' in response.json['content']
+    
+    def test_broken_responses_fall_back(self, client, local_llm):
+        """Test that malformed and truncated streams are provider errors"""
+        StubCompletionHandler.failure = 'malformed'
+        response = client.post('/api/chat/message', json={'content': 'hello', 'session_id': 'a'})
+        assert response.status_code == 200
+        assert 'VulWeb' in response.json['content']
+        
+        StubCompletionHandler.failure = 'truncated'
+        body = client.post('/api/chat/stream', json={'content': 'help', 'session_id': 'b'}).get_data(as_text=True)
+        assert '"Hi"' in body
+        assert 'event: done' in body
+    
+    def test_busy_provider_rejects_stream(self, client, app, local_llm):
+        """Test that /stream answers 503 like /message when the provider is full"""
+        app.config['AI_MAX_CONCURRENCY'] = 0
+        app.config['AI_QUEUE_TIMEOUT'] = 0
+        app.extensions.pop('llm_provider', None)
+        
+        assert client.post('/api/chat/message', json={'content': 'hello'}).status_code == 503
+        response = client.post('/api/chat/stream', json={'content': 'hello'})
+        assert response.status_code == 503
+        assert 'Too many' in response.json['error']
+        assert StubCompletionHandler.requests_seen == 0
+    
+    def test_busy_provider_keeps_no_user_turn(self, client, app, local_llm):
+        """Test that a rejected message is not left in the history without a reply"""
+        client.post('/api/chat/message', json={'content': 'first', 'session_id': 's'})
+        app.config['AI_MAX_CONCURRENCY'] = 0
+        app.config['AI_QUEUE_TIMEOUT'] = 0
+        app.extensions.pop('llm_provider', None)
+        
+        for route in ('/api/chat/message', '/api/chat/stream'):
+            assert client.post(route, json={'content': 'hello', 'session_id': 's'}).status_code == 503
+        messages = client.get('/api/chat/history?session_id=s').json['messages']
+        assert [m['role'] for m in messages] == ['user', 'assistant']
+        assert messages[0]['content'] == 'first'
+
+
+class TestChatRetrieval:
+    """Test retrieval-augmented chat answers"""
+    
+    def test_status_question_uses_live_counts(self, client):
+        """Test that status questions are answered from the database"""
+        client.post('/api/models', data={'name': 'Model A'})
+        client.post('/api/models', data={'name': 'Model B'})
+        
+        response = client.post('/api/chat/message', json={'content': '现在有多少个模型？'})
+        assert response.status_code == 200
+        assert '模型数量：2' in response.json['content']
+        
+        client.post('/api/models', data={'name': 'Model C'})
+        response = client.post('/api/chat/message', json={'content': '现在有多少个模型？'})
+        assert '模型数量：3' in response.json['content']
+    
+    def test_docs_question_uses_index(self, client):
+        """Test that other questions are answered from the docs"""
+        response = client.post('/api/chat/message', json={'content': 'How do I deploy on WSL?'})
+        assert response.status_code == 200
+        assert '文档' in response.json['content']
+    
+    def test_index_is_cached_on_disk(self, app, tmp_path):
+        """Test that the index is persisted and reloaded"""
+        from app.services import retrieval_service
+        
+        docs = tmp_path / 'docs'
+        docs.mkdir()
+        (docs / 'README.md').write_text('# Title\n\nGPU training requires CUDA drivers.\n')
+        config = {'DOCS_FOLDER': str(docs), 'RETRIEVAL_INDEX_PATH': str(tmp_path / 'index.pkl')}
+        
+        index = retrieval_service.get_index(config)
+        assert (tmp_path / 'index.pkl').exists()
+        assert index.search('cuda')[0]['source'] == 'README.md'
+        
+        retrieval_service._index = None
+        assert retrieval_service.get_index(config).signature == index.signature
+
+
+class TestEarlyStopping:
+    """Test early-stopping policies on training tasks"""
+    
+    def create_task(self, client, app, policy):
+        with app.app_context():
+            model = Model(name='Test Model', model_type='vulnerability_detection')
+            dataset = Dataset(name='Test Dataset', format='json')
+            db.session.add(model)
+            db.session.add(dataset)
+            db.session.commit()
+            model_id, dataset_id = model.id, dataset.id
+        
+        response = client.post('/api/training/tasks', json={
+            'name': 'Test Training',
+            'model_id': model_id,
+            'dataset_id': dataset_id,
+            'epochs': 20,
+            'early_stopping': policy
+        })
+        assert response.status_code == 201
+        return response.json['id']
+    
+    def report(self, client, task_id, epoch, **values):
+        return client.post(f'/api/training/tasks/{task_id}/metrics', json=dict(values, epoch=epoch))
+    
+    def test_patience(self, client, app):
+        """Test stopping after patience epochs without improvement"""
+        task_id = self.create_task(client, app, {'patience': 2, 'min_delta': 0.01})
+        
+        for epoch, val_loss in enumerate([0.9, 0.5, 0.495, 0.6], 1):
+            response = self.report(client, task_id, epoch, validation_loss=val_loss)
+        
+        assert response.json['task_status'] == 'stopped'
+        task = client.get(f'/api/training/tasks/{task_id}').json
+        assert task['best_epoch'] == 2
+        assert 'No improvement' in task['stop_reason']
+    
+    def test_nan_loss_stops(self, client, app):
+        """Test stopping on a non-finite loss"""
+        task_id = self.create_task(client, app, {'patience': 5})
+        response = client.post(
+            f'/api/training/tasks/{task_id}/metrics',
+            data='{"epoch": 1, "loss": NaN}',
+            content_type='application/json'
+        )
+        assert response.json['task_status'] == 'stopped'
+        assert 'Diverged' in client.get(f'/api/training/tasks/{task_id}').json['stop_reason']
+    
+    def test_non_numeric_metrics(self, client, app):
+        """Test rejecting metric reports with values that are not numbers"""
+        task_id = self.create_task(client, app, {'patience': 5})
+        for values in ({'loss': 'high'}, {'validation_accuracy': True}, {'learning_rate': [0.1]}):
+            assert self.report(client, task_id, 1, **values).status_code == 400
+        assert self.report(client, task_id, '1', loss=0.5).status_code == 400
+        assert self.report(client, task_id, 1, loss=0.5).status_code == 201
+    
+    def test_target_reached(self, client, app):
+        """Test stopping once the target is reached"""
+        task_id = self.create_task(client, app, {
+            'monitor': 'validation_accuracy', 'mode': 'max', 'target': 0.9
+        })
+        assert self.report(client, task_id, 1, validation_accuracy=0.8).json['task_status'] == 'running'
+        assert self.report(client, task_id, 2, validation_accuracy=0.92).json['task_status'] == 'stopped'
+    
+    def test_invalid_policy(self, client, app):
+        """Test rejecting unknown policy settings"""
+        with pytest.raises(AssertionError):
+            self.create_task(client, app, {'monitor': 'f1'})
+    
+    def test_non_numeric_settings(self, client, app):
+        """Test rejecting thresholds that are not finite numbers"""
+        task_id = self.create_task(client, app, {'patience': 2})
+        for policy in ({'min_delta': 'x'}, {'target': 'x'}, {'divergence_threshold': True}, {'min_delta': None},
+                       {'patience': True}):
+            response = client.put(f'/api/training/tasks/{task_id}/early-stopping', json=policy)
+            assert response.status_code == 400
+
+
+class TestCheckpointAPI:
+    """Test checkpoint registry, retention, resume and promotion"""
+    
+    @pytest.fixture
+    def task_id(self, app):
+        with app.app_context():
+            model = Model(name='Test Model', model_type='vulnerability_detection')
+            dataset = Dataset(name='Test Dataset', format='json')
+            db.session.add(model)
+            db.session.add(dataset)
+            db.session.commit()
+            task = TrainingTask(name='Test Task', model_id=model.id, dataset_id=dataset.id,
+                                status='running', total_epochs=10,
+                                checkpoint_policy={'keep_best': 1, 'keep_last': 1})
+            db.session.add(task)
+            db.session.commit()
+            return task.id
+    
+    def upload(self, client, task_id, epoch, val_loss):
+        client.post(f'/api/training/tasks/{task_id}/metrics',
+                    json={'epoch': epoch, 'validation_loss': val_loss})
+        return client.post(f'/api/training/tasks/{task_id}/checkpoints', data={
+            'epoch': epoch,
+            'file': (io.BytesIO(f'weights {epoch}'.encode()), 'model.pt')
+        })
+    
+    def test_retention_keeps_best_and_last(self, client, task_id):
+        """Test that retention keeps best-k plus last-n checkpoints"""
+        for epoch, val_loss in enumerate([0.9, 0.3, 0.5, 0.6], 1):
+            response = self.upload(client, task_id, epoch, val_loss)
+            assert response.status_code == 201
+        
+        checkpoints = client.get(f'/api/training/tasks/{task_id}/checkpoints').json
+        assert [c['epoch'] for c in checkpoints] == [2, 4]
+        assert checkpoints[0]['metrics']['validation_loss'] == 0.3
+        assert checkpoints[0]['size'] == len('weights 2')
+        assert all(os.path.exists(c['file_path']) for c in checkpoints)
+    
+    def test_resume_from_latest_checkpoint(self, client, task_id):
+        """Test resuming a stopped task from its latest checkpoint"""
+        self.upload(client, task_id, 1, 0.9)
+        self.upload(client, task_id, 2, 0.8)
+        client.post(f'/api/training/tasks/{task_id}/metrics', json={'epoch': 3, 'validation_loss': 0.7})
+        client.post(f'/api/training/tasks/{task_id}/stop')
+        
+        response = client.post(f'/api/training/tasks/{task_id}/resume')
+        assert response.status_code == 200
+        assert response.json['status'] == 'running'
+        assert response.json['current_epoch'] == 2
+        
+        metrics = client.get(f'/api/training/tasks/{task_id}/metrics').json['metrics']
+        assert [m['epoch'] for m in metrics] == [1, 2]
+    
+    def test_resume_from_earlier_checkpoint(self, client, task_id):
+        """Test that resuming drops later checkpoints and rebuilds the best metric"""
+        client.put(f'/api/training/tasks/{task_id}/early-stopping', json={'patience': 5})
+        client.put(f'/api/training/tasks/{task_id}/checkpoint-policy', json={'keep_best': 0, 'keep_last': 3})
+        for epoch, val_loss in enumerate([0.9, 0.8, 0.2], 1):
+            self.upload(client, task_id, epoch, val_loss)
+        client.post(f'/api/training/tasks/{task_id}/telemetry', json={'cpu_percent': 50})
+        client.post(f'/api/training/tasks/{task_id}/stop')
+        assert self.upload(client, task_id, 4, 0.1).status_code == 409
+        
+        first, _, last = client.get(f'/api/training/tasks/{task_id}/checkpoints').json
+        response = client.post(f'/api/training/tasks/{task_id}/resume', json={'checkpoint_id': first['id']})
+        assert response.status_code == 200
+        assert (response.json['best_metric_value'], response.json['best_epoch']) == (0.9, 1)
+        assert client.get(f'/api/training/tasks/{task_id}/telemetry').json['samples'] == []
+        assert [c['id'] for c in client.get(f'/api/training/tasks/{task_id}/checkpoints').json] == [first['id']]
+        
+        # The same epoch uploaded again gets a file of its own
+        response = self.upload(client, task_id, 2, 0.5)
+        assert response.status_code == 201
+        assert response.json['file_path'] not in (first['file_path'], last['file_path'])
+    
+    def test_promote_best_checkpoint(self, client, task_id):
+        """Test promoting the best checkpoint into a new model"""
+        self.upload(client, task_id, 1, 0.4)
+        self.upload(client, task_id, 2, 0.6)
+        
+        response = client.post(f'/api/training/tasks/{task_id}/promote', json={'name': 'Promoted'})
+        assert response.status_code == 201
+        assert response.json['name'] == 'Promoted'
+        with open(response.json['file_path']) as f:
+            assert f.read() == 'weights 1'
+        
+        # Each promotion gets its own copy
+        second = client.post(f'/api/training/tasks/{task_id}/promote', json={'name': 'Promoted again'})
+        assert second.status_code == 201
+        assert second.json['file_path'] != response.json['file_path']
+
+
+class TestWorkerLeaseAPI:
+    """Test leasing training tasks to worker agents"""
+    
+    @pytest.fixture
+    def task_id(self, app, client):
+        app.config['TRAINING_DISPATCH'] = 'worker'
+        app.config['TRAINING_MAX_ATTEMPTS'] = 2
+        with app.app_context():
+            model = Model(name='Test Model', model_type='vulnerability_detection')
+            dataset = Dataset(name='Test Dataset', format='json')
+            db.session.add(model)
+            db.session.add(dataset)
+            db.session.commit()
+            model_id, dataset_id = model.id, dataset.id
+        response = client.post('/api/training/tasks', json={
+            'name': 'Leased Task', 'model_id': model_id, 'dataset_id': dataset_id,
+            'epochs': 3, 'learning_rate': 0.01
+        })
+        assert response.json['status'] == 'queued'
+        return response.json['id']
+    
+    def expire_lease(self, app, task_id):
+        from datetime import datetime, timedelta
+        with app.app_context():
+            task = db.session.get(TrainingTask, task_id)
+            task.lease_expires_at = datetime.utcnow() - timedelta(seconds=1)
+            db.session.commit()
+    
+    def test_lease_heartbeat_complete(self, client, task_id):
+        """Test that one worker wins a task and finishes it"""
+        response = client.post('/api/training/lease', json={'worker_id': 'a'})
+        assert response.status_code == 200
+        assert response.json['id'] == task_id
+        assert response.json['config']['learning_rate'] == 0.01
+        assert response.json['attempts'] == 1
+        
+        assert client.post('/api/training/lease', json={'worker_id': 'b'}).status_code == 204
+        assert client.post(f'/api/training/tasks/{task_id}/heartbeat', json={'worker_id': 'b'}).status_code == 409
+        assert client.post(f'/api/training/tasks/{task_id}/heartbeat', json={'worker_id': 'a'}).status_code == 200
+        
+        response = client.post(f'/api/training/tasks/{task_id}/complete', json={'worker_id': 'a'})
+        assert response.status_code == 200
+        assert response.json['status'] == 'completed'
+        assert response.json['lease_expires_at'] is None
+    
+    def test_expired_lease_is_requeued(self, app, client, task_id):
+        """Test that a dead worker's task goes to another worker, then fails after max attempts"""
+        client.post('/api/training/lease', json={'worker_id': 'a'})
+        client.post(f'/api/training/tasks/{task_id}/metrics', json={'epoch': 1, 'loss': 0.5})
+        self.expire_lease(app, task_id)
+        
+        response = client.post('/api/training/lease', json={'worker_id': 'b'})
+        assert response.json['id'] == task_id
+        assert response.json['attempts'] == 2
+        assert response.json['current_epoch'] == 0
+        assert client.get(f'/api/training/tasks/{task_id}/metrics').json['metrics'] == []
+        
+        # The first worker lost its lease
+        assert client.post(f'/api/training/tasks/{task_id}/complete', json={'worker_id': 'a'}).status_code == 409
+        
+        self.expire_lease(app, task_id)
+        assert client.post('/api/training/lease', json={'worker_id': 'c'}).status_code == 204
+        task = client.get(f'/api/training/tasks/{task_id}').json
+        assert task['status'] == 'failed'
+    
+    def test_stopped_task_stops_worker(self, client, task_id):
+        """Test that heartbeats tell the worker about a stopped task"""
+        client.post('/api/training/lease', json={'worker_id': 'a'})
+        client.post(f'/api/training/tasks/{task_id}/stop')
+        
+        response = client.post(f'/api/training/tasks/{task_id}/heartbeat', json={'worker_id': 'a'})
+        assert response.status_code == 409
+        assert response.json['task_status'] == 'stopped'
+    
+    def test_wait_is_validated_and_capped(self, app, client, task_id):
+        """Test rejecting a bad long-poll wait and capping a long one"""
+        for wait in ('soon', -1, 'inf'):
+            assert client.post('/api/training/lease', json={'worker_id': 'a', 'wait': wait}).status_code == 400
+        
+        client.post('/api/training/lease', json={'worker_id': 'a'})
+        app.config['TRAINING_LEASE_MAX_WAIT'] = 0
+        started = time.monotonic()
+        assert client.post('/api/training/lease', json={'worker_id': 'b', 'wait': 3600}).status_code == 204
+        assert time.monotonic() - started < 5
+    
+    def test_requeue_is_conditional(self, app, client, task_id, monkeypatch):
+        """Test that a lease another process already requeued is left alone"""
+        from app.services import lease_service
+        client.post('/api/training/lease', json={'worker_id': 'a'})
+        self.expire_lease(app, task_id)
+        with app.app_context():
+            stale = TrainingTask.query.filter_by(id=task_id).all()
+            assert lease_service.requeue_expired_leases() == [task_id]
+            
+            # A second process that read the expired lease before the requeue
+            monkeypatch.setattr(type(TrainingTask.query), 'all', lambda query: stale)
+            assert lease_service.requeue_expired_leases() == []
+            monkeypatch.undo()
+            task = db.session.get(TrainingTask, task_id)
+            assert task.status == 'queued'
+            assert task.attempts == 1
+
+
+class TestSchedulerAPI:
+    """Test priority, fair-share and resource-aware scheduling"""
+    
+    @pytest.fixture
+    def submit(self, app, client):
+        app.config['TRAINING_DISPATCH'] = 'worker'
+        with app.app_context():
+            model = Model(name='Test Model', model_type='vulnerability_detection')
+            dataset = Dataset(name='Test Dataset', format='json')
+            db.session.add(model)
+            db.session.add(dataset)
+            db.session.commit()
+            ids = {'model_id': model.id, 'dataset_id': dataset.id}
+        
+        def submit(name, **fields):
+            response = client.post('/api/training/tasks', json=dict(ids, name=name, epochs=2, **fields))
+            assert response.status_code == 201
+            return response.json['id']
+        return submit
+    
+    def lease(self, client, **capacity):
+        response = client.post('/api/training/lease', json=dict(worker_id='w', **capacity))
+        return response.json['name'] if response.status_code == 200 else None
+    
+    def test_priority_and_fair_share(self, client, submit):
+        """Test that priority wins and owners take turns"""
+        for i in range(3):
+            submit(f'alice-{i}', owner='alice')
+        submit('bob-0', owner='bob')
+        submit('urgent', owner='carol', priority=5)
+        
+        queue = client.get('/api/training/queue').json['tasks']
+        assert [task['name'] for task in queue] == ['urgent', 'alice-0', 'bob-0', 'alice-1', 'alice-2']
+        assert [task['position'] for task in queue] == [1, 2, 3, 4, 5]
+        assert queue[0]['estimated_start'] < queue[-1]['estimated_start']
+        
+        assert self.lease(client) == 'urgent'
+        assert self.lease(client) == 'alice-0'
+        assert self.lease(client) == 'bob-0'
+        
+        mine = client.get('/api/training/queue?owner=alice').json['tasks']
+        assert [task['name'] for task in mine] == ['alice-1', 'alice-2']
+    
+    def test_bin_packing_and_aging(self, app, client, submit):
+        """Test that leases only get tasks that fit, and old tasks catch up"""
+        big = submit('big', cpu_request=8, memory_request=16384, priority=1)
+        submit('small', cpu_request=2, memory_request=1024)
+        
+        assert self.lease(client, cpu=4, memory=8192) == 'small'
+        assert self.lease(client, cpu=4, memory=8192) is None
+        assert self.lease(client, cpu=8, memory=32768) == 'big'
+        
+        from datetime import datetime, timedelta
+        submit('new', priority=2)
+        old = submit('old')
+        with app.app_context():
+            task = db.session.get(TrainingTask, old)
+            task.queued_at = datetime.utcnow() - timedelta(seconds=app.config['TRAINING_AGING_SECONDS'] * 3)
+            db.session.commit()
+        assert self.lease(client) == 'old'
+    
+    def test_waiting_task_reserves_capacity(self, app, client, submit):
+        """Test that small tasks stop backfilling once a large task has waited long enough"""
+        from datetime import datetime, timedelta
+        big = submit('big', cpu_request=8, priority=1)
+        submit('small-0', cpu_request=2)
+        submit('small-1', cpu_request=2)
+        
+        assert self.lease(client, cpu=4, total_cpu=8) == 'small-0'
+        with app.app_context():
+            task = db.session.get(TrainingTask, big)
+            task.queued_at = datetime.utcnow() - timedelta(seconds=app.config['TRAINING_BACKFILL_SECONDS'])
+            db.session.commit()
+        
+        # The big task holds the capacity of workers that could run it, but not of smaller ones
+        assert self.lease(client, cpu=4, total_cpu=8) is None
+        assert self.lease(client, cpu=4) is None
+        assert self.lease(client, cpu=4, total_cpu=4) == 'small-1'
+        assert self.lease(client, cpu=8, total_cpu=8) == 'big'
+    
+    def test_queue_is_read_in_pages(self, client, submit, monkeypatch):
+        """Test that paging through owners' queues keeps the scheduling order"""
+        from app.services import scheduler_service
+        for i in range(5):
+            submit(f'alice-{i}', owner='alice', priority=i % 2)
+        submit('bob-0', owner='bob')
+        submit('bob-1', owner='bob', priority=1)
+        
+        expected = [task['name'] for task in client.get('/api/training/queue').json['tasks']]
+        assert expected[:3] == ['alice-1', 'bob-1', 'alice-3']
+        monkeypatch.setattr(scheduler_service, 'SCHEDULE_PAGE', 2)
+        assert [task['name'] for task in client.get('/api/training/queue').json['tasks']] == expected
+        assert self.lease(client) == 'alice-1'
+    
+    def test_invalid_resource_request(self, client, submit):
+        """Test validation of resource requests"""
+        response = client.post('/api/training/tasks', json={
+            'name': 'bad', 'model_id': 1, 'dataset_id': 1, 'cpu_request': 0
+        })
+        assert response.status_code == 400
+        
+        # JSON parsing accepts NaN and Infinity, which would break bin packing
+        for field in ('"cpu_request": NaN', '"cpu_request": Infinity', '"memory_request": Infinity',
+                      '"priority": -Infinity'):
+            body = '{"name": "bad", "model_id": 1, "dataset_id": 1, %s}' % field
+            for url in ('/api/training/tasks', '/api/training/tasks/bulk'):
+                data = body if url.endswith('tasks') else '{"create": [%s]}' % body
+                response = client.post(url, data=data, content_type='application/json')
+                assert response.status_code == 400
+
+
+class TestTelemetryAPI:
+    """Test training resource telemetry"""
+    
+    @pytest.fixture
+    def task_id(self, app):
+        app.config['TELEMETRY_RING_SIZE'] = 20
+        app.config['TELEMETRY_DOWNSAMPLED_SIZE'] = 5
+        with app.app_context():
+            task = TrainingTask(name='Telemetry Task', status='running', total_epochs=2,
+                                cpu_request=2, memory_request=4096)
+            db.session.add(task)
+            db.session.commit()
+            return task.id
+    
+    def samples(self, count, cpu, rss, rss_step=0):
+        from datetime import datetime, timedelta
+        start = datetime(2024, 1, 1)
+        return [{'timestamp': (start + timedelta(seconds=5 * i)).isoformat(), 'cpu_percent': cpu,
+                 'rss': rss + rss_step * i, 'read_bytes': 1000 * i, 'write_bytes': 0,
+                 'samples_per_sec': 50.0} for i in range(count)]
+    
+    def test_ring_buffer_and_downsampling(self, client, task_id):
+        """Test that storage stays bounded while running and shrinks on completion"""
+        samples = self.samples(30, 150, 500 * 2 ** 20)
+        for sample in samples[:25]:
+            assert client.post(f'/api/training/tasks/{task_id}/telemetry', json=sample).status_code == 201
+        response = client.post(f'/api/training/tasks/{task_id}/telemetry', json={'samples': samples[25:]})
+        assert response.json['received'] == 5
+        
+        telemetry = client.get(f'/api/training/tasks/{task_id}/telemetry').json
+        assert [s['sequence'] for s in telemetry['samples']] == list(range(10, 30))
+        assert telemetry['summary']['cpu_utilization'] == 0.75
+        assert telemetry['summary']['flags'] == []
+        
+        # Reaching the last epoch completes the task
+        client.post(f'/api/training/tasks/{task_id}/metrics', json={'epoch': 2, 'loss': 0.1})
+        metrics = client.get(f'/api/training/tasks/{task_id}/metrics').json
+        assert metrics['telemetry']['samples'] == 5
+        assert metrics['telemetry']['mean_samples_per_sec'] == 50.0
+        
+        # Late samples do not overwrite the downsampled ring
+        response = client.post(f'/api/training/tasks/{task_id}/telemetry', json=samples[0])
+        assert response.status_code == 409
+        assert response.json['task_status'] == 'completed'
+        assert client.get(f'/api/training/tasks/{task_id}/telemetry').json['summary']['samples'] == 5
+    
+    def test_flags(self, client, task_id):
+        """Test under-utilization and memory leak detection"""
+        client.post(f'/api/training/tasks/{task_id}/telemetry',
+                    json={'samples': self.samples(12, 20, 500 * 2 ** 20, rss_step=50 * 2 ** 20)})
+        
+        task = client.get(f'/api/training/tasks/{task_id}').json
+        assert set(task['telemetry_flags']) == {'under_utilized', 'memory_leak'}
+    
+    def test_invalid_sample(self, client, task_id):
+        """Test validation of telemetry samples"""
+        response = client.post(f'/api/training/tasks/{task_id}/telemetry', json={'cpu_percent': -1})
+        assert response.status_code == 400
+        for sample in ('{"cpu_percent": true}', '{"rss": NaN}', '{"read_bytes": Infinity}'):
+            response = client.post(f'/api/training/tasks/{task_id}/telemetry', data=sample,
+                                   content_type='application/json')
+            assert response.status_code == 400
+
+
+class TestSweepAPI:
+    """Test hyperparameter sweep endpoints"""
+    
+    def create_model_and_dataset(self, app):
+        with app.app_context():
+            model = Model(name='Test Model', model_type='vulnerability_detection')
+            dataset = Dataset(name='Test Dataset', format='json')
+            db.session.add(model)
+            db.session.add(dataset)
+            db.session.commit()
+            return model.id, dataset.id
+    
+    def report(self, client, task_id, epoch, val_loss):
+        return client.post(f'/api/training/tasks/{task_id}/metrics', json={
+            'epoch': epoch, 'loss': val_loss, 'validation_loss': val_loss
+        })
+    
+    def test_grid_sweep_respects_concurrency(self, client, app):
+        """Test grid expansion and the concurrency budget"""
+        model_id, dataset_id = self.create_model_and_dataset(app)
+        response = client.post('/api/training/sweeps', json={
+            'name': 'LR sweep',
+            'model_id': model_id,
+            'dataset_id': dataset_id,
+            'search_space': {'learning_rate': [0.1, 0.01], 'batch_size': [16, 32]},
+            'max_concurrency': 2,
+            'max_epochs': 2
+        })
+        assert response.status_code == 201
+        assert response.json['num_trials'] == 4
+        assert response.json['trials_by_status'] == {'running': 2, 'pending': 2}
+        
+        sweep_id = response.json['id']
+        tasks = client.get(f'/api/training/sweeps/{sweep_id}/tasks').json
+        assert tasks[0]['hyperparameters'] == {'batch_size': 16, 'learning_rate': 0.1}
+        
+        # Finishing a trial starts the next one
+        self.report(client, tasks[0]['id'], 2, 0.5)
+        summary = client.get(f'/api/training/sweeps/{sweep_id}').json
+        assert summary['trials_by_status'] == {'completed': 1, 'running': 2, 'pending': 1}
+    
+    def test_successive_halving_prunes_worst(self, client, app):
+        """Test that trials outside the top 1/eta at a rung are stopped"""
+        model_id, dataset_id = self.create_model_and_dataset(app)
+        sweep = client.post('/api/training/sweeps', json={
+            'name': 'ASHA sweep',
+            'model_id': model_id,
+            'dataset_id': dataset_id,
+            'strategy': 'random',
+            'num_samples': 3,
+            'seed': 7,
+            'search_space': {'learning_rate': {'distribution': 'log_uniform', 'min': 1e-4, 'max': 1e-1}},
+            'max_concurrency': 3,
+            'max_epochs': 9,
+            'grace_epochs': 1,
+            'reduction_factor': 3
+        }).json
+        assert sweep['rungs'] == [1, 3]
+        
+        tasks = client.get(f'/api/training/sweeps/{sweep["id"]}/tasks').json
+        self.report(client, tasks[0]['id'], 1, 0.3)
+        self.report(client, tasks[1]['id'], 1, 0.5)
+        response = self.report(client, tasks[2]['id'], 1, 0.9)
+        assert response.json['task_status'] == 'stopped'
+        
+        pruned = client.get(f'/api/training/tasks/{tasks[2]["id"]}').json
+        assert 'successive halving' in pruned['stop_reason']
+        
+        # The best trial keeps running
+        assert self.report(client, tasks[0]['id'], 2, 0.2).json['task_status'] == 'running'
+    
+    def test_invalid_search_space(self, client, app):
+        """Test rejecting a grid without value lists and malformed distributions"""
+        model_id, dataset_id = self.create_model_and_dataset(app)
+        response = client.post('/api/training/sweeps', json={
+            'name': 'Bad sweep',
+            'model_id': model_id,
+            'dataset_id': dataset_id,
+            'search_space': {'learning_rate': {'min': 0.1, 'max': 1}}
+        })
+        assert response.status_code == 400
+        
+        for spec in ([], {'min': 'a', 'max': 1}, {'min': True, 'max': 2}, {'min': 2, 'max': 1},
+                     {'distribution': 'log_uniform', 'min': 0, 'max': 1}):
+            response = client.post('/api/training/sweeps', json={
+                'name': 'Bad sweep',
+                'model_id': model_id,
+                'dataset_id': dataset_id,
+                'strategy': 'random',
+                'search_space': {'learning_rate': spec}
+            })
+            assert response.status_code == 400
+    
+    def test_invalid_limits(self, client, app):
+        """Test rejecting sweep settings that are not positive integers"""
+        model_id, dataset_id = self.create_model_and_dataset(app)
+        for key, value in [('num_samples', 0), ('max_concurrency', -1), ('max_epochs', '10'),
+                           ('grace_epochs', True), ('reduction_factor', 1)]:
+            response = client.post('/api/training/sweeps', json={
+                'name': 'Bad sweep',
+                'model_id': model_id,
+                'dataset_id': dataset_id,
+                'search_space': {'learning_rate': [0.1]},
+                key: value
+            })
+            assert response.status_code == 400
+            assert key in response.json['error']
+    
+    def test_stop_ends_trials(self, client, app):
+        """Test that stopping a sweep records when its trials ended"""
+        model_id, dataset_id = self.create_model_and_dataset(app)
+        response = client.post('/api/training/sweeps', json={
+            'name': 'LR sweep',
+            'model_id': model_id,
+            'dataset_id': dataset_id,
+            'search_space': {'learning_rate': [0.1, 0.01, 0.001]},
+            'max_concurrency': 1
+        })
+        sweep_id = response.json['id']
+        
+        response = client.post(f'/api/training/sweeps/{sweep_id}/stop')
+        assert response.status_code == 200
+        tasks = client.get(f'/api/training/sweeps/{sweep_id}/tasks').json
+        assert [task['status'] for task in tasks] == ['stopped'] * 3
+        assert all(task['end_time'] for task in tasks)
+
+
+class TestBulkAPI:
+    """Test transactional bulk create, update and delete"""
+    
+    @pytest.fixture
+    def uploads(self, app, tmp_path):
+        folder = tmp_path / 'uploads' / 'datasets'
+        folder.mkdir(parents=True)
+        for name in ('a', 'b', 'c'):
+            (folder / f'{name}.json').write_text(json.dumps([{'code': 'x', 'label': 1}, {'code': 'y', 'label': 0}]))
+        return folder
+    
+    def test_create_update_delete_in_one_batch(self, client, uploads):
+        """Test that a batch is applied at once with per-item results"""
+        response = client.post('/api/datasets/bulk', json={'create': [
+            {'name': 'A', 'file_path': str(uploads / 'a.json')},
+            {'name': 'B', 'file_path': str(uploads / 'b.json')}
+        ]})
+        assert response.status_code == 200
+        assert response.json['created'] == 2
+        first, second = [result['id'] for result in response.json['results']]
+        assert response.json['results'][0]['item']['num_samples'] == 2
+        
+        # The deleted dataset's name can be reused in the same batch
+        response = client.post('/api/datasets/bulk', json={
+            'create': [{'name': 'A', 'file_path': str(uploads / 'c.json')}],
+            'update': [{'id': second, 'description': 'updated'}],
+            'delete': [first]
+        })
+        assert response.status_code == 200
+        assert (response.json['created'], response.json['updated'], response.json['deleted']) == (1, 1, 1)
+        assert client.get(f'/api/datasets/{second}').json['description'] == 'updated'
+        assert client.get(f'/api/datasets/{first}').status_code == 404
+        
+        from app.services.file_cleaner import file_cleaner
+        assert (uploads / 'a.json').exists()
+        assert file_cleaner.reclaim() == (1, 0)
+        assert not (uploads / 'a.json').exists()
+    
+    def test_files_in_use_are_rejected(self, app, client, uploads):
+        """Test that a file referenced by a row, or twice in a batch, cannot be registered"""
+        created = client.post('/api/datasets/bulk', json={'create': [
+            {'name': 'A', 'file_path': str(uploads / 'a.json')}]}).json
+        
+        response = client.post('/api/datasets/bulk', json={'create': [
+            {'name': 'Same file', 'file_path': str(uploads / '..' / 'datasets' / 'a.json')},
+            {'name': 'B', 'file_path': str(uploads / 'b.json')},
+            {'name': 'B again', 'file_path': str(uploads / 'b.json')}
+        ], 'atomic': False})
+        assert [result['status'] for result in response.json['results']] == [409, 201, 409]
+        assert response.json['results'][0]['error'] == 'file_path is already in use'
+        assert client.post('/api/models/bulk', json={'create': [
+            {'name': 'Model', 'file_path': str(uploads / 'a.json')}]}).status_code == 400
+        
+        # A deleted dataset's file is queued for removal
+        client.delete(f"/api/datasets/{created['results'][0]['id']}")
+        assert client.post('/api/datasets/bulk', json={'create': [
+            {'name': 'C', 'file_path': str(uploads / 'a.json')}]}).json['results'][0]['status'] == 409
+        
+        # Trained files inside a task's output folder can be registered
+        output = uploads.parent.parent / 'outputs' / 'task_1'
+        output.mkdir(parents=True)
+        (output / 'model.pt').write_bytes(b'weights')
+        with app.app_context():
+            model = Model(name='Base')
+            dataset = Dataset(name='Data', format='json')
+            db.session.add_all([model, dataset])
+            db.session.commit()
+            db.session.add(TrainingTask(name='Task', model_id=model.id, dataset_id=dataset.id, output_path=str(output)))
+            db.session.commit()
+        response = client.post('/api/models/bulk', json={'create': [
+            {'name': 'Trained', 'file_path': str(output / 'model.pt')}]})
+        assert response.status_code == 200
+    
+    def test_atomic_batch_rejected_as_a_whole(self, client):
+        """Test that uniqueness is checked across the batch and the database"""
+        client.post('/api/models/bulk', json={'create': [{'name': 'Existing'}]})
+        
+        response = client.post('/api/models/bulk', json={'create': [
+            {'name': 'New'}, {'name': 'Existing'}, {'name': 'Twice'}, {'name': 'Twice'},
+            {'name': 'Outside', 'file_path': '/etc/passwd'}
+        ], 'delete': [999]})
+        assert response.status_code == 400
+        assert response.json['committed'] is False
+        statuses = [result['status'] for result in response.json['results']]
+        assert statuses == [404, 424, 409, 424, 409, 400]
+        assert response.json['failed'] == 4
+        assert [model['name'] for model in client.get('/api/models').json] == ['Existing']
+        
+        response = client.post('/api/models/bulk', json={
+            'create': [{'name': 'New'}, {'name': 'Existing'}], 'atomic': False})
+        assert response.status_code == 200
+        assert (response.json['created'], response.json['failed']) == (1, 1)
+        
+        app_config = client.application.config
+        app_config['BULK_MAX_ITEMS'] = 1
+        response = client.post('/api/models/bulk', json={'create': [{'name': 'X'}, {'name': 'Y'}]})
+        assert response.status_code == 400
+    
+    def test_tasks(self, app, client):
+        """Test that tasks are launched after commit and running tasks are kept"""
+        with app.app_context():
+            model = Model(name='Test Model', model_type='vulnerability_detection')
+            dataset = Dataset(name='Test Dataset', format='json')
+            db.session.add_all([model, dataset])
+            db.session.commit()
+            running = TrainingTask(name='Running', model_id=model.id, dataset_id=dataset.id, status='running')
+            db.session.add(running)
+            db.session.commit()
+            model_id, dataset_id, running_id = model.id, dataset.id, running.id
+        
+        app.config['TRAINING_DISPATCH'] = 'worker'
+        response = client.post('/api/training/tasks/bulk', json={'create': [
+            {'name': f'Task {i}', 'model_id': model_id, 'dataset_id': dataset_id, 'priority': i}
+            for i in range(3)
+        ]})
+        assert response.status_code == 200
+        tasks = [result['item'] for result in response.json['results']]
+        assert [task['status'] for task in tasks] == ['queued'] * 3
+        assert [task['priority'] for task in tasks] == [0, 1, 2]
+        
+        response = client.post('/api/training/tasks/bulk', json={
+            'update': [{'id': tasks[0]['id'], 'priority': 5}],
+            'delete': [tasks[1]['id'], running_id]
+        })
+        assert response.status_code == 400
+        assert response.json['results'][1]['error'] == 'Cannot delete a running task'
+        
+        response = client.post('/api/training/tasks/bulk', json={
+            'update': [{'id': tasks[0]['id'], 'priority': 5}], 'delete': [tasks[1]['id']]})
+        assert response.status_code == 200
+        assert client.get(f"/api/training/tasks/{tasks[0]['id']}").json['priority'] == 5
+        assert client.get(f"/api/training/tasks/{tasks[1]['id']}").status_code == 404
+
+
+class TestStorageAPI:
+    """Test background file reclamation, cascading deletes and orphan scans"""
+    
+    @pytest.fixture
+    def folders(self, app, tmp_path):
+        (tmp_path / 'uploads').mkdir()
+        (tmp_path / 'outputs').mkdir()
+        return tmp_path
+    
+    def test_cascading_delete_is_reclaimed_later(self, app, client, folders):
+        """Test that a model used by tasks needs cascade and its files outlive the request"""
+        model_file = folders / 'uploads' / 'model.pt'
+        model_file.write_bytes(b'weights')
+        output = folders / 'outputs' / 'task_1'
+        output.mkdir()
+        (output / 'epoch_1_model.pt').write_bytes(b'checkpoint')
+        with app.app_context():
+            model = Model(name='Test Model', file_path=str(model_file))
+            dataset = Dataset(name='Test Dataset', format='json')
+            db.session.add_all([model, dataset])
+            db.session.commit()
+            task = TrainingTask(name='Test Task', model_id=model.id, dataset_id=dataset.id,
+                                status='completed', output_path=str(output))
+            db.session.add(task)
+            db.session.commit()
+            model_id, task_id = model.id, task.id
+        
+        response = client.delete(f'/api/models/{model_id}')
+        assert response.status_code == 409
+        assert 'cascade' in response.json['error']
+        
+        response = client.delete(f'/api/models/{model_id}?cascade=true')
+        assert response.status_code == 200
+        assert client.get(f'/api/training/tasks/{task_id}').status_code == 404
+        assert model_file.exists() and output.exists()
+        
+        usage = client.get('/api/storage').json
+        assert usage['models']['count'] == 0
+        assert usage['tombstones']['pending']['count'] == 2
+        assert usage['tombstones']['pending']['bytes'] == len(b'weights')
+        
+        response = client.post('/api/storage/reclaim')
+        assert response.json == {'removed': 2, 'failed': 0}
+        assert not model_file.exists() and not output.exists()
+        assert client.get('/api/storage/tombstones').json == []
+    
+    def test_shared_files_outlive_one_record(self, app, client, folders):
+        """Test that deleting a record keeps files another row still refers to"""
+        shared = folders / 'uploads' / 'shared.pt'
+        shared.write_bytes(b'weights')
+        data = folders / 'uploads' / 'shared.json'
+        data.write_text('[]')
+        with app.app_context():
+            models = [Model(name=f'Model {i}', file_path=str(shared)) for i in range(2)]
+            datasets = [Dataset(name=f'Dataset {i}', format='json', file_path=str(data)) for i in range(2)]
+            db.session.add_all(models + datasets)
+            db.session.commit()
+            model_ids = [model.id for model in models]
+            dataset_ids = [dataset.id for dataset in datasets]
+        
+        assert client.delete(f'/api/models/{model_ids[0]}').status_code == 200
+        assert client.delete(f'/api/datasets/{dataset_ids[0]}').status_code == 200
+        assert client.get('/api/storage/tombstones').json == []
+        
+        assert client.delete(f'/api/models/{model_ids[1]}').status_code == 200
+        assert client.delete(f'/api/datasets/{dataset_ids[1]}').status_code == 200
+        assert client.post('/api/storage/reclaim').json == {'removed': 2, 'failed': 0}
+        assert not shared.exists() and not data.exists()
+    
+    def test_orphan_scan(self, app, client, folders):
+        """Test that only old untracked files are tombstoned and rewritten ones are spared"""
+        uploads = folders / 'uploads' / 'models'
+        uploads.mkdir()
+        tracked, orphan, recent, rewritten = (
+            uploads / f'{name}.pt' for name in ('tracked', 'orphan', 'recent', 'rewritten'))
+        for path in (tracked, orphan, recent, rewritten):
+            path.write_bytes(b'12345')
+        for path in (tracked, orphan, rewritten):
+            os.utime(path, (1, 1))
+        with app.app_context():
+            db.session.add(Model(name='Tracked', file_path=str(tracked)))
+            db.session.commit()
+        
+        response = client.post('/api/storage/scan', json={'dry_run': True})
+        assert response.status_code == 200
+        assert response.json['orphans'] == [str(orphan), str(rewritten)]
+        assert (response.json['num_files'], response.json['num_orphans']) == (4, 2)
+        assert client.get('/api/storage/tombstones').json == []
+        
+        response = client.post('/api/storage/scan', json={})
+        assert response.json['orphan_bytes'] == 10
+        assert client.get('/api/storage').json['last_scan']['id'] == response.json['id']
+        
+        rewritten.write_bytes(b'uploaded again')
+        assert client.post('/api/storage/reclaim').json['removed'] == 2
+        assert [path.exists() for path in (tracked, orphan, recent, rewritten)] == [True, False, True, True]
+        
+        # Tombstoned paths are not reported again
+        response = client.post('/api/storage/scan', json={'dry_run': True, 'grace_seconds': 0})
+        assert response.json['orphans'] == [str(recent), str(rewritten)]
+
+
+class TestExportAPI:
+    """Test streaming exports of metrics, tasks and datasets"""
+    
+    @pytest.fixture
+    def tasks(self, app):
+        with app.app_context():
+            model = Model(name='Test Model')
+            dataset = Dataset(name='Test Dataset', format='json', num_samples=10)
+            db.session.add_all([model, dataset])
+            db.session.commit()
+            ids = []
+            for status in ('completed', 'failed', 'completed'):
+                task = TrainingTask(name=f'{status} task', model_id=model.id, dataset_id=dataset.id,
+                                    status=status, hyperparameters={'learning_rate': 0.01})
+                db.session.add(task)
+                db.session.commit()
+                db.session.add_all([TrainingMetric(task_id=task.id, epoch=epoch, loss=1.0 / epoch)
+                                    for epoch in range(1, 4)])
+                ids.append(task.id)
+            db.session.commit()
+            return ids
+    
+    def test_metrics_csv_filtered_by_tasks(self, client, tasks):
+        """Test that metrics of the selected tasks stream as CSV"""
+        response = client.get('/api/exports/metrics?status=completed')
+        assert response.status_code == 200
+        assert response.is_streamed
+        assert response.mimetype == 'text/csv'
+        assert 'filename=metrics.csv' in response.headers['Content-Disposition']
+        
+        rows = list(csv.DictReader(io.StringIO(response.data.decode())))
+        assert [(int(row['task_id']), int(row['epoch'])) for row in rows] == \
+            [(task_id, epoch) for task_id in (tasks[0], tasks[2]) for epoch in (1, 2, 3)]
+        assert rows[0]['accuracy'] == ''
+        
+        response = client.get(f'/api/exports/metrics?format=ndjson&task_id={tasks[1]}')
+        assert response.mimetype == 'application/x-ndjson'
+        assert [json.loads(line)['task_id'] for line in response.data.decode().splitlines()] == [tasks[1]] * 3
+    
+    def test_gzip_and_validation(self, client, tasks):
+        """Test on-the-fly gzip and that bad filters fail before streaming"""
+        response = client.get('/api/exports/tasks?format=jsonl&gzip=true')
+        assert response.mimetype == 'application/gzip'
+        assert 'filename=tasks.jsonl.gz' in response.headers['Content-Disposition']
+        records = [json.loads(line) for line in gzip.decompress(response.data).decode().splitlines()]
+        assert [record['id'] for record in records] == tasks
+        assert records[0]['hyperparameters'] == {'learning_rate': 0.01}
+        
+        response = client.get('/api/exports/datasets?format=jsonl')
+        assert json.loads(response.data)['num_samples'] == 10
+        
+        assert client.get('/api/exports/tasks?format=xml').status_code == 400
+        assert client.get('/api/exports/metrics?model_id=abc').status_code == 400
+        assert client.get('/api/exports/tasks?created_after=yesterday').status_code == 400
+
+
+class TestDatasetVersionAPI:
+    """Test dataset versions stored as deltas"""
+    
+    @pytest.fixture
+    def dataset_id(self, app, client):
+        records = [{'code': str(i), 'label': i % 2} for i in range(10)]
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as f:
+            json.dump(records, f)
+            temp_file = f.name
+        try:
+            with open(temp_file, 'rb') as f:
+                return client.post('/api/datasets', data={'name': 'Versioned', 'file': (f, 'versioned.json')}).json['id']
+        finally:
+            os.unlink(temp_file)
+    
+    def test_overwritten_file_rebuilds_labels(self, client, dataset_id):
+        """Test that version stats use the labels of a file re-uploaded in place"""
+        add = {'add': [{'code': 'a', 'label': 0}], 'parent': 0}
+        assert client.post(f'/api/datasets/{dataset_id}/versions', json=add).json['num_vulnerable'] == 5
+        
+        file_path = client.get(f'/api/datasets/{dataset_id}').json['file_path']
+        with open(file_path, 'w') as f:
+            json.dump([{'code': str(i), 'label': 1} for i in range(10)], f)
+        os.utime(file_path, ns=(0, 0))
+        assert client.post(f'/api/datasets/{dataset_id}/versions', json=add).json['num_vulnerable'] == 10
+        assert len([name for name in os.listdir(f'{file_path}.versions') if name.endswith('.bin')]) == 1
+    
+    def test_versions_store_deltas_and_update_stats(self, client, dataset_id):
+        """Test appending, removing and patching records, and incremental stats"""
+        response = client.post(f'/api/datasets/{dataset_id}/versions', json={
+            'add': [{'code': 'a', 'label': 1}, {'code': 'b', 'label': 1}, {'code': 'c', 'label': 0}],
+            'remove': [0, 1],
+            'description': 'New samples'
+        })
+        assert response.status_code == 201
+        v1 = response.json
+        assert (v1['version'], v1['parent_version'], v1['first_record_id'], v1['next_record_id']) == (1, 0, 10, 13)
+        assert (v1['num_samples'], v1['num_vulnerable'], v1['num_safe']) == (11, 6, 5)
+        with open(v1['deltas'][0]) as f:
+            assert len(f.readlines()) == 4  # Header and the added records only
+        
+        # Patching replaces a record under a new id, on top of the latest version
+        v2 = client.post(f'/api/datasets/{dataset_id}/versions',
+                         json={'patch': [{'id': 10, 'record': {'code': 'a2', 'label': 0}}]}).json
+        assert (v2['version'], v2['parent_version']) == (2, 1)
+        assert (v2['num_samples'], v2['num_vulnerable']) == (11, 5)
+        stats = client.get(f'/api/datasets/{dataset_id}/stats?version=2').json
+        assert (stats['num_samples'], stats['num_vulnerable'], stats['num_safe']) == (11, 5, 6)
+        
+        response = client.get(f'/api/datasets/{dataset_id}/versions/2/records?with_ids=true')
+        assert response.is_streamed
+        lines = [json.loads(line) for line in response.data.decode().splitlines()]
+        assert [line['id'] for line in lines] == list(range(2, 10)) + [11, 12, 13]
+        assert lines[-1]['record'] == {'code': 'a2', 'label': 0}
+        assert sum(line['record']['label'] for line in lines) == 5
+        
+        # The base file is version 0, and other versions can branch from it
+        base = client.get(f'/api/datasets/{dataset_id}/versions/0/records').data.decode().splitlines()
+        assert len(base) == 10
+        response = client.post(f'/api/datasets/{dataset_id}/versions', json={'parent': 0, 'remove': [9]})
+        assert response.json['num_samples'] == 9
+        assert [v['version'] for v in client.get(f'/api/datasets/{dataset_id}/versions').json] == [3, 2, 1]
+        
+        assert client.post(f'/api/datasets/{dataset_id}/versions', json={'parent': 1, 'remove': [0]}).status_code == 400
+        assert client.post(f'/api/datasets/{dataset_id}/versions', json={'remove': [99]}).status_code == 400
+        assert client.post(f'/api/datasets/{dataset_id}/versions', json={}).status_code == 400
+        assert client.post(f'/api/datasets/{dataset_id}/versions', json={'parent': 7, 'remove': [2]}).status_code == 404
+    
+    def test_trainers_read_versions(self, app, client, dataset_id, monkeypatch):
+        """Test that a task leases a version, the loader merges it and deletes cascade"""
+        from data_loader import DataLoader
+        version = client.post(f'/api/datasets/{dataset_id}/versions',
+                              json={'add': [{'code': 'new', 'label': 1}], 'remove': [3]}).json
+        
+        loader = DataLoader(version['dataset_path'], batch_size=4, shuffle=False, prefetch=0,
+                            deltas=version['deltas'])
+        records = [record for batch in loader for record in batch]
+        streamed = client.get(f'/api/datasets/{dataset_id}/versions/1/records').data.decode().splitlines()
+        assert records == [json.loads(line) for line in streamed]
+        assert len(records) == 10 and records[-1]['code'] == 'new'
+        
+        app.config['TRAINING_DISPATCH'] = 'worker'
+        with app.app_context():
+            model = Model(name='Test Model')
+            db.session.add(model)
+            db.session.commit()
+            model_id = model.id
+        task = {'name': 'Versioned Task', 'model_id': model_id, 'dataset_id': dataset_id}
+        assert client.post('/api/training/tasks', json={**task, 'dataset_version': 5}).status_code == 404
+        response = client.post('/api/training/tasks', json={**task, 'dataset_version': 1})
+        assert response.json['dataset_version'] == 1
+        leased = client.post('/api/training/lease', json={'worker_id': 'worker-1'}).json
+        assert leased['dataset']['version']['deltas'] == version['deltas']
+        
+        # The worker's trainer loads the version, not the file as uploaded
+        import worker_agent
+        loaded = []
+        
+        class RecordingTrainer(worker_agent.VulWebTrainer):
+            def report_metric(self, *args, **kwargs):
+                return True
+            
+            def load_dataset(self, dataset_path, batch_size=32, **kwargs):
+                loader = super().load_dataset(dataset_path, batch_size=batch_size, **kwargs)
+                loaded.extend(record for batch in loader for record in batch)
+                return loader
+        
+        monkeypatch.setattr(worker_agent, 'VulWebTrainer', RecordingTrainer)
+        monkeypatch.setattr(worker_agent, 'apply_resource_limits', lambda cpu, memory: None)
+        worker_agent.run_leased_task('http://localhost:5000', {**leased, 'config': {'epochs': 1}})
+        assert sorted(loaded, key=json.dumps) == sorted(records, key=json.dumps)
+        client.post(f'/api/training/tasks/{leased["id"]}/complete', json={'worker_id': 'worker-1'})
+        
+        response = client.delete(f'/api/datasets/{dataset_id}?cascade=true')
+        assert response.status_code == 200
+        with app.app_context():
+            from app.models import DatasetVersion
+            assert DatasetVersion.query.count() == 0
+        assert client.post('/api/storage/reclaim').json['failed'] == 0
+        assert not os.path.exists(version['deltas'][0])
+
+
+class TestDatasetSearchAPI:
+    """Test code search over the trigram index"""
+    
+    def create_dataset(self, client, name, records):
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as f:
+            json.dump(records, f)
+            temp_file = f.name
+        try:
+            with open(temp_file, 'rb') as f:
+                return client.post('/api/datasets', data={'name': name, 'file': (f, f'{name}.json')}).json['id']
+        finally:
+            os.unlink(temp_file)
+    
+    @pytest.fixture
+    def datasets(self, app, client):
+        from app.services.search_indexer import search_indexer
+        first = self.create_dataset(client, 'Search A', [
+            {'code': 'data = pickle.load(open(path, "rb"))', 'label': 1, 'vulnerability_type': 'Deserialization'},
+            {'code': 'value = json.load(f)', 'label': 0},
+            {'code': "cursor.execute('SELECT * FROM users WHERE id=' + user_id)", 'label': 1,
+             'vulnerability_type': 'SQL Injection'},
+            {'label': 0}
+        ])
+        second = self.create_dataset(client, 'Search B', [
+            {'code': 'def f():\n    return 1', 'label': 0},
+            {'code': 'import pickle\nobj = pickle.loads(blob)', 'label': 1, 'vulnerability_type': 'Deserialization'}
+        ])
+        assert client.get('/api/datasets/search/index').json['status'] == {'pending': 2}
+        with app.app_context():
+            assert search_indexer.index_pending() == 2
+        return first, second
+    
+    def test_literal_and_regex_search(self, client, datasets):
+        """Test literal, regex and case-insensitive queries with filters"""
+        first, second = datasets
+        response = client.get('/api/datasets/search?q=pickle.load')
+        assert response.status_code == 200
+        hits = [(hit['dataset_id'], hit['record_id']) for hit in response.json['results']]
+        assert hits == [(first, 0), (second, 1)]
+        assert response.json['results'][1]['line'] == 2
+        assert response.json['results'][1]['snippet'] == 'obj = pickle.loads(blob)'
+        
+        response = client.get('/api/datasets/search', query_string={'q': r'pickle\.load\(', 'regex': 'true'})
+        assert [hit['dataset_id'] for hit in response.json['results']] == [first]
+        response = client.get('/api/datasets/search', query_string={
+            'q': r"execute\(['\"]select .*\+", 'regex': 'true', 'ignore_case': 'true'})
+        assert [hit['record_id'] for hit in response.json['results']] == [2]
+        assert response.json['results'][0]['vulnerability_type'] == 'SQL Injection'
+        
+        response = client.get(f'/api/datasets/search?q=load&label=0&dataset_id={first}')
+        assert [hit['record_id'] for hit in response.json['results']] == [1]
+        response = client.get('/api/datasets/search?q=pickle&type=Deserialization&limit=1')
+        assert response.json['count'] == 1 and response.json['truncated']
+        
+        assert client.get('/api/datasets/search?q=ab').status_code == 400
+        assert client.get('/api/datasets/search?q=a.*b&regex=true').status_code == 400
+        assert client.get('/api/datasets/search?q=(abc&regex=true').status_code == 400
+    
+    def test_regex_parser_before_python_311(self, monkeypatch):
+        """Test that patterns are parsed with sre_parse where re._parser does not exist"""
+        import re
+        import sys
+        import warnings
+        import importlib
+        from app.services import search_index
+        patterns = [r'pickle\.load\(', r"execute\(['\"]select .*\+", r'(?i)eval(uate)?\(', r'os\.(system|popen)']
+        expected = [search_index.pattern_query(pattern) for pattern in patterns]
+        
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', DeprecationWarning)
+            import sre_parse  # On 3.11+ a deprecated alias that itself imports re._parser
+        if hasattr(re, '_parser'):
+            monkeypatch.delattr(re, '_parser')
+            monkeypatch.setitem(sys.modules, 're._parser', None)
+        try:
+            importlib.reload(search_index)
+            assert search_index.sre_parse.__name__ == 'sre_parse'
+            assert [search_index.pattern_query(pattern) for pattern in patterns] == expected
+        finally:
+            monkeypatch.undo()
+            importlib.reload(search_index)
+    
+    def test_versions_are_indexed_and_deletes_reclaim(self, app, client, datasets):
+        """Test that version deltas are indexed incrementally and removed with the dataset"""
+        from app.services.search_indexer import search_indexer
+        first, _ = datasets
+        client.post(f'/api/datasets/{first}/versions', json={'add': [{'code': 'yaml.load(stream)', 'label': 1}]})
+        with app.app_context():
+            assert search_indexer.index_pending() == 1
+        
+        response = client.get('/api/datasets/search?q=yaml.load')
+        assert [(hit['version'], hit['record_id']) for hit in response.json['results']] == [(1, 4)]
+        index = client.get('/api/datasets/search/index').json
+        assert index['status'] == {'completed': 3}
+        assert index['num_docs'] == 3 + 2 + 1
+        
+        assert client.post('/api/datasets/search/index', json={'rebuild': True}).json['queued'] == 3
+        for dataset_ids in (5, '5', [True], ['a']):
+            assert client.post('/api/datasets/search/index', json={'dataset_ids': dataset_ids}).status_code == 400
+        with app.app_context():
+            assert search_indexer.index_pending() == 3
+        assert client.get('/api/datasets/search?q=yaml.load').json['count'] == 1
+        
+        sources = client.get('/api/datasets/search/index').json['sources']
+        paths = [source['path'] for source in sources if source['dataset_id'] == first]
+        client.delete(f'/api/datasets/{first}')
+        assert client.get('/api/datasets/search?q=pickle').json['count'] == 1
+        assert client.post('/api/storage/reclaim').json['failed'] == 0
+        assert paths and not any(os.path.exists(path) for path in paths)
+    
+    def test_search_follows_versions(self, app, client, datasets):
+        """Test that removed and patched records leave the latest version's results"""
+        from app.services.search_indexer import search_indexer
+        first, _ = datasets
+        client.post(f'/api/datasets/{first}/versions', json={
+            'remove': [2],
+            'patch': [{'id': 0, 'record': {'code': 'data = json.load(open(path))', 'label': 0}}]
+        })
+        client.post(f'/api/datasets/{first}/versions', json={'parent': 0, 'add': [{'code': 'pickle.dump(x)', 'label': 0}]})
+        with app.app_context():
+            assert search_indexer.index_pending() == 2
+        
+        def hits(**params):
+            response = client.get('/api/datasets/search', query_string={'dataset_id': first, **params})
+            return [(hit['version'], hit['record_id']) for hit in response.json['results']]
+        
+        # Version 2 branches from the base file, so version 1's changes do not apply
+        assert hits(q='pickle') == [(0, 0), (2, 4)]
+        assert hits(q='json.load', version=1) == [(0, 1), (1, 4)]
+        assert hits(q='pickle', version=1) == []
+        assert hits(q='SELECT', version=1) == []
+        assert hits(q='SELECT', version=0) == [(0, 2)]
+        
+        assert client.get(f'/api/datasets/search?q=pickle&dataset_id={first}&version=9').status_code == 404
+        assert client.get('/api/datasets/search?q=pickle&version=1').status_code == 400
+
+
+class TestModelOptimizationAPI:
+    """Test optimizing models into benchmarked derivatives"""
+    
+    @pytest.fixture
+    def optimizable(self, app, client, monkeypatch):
+        """A model and a dataset, with a method and a runtime that need no libraries"""
+        import numpy as np
+        from app.services import optimization_service
+        
+        def convert(source, target, options):
+            if options.get('input_dtype') == 'float32':
+                raise ValueError('Conversion failed')
+            with open(source, 'rb') as f, open(target, 'wb') as out:
+                out.write(f.read()[:4])
+        
+        def load(path, options):
+            # Flags inputs starting with 'eval'; the truncated copy flags everything
+            with open(path, 'rb') as f:
+                truncated = len(f.read()) == 4
+            return lambda batch: np.where(truncated | (batch[:, :1] == ord('e')), 5.0, -5.0)
+        
+        monkeypatch.setitem(optimization_service.OPTIMIZERS, 'truncate',
+                            {'requires': (), 'extension': '.bin', 'run': convert, 'runtime': 'torch'})
+        monkeypatch.setitem(optimization_service.RUNTIMES, 'torch', load)
+        
+        samples = [{'code': 'eval(user_input)', 'label': 1}, {'code': 'print(x)', 'label': 0}] * 20
+        dataset_id = client.post('/api/datasets', data={
+            'name': 'Benchmark Dataset',
+            'file': (io.BytesIO(json.dumps(samples).encode()), 'bench.json')
+        }).json['id']
+        model_id = client.post('/api/models', data={
+            'name': 'Base Model',
+            'file': (io.BytesIO(b'full precision weights'), 'base.pt')
+        }).json['id']
+        return model_id, dataset_id
+    
+    def test_optimize_model(self, client, optimizable):
+        """Test that an optimization registers a linked derivative and records the benchmark"""
+        model_id, dataset_id = optimizable
+        response = client.post(f'/api/models/{model_id}/optimizations', json={
+            'method': 'truncate',
+            'dataset_id': dataset_id,
+            'batch_size': 8
+        })
+        assert response.status_code == 201
+        optimization = response.json
+        assert optimization['status'] == 'completed'
+        assert optimization['num_samples'] == 40
+        assert optimization['baseline']['accuracy'] == 1.0
+        assert optimization['optimized']['size'] == 4
+        assert optimization['optimized']['latency_p95_ms'] >= optimization['optimized']['latency_p50_ms']
+        assert optimization['optimized']['agreement'] == 0.5
+        assert optimization['accuracy_delta'] == -0.5
+        assert optimization['speedup'] > 0
+        
+        derivative = client.get(f"/api/models/{optimization['output_model_id']}").json
+        assert derivative['parent_id'] == model_id
+        assert derivative['optimization'] == 'truncate'
+        assert derivative['recall'] == 1.0
+        
+        assert client.get(f'/api/models/{model_id}/optimizations?max_accuracy_drop=0.1').json == []
+        listed = client.get(f'/api/models/{model_id}/optimizations?max_accuracy_drop=0.5').json
+        assert [item['id'] for item in listed] == [optimization['id']]
+        
+        assert client.delete(f'/api/models/{model_id}').status_code == 200
+        assert client.get(f"/api/models/optimizations/{optimization['id']}").status_code == 404
+        assert client.get(f"/api/models/{optimization['output_model_id']}").json['parent_id'] is None
+    
+    def test_invalid_and_failed_optimizations(self, client, optimizable):
+        """Test rejected methods and options, and a conversion that fails"""
+        model_id, dataset_id = optimizable
+        methods = {item['method']: item for item in client.get('/api/models/optimizations/methods').json}
+        assert methods['truncate']['available']
+        for method in ('onnx', 'onnx_int8', 'dynamic_quantization', 'torchscript'):
+            if not methods[method]['available']:
+                response = client.post(f'/api/models/{model_id}/optimizations',
+                                       json={'method': method, 'dataset_id': dataset_id})
+                assert response.status_code == 400
+                assert 'not installed' in response.json['error']
+        
+        for body in ({'method': 'fp16'}, {'method': 'truncate', 'options': {'input_shape': [0]}},
+                     {'method': 'truncate'}):
+            response = client.post(f'/api/models/{model_id}/optimizations', json=body)
+            assert response.status_code == 400
+        
+        response = client.post(f'/api/models/{model_id}/optimizations', json={
+            'method': 'truncate',
+            'dataset_id': dataset_id,
+            'options': {'input_dtype': 'float32'}
+        })
+        assert response.status_code == 201
+        assert response.json['status'] == 'failed'
+        assert response.json['error_message'] == 'Conversion failed'
+        assert response.json['output_model_id'] is None
+        assert len(client.get('/api/models').json) == 1
+
+    
+    def test_pickled_modules_need_opt_in(self, app, monkeypatch):
+        """Test that files other than TorchScript are only unpickled when trusted"""
+        from types import SimpleNamespace
+        from app.services import optimization_service
+        
+        def not_torchscript(path, map_location=None):
+            raise RuntimeError('not TorchScript')
+        
+        unpickled = []
+        torch = SimpleNamespace(jit=SimpleNamespace(load=not_torchscript),
+                                load=lambda path, **kwargs: unpickled.append(path),
+                                nn=SimpleNamespace(Module=SimpleNamespace))
+        monkeypatch.setattr(optimization_service, 'lazy_import', lambda name: torch)
+        with pytest.raises(ValueError, match='OPTIMIZATION_ALLOW_PICKLE'):
+            optimization_service._load_module('model.pt')
+        assert unpickled == []
+        
+        app.config['OPTIMIZATION_ALLOW_PICKLE'] = True
+        with pytest.raises(ValueError, match='weights only'):
+            optimization_service._load_module('model.pt')
+        assert unpickled == ['model.pt']
+
+class TestLocalizationAPI:
+    """Test the line-level localization results store"""
+    
+    @pytest.fixture
+    def scan_id(self, app, client):
+        model_id = client.post('/api/models', data={
+            'name': 'Locator', 'model_type': 'fine_grained_location'
+        }).json['id']
+        return client.post('/api/localization/scans', json={'model_id': model_id, 'name': 'nightly'}).json['id']
+    
+    def test_top_lines_files_and_heatmap(self, client, scan_id):
+        """Test that results posted in batches are served by score and by file"""
+        batches = [
+            [
+                {'file': 'src/db.py', 'function': 'query', 'line_start': 10, 'line_end': 12,
+                 'score': 0.9, 'vulnerability_type': 'SQL Injection'},
+                {'file': 'src/util.py', 'line_start': 3, 'score': 0.2},
+            ],
+            [
+                {'file': 'src/db.py', 'function': 'query', 'line_start': 4, 'line_end': 11,
+                 'score': 0.5, 'vulnerability_type': 'SQL Injection'},
+                {'file': 'lib/run.py', 'function': 'main', 'line_start': 7, 'score': 0.7,
+                 'vulnerability_type': 'Command Injection'},
+            ],
+        ]
+        for results in batches:
+            response = client.post(f'/api/localization/scans/{scan_id}/results', json={'results': results})
+            assert response.status_code == 200
+        assert response.json['num_ranges'] == 4
+        assert client.get(f'/api/localization/scans/{scan_id}/top').status_code == 409
+        
+        response = client.post(f'/api/localization/scans/{scan_id}/complete')
+        assert response.status_code == 200
+        assert response.json['status'] == 'completed'
+        assert response.json['num_files'] == 3
+        assert response.json['max_score'] == 0.9
+        
+        top = client.get(f'/api/localization/scans/{scan_id}/top?k=2').json['results']
+        assert [(line['file'], line['line_start'], line['score']) for line in top] == [
+            ('src/db.py', 10, 0.9), ('lib/run.py', 7, 0.7)]
+        assert top[0]['function'] == 'query'
+        
+        top = client.get(f'/api/localization/scans/{scan_id}/top?path_prefix=src/&min_score=0.3').json['results']
+        assert [line['score'] for line in top] == [0.9, 0.5]
+        top = client.get(f'/api/localization/scans/{scan_id}/top?type=Command Injection').json['results']
+        assert [line['file'] for line in top] == ['lib/run.py']
+        
+        files = client.get(f'/api/localization/scans/{scan_id}/files?limit=2').json['files']
+        assert files == [{'file': 'src/db.py', 'max_score': 0.9, 'num_ranges': 2},
+                         {'file': 'lib/run.py', 'max_score': 0.7, 'num_ranges': 1}]
+        
+        heatmap = client.get(f'/api/localization/scans/{scan_id}/heatmap?path=src/db.py').json
+        assert heatmap['segments'] == [{'line_start': 4, 'line_end': 9, 'score': 0.5},
+                                       {'line_start': 10, 'line_end': 12, 'score': 0.9}]
+        assert [line['line_start'] for line in heatmap['ranges']] == [4, 10]
+        assert client.get(f'/api/localization/scans/{scan_id}/heatmap?path=src/none.py').status_code == 404
+    
+    def test_invalid_results_and_states(self, client, scan_id):
+        """Test rejected results, completion without results and results after completion"""
+        url = f'/api/localization/scans/{scan_id}'
+        for results in ([], [{'file': 'a.py', 'line_start': 0, 'score': 0.5}],
+                        [{'file': 'a.py', 'line_start': 5, 'line_end': 4, 'score': 0.5}],
+                        [{'file': 'a.py', 'line_start': 1, 'score': 2}],
+                        [{'file': 'a.py', 'line_start': 1, 'line_end': 2 ** 40, 'score': 0.5}]):
+            assert client.post(f'{url}/results', json={'results': results}).status_code == 400
+        
+        assert client.post(f'{url}/complete').status_code == 400
+        assert client.get(url).json['status'] == 'receiving'
+        
+        client.post(f'{url}/results', json={'results': [{'file': 'a.py', 'line_start': 1, 'score': 0.5}]})
+        assert client.post(f'{url}/complete').status_code == 200
+        assert client.post(f'{url}/complete').status_code == 409
+        response = client.post(f'{url}/results', json={'results': [{'file': 'a.py', 'line_start': 2, 'score': 0.5}]})
+        assert response.status_code == 409
+        
+        model_id = client.post('/api/models', data={'name': 'Detector'}).json['id']
+        assert client.post('/api/localization/scans', json={'model_id': model_id}).status_code == 400
+    
+    def test_batch_racing_completion(self, app, client, scan_id, monkeypatch):
+        """Test that a batch completion took before it was counted stays in the scan"""
+        from app.models import LocalizationScan
+        from app.services import localization_store
+        url = f'/api/localization/scans/{scan_id}'
+        client.post(f'{url}/results', json={'results': [{'file': 'a.py', 'line_start': 1, 'score': 0.5}]})
+        replace = os.replace
+        
+        def complete_after_write(source, target):
+            # Completion lists the batch after it is written, before it is counted
+            replace(source, target)
+            monkeypatch.setattr(os, 'replace', replace)
+            assert localization_store.complete_scan(db.session.get(LocalizationScan, scan_id))
+        
+        monkeypatch.setattr(os, 'replace', complete_after_write)
+        response = client.post(f'{url}/results', json={'results': [{'file': 'b.py', 'line_start': 2, 'score': 0.7}]})
+        assert response.status_code == 200
+        scan = client.get(url).json
+        assert (scan['status'], scan['num_ranges'], scan['num_files']) == ('completed', 2, 2)
+        
+        # A batch written after completion took its list is dropped
+        response = client.post(f'{url}/results', json={'results': [{'file': 'c.py', 'line_start': 3, 'score': 0.1}]})
+        assert response.status_code == 409
+        with app.app_context():
+            path = db.session.get(LocalizationScan, scan_id).path
+        assert not [name for name in os.listdir(path) if name.startswith('batch-')]
+        
+        assert client.delete(url).status_code == 200
+        assert client.get(url).status_code == 404
+
+
+class TestAdmissionControl:
+    """Test bulkheads and rate limits for heavy requests"""
+    
+    @pytest.fixture
+    def limited_client(self, monkeypatch):
+        from config.config import TestingConfig
+        monkeypatch.setattr(TestingConfig, 'ADMISSION_POOLS', {'upload': 1, 'inference': 1, 'ingest': 0})
+        monkeypatch.setattr(TestingConfig, 'ADMISSION_RATE_LIMITS', {'ingest': (0.5, 2)})
+        app = create_app('testing')
+        with app.app_context():
+            db.create_all()
+            yield app.test_client()
+            db.session.remove()
+            db.drop_all()
+    
+    def test_full_pool_rejects_without_blocking_reads(self, limited_client, monkeypatch):
+        """Test that a busy inference pool answers 503 while other routes are served"""
+        from app.services import inference_service
+        started, release = threading.Event(), threading.Event()
+        
+        def slow_predictor(model, codes):
+            started.set()
+            release.wait(5)
+            return [{'label': 0, 'score': 0.1, 'vulnerability_type': None} for _ in codes]
+        
+        monkeypatch.setattr(inference_service, 'predictor', slow_predictor)
+        model_id = limited_client.post('/api/models', data={'name': 'Test Model'}).json['id']
+        url = f'/api/models/{model_id}/predict'
+        
+        responses = []
+        thread = threading.Thread(target=lambda: responses.append(
+            limited_client.post(url, json={'code': 'x = 1', 'use_cache': False})))
+        thread.start()
+        try:
+            assert started.wait(5)
+            response = limited_client.post(url, json={'code': 'y = 2', 'use_cache': False})
+            assert response.status_code == 503
+            assert int(response.headers['Retry-After']) >= 1
+            assert limited_client.get(f'/api/models/{model_id}').status_code == 200
+        finally:
+            release.set()
+            thread.join()
+        assert responses[0].status_code == 200
+        assert limited_client.post(url, json={'code': 'y = 2', 'use_cache': False}).status_code == 200
+        
+        metrics = limited_client.get('/metrics').get_data(as_text=True)
+        assert 'vulweb_admission_rejected_total{pool="inference",reason="concurrency"} 1' in metrics
+    
+    def test_rate_limit_per_task(self, limited_client):
+        """Test that each training task has its own token bucket for metric reports"""
+        model_id = limited_client.post('/api/models', data={'name': 'Test Model'}).json['id']
+        with limited_client.application.app_context():
+            dataset = Dataset(name='Test Dataset', format='json')
+            db.session.add(dataset)
+            db.session.commit()
+            dataset_id = dataset.id
+        task_ids = [limited_client.post('/api/training/tasks', json={
+            'name': f'Task {i}', 'model_id': model_id, 'dataset_id': dataset_id
+        }).json['id'] for i in range(2)]
+        
+        report = {'epoch': 1, 'loss': 0.5}
+        for _ in range(2):
+            assert limited_client.post(f'/api/training/tasks/{task_ids[0]}/metrics', json=report).status_code == 201
+        response = limited_client.post(f'/api/training/tasks/{task_ids[0]}/metrics', json=report)
+        assert response.status_code == 429
+        assert response.headers['Retry-After'] in ('1', '2')
+        assert limited_client.post(f'/api/training/tasks/{task_ids[1]}/metrics', json=report).status_code == 201
+    
+    def test_checkpoint_uploads_have_their_own_pool(self, app):
+        """Test that checkpoint uploads do not compete with dataset uploads"""
+        from app.services.admission_control import admission
+        for url, pool in (('/api/training/tasks/1/checkpoints', 'checkpoint'), ('/api/datasets', 'upload')):
+            with app.test_request_context(url, method='POST', data={'file': (io.BytesIO(b'x'), 'file.json')}):
+                assert admission.classify().name == pool
+    
+    def test_lease_polls_have_their_own_pool(self, app):
+        """Test that long-polling workers cannot take every request thread"""
+        from app.services.admission_control import admission
+        with app.test_request_context('/api/training/lease', method='POST', json={'worker_id': 'a'}):
+            assert admission.classify().name == 'lease'
+            assert admission.pools['lease'].limit > 0
+    
+    def test_clients_behind_proxy(self, monkeypatch):
+        """Test that clients behind a trusted proxy get their own token buckets"""
+        from config.config import TestingConfig
+        monkeypatch.setattr(TestingConfig, 'ADMISSION_RATE_LIMITS', {'inference': (0.01, 1)})
+        monkeypatch.setattr(TestingConfig, 'TRUSTED_PROXIES', 1)
+        app = create_app('testing')
+        with app.app_context():
+            db.create_all()
+            client = app.test_client()
+            url = f"/api/models/{client.post('/api/models', data={'name': 'Test Model'}).json['id']}/predict"
+            
+            def predict(address):
+                return client.post(url, json={'code': 'x = 1'}, headers={'X-Forwarded-For': address}).status_code
+            
+            assert [predict('10.0.0.1'), predict('10.0.0.1'), predict('10.0.0.2')] == [200, 429, 200]
+            db.session.remove()
+            db.drop_all()
+
+
 class TestDatabaseModels:
     """Test database models"""
     
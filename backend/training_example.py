@@ -6,9 +6,10 @@ Replace the simulate_training function in backend/app/services/training_service.
 actual training logic following this pattern.
 """
 
-import json
 import requests
 from datetime import datetime
+from data_loader import DataLoader
+from telemetry_sampler import TelemetrySampler, post_with_retry
 
 
 class VulWebTrainer:
@@ -16,14 +17,17 @@ class VulWebTrainer:
     Example trainer class that integrates with VulWeb platform
     """
     
-    def __init__(self, task_id, api_url='http://localhost:5000'):
+    def __init__(self, task_id, api_url='http://localhost:5000', telemetry_interval=5.0):
         self.task_id = task_id
         self.api_url = api_url
+        self.stop_requested = False
+        # Reports CPU, memory, IO and throughput of this process while training
+        self.telemetry = TelemetrySampler(task_id, api_url, interval=telemetry_interval)
         
     def report_metric(self, epoch, loss, accuracy, val_loss, val_accuracy, learning_rate=0.001):
         """Report training metrics to the platform"""
         try:
-            response = requests.post(
+            response = post_with_retry(
                 f'{self.api_url}/api/training/tasks/{self.task_id}/metrics',
                 json={
                     'epoch': epoch,
@@ -34,12 +38,55 @@ class VulWebTrainer:
                     'learning_rate': float(learning_rate)
                 }
             )
-            return response.status_code == 201
+            if response.status_code != 201:
+                return False
+            # The platform stops tasks that are pruned by a sweep or stopped by a user
+            if response.json().get('task_status', 'running') != 'running':
+                self.stop_requested = True
+            return True
         except Exception as e:
             print(f"Error reporting metric: {e}")
             return False
     
-    def train(self, model_path, dataset_path, epochs=10, batch_size=32, learning_rate=0.001):
+    def get_split(self, dataset_id, part='train', ratios=None, seed=0, stratify=True, group_key=None):
+        """
+        Fetch the record indices of one part of a dataset split. The platform
+        computes each split once, so every run with the same parameters
+        trains and validates on exactly the same records.
+        """
+        import io
+        import numpy as np
+        
+        response = requests.post(
+            f'{self.api_url}/api/datasets/{dataset_id}/splits',
+            json={'ratios': ratios, 'seed': seed, 'stratify': stratify, 'group_key': group_key}
+        )
+        response.raise_for_status()
+        split_id = response.json()['id']
+        
+        response = requests.get(
+            f'{self.api_url}/api/datasets/{dataset_id}/splits/{split_id}',
+            params={'part': part, 'format': 'npy'}
+        )
+        response.raise_for_status()
+        return np.load(io.BytesIO(response.content))
+    
+    def save_checkpoint(self, checkpoint_path, epoch):
+        """Upload a checkpoint file; the platform keeps it per its retention policy"""
+        try:
+            with open(checkpoint_path, 'rb') as f:
+                response = post_with_retry(
+                    f'{self.api_url}/api/training/tasks/{self.task_id}/checkpoints',
+                    data={'epoch': epoch},
+                    files={'file': f}
+                )
+            return response.status_code == 201
+        except Exception as e:
+            print(f"Error saving checkpoint: {e}")
+            return False
+    
+    def train(self, model_path, dataset_path, epochs=10, batch_size=32, learning_rate=0.001,
+              resume_from=None, start_epoch=1, num_shards=1, shard_index=0, seed=0, deltas=None):
         """
         Main training function - replace with your actual training code
         
@@ -49,62 +96,91 @@ class VulWebTrainer:
             epochs: Number of training epochs
             batch_size: Batch size for training
             learning_rate: Learning rate
+            resume_from: Checkpoint file to restore model/optimizer state from
+            start_epoch: First epoch to run when resuming
+            num_shards: Number of data-parallel workers sharing the dataset
+            shard_index: This worker's shard
+            seed: Shuffle seed, shared by all workers
+            deltas: Delta files of the task's dataset version, oldest first
         """
         print(f"Starting training for task {self.task_id}")
         print(f"Model: {model_path}")
         print(f"Dataset: {dataset_path}")
         
-        # Load your dataset
-        dataset = self.load_dataset(dataset_path)
-        print(f"Loaded dataset with {len(dataset)} samples")
+        # Stream your dataset; batches are prefetched while the model trains
+        dataset = self.load_dataset(dataset_path, batch_size=batch_size, seed=seed,
+                                    num_shards=num_shards, shard_index=shard_index, deltas=deltas)
         
         # Initialize your model
         # model = YourModel()
         # optimizer = YourOptimizer(model.parameters(), lr=learning_rate)
         
+        if resume_from:
+            print(f"Resuming from {resume_from} at epoch {start_epoch}")
+            # state = torch.load(resume_from)
+            # model.load_state_dict(state['model']); optimizer.load_state_dict(state['optimizer'])
+        
         # Training loop
-        for epoch in range(1, epochs + 1):
-            print(f"\nEpoch {epoch}/{epochs}")
-            
-            # Training phase
-            # train_loss, train_acc = self.train_epoch(model, dataset, optimizer)
-            
-            # Validation phase
-            # val_loss, val_acc = self.validate(model, dataset)
-            
-            # For demonstration, using simulated metrics
-            train_loss = 1.0 - (epoch / epochs) * 0.8
-            train_acc = 0.5 + (epoch / epochs) * 0.4
-            val_loss = train_loss + 0.05
-            val_acc = train_acc - 0.05
-            
-            print(f"Loss: {train_loss:.4f}, Accuracy: {train_acc:.4f}")
-            print(f"Val Loss: {val_loss:.4f}, Val Accuracy: {val_acc:.4f}")
-            
-            # Report to platform
-            self.report_metric(
-                epoch=epoch,
-                loss=train_loss,
-                accuracy=train_acc,
-                val_loss=val_loss,
-                val_accuracy=val_acc,
-                learning_rate=learning_rate
-            )
+        self.telemetry.start()
+        try:
+            for epoch in range(start_epoch, epochs + 1):
+                print(f"\nEpoch {epoch}/{epochs}")
+                dataset.set_epoch(epoch)
+                
+                # Training phase
+                # train_loss, train_acc = self.train_epoch(model, dataset, optimizer)
+                for batch in dataset:
+                    # Your training step here
+                    self.telemetry.count(len(batch))
+                
+                # Validation phase
+                # val_loss, val_acc = self.validate(model, dataset)
+                
+                # For demonstration, using simulated metrics
+                train_loss = 1.0 - (epoch / epochs) * 0.8
+                train_acc = 0.5 + (epoch / epochs) * 0.4
+                val_loss = train_loss + 0.05
+                val_acc = train_acc - 0.05
+                
+                print(f"Loss: {train_loss:.4f}, Accuracy: {train_acc:.4f}")
+                print(f"Val Loss: {val_loss:.4f}, Val Accuracy: {val_acc:.4f}")
+                
+                # Report to platform
+                self.report_metric(
+                    epoch=epoch,
+                    loss=train_loss,
+                    accuracy=train_acc,
+                    val_loss=val_loss,
+                    val_accuracy=val_acc,
+                    learning_rate=learning_rate
+                )
+                
+                # Save a checkpoint after each epoch
+                # torch.save({'model': model.state_dict(), 'optimizer': optimizer.state_dict()}, path)
+                # self.save_checkpoint(path, epoch)
+                
+                if self.stop_requested:
+                    print(f"Task {self.task_id} was stopped by the platform")
+                    break
+        finally:
+            self.telemetry.stop()
         
         print(f"\nTraining completed for task {self.task_id}")
         return True
     
-    def load_dataset(self, dataset_path):
-        """Load dataset from file"""
-        with open(dataset_path, 'r') as f:
-            if dataset_path.endswith('.json'):
-                return json.load(f)
-            # Add more format handlers as needed
-        return []
+    def load_dataset(self, dataset_path, batch_size=32, **kwargs):
+        """
+        Stream a JSON/JSONL/CSV/ZIP dataset in shuffled, prefetched batches
+        See data_loader.DataLoader for the available options
+        """
+        return DataLoader(dataset_path, batch_size=batch_size, **kwargs)
     
     def train_epoch(self, model, dataset, optimizer):
         """Train for one epoch - implement your training logic"""
-        # Your training code here
+        # for batch in dataset:
+        #     codes = [record['code'] for record in batch]
+        #     ...
+        #     self.telemetry.count(len(batch))
         pass
     
     def validate(self, model, dataset):
@@ -119,11 +195,16 @@ def start_training_task(task_id, config):
     Integration point in backend/app/services/training_service.py
     """
     from ..models import db, TrainingTask
+    from .version_service import get_version, version_details
     
     task = TrainingTask.query.get(task_id)
     if not task:
         raise Exception("Task not found")
     
+    deltas = None
+    if task.dataset_version:
+        deltas = version_details(task.dataset, get_version(task.dataset, task.dataset_version))['deltas']
+    
     # Initialize trainer
     trainer = VulWebTrainer(task_id)
     
@@ -132,9 +213,12 @@ def start_training_task(task_id, config):
         trainer.train(
             model_path=task.model.file_path,
             dataset_path=task.dataset.file_path,
+            deltas=deltas,
             epochs=config.get('epochs', 10),
             batch_size=config.get('batch_size', 32),
-            learning_rate=config.get('learning_rate', 0.001)
+            learning_rate=config.get('learning_rate', 0.001),
+            resume_from=config.get('resume_from'),
+            start_epoch=config.get('start_epoch', 1)
         )
         
         # Update task status
@@ -178,10 +262,23 @@ if __name__ == '__main__':
     model_data = model_response.json()
     dataset_data = dataset_response.json()
     
+    # Tasks on a dataset version read the base file plus the version's deltas
+    deltas = None
+    if task_data.get('dataset_version'):
+        version_response = requests.get(f'http://localhost:5000/api/datasets/{task_data["dataset_id"]}'
+                                        f'/versions/{task_data["dataset_version"]}')
+        deltas = version_response.json()['deltas']
+    
+    # Sweep trials carry their own hyperparameters
+    hyperparameters = task_data.get('hyperparameters') or {}
+    
     # Initialize and run trainer
     trainer = VulWebTrainer(task_id)
     trainer.train(
         model_path=model_data['file_path'],
         dataset_path=dataset_data['file_path'],
-        epochs=task_data['total_epochs']
+        deltas=deltas,
+        epochs=task_data['total_epochs'],
+        batch_size=hyperparameters.get('batch_size', 32),
+        learning_rate=hyperparameters.get('learning_rate', 0.001)
     )
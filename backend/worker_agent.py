@@ -0,0 +1,218 @@
+"""
+Training Worker Agent
+
+Runs training tasks leased from the VulWeb API, so training capacity can be
+added by starting agents on more machines. Start the API with
+TRAINING_DISPATCH=worker so new tasks are queued for agents instead of
+being started in the API process.
+
+Each agent long-polls POST /api/training/lease with its free and total CPU
+cores and memory, so the scheduler only hands it tasks that fit and can hold
+back smaller tasks while a large one waits for room. It runs every task
+in its own process limited to the task's declared requests (CPU affinity
+and an address-space rlimit, where the platform supports them). It
+heartbeats while tasks run and reports the outcome to
+/api/training/tasks/<id>/complete. If an agent dies, its leases expire and
+the tasks are requeued from their latest checkpoints. Model and dataset
+paths are the ones stored by the API, so agents need the upload folder on
+shared storage.
+
+Usage: python worker_agent.py [--api-url URL] [--worker-id ID] [--cpus N] [--memory MB] [--once]
+"""
+
+import os
+import time
+import socket
+import argparse
+import multiprocessing
+import requests
+from training_example import VulWebTrainer
+
+
+def total_memory():
+    """Physical memory in MB, or None if it cannot be determined"""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def apply_resource_limits(cpu, memory):
+    """
+    Confine the current process to its requested resources: pin it to
+    ceil(cpu) cores and cap its address space at the requested memory
+    """
+    cores = max(int(-(-cpu // 1)), 1)
+    for name in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[name] = str(cores)
+
+    if hasattr(os, 'sched_getaffinity'):
+        available = sorted(os.sched_getaffinity(0))
+        # Spread tasks over the cores by pid so they do not all share the first ones
+        start = os.getpid() % len(available)
+        os.sched_setaffinity(0, [available[(start + i) % len(available)]
+                                 for i in range(min(cores, len(available)))])
+
+    try:
+        import resource
+        limit = memory * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+def run_leased_task(api_url, task):
+    """Entry point of a task's process"""
+    apply_resource_limits(task['cpu_request'] or 1, task['memory_request'] or 2048)
+    config = task['config']
+    # A task on a dataset version reads the base file and the version's deltas
+    version = task['dataset'].get('version')
+    trainer = VulWebTrainer(task['id'], api_url=api_url)
+    trainer.train(
+        model_path=task['model']['file_path'],
+        dataset_path=version['dataset_path'] if version else task['dataset']['file_path'],
+        deltas=version['deltas'] if version else None,
+        epochs=config.get('epochs', task['total_epochs'] or 10),
+        batch_size=config.get('batch_size', 32),
+        learning_rate=config.get('learning_rate', 0.001),
+        resume_from=config.get('resume_from'),
+        start_epoch=config.get('start_epoch', 1)
+    )
+
+
+class WorkerAgent:
+    """Leases tasks that fit the free capacity and runs them side by side"""
+
+    def __init__(self, api_url='http://localhost:5000', worker_id=None, wait=20,
+                 cpus=None, memory=None, queues=None):
+        self.api_url = api_url
+        self.worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}'
+        self.wait = wait
+        self.cpus = cpus or os.cpu_count() or 1
+        self.memory = memory or total_memory()
+        self.queues = queues
+        self.running = {}  # task id -> (task, process, next heartbeat)
+
+    def free_capacity(self):
+        cpu = self.cpus - sum(task['cpu_request'] or 1 for task, _, _ in self.running.values())
+        memory = None
+        if self.memory is not None:
+            memory = self.memory - sum(task['memory_request'] or 2048 for task, _, _ in self.running.values())
+        return cpu, memory
+
+    def lease(self, wait):
+        """Long-poll for a task that fits; returns the leased task or None"""
+        cpu, memory = self.free_capacity()
+        response = requests.post(
+            f'{self.api_url}/api/training/lease',
+            json={'worker_id': self.worker_id, 'wait': wait, 'cpu': cpu, 'memory': memory,
+                  'total_cpu': self.cpus, 'total_memory': self.memory, 'queues': self.queues},
+            timeout=wait + 10
+        )
+        response.raise_for_status()
+        return response.json() if response.status_code == 200 else None
+
+    def heartbeat(self, task_id):
+        """Renew the lease; returns False once the task should stop"""
+        try:
+            response = requests.post(
+                f'{self.api_url}/api/training/tasks/{task_id}/heartbeat',
+                json={'worker_id': self.worker_id},
+                timeout=10
+            )
+            return response.status_code != 409
+        except requests.RequestException as e:
+            # Keep training; the lease only lapses if heartbeats keep failing
+            print(f"Error sending heartbeat: {e}")
+            return True
+
+    def complete(self, task_id, status, error_message=None):
+        try:
+            requests.post(
+                f'{self.api_url}/api/training/tasks/{task_id}/complete',
+                json={'worker_id': self.worker_id, 'status': status, 'error_message': error_message},
+                timeout=10
+            )
+        except requests.RequestException as e:
+            print(f"Error completing task {task_id}: {e}")
+
+    def start(self, task):
+        process = multiprocessing.Process(target=run_leased_task, args=(self.api_url, task), daemon=True)
+        process.start()
+        self.running[task['id']] = (task, process, time.monotonic() + self.heartbeat_interval(task))
+        print(f"Started task {task['id']} (attempt {task['attempts']}, "
+              f"{task['cpu_request']} cpu, {task['memory_request']} MB)")
+
+    def heartbeat_interval(self, task):
+        return max(task['lease_seconds'] / 3, 1)
+
+    def supervise(self):
+        """Report finished tasks and heartbeat running ones"""
+        now = time.monotonic()
+        for task_id, (task, process, next_heartbeat) in list(self.running.items()):
+            if not process.is_alive():
+                del self.running[task_id]
+                if process.exitcode == 0:
+                    self.complete(task_id, 'completed')
+                else:
+                    self.complete(task_id, 'failed', f'Training process exited with code {process.exitcode}')
+            elif now >= next_heartbeat:
+                if self.heartbeat(task_id):
+                    self.running[task_id] = (task, process, now + self.heartbeat_interval(task))
+                else:
+                    print(f"Task {task_id} was stopped by the platform")
+                    process.terminate()
+                    process.join()
+                    del self.running[task_id]
+
+    def next_wait(self):
+        """Long-poll only as long as the next heartbeat allows"""
+        if not self.running:
+            return self.wait
+        now = time.monotonic()
+        due = min(next_heartbeat for _, _, next_heartbeat in self.running.values())
+        return max(min(self.wait, due - now), 0)
+
+    def run(self, once=False):
+        """Lease and train tasks until interrupted; with once, run what one lease yields"""
+        print(f"Worker {self.worker_id} polling {self.api_url} "
+              f"({self.cpus} cpu, {self.memory} MB)")
+        leased = False
+        while True:
+            self.supervise()
+            if once and leased and not self.running:
+                return
+
+            cpu, memory = self.free_capacity()
+            if once and leased or cpu <= 0 or (memory is not None and memory <= 0):
+                time.sleep(min(self.next_wait(), 1))
+                continue
+
+            try:
+                task = self.lease(self.next_wait())
+            except requests.RequestException as e:
+                print(f"Error leasing task: {e}")
+                if once:
+                    return
+                time.sleep(min(self.wait, 5))
+                continue
+
+            if task:
+                self.start(task)
+                leased = True
+            elif once:
+                return
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='VulWeb training worker agent')
+    parser.add_argument('--api-url', default=os.environ.get('VULWEB_API_URL', 'http://localhost:5000'))
+    parser.add_argument('--worker-id', default=os.environ.get('VULWEB_WORKER_ID'))
+    parser.add_argument('--wait', type=int, default=20, help='Long-poll timeout in seconds')
+    parser.add_argument('--cpus', type=float, help='CPU cores to offer, default all')
+    parser.add_argument('--memory', type=int, help='Memory to offer in MB, default all')
+    parser.add_argument('--queue', action='append', dest='queues', help='Only serve these queues')
+    parser.add_argument('--once', action='store_true', help='Run a single leased task, then exit')
+    args = parser.parse_args()
+
+    WorkerAgent(args.api_url, args.worker_id, args.wait, args.cpus, args.memory, args.queues).run(once=args.once)